@@ -35,6 +35,12 @@ from routes.legacy_file_proxy import init_legacy_file_proxy_routes
 from routes.setup_routes import setup_bp
 from routes.tasks import tasks_bp # Import new tasks blueprint
 from r2_storage import r2_storage
+from occupancy import register_occupancy_tracking
+from audit_log import register_audit_log_buffer
+from db_pool import build_engine_options, register_pool_instrumentation
+from booking_settings_cache import register_booking_settings_cache
+from effective_clock import register_effective_clock
+from cli_commands import register_cli_commands
 
 # Scheduler removed for Cloud Run compatibility. External scheduler (e.g. Cloud Scheduler) should hit endpoints in routes/tasks.py
 
@@ -114,16 +120,32 @@ def create_app(config_object=config, testing=False, start_scheduler=True): # Add
     if testing:
         app.config['TESTING'] = True
         app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('TEST_DATABASE_URL', 'sqlite:///:memory:')
+        test_replica_url = os.environ.get('TEST_DATABASE_REPLICA_URL')
+        app.config['SQLALCHEMY_BINDS'] = {'replica': test_replica_url} if test_replica_url else {}
         app.config['WTF_CSRF_ENABLED'] = False
         app.config['LOGIN_DISABLED'] = True # Custom flag for decorators
         app.config['SCHEDULER_ENABLED'] = False # Disable scheduler during tests
         app.config['MAIL_SUPPRESS_SEND'] = True # Suppress emails
         app.config['SERVER_NAME'] = 'localhost.test' # For url_for in tests without active request context
 
+    # Pool settings come from the DB_POOL_* environment unless engine options were given explicitly
+    app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', build_engine_options(app.config))
+
     # Initialize DB early
     db.init_app(app)
+    with app.app_context():
+        for engine in db.engines.values(): # The primary plus the read replica, if configured
+            register_pool_instrumentation(app, engine)
     # Initialize Migrate immediately after DB and App, and before startup restore sequence
     migrate.init_app(app, db)
+    # Keep resource_day_occupancy in step with every Booking flush
+    register_occupancy_tracking()
+    # Batch add_audit_log rows into the request's own commit, or one write at teardown
+    register_audit_log_buffer(app)
+    # Version-stamp BookingSettings writes so every worker's cached snapshot notices them
+    register_booking_settings_cache(app)
+    # One effective "now" per request; get_current_effective_time() reuses it
+    register_effective_clock(app)
 
     # 2. Check Database Connection (Startup Check)
     if not testing:
@@ -314,6 +336,7 @@ def create_app(config_object=config, testing=False, start_scheduler=True): # Add
     init_legacy_file_proxy_routes(app)
     app.register_blueprint(setup_bp)
     app.register_blueprint(tasks_bp) # Register tasks blueprint
+    register_cli_commands(app)
 
     # 7.5 Setup Redirect Middleware
     @app.before_request
@@ -0,0 +1,162 @@
+import logging
+import re
+from datetime import datetime, timezone
+
+from flask import current_app, g, has_app_context
+from sqlalchemy import DDL, delete, event, func, literal_column, or_, select, text
+
+from extensions import db
+from models import AUDIT_LOG_SEARCH_SQL, AuditLog
+
+AUDIT_LOG_FTS_TABLE = 'audit_log_fts'
+_BUFFER_ATTR = 'audit_log_buffer'
+_INFLIGHT_KEY = 'audit_log_inflight'
+_PRUNE_BATCH_SIZE = 1000
+
+# SQLite: an external-content FTS5 index over audit_log, kept in sync by triggers.
+_SQLITE_FTS_DDL = (
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {AUDIT_LOG_FTS_TABLE} USING fts5("
+    "username, action, details, content='audit_log', content_rowid='id')",
+    f"CREATE TRIGGER IF NOT EXISTS audit_log_fts_ai AFTER INSERT ON audit_log BEGIN "
+    f"INSERT INTO {AUDIT_LOG_FTS_TABLE}(rowid, username, action, details) "
+    "VALUES (new.id, new.username, new.action, new.details); END",
+    f"CREATE TRIGGER IF NOT EXISTS audit_log_fts_ad AFTER DELETE ON audit_log BEGIN "
+    f"INSERT INTO {AUDIT_LOG_FTS_TABLE}({AUDIT_LOG_FTS_TABLE}, rowid, username, action, details) "
+    "VALUES ('delete', old.id, old.username, old.action, old.details); END",
+    f"CREATE TRIGGER IF NOT EXISTS audit_log_fts_au AFTER UPDATE ON audit_log BEGIN "
+    f"INSERT INTO {AUDIT_LOG_FTS_TABLE}({AUDIT_LOG_FTS_TABLE}, rowid, username, action, details) "
+    "VALUES ('delete', old.id, old.username, old.action, old.details); "
+    f"INSERT INTO {AUDIT_LOG_FTS_TABLE}(rowid, username, action, details) "
+    "VALUES (new.id, new.username, new.action, new.details); END",
+)
+
+
+def _logger():
+    return current_app.logger if has_app_context() else logging.getLogger(__name__)
+
+
+def queue_audit_log(**fields):
+    """
+    Buffers an audit_log row for the current app context. Buffered rows ride along with the
+    next commit on the session, or are written in one batch when the request/context ends.
+    """
+    fields.setdefault('timestamp', datetime.now(timezone.utc))
+    if not hasattr(g, _BUFFER_ATTR):
+        setattr(g, _BUFFER_ATTR, [])
+    getattr(g, _BUFFER_ATTR).append(fields)
+
+
+def _take_buffered_entries() -> list:
+    if not has_app_context():
+        return []
+    entries = getattr(g, _BUFFER_ATTR, None) or []
+    if entries:
+        setattr(g, _BUFFER_ATTR, [])
+    return entries
+
+
+def flush_audit_log_buffer(exc=None):
+    """Writes any buffered audit rows in a single commit. Registered as request and app-context teardown."""
+    entries = _take_buffered_entries()
+    if not entries:
+        return
+    try:
+        if not db.session.is_active: # A failed flush earlier in the request left the transaction unusable
+            db.session.rollback()
+        db.session.add_all([AuditLog(**fields) for fields in entries])
+        db.session.commit()
+    except Exception as e:
+        _logger().error(f"Error writing {len(entries)} buffered audit log entries: {e}", exc_info=True)
+        db.session.rollback()
+
+
+def _attach_buffer_to_commit(session):
+    entries = _take_buffered_entries()
+    if entries:
+        session.add_all([AuditLog(**fields) for fields in entries])
+        session.info.setdefault(_INFLIGHT_KEY, []).extend(entries)
+
+
+def _commit_succeeded(session):
+    session.info.pop(_INFLIGHT_KEY, None)
+
+
+def _requeue_after_rollback(session, previous_transaction=None):
+    # The AuditLog objects were expunged by the rollback; their field dicts go back to the buffer.
+    entries = session.info.pop(_INFLIGHT_KEY, None)
+    if entries and has_app_context():
+        setattr(g, _BUFFER_ATTR, entries + (getattr(g, _BUFFER_ATTR, None) or []))
+
+
+def _create_sqlite_fts(target, connection, **kw):
+    if connection.dialect.name != 'sqlite':
+        return
+    try:
+        for statement in _SQLITE_FTS_DDL:
+            connection.exec_driver_sql(statement)
+    except Exception as e: # SQLite built without FTS5: searches fall back to LIKE
+        logging.getLogger(__name__).warning(f"Could not create {AUDIT_LOG_FTS_TABLE}: {e}")
+
+
+event.listen(AuditLog.__table__, 'after_create', _create_sqlite_fts)
+event.listen(AuditLog.__table__, 'before_drop',
+             DDL(f"DROP TABLE IF EXISTS {AUDIT_LOG_FTS_TABLE}").execute_if(dialect='sqlite'))
+
+
+def register_audit_log_buffer(app, session=None):
+    """Hooks the session commit cycle and the app teardowns that drain the audit buffer. Safe to call repeatedly."""
+    target = session if session is not None else db.session
+    for event_name, handler in (('before_commit', _attach_buffer_to_commit),
+                                ('after_commit', _commit_succeeded),
+                                ('after_rollback', _requeue_after_rollback)):
+        if not event.contains(target, event_name, handler):
+            event.listen(target, event_name, handler)
+    if flush_audit_log_buffer not in app.teardown_request_funcs.get(None, []):
+        app.teardown_request(flush_audit_log_buffer)
+        app.teardown_appcontext(flush_audit_log_buffer)
+
+
+def _search_words(term: str) -> list:
+    return re.findall(r'[^\W_]+', (term or '').lower())
+
+
+def audit_log_search_filter(term: str, session=None):
+    """
+    Filter clause matching audit rows whose username, action or details contain words starting
+    with each word of term. Uses the tsvector GIN index on Postgres and FTS5 on SQLite,
+    falling back to ILIKE substring matching elsewhere.
+    """
+    session = session or db.session
+    words = _search_words(term)
+    if not words:
+        return None
+    dialect_name = session.get_bind().dialect.name
+    if dialect_name == 'postgresql':
+        prefix_query = ' & '.join(f"{word}:*" for word in words)
+        return literal_column(AUDIT_LOG_SEARCH_SQL).op('@@')(func.to_tsquery('simple', prefix_query))
+    if dialect_name == 'sqlite' and _sqlite_fts_available(session):
+        match_query = ' '.join(f'"{word}"*' for word in words)
+        fts_rowids = text(f"SELECT rowid FROM {AUDIT_LOG_FTS_TABLE} WHERE {AUDIT_LOG_FTS_TABLE} MATCH :audit_match")
+        return AuditLog.id.in_(fts_rowids.bindparams(audit_match=match_query).columns(rowid=db.Integer))
+    search_filter = f'%{term}%'
+    return or_(AuditLog.username.ilike(search_filter), AuditLog.action.ilike(search_filter), AuditLog.details.ilike(search_filter))
+
+
+def _sqlite_fts_available(session) -> bool:
+    return session.execute(
+        text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"), {'name': AUDIT_LOG_FTS_TABLE}
+    ).first() is not None
+
+
+def prune_audit_logs(cutoff: datetime, batch_size: int = _PRUNE_BATCH_SIZE) -> int:
+    """Deletes audit rows older than cutoff (UTC), batch_size rows per transaction. Returns the number deleted."""
+    deleted = 0
+    while True:
+        batch_ids = db.session.execute(
+            select(AuditLog.id).where(AuditLog.timestamp < cutoff).order_by(AuditLog.id).limit(batch_size)
+        ).scalars().all()
+        if not batch_ids:
+            return deleted
+        db.session.execute(delete(AuditLog).where(AuditLog.id.in_(batch_ids)))
+        db.session.commit()
+        deleted += len(batch_ids)
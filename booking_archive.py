@@ -0,0 +1,54 @@
+from datetime import datetime
+
+from sqlalchemy import delete, insert, literal, select
+
+from extensions import db
+from models import ARCHIVABLE_BOOKING_STATUSES, Booking, BookingArchive, Resource
+from query_helpers import on_date
+
+# booking_archive mirrors every booking column, so rows are copied by name.
+_ARCHIVED_COLUMNS = [column.name for column in Booking.__table__.columns]
+
+
+def archive_finished_bookings(cutoff: datetime, batch_size: int = 500) -> int:
+    """
+    Moves bookings in a finished status that ended before cutoff (naive venue local) from booking
+    into booking_archive, batch_size rows per transaction. Returns the number of rows moved.
+    Only non-active bookings move, so slot occupancy and conflict checks are unaffected.
+    """
+    booking_table = Booking.__table__
+    archive_table = BookingArchive.__table__
+    moved = 0
+    while True:
+        batch_ids = db.session.execute(
+            select(booking_table.c.id).where(
+                booking_table.c.end_time < cutoff,
+                booking_table.c.status.in_(ARCHIVABLE_BOOKING_STATUSES)
+            ).order_by(booking_table.c.id).limit(batch_size)
+        ).scalars().all()
+        if not batch_ids:
+            return moved
+        archived_at = literal(datetime.utcnow(), db.DateTime)
+        db.session.execute(insert(archive_table).from_select(
+            _ARCHIVED_COLUMNS + ['archived_at'],
+            select(*(booking_table.c[name] for name in _ARCHIVED_COLUMNS), archived_at)
+            .where(booking_table.c.id.in_(batch_ids))
+        ))
+        db.session.execute(delete(booking_table).where(booking_table.c.id.in_(batch_ids)))
+        db.session.commit()
+        moved += len(batch_ids)
+
+
+def filtered_history_query(model, user_id, status_filter=None, resource_name_filter=None, selected_date=None):
+    """
+    The "my bookings" filters applied to Booking or BookingArchive alike,
+    so past-booking views can read through to the archive.
+    """
+    query = model.query.filter(model.user_id == user_id)
+    if status_filter and status_filter.lower() != 'all':
+        query = query.filter(model.status == status_filter.strip().lower())
+    if resource_name_filter:
+        query = query.join(Resource, model.resource_id == Resource.id).filter(Resource.name.ilike(f"%{resource_name_filter}%"))
+    if selected_date:
+        query = query.filter(on_date(model.start_time, selected_date))
+    return query
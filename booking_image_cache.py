@@ -0,0 +1,149 @@
+import hashlib
+import io
+import json
+import os
+import threading
+from collections import OrderedDict
+
+from flask import current_app
+
+from floor_map_derivatives import FLOOR_MAP_FOLDER
+from r2_storage import r2_storage
+
+BOOKING_IMAGE_CACHE_FOLDER = 'booking_image_cache'
+_MEMORY_ENTRIES = 64
+
+# (floor_map_id, image_filename, image version) -> sha256 of the map image bytes
+_map_hashes = {}
+# cache key -> rendered image bytes, most recently used last
+_rendered = OrderedDict()
+_lock = threading.Lock()
+
+
+def map_image_version(floor_map, image_path=None):
+    """
+    Identifies the current bytes of floor_map's image without reading them: the local file's
+    mtime, or the object's ETag on R2 (one HEAD request). None when it can't be determined, in
+    which case the map hash is neither looked up nor remembered.
+    """
+    if image_path:
+        try:
+            return os.stat(image_path).st_mtime_ns
+        except OSError:
+            return None
+    if _use_r2():
+        head = r2_storage.head_file(floor_map.image_filename, FLOOR_MAP_FOLDER)
+        return head.get('ETag') if head else None
+    return None
+
+
+def _map_hash_key(floor_map, image_version):
+    if image_version is None:
+        return None
+    return floor_map.id, floor_map.image_filename, image_version
+
+
+def remembered_map_hash(floor_map, image_version):
+    """The content hash of floor_map's image if this process has already read this version of it, else None."""
+    key = _map_hash_key(floor_map, image_version)
+    return _map_hashes.get(key) if key else None
+
+
+def remember_map_hash(floor_map, image_bytes: bytes, image_version) -> str:
+    digest = hashlib.sha256(image_bytes).hexdigest()
+    key = _map_hash_key(floor_map, image_version)
+    if key:
+        with _lock:
+            _map_hashes[key] = digest
+    return digest
+
+
+def booking_image_key(map_hash: str, floor_map, map_coordinates_str: str, resource_name: str) -> str:
+    """
+    Content address of an annotated image: the map image hash plus everything drawn on it.
+    Grouped under the map hash so all renders of one map image can be dropped together.
+    """
+    try:
+        coordinates = json.dumps(json.loads(map_coordinates_str), sort_keys=True)
+    except (TypeError, ValueError):
+        coordinates = str(map_coordinates_str)
+    parts = [map_hash, floor_map.offset_x or 0, floor_map.offset_y or 0, coordinates, resource_name]
+    return f"{map_hash[:16]}/{hashlib.sha256(json.dumps(parts).encode('utf-8')).hexdigest()}.img"
+
+
+def _local_cache_dir():
+    return current_app.config.get('BOOKING_IMAGE_CACHE_DIR') or os.path.join(current_app.root_path, 'data', BOOKING_IMAGE_CACHE_FOLDER)
+
+
+def _use_r2():
+    return current_app.config.get('STORAGE_PROVIDER', 'local') == 'r2' and r2_storage.client is not None
+
+
+def _remember_rendered(key, data):
+    with _lock:
+        _rendered[key] = data
+        _rendered.move_to_end(key)
+        while len(_rendered) > _MEMORY_ENTRIES:
+            _rendered.popitem(last=False)
+
+
+def get_cached_booking_image(key: str):
+    """Rendered bytes for key from this process's memory, then from disk or R2. None on a miss."""
+    with _lock:
+        data = _rendered.get(key)
+        if data is not None:
+            _rendered.move_to_end(key)
+            return data
+    if _use_r2():
+        data = r2_storage.download_file(key, BOOKING_IMAGE_CACHE_FOLDER, missing_ok=True) # A miss is expected
+    else:
+        path = os.path.join(_local_cache_dir(), key)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except OSError:
+            data = None
+    if data:
+        _remember_rendered(key, data)
+        return data
+    return None
+
+
+def store_booking_image(key: str, data: bytes):
+    _remember_rendered(key, data)
+    try:
+        if _use_r2():
+            r2_storage.upload_file(io.BytesIO(data), key, BOOKING_IMAGE_CACHE_FOLDER)
+        else:
+            path = os.path.join(_local_cache_dir(), key)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            temp_path = f"{path}.{os.getpid()}.tmp"
+            with open(temp_path, 'wb') as f:
+                f.write(data)
+            os.replace(temp_path, path) # Concurrent writers produce identical bytes; last one wins
+    except Exception as e:
+        current_app.logger.warning(f"Could not store cached booking image {key}: {e}")
+
+
+def invalidate_booking_images(floor_map_id=None):
+    """
+    Forgets remembered map hashes (for one map, or all) and the in-memory renders. Renders for a
+    map image that this process has hashed are also deleted from disk/R2; other keys are content
+    addressed and simply stop being requested once a map or resource changes.
+    """
+    with _lock:
+        dropped = [key for key in _map_hashes if floor_map_id is None or key[0] == floor_map_id]
+        map_hashes = {_map_hashes.pop(key) for key in dropped}
+        _rendered.clear()
+    for map_hash in map_hashes:
+        prefix = map_hash[:16]
+        try:
+            if _use_r2():
+                for item in r2_storage.list_files(f"{BOOKING_IMAGE_CACHE_FOLDER}/{prefix}/"):
+                    r2_storage.delete_file(item['name'])
+            else:
+                folder = os.path.join(_local_cache_dir(), prefix)
+                for name in os.listdir(folder) if os.path.isdir(folder) else []:
+                    os.remove(os.path.join(folder, name))
+        except Exception as e:
+            current_app.logger.warning(f"Could not remove cached booking images for map hash {prefix}: {e}")
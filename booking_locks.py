@@ -0,0 +1,39 @@
+from sqlalchemy import text
+from sqlalchemy.exc import IntegrityError
+
+from extensions import db
+
+# Postgres: EXCLUDE USING gist (resource_id WITH =, tsrange(start_time, end_time) WITH &&) over active statuses.
+BOOKING_OVERLAP_CONSTRAINT = 'ex_booking_active_overlap'
+BOOKING_EXACT_SLOT_CONSTRAINT = 'uq_booking_resource_time'
+
+_UPSERT_LOCK_ROW_SQL = text(
+    "INSERT INTO resource_booking_lock (resource_id, version) VALUES (:resource_id, 1) "
+    "ON CONFLICT (resource_id) DO UPDATE SET version = resource_booking_lock.version + 1"
+)
+
+
+def database_enforces_booking_overlaps(session=None) -> bool:
+    """True when the exclusion constraint guards overlaps, so a racing insert fails on its own."""
+    return (session or db.session).get_bind().dialect.name == 'postgresql'
+
+
+def lock_resources_for_booking(resource_ids, session=None):
+    """
+    Serializes check-then-write booking transactions per resource on databases without the
+    overlap exclusion constraint. Bumping the resource's lock row takes the write lock up front
+    (on SQLite, the database-wide RESERVED lock), so the conflict SELECTs that follow cannot be
+    invalidated by a concurrent insert before this transaction commits. Call before the checks.
+    """
+    session = session or db.session
+    if database_enforces_booking_overlaps(session):
+        return
+    for resource_id in sorted({int(r) for r in resource_ids if r is not None}):
+        session.execute(_UPSERT_LOCK_ROW_SQL, {'resource_id': resource_id})
+
+
+def is_booking_conflict_error(error: IntegrityError) -> bool:
+    """Whether an IntegrityError came from the overlap exclusion or the exact-slot unique constraint."""
+    message = str(getattr(error, 'orig', error))
+    return (BOOKING_OVERLAP_CONSTRAINT in message or BOOKING_EXACT_SLOT_CONSTRAINT in message
+            or 'UNIQUE constraint failed: booking.resource_id' in message)
@@ -0,0 +1,119 @@
+import itertools
+import threading
+
+from flask import g, has_request_context
+from sqlalchemy import event, select
+
+from extensions import db
+from models import BookingSettings
+
+_G_ATTR = 'booking_settings_snapshot'
+_PENDING_KEY = 'booking_settings_pending'
+_UNSET = object()
+
+_cached = _UNSET # (key, snapshot) where key is (id, version) of the row, or None when there is no row
+_cached_lock = threading.Lock()
+
+
+class BookingSettingsSnapshot:
+    """Read-only copy of the BookingSettings row; attribute names match the model's columns."""
+
+    __slots__ = tuple(column.key for column in BookingSettings.__table__.columns)
+
+    def __init__(self, settings: BookingSettings):
+        for name in self.__slots__:
+            object.__setattr__(self, name, getattr(settings, name))
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"BookingSettingsSnapshot is read-only; update BookingSettings to change '{name}'.")
+
+    def to_dict(self) -> dict:
+        return BookingSettings.to_dict(self)
+
+    def __repr__(self):
+        return f"<BookingSettingsSnapshot {self.id} v{self.version}>"
+
+
+def _settings_key(session):
+    row = session.execute(
+        select(BookingSettings.id, BookingSettings.version).order_by(BookingSettings.id).limit(1)
+    ).first()
+    return tuple(row) if row else None
+
+
+def _load_snapshot(session):
+    global _cached
+    key = _settings_key(session)
+    cached = _cached
+    if cached is not _UNSET and cached[0] == key:
+        return cached[1]
+    settings = session.execute(select(BookingSettings).order_by(BookingSettings.id).limit(1)).scalar()
+    snapshot = BookingSettingsSnapshot(settings) if settings else None
+    if not session.info.get(_PENDING_KEY): # Uncommitted edits may still roll back; don't share them
+        with _cached_lock:
+            _cached = ((snapshot.id, snapshot.version) if snapshot else None, snapshot)
+    return snapshot
+
+
+def current_booking_settings():
+    """
+    The current BookingSettings as an immutable BookingSettingsSnapshot, or None when no row exists.
+    The process-wide snapshot is revalidated against the row's version counter (one primary-key
+    lookup) at most once per request, so edits made by any worker are seen on the next request.
+    """
+    if has_request_context():
+        snapshot = getattr(g, _G_ATTR, _UNSET)
+        if snapshot is _UNSET:
+            snapshot = _load_snapshot(db.session)
+            setattr(g, _G_ATTR, snapshot)
+        return snapshot
+    return _load_snapshot(db.session)
+
+
+def invalidate_booking_settings_cache():
+    """Drops the process-wide and per-request snapshots; the next lookup reloads the row."""
+    global _cached
+    with _cached_lock:
+        _cached = _UNSET
+    _drop_request_snapshot()
+
+
+def _drop_request_snapshot(*args):
+    if has_request_context() and hasattr(g, _G_ATTR):
+        delattr(g, _G_ATTR)
+
+
+def _bump_version_on_change(session, flush_context, instances):
+    changed = any(isinstance(obj, BookingSettings) for obj in itertools.chain(session.new, session.deleted))
+    for obj in session.dirty:
+        if isinstance(obj, BookingSettings) and session.is_modified(obj, include_collections=False):
+            obj.version = BookingSettings.version + 1 # In SQL, so concurrent writers can't reuse a version
+            changed = True
+    if changed:
+        session.info[_PENDING_KEY] = True
+        _drop_request_snapshot()
+
+
+def _transaction_finished(session, *args):
+    # Other workers notice the new version on their next request; this one can drop its copy right away.
+    if session.info.pop(_PENDING_KEY, None):
+        invalidate_booking_settings_cache()
+
+
+def _table_recreated(target, connection, **kw):
+    invalidate_booking_settings_cache() # A fresh table restarts ids and versions at 1
+
+
+event.listen(BookingSettings.__table__, 'after_create', _table_recreated)
+
+
+def register_booking_settings_cache(app, session=None):
+    """Hooks the version bump into flushes and drops the per-request snapshot at teardown. Safe to call repeatedly."""
+    target = session if session is not None else db.session
+    for event_name, handler in (('before_flush', _bump_version_on_change),
+                                ('after_commit', _transaction_finished),
+                                ('after_rollback', _transaction_finished)):
+        if not event.contains(target, event_name, handler):
+            event.listen(target, event_name, handler)
+    if _drop_request_snapshot not in app.teardown_request_funcs.get(None, []):
+        app.teardown_request(_drop_request_snapshot)
@@ -1,3 +1,4 @@
+import os
 import click
 from flask.cli import with_appcontext
 from datetime import timedelta, timezone # timezone might not be used directly here, but good for clarity
@@ -84,8 +85,59 @@ def migrate_booking_times_to_local_command():
     if error_count > 0:
         click.echo(click.style(f'{error_count} errors occurred.', fg='red'))
 
+@click.command('rebuild_resource_day_occupancy')
+@with_appcontext
+def rebuild_resource_day_occupancy_command():
+    """Rebuilds the resource_day_occupancy table from scratch using the current bookings."""
+    from occupancy import rebuild_all_resource_day_occupancy
+    click.echo('Rebuilding resource_day_occupancy...')
+    try:
+        rows_written = rebuild_all_resource_day_occupancy(db.session.connection())
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        click.echo(click.style(f'Error rebuilding resource_day_occupancy: {str(e)}', fg='red'))
+        return
+    click.echo(click.style(f'Rebuild complete. Wrote {rows_written} resource/day rows.', fg='green'))
+
+@click.command('generate_floor_map_derivatives')
+@click.option('--missing-only', is_flag=True, help='Skip maps that already have derivatives for their current image.')
+@with_appcontext
+def generate_floor_map_derivatives_command(missing_only):
+    """Generates the resized/WebP/AVIF floor map copies and, for very large maps, the tile pyramid for existing maps (uploads create them automatically)."""
+    from flask import current_app
+    from models import FloorMap
+    from floor_map_derivatives import FLOOR_MAP_FOLDER, floor_map_derivatives_payload, refresh_floor_map_derivatives
+    from floor_map_tiles import refresh_floor_map_tiles
+    from r2_storage import r2_storage
+    generated_count, error_count = 0, 0
+    for floor_map in FloorMap.query.order_by(FloorMap.id).all():
+        if not floor_map.image_filename or (missing_only and floor_map_derivatives_payload(floor_map)):
+            continue
+        if current_app.config.get('STORAGE_PROVIDER', 'local') == 'r2':
+            image_bytes = r2_storage.download_file(floor_map.image_filename, FLOOR_MAP_FOLDER)
+        else:
+            upload_folder = current_app.config.get('UPLOAD_FOLDER', os.path.join(current_app.root_path, 'static', FLOOR_MAP_FOLDER))
+            try:
+                with open(os.path.join(upload_folder, floor_map.image_filename), 'rb') as f:
+                    image_bytes = f.read()
+            except OSError:
+                image_bytes = None
+        if not image_bytes or not refresh_floor_map_derivatives(floor_map, image_bytes):
+            click.echo(click.style(f'Could not generate derivatives for map {floor_map.id} ({floor_map.image_filename}).', fg='red'))
+            error_count += 1
+            continue
+        refresh_floor_map_tiles(floor_map, image_bytes)
+        db.session.commit()
+        generated_count += 1
+    click.echo(click.style(f'Generated derivatives for {generated_count} floor maps.', fg='green'))
+    if error_count > 0:
+        click.echo(click.style(f'{error_count} errors occurred.', fg='red'))
+
 def register_cli_commands(app):
     app.cli.add_command(migrate_booking_times_to_local_command)
+    app.cli.add_command(rebuild_resource_day_occupancy_command)
+    app.cli.add_command(generate_floor_map_derivatives_command)
 
     from cli_admin_emails import register_cli_admin_email_commands
     register_cli_admin_email_commands(app)
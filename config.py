@@ -55,10 +55,29 @@ else:
 
 SQLALCHEMY_TRACK_MODIFICATIONS = False
 
+# Optional streaming replica for read-only views (see db_routing.reads_from_replica).
+DATABASE_REPLICA_URL = os.environ.get('DATABASE_REPLICA_URL')
+if DATABASE_REPLICA_URL and DATABASE_REPLICA_URL.startswith("postgres://"):
+    DATABASE_REPLICA_URL = DATABASE_REPLICA_URL.replace("postgres://", "postgresql://", 1)
+SQLALCHEMY_BINDS = {'replica': DATABASE_REPLICA_URL} if DATABASE_REPLICA_URL else {}
+
 # Database connection retry settings
 DB_CONNECT_MAX_RETRIES = int(os.environ.get('DB_CONNECT_MAX_RETRIES', 3))
 DB_CONNECT_RETRY_DELAY = int(os.environ.get('DB_CONNECT_RETRY_DELAY', 3))
 
+# Connection pool (server databases only; see db_pool.build_engine_options). Size per worker process:
+# workers x (DB_POOL_SIZE + DB_MAX_OVERFLOW) must stay below the server's (or PgBouncer's) connection limit.
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 5))
+DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW', 10))
+DB_POOL_TIMEOUT = int(os.environ.get('DB_POOL_TIMEOUT', 30)) # Seconds a request waits for a free connection
+DB_POOL_RECYCLE = int(os.environ.get('DB_POOL_RECYCLE', 1800)) # Seconds before a connection is replaced
+DB_POOL_PRE_PING = os.environ.get('DB_POOL_PRE_PING', 'true').lower() in ['true', '1', 'yes']
+DB_STATEMENT_TIMEOUT_MS = int(os.environ.get('DB_STATEMENT_TIMEOUT_MS', 0)) # 0 = no timeout
+# Behind PgBouncer in transaction mode: no startup options, statement timeout applied with SET LOCAL per transaction
+DB_PGBOUNCER_TRANSACTION_MODE = os.environ.get('DB_PGBOUNCER_TRANSACTION_MODE', 'false').lower() in ['true', '1', 'yes']
+# Bearer token for scraping /metrics without a login session (unset = admin login only)
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+
 # --- Internationalization and Localization (i18n/l10n) ---
 LANGUAGES = ['en', 'es', 'th', 'fr'] # Supported languages
 BABEL_DEFAULT_LOCALE = 'en'
@@ -72,6 +91,15 @@ R2_SECRET_KEY = os.environ.get('R2_SECRET_KEY')
 R2_BUCKET_NAME = os.environ.get('R2_BUCKET_NAME')
 R2_ENDPOINT_URL = os.environ.get('R2_ENDPOINT_URL')
 STORAGE_PROVIDER = os.environ.get('STORAGE_PROVIDER', 'r2' if R2_ACCESS_KEY else 'local')
+# Presigned image URLs are reused per object key until this many seconds before they expire.
+R2_PRESIGNED_URL_SAFETY_MARGIN = int(os.environ.get('R2_PRESIGNED_URL_SAFETY_MARGIN', 300))
+R2_PRESIGNED_URL_CACHE_SIZE = int(os.environ.get('R2_PRESIGNED_URL_CACHE_SIZE', 2048))
+# Annotated floor-map images for booking emails (local storage; R2 uses booking_image_cache/ in the bucket).
+BOOKING_IMAGE_CACHE_DIR = os.environ.get('BOOKING_IMAGE_CACHE_DIR', str(basedir / 'data' / 'booking_image_cache'))
+# Deep-zoom tiles for floor maps whose longest edge is at least this many pixels (0 disables tiling).
+# Local storage; R2 uses floor_map_tiles/ in the bucket.
+FLOOR_MAP_TILE_MIN_EDGE = int(os.environ.get('FLOOR_MAP_TILE_MIN_EDGE', 4096))
+FLOOR_MAP_TILE_DIR = os.environ.get('FLOOR_MAP_TILE_DIR', str(basedir / 'data' / 'floor_map_tiles'))
 
 # --- File Upload Configurations ---
 # Define base upload folder, then specific subfolders.
@@ -159,6 +187,11 @@ GMAIL_REFRESH_TOKEN = os.environ.get('GMAIL_REFRESH_TOKEN')
 CHECK_IN_GRACE_MINUTES = int(os.environ.get('CHECK_IN_GRACE_MINUTES', 15)) # Grace period for check-in in minutes
 # How often the background job checks for bookings to auto-cancel if not checked in
 AUTO_CANCEL_CHECK_INTERVAL_MINUTES = int(os.environ.get('AUTO_CANCEL_CHECK_INTERVAL_MINUTES', 5))
+# Finished bookings that ended more than this many days ago are moved to booking_archive by /tasks/archive_bookings
+BOOKING_ARCHIVE_AFTER_DAYS = int(os.environ.get('BOOKING_ARCHIVE_AFTER_DAYS', 180))
+BOOKING_ARCHIVE_BATCH_SIZE = int(os.environ.get('BOOKING_ARCHIVE_BATCH_SIZE', 500)) # Rows moved per transaction
+# Audit log entries older than this many days are deleted by /tasks/prune_audit_logs (0 keeps everything)
+AUDIT_LOG_RETENTION_DAYS = int(os.environ.get('AUDIT_LOG_RETENTION_DAYS', 365))
 
 # --- Azure Backup Configuration (Legacy) ---
 # Interval for the legacy backup job (if `backup_if_changed` is used)
@@ -209,6 +242,10 @@ MAX_BOOKING_DURATION_HOURS = int(os.environ.get('MAX_BOOKING_DURATION_HOURS', 8)
 MIN_BOOKING_DURATION_MINUTES = int(os.environ.get('MIN_BOOKING_DURATION_MINUTES', 15))
 BOOKING_LEAD_TIME_DAYS = int(os.environ.get('BOOKING_LEAD_TIME_DAYS', 14)) # How far in advance users can book
 DEFAULT_ITEMS_PER_PAGE = int(os.environ.get('DEFAULT_ITEMS_PER_PAGE', 10)) # For pagination
+# Maintenance schedules are compiled once per process; other workers pick up edits after this many seconds
+MAINTENANCE_SCHEDULE_CACHE_TTL_SECONDS = int(os.environ.get('MAINTENANCE_SCHEDULE_CACHE_TTL_SECONDS', 60))
+# Serve slot occupancy from resource_day_occupancy (run `flask rebuild_resource_day_occupancy` once before enabling)
+OCCUPANCY_TABLE_READS_ENABLED = os.environ.get('OCCUPANCY_TABLE_READS_ENABLED', 'false').lower() in ('true', '1', 'yes')
 
 # --- Map View Settings ---
 try:
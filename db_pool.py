@@ -0,0 +1,114 @@
+import os
+import threading
+import time
+
+from sqlalchemy import event, exc
+from sqlalchemy.pool import QueuePool
+
+
+class _CheckoutStats:
+    """Process-wide checkout wait counters; each gunicorn worker reports its own."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+        self.timeouts = 0
+
+    def record(self, waited: float, timed_out: bool):
+        with self._lock:
+            self.checkouts += 1
+            self.wait_seconds_total += waited
+            self.wait_seconds_max = max(self.wait_seconds_max, waited)
+            if timed_out:
+                self.timeouts += 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                'checkouts_total': self.checkouts,
+                'checkout_wait_seconds_sum': round(self.wait_seconds_total, 6),
+                'checkout_wait_seconds_max': round(self.wait_seconds_max, 6),
+                'checkout_timeouts_total': self.timeouts,
+            }
+
+
+checkout_stats = _CheckoutStats()
+
+
+class InstrumentedQueuePool(QueuePool):
+    """QueuePool that records how long each checkout waited for a free (or newly opened) connection."""
+
+    def _do_get(self):
+        started = time.perf_counter()
+        timed_out = False
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            timed_out = True
+            raise
+        finally:
+            checkout_stats.record(time.perf_counter() - started, timed_out)
+
+
+def build_engine_options(config) -> dict:
+    """
+    SQLALCHEMY_ENGINE_OPTIONS for a server database from the DB_POOL_* / DB_STATEMENT_TIMEOUT_MS settings.
+    SQLite keeps SQLAlchemy's defaults. With DB_PGBOUNCER_TRANSACTION_MODE the statement timeout is not
+    sent as a startup option (PgBouncer rejects those); register_pool_instrumentation applies it per transaction.
+    """
+    if config.get('SQLALCHEMY_DATABASE_URI', '').startswith('sqlite'):
+        return {}
+    options = {
+        'poolclass': InstrumentedQueuePool,
+        'pool_size': config.get('DB_POOL_SIZE', 5),
+        'max_overflow': config.get('DB_MAX_OVERFLOW', 10),
+        'pool_timeout': config.get('DB_POOL_TIMEOUT', 30),
+        'pool_recycle': config.get('DB_POOL_RECYCLE', 1800),
+        'pool_pre_ping': config.get('DB_POOL_PRE_PING', True),
+    }
+    statement_timeout_ms = config.get('DB_STATEMENT_TIMEOUT_MS', 0)
+    if statement_timeout_ms and not config.get('DB_PGBOUNCER_TRANSACTION_MODE', False):
+        options['connect_args'] = {'options': f'-c statement_timeout={int(statement_timeout_ms)}'}
+    return options
+
+
+def register_pool_instrumentation(app, engine):
+    """Per-transaction statement timeout for PgBouncer transaction mode, where session-level SETs would leak."""
+    statement_timeout_ms = app.config.get('DB_STATEMENT_TIMEOUT_MS', 0)
+    if not (statement_timeout_ms and app.config.get('DB_PGBOUNCER_TRANSACTION_MODE', False)):
+        return
+    if engine.dialect.name != 'postgresql':
+        return
+
+    def _set_local_statement_timeout(connection):
+        connection.exec_driver_sql(f"SET LOCAL statement_timeout = {int(statement_timeout_ms)}")
+
+    if not event.contains(engine, 'begin', _set_local_statement_timeout):
+        event.listen(engine, 'begin', _set_local_statement_timeout)
+
+
+def pool_metrics(engine) -> dict:
+    """Current pool gauges plus the cumulative checkout wait counters for this process."""
+    pool = engine.pool
+    metrics = {'pool_class': type(pool).__name__, 'pid': os.getpid()}
+    for name, attr in (('pool_size', 'size'), ('connections_in_use', 'checkedout'),
+                       ('connections_idle', 'checkedin'), ('overflow', 'overflow')):
+        gauge = getattr(pool, attr, None)
+        metrics[name] = gauge() if callable(gauge) else None
+    metrics.update(checkout_stats.snapshot())
+    return metrics
+
+
+def render_prometheus(metrics: dict) -> str:
+    """Prometheus text exposition of pool_metrics(); None gauges are skipped."""
+    labels = f'pid="{metrics["pid"]}",pool="{metrics["pool_class"]}"'
+    lines = []
+    for name, value in metrics.items():
+        if name in ('pid', 'pool_class') or value is None:
+            continue
+        metric_type = 'counter' if name.endswith(('_total', '_sum')) else 'gauge'
+        lines.append(f"# TYPE db_pool_{name} {metric_type}")
+        lines.append(f"db_pool_{name}{{{labels}}} {value}")
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,52 @@
+from functools import wraps
+
+from flask import g, has_request_context, request
+from flask_sqlalchemy.session import Session
+
+REPLICA_BIND_KEY = 'replica'
+_READ_ONLY_FLAG = 'use_read_replica'
+_WROTE_KEY = 'read_replica_disabled'
+
+
+class RoutingSession(Session):
+    """
+    Sends plain SELECTs issued inside a reads_from_replica view to the SQLALCHEMY_BINDS['replica']
+    engine. Anything else (flushes, DML, SELECT ... FOR UPDATE, raw connections) goes to the primary,
+    and once that has happened the rest of the session reads from the primary too, so a request
+    always sees its own writes. Without a replica bind this behaves exactly like the default session.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        engine = super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+        if bind is not None or not (has_request_context() and g.get(_READ_ONLY_FLAG)):
+            return engine
+        engines = self._db.engines
+        if REPLICA_BIND_KEY not in engines or engine is not engines.get(None):
+            return engine # Models with their own bind_key keep it
+        if self.info.get(_WROTE_KEY):
+            return engine
+        if self._flushing or not _is_plain_select(clause):
+            self.info[_WROTE_KEY] = True
+            return engine
+        return engines[REPLICA_BIND_KEY]
+
+
+def _is_plain_select(clause) -> bool:
+    return (clause is not None and getattr(clause, 'is_select', False)
+            and getattr(clause, '_for_update_arg', None) is None)
+
+
+def reads_from_replica(f):
+    """Marks a read-only view: its GET/HEAD requests may be served from the read replica, if one is configured."""
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if request.method not in ('GET', 'HEAD'):
+            return f(*args, **kwargs)
+        previous = g.get(_READ_ONLY_FLAG, False)
+        setattr(g, _READ_ONLY_FLAG, True)
+        try:
+            return f(*args, **kwargs)
+        finally:
+            setattr(g, _READ_ONLY_FLAG, previous)
+    return decorated_function
+
@@ -0,0 +1,96 @@
+import logging
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+
+from flask import current_app, g, has_app_context
+from sqlalchemy.exc import OperationalError, ProgrammingError
+
+from booking_settings_cache import current_booking_settings
+
+_G_ATTR = 'effective_clock'
+_frozen_utc_now = None
+
+
+class EffectiveClock:
+    """
+    The effective "now" for one request or task run. utc_now is read once; the venue offset and
+    past-booking adjustment come from the BookingSettings snapshot it was built with.
+    """
+
+    __slots__ = ('utc_now', 'settings', 'offset_hours', 'past_booking_adjustment_hours',
+                 'effective_now', 'venue_now', 'past_booking_cutoff')
+
+    def __init__(self, utc_now: datetime, settings=None):
+        self.utc_now = utc_now
+        self.settings = settings
+        self.offset_hours = (settings.global_time_offset_hours or 0) if settings else 0
+        self.past_booking_adjustment_hours = (settings.past_booking_time_adjustment_hours or 0) if settings else 0
+        # Aware, as get_current_effective_time() has always returned it
+        self.effective_now = utc_now + timedelta(hours=self.offset_hours)
+        # Naive venue local, comparable with Booking.start_time / end_time
+        self.venue_now = self.effective_now.replace(tzinfo=None)
+        self.past_booking_cutoff = self.venue_now - timedelta(hours=self.past_booking_adjustment_hours)
+
+    def __repr__(self):
+        return f"<EffectiveClock {self.venue_now.isoformat()} offset={self.offset_hours}h>"
+
+
+def _utc_now() -> datetime:
+    return _frozen_utc_now or datetime.now(timezone.utc)
+
+
+def _settings_for_clock():
+    try:
+        return current_booking_settings()
+    except (OperationalError, ProgrammingError):
+        # Table doesn't exist yet, suppress error and use default
+        return None
+    except Exception as e:
+        logger = current_app.logger if has_app_context() else logging.getLogger(__name__)
+        logger.error(f"Error fetching time offset from BookingSettings: {e}. Defaulting offset to 0.")
+        return None
+
+
+def current_clock() -> EffectiveClock:
+    """
+    The EffectiveClock for the current request or app context (a scheduler task run), built on
+    first use and reused afterwards. If BookingSettings change mid-request the offsets are
+    recomputed, but utc_now stays the same.
+    """
+    settings = _settings_for_clock()
+    if not has_app_context():
+        return EffectiveClock(_utc_now(), settings)
+    clock = g.get(_G_ATTR)
+    if clock is None or clock.settings is not settings:
+        clock = EffectiveClock(clock.utc_now if clock is not None else _utc_now(), settings)
+        setattr(g, _G_ATTR, clock)
+    return clock
+
+
+def reset_clock(*args):
+    """Forgets the current context's clock; the next current_clock() reads the time again."""
+    if has_app_context():
+        g.pop(_G_ATTR, None)
+
+
+@contextmanager
+def freeze_time(utc_now: datetime):
+    """
+    Test hook: every clock built inside the block uses utc_now (naive values are taken as UTC).
+        with freeze_time(datetime(2025, 6, 11, 16, 0, tzinfo=timezone.utc)): ...
+    """
+    global _frozen_utc_now
+    previous = _frozen_utc_now
+    _frozen_utc_now = utc_now if utc_now.tzinfo else utc_now.replace(tzinfo=timezone.utc)
+    reset_clock()
+    try:
+        yield
+    finally:
+        _frozen_utc_now = previous
+        reset_clock()
+
+
+def register_effective_clock(app):
+    """Drops the clock at the end of each request (tests can share one app context across requests)."""
+    if reset_clock not in app.teardown_request_funcs.get(None, []):
+        app.teardown_request(reset_clock)
@@ -6,7 +6,9 @@ from flask_wtf.csrf import CSRFProtect
 # from flask_socketio import SocketIO # Removed
 from flask_migrate import Migrate
 
-db = SQLAlchemy()
+from db_routing import RoutingSession
+
+db = SQLAlchemy(session_options={'class_': RoutingSession}) # Routes reads_from_replica views to SQLALCHEMY_BINDS['replica']
 login_manager = LoginManager()
 oauth = OAuth()
 # mail = Mail() # Removed
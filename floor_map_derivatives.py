@@ -0,0 +1,187 @@
+import io
+import json
+import os
+
+from flask import current_app, url_for
+from PIL import Image, ImageOps
+
+from r2_storage import r2_storage
+
+FLOOR_MAP_FOLDER = 'floor_map_uploads'
+# Variant name -> longest edge in pixels, largest first. 'base' matches the 1200 px working size used
+# for booking email images; 'display' fits the 800x600 map containers.
+DERIVATIVE_SIZES = (('base', 1200), ('display', 800), ('thumb', 240))
+SRCSET_SIZES = '(max-width: 800px) 100vw, 800px'
+_MODERN_FORMATS = (('avif', 'AVIF', {'quality': 60, 'speed': 6}),
+                   ('webp', 'WEBP', {'quality': 82, 'method': 4}))
+
+
+def _encoder_available(pil_format: str) -> bool:
+    Image.init()
+    return pil_format in Image.SAVE
+
+
+def _has_alpha(img) -> bool:
+    return img.mode in ('RGBA', 'LA', 'PA') or (img.mode == 'P' and 'transparency' in img.info)
+
+
+def _fallback_format(source_filename: str):
+    """The widely supported format a variant is also written in: JPEG for JPEG uploads, otherwise PNG."""
+    ext = source_filename.rsplit('.', 1)[-1].lower() if '.' in source_filename else ''
+    return ('jpg', 'JPEG', {'quality': 85, 'optimize': True}) if ext in ('jpg', 'jpeg') else ('png', 'PNG', {'optimize': True})
+
+
+def derivative_filename(source_filename: str, variant: str, ext: str) -> str:
+    stem = source_filename.rsplit('.', 1)[0]
+    return f"{stem}__{variant}.{ext}"
+
+
+def build_floor_map_derivatives(image_bytes: bytes, source_filename: str):
+    """
+    Decodes an uploaded floor map once, applies its EXIF orientation (as browsers do) and renders each
+    size in DERIVATIVE_SIZES in the fallback format plus WebP/AVIF where Pillow can encode them.
+    Images are never upscaled, so every derivative keeps the original's aspect ratio and map
+    coordinates stay valid. Returns (manifest, {filename: bytes}).
+    """
+    img = Image.open(io.BytesIO(image_bytes))
+    source_width, source_height = img.size
+    if img.getexif().get(0x0112) in (5, 6, 7, 8): # Orientations that swap width and height
+        source_width, source_height = source_height, source_width
+    img.draft('RGB', (DERIVATIVE_SIZES[0][1], DERIVATIVE_SIZES[0][1])) # JPEG only: decode at a reduced scale
+    img = ImageOps.exif_transpose(img)
+    img = img.convert('RGBA' if _has_alpha(img) else 'RGB')
+
+    fallback = _fallback_format(source_filename)
+    formats = [fallback] + [fmt for fmt in _MODERN_FORMATS if _encoder_available(fmt[1])]
+    manifest = {'source': source_filename, 'width': source_width, 'height': source_height,
+                'formats': [fmt[0] for fmt in formats], 'variants': {}}
+    files = {}
+    current = img
+    for variant, long_edge in DERIVATIVE_SIZES:
+        if max(current.size) > long_edge:
+            current = current.copy()
+            current.thumbnail((long_edge, long_edge), Image.Resampling.LANCZOS, reducing_gap=3.0)
+        variant_files = {}
+        for ext, pil_format, save_options in formats:
+            frame = current.convert('RGB') if pil_format == 'JPEG' and current.mode != 'RGB' else current
+            buffer = io.BytesIO()
+            frame.save(buffer, format=pil_format, **save_options)
+            name = derivative_filename(source_filename, variant, ext)
+            files[name] = buffer.getvalue()
+            variant_files[ext] = name
+        manifest['variants'][variant] = {'width': current.width, 'height': current.height, 'files': variant_files}
+    return manifest, files
+
+
+def _local_folder():
+    return current_app.config.get('UPLOAD_FOLDER', os.path.join(current_app.root_path, 'static', FLOOR_MAP_FOLDER))
+
+
+def _use_r2():
+    return current_app.config.get('STORAGE_PROVIDER', 'local') == 'r2'
+
+
+def _write_files(files: dict):
+    if _use_r2():
+        for name, data in files.items():
+            if not r2_storage.upload_file(io.BytesIO(data), name, FLOOR_MAP_FOLDER):
+                raise Exception(f"Failed to upload floor map derivative {name} to R2.")
+        return
+    folder = _local_folder()
+    os.makedirs(folder, exist_ok=True)
+    for name, data in files.items():
+        with open(os.path.join(folder, name), 'wb') as f:
+            f.write(data)
+
+
+def _manifest_filenames(manifest: dict):
+    for variant in (manifest or {}).get('variants', {}).values():
+        yield from variant.get('files', {}).values()
+
+
+def _delete_files(names):
+    for name in names:
+        try:
+            if _use_r2():
+                r2_storage.delete_file(name, FLOOR_MAP_FOLDER)
+            else:
+                path = os.path.join(_local_folder(), name)
+                if os.path.exists(path):
+                    os.remove(path)
+        except Exception as e:
+            current_app.logger.warning(f"Could not delete floor map derivative {name}: {e}")
+
+
+def delete_floor_map_derivatives(manifest_json):
+    """Removes the files listed in a FloorMap.image_derivatives manifest. Missing files are ignored."""
+    try:
+        manifest = json.loads(manifest_json) if manifest_json else None
+    except (TypeError, ValueError):
+        return
+    _delete_files(list(_manifest_filenames(manifest)))
+
+
+def refresh_floor_map_derivatives(floor_map, image_bytes: bytes) -> bool:
+    """
+    (Re)generates and stores the derivatives for floor_map's current image and records the manifest
+    on floor_map.image_derivatives (the caller commits). On failure the map keeps no manifest and
+    clients fall back to image_url. Returns True when derivatives were written.
+    """
+    previous = floor_map.image_derivatives
+    try:
+        manifest, files = build_floor_map_derivatives(image_bytes, floor_map.image_filename)
+        _write_files(files)
+    except Exception as e:
+        current_app.logger.warning(f"Could not generate derivatives for floor map image '{floor_map.image_filename}': {e}")
+        floor_map.image_derivatives = None
+        return False
+    floor_map.image_derivatives = json.dumps(manifest)
+    if previous:
+        try:
+            _delete_files(set(_manifest_filenames(json.loads(previous))) - set(files)) # e.g. AVIF no longer available
+        except (TypeError, ValueError):
+            pass
+    return True
+
+
+def floor_map_file_url(filename: str):
+    if _use_r2():
+        return r2_storage.generate_presigned_url(filename, FLOOR_MAP_FOLDER)
+    return url_for('static', filename=f'{FLOOR_MAP_FOLDER}/{filename}', _external=False)
+
+
+def floor_map_derivatives_payload(floor_map):
+    """
+    The derivative URLs and srcset metadata for the map APIs, or None when floor_map has no
+    derivatives for its current image (uploaded before they existed, or generation failed).
+        {'width', 'height', 'sizes', 'srcset': {ext: '<url> 240w, ...'},
+         'variants': {'thumb' | 'display' | 'base': {'width', 'height', 'urls': {ext: url}}}}
+    """
+    if not floor_map.image_derivatives:
+        return None
+    try:
+        manifest = json.loads(floor_map.image_derivatives)
+    except (TypeError, ValueError):
+        return None
+    if manifest.get('source') != floor_map.image_filename:
+        return None # The image was replaced or renamed after these were generated
+    variants = {}
+    srcset = {}
+    for variant, _ in reversed(DERIVATIVE_SIZES):
+        info = manifest.get('variants', {}).get(variant)
+        if not info:
+            continue
+        urls = {ext: floor_map_file_url(name) for ext, name in info['files'].items()}
+        variants[variant] = {'width': info['width'], 'height': info['height'], 'urls': urls}
+        for ext, url in urls.items():
+            entries = srcset.setdefault(ext, [])
+            descriptor = f"{url} {info['width']}w"
+            if not any(entry.endswith(f" {info['width']}w") for entry in entries): # Small maps repeat a width
+                entries.append(descriptor)
+    return {
+        'width': manifest.get('width'), 'height': manifest.get('height'),
+        'formats': manifest.get('formats', list(srcset)),
+        'sizes': SRCSET_SIZES,
+        'srcset': {ext: ', '.join(entries) for ext, entries in srcset.items()},
+        'variants': variants,
+    }
@@ -0,0 +1,198 @@
+import hashlib
+import io
+import json
+import math
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import current_app, url_for
+from PIL import Image, ImageOps
+
+from r2_storage import r2_storage
+
+FLOOR_MAP_TILE_FOLDER = 'floor_map_tiles'
+TILE_SIZE = 256
+TILE_SET_PATTERN = re.compile(r'^[0-9a-f]{16}$')
+_R2_UPLOAD_WORKERS = 8
+
+
+def _tile_format():
+    Image.init()
+    return ('webp', 'WEBP', {'quality': 85, 'method': 4}) if 'WEBP' in Image.SAVE else ('png', 'PNG', {})
+
+
+def tile_set_id(image_bytes: bytes, source_filename: str, tile_format: str) -> str:
+    """Content address of a pyramid. Tiles under it never change, so they can be cached as immutable."""
+    digest = hashlib.sha256(f"{source_filename}\0{TILE_SIZE}\0{tile_format}\0".encode('utf-8'))
+    digest.update(image_bytes)
+    return digest.hexdigest()[:16]
+
+
+def level_size(width: int, height: int, level: int, max_level: int):
+    scale = 2 ** (max_level - level)
+    return math.ceil(width / scale), math.ceil(height / scale)
+
+
+def build_tile_pyramid(image_bytes: bytes, source_filename: str):
+    """
+    Cuts an EXIF-corrected floor map into a Deep Zoom style pyramid: level max_level is the full image,
+    each level below halves it, down to the first level that fits in one tile. Tiles are TILE_SIZE
+    squares (smaller at the right and bottom edges) without overlap. Returns (descriptor, {path: bytes})
+    with paths '<level>/<col>_<row>.<ext>'.
+    """
+    ext, pil_format, save_options = _tile_format()
+    img = ImageOps.exif_transpose(Image.open(io.BytesIO(image_bytes)))
+    img = img.convert('RGBA' if img.mode in ('RGBA', 'LA', 'PA') or 'transparency' in img.info else 'RGB')
+    width, height = img.size
+    max_level = math.ceil(math.log2(max(width, height, 1)))
+    min_level = max_level
+    while min_level > 0 and max(level_size(width, height, min_level, max_level)) > TILE_SIZE:
+        min_level -= 1
+
+    tiles = {}
+    current = img
+    for level in range(max_level, min_level - 1, -1):
+        size = level_size(width, height, level, max_level)
+        if current.size != size:
+            current = current.resize(size, Image.Resampling.LANCZOS)
+        for col in range(math.ceil(size[0] / TILE_SIZE)):
+            for row in range(math.ceil(size[1] / TILE_SIZE)):
+                box = (col * TILE_SIZE, row * TILE_SIZE,
+                       min((col + 1) * TILE_SIZE, size[0]), min((row + 1) * TILE_SIZE, size[1]))
+                buffer = io.BytesIO()
+                current.crop(box).save(buffer, format=pil_format, **save_options)
+                tiles[f"{level}/{col}_{row}.{ext}"] = buffer.getvalue()
+
+    descriptor = {'source': source_filename, 'tile_set': tile_set_id(image_bytes, source_filename, ext),
+                  'width': width, 'height': height, 'tile_size': TILE_SIZE, 'overlap': 0,
+                  'format': ext, 'min_level': min_level, 'max_level': max_level}
+    return descriptor, tiles
+
+
+def _local_dir():
+    return current_app.config.get('FLOOR_MAP_TILE_DIR') or os.path.join(current_app.root_path, 'data', FLOOR_MAP_TILE_FOLDER)
+
+
+def _use_r2():
+    return current_app.config.get('STORAGE_PROVIDER', 'local') == 'r2'
+
+
+def _write_tiles(tile_set: str, tiles: dict):
+    if _use_r2():
+        app = current_app._get_current_object()
+
+        def upload(item):
+            path, data = item
+            with app.app_context():
+                return r2_storage.upload_file(io.BytesIO(data), f"{tile_set}/{path}", FLOOR_MAP_TILE_FOLDER)
+
+        # A large plan is about a thousand small objects; upload them concurrently
+        with ThreadPoolExecutor(max_workers=_R2_UPLOAD_WORKERS) as executor:
+            if not all(executor.map(upload, tiles.items())):
+                raise Exception(f"Failed to upload floor map tile set {tile_set} to R2.")
+        return
+    for path, data in tiles.items():
+        target = os.path.join(_local_dir(), tile_set, path)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        with open(target, 'wb') as f:
+            f.write(data)
+
+
+def _delete_tile_set(tile_set: str):
+    try:
+        if _use_r2():
+            for item in r2_storage.list_files(f"{FLOOR_MAP_TILE_FOLDER}/{tile_set}/"):
+                r2_storage.delete_file(item['name'])
+        else:
+            folder = os.path.join(_local_dir(), tile_set)
+            for root, dirs, names in os.walk(folder, topdown=False):
+                for name in names:
+                    os.remove(os.path.join(root, name))
+                os.rmdir(root)
+    except Exception as e:
+        current_app.logger.warning(f"Could not delete floor map tile set {tile_set}: {e}")
+
+
+def _tile_set_of(tiles_json):
+    try:
+        return json.loads(tiles_json).get('tile_set') if tiles_json else None
+    except (TypeError, ValueError, AttributeError):
+        return None
+
+
+def delete_floor_map_tiles(tiles_json):
+    """Removes the tile set described by a FloorMap.image_tiles value, if any."""
+    tile_set = _tile_set_of(tiles_json)
+    if tile_set and TILE_SET_PATTERN.match(tile_set):
+        _delete_tile_set(tile_set)
+
+
+def refresh_floor_map_tiles(floor_map, image_bytes: bytes) -> bool:
+    """
+    Builds and stores the tile pyramid for floor_map's current image when its longest edge reaches
+    FLOOR_MAP_TILE_MIN_EDGE, recording the descriptor on floor_map.image_tiles (the caller commits).
+    Smaller images, a disabled threshold or a failure leave image_tiles empty. Returns True when tiles were written.
+    """
+    previous = _tile_set_of(floor_map.image_tiles)
+    floor_map.image_tiles = None
+    min_edge = current_app.config.get('FLOOR_MAP_TILE_MIN_EDGE', 4096)
+    try:
+        with Image.open(io.BytesIO(image_bytes)) as probe:
+            long_edge = max(probe.size)
+        if not min_edge or long_edge < min_edge:
+            descriptor = None
+        else:
+            descriptor, tiles = build_tile_pyramid(image_bytes, floor_map.image_filename)
+            _write_tiles(descriptor['tile_set'], tiles)
+    except Exception as e:
+        current_app.logger.warning(f"Could not generate tiles for floor map image '{floor_map.image_filename}': {e}")
+        descriptor = None
+    if descriptor:
+        floor_map.image_tiles = json.dumps(descriptor)
+    if previous and previous != (descriptor or {}).get('tile_set') and TILE_SET_PATTERN.match(previous):
+        _delete_tile_set(previous)
+    return descriptor is not None
+
+
+def read_floor_map_tile(tile_set: str, tile_path: str):
+    """Bytes of one stored tile, or None."""
+    if _use_r2():
+        return r2_storage.download_file(f"{tile_set}/{tile_path}", FLOOR_MAP_TILE_FOLDER)
+    try:
+        with open(os.path.join(_local_dir(), tile_set, tile_path), 'rb') as f:
+            return f.read()
+    except OSError:
+        return None
+
+
+def floor_map_tiles_payload(floor_map):
+    """
+    The tile descriptor for map_details, or None when the map isn't tiled. url_template takes
+    {level}, {col} and {row}; levels lists each level's pixel size and tile grid, so a viewer can
+    pick the level for its zoom and request only the tiles that intersect its viewport.
+    """
+    if not floor_map.image_tiles:
+        return None
+    try:
+        descriptor = json.loads(floor_map.image_tiles)
+    except (TypeError, ValueError):
+        return None
+    if descriptor.get('source') != floor_map.image_filename:
+        return None
+    tile_size = descriptor['tile_size']
+    sample_url = url_for('api_maps.get_floor_map_tile', tile_set=descriptor['tile_set'], level=0, col=0, row=0, ext=descriptor['format'])
+    prefix = sample_url[:-len(f"0/0_0.{descriptor['format']}")]
+    levels = []
+    for level in range(descriptor['min_level'], descriptor['max_level'] + 1):
+        width, height = level_size(descriptor['width'], descriptor['height'], level, descriptor['max_level'])
+        levels.append({'level': level, 'width': width, 'height': height,
+                       'columns': math.ceil(width / tile_size), 'rows': math.ceil(height / tile_size)})
+    return {
+        'type': 'deepzoom',
+        'width': descriptor['width'], 'height': descriptor['height'],
+        'tile_size': tile_size, 'overlap': descriptor['overlap'], 'format': descriptor['format'],
+        'min_level': descriptor['min_level'], 'max_level': descriptor['max_level'],
+        'url_template': prefix + '{level}/{col}_{row}.' + descriptor['format'],
+        'levels': levels,
+    }
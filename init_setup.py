@@ -27,7 +27,8 @@ from app_factory import create_app
 from extensions import db
 from models import (
     User, Resource, Booking, Role, AuditLog, FloorMap,
-    WaitlistEntry, resource_roles_table, user_roles_table
+    WaitlistEntry, BookingArchive, ResourceDayOccupancy, ResourceBookingLock, MaintenanceScheduleResource, MaintenanceScheduleFloor, ResourceTag, ResourceEquipment,
+    resource_roles_table, user_roles_table
 )
 from add_resource_tags_column import add_tags_column
 # from azure_backup import perform_startup_restore_sequence # Azure backup replaced by R2
@@ -280,7 +281,14 @@ def init_db(force=False):
             db.session.query(AuditLog).delete()
             db.session.query(WaitlistEntry).delete()
             db.session.query(Booking).delete()
+            db.session.query(BookingArchive).delete()
+            db.session.query(ResourceDayOccupancy).delete()
+            db.session.query(ResourceBookingLock).delete()
             db.session.execute(resource_roles_table.delete())
+            db.session.query(MaintenanceScheduleResource).delete()
+            db.session.query(MaintenanceScheduleFloor).delete()
+            db.session.query(ResourceTag).delete()
+            db.session.query(ResourceEquipment).delete()
             db.session.query(Resource).delete()
             db.session.query(FloorMap).delete()
             db.session.execute(user_roles_table.delete())
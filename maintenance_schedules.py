@@ -0,0 +1,183 @@
+import threading
+import time as time_module
+from datetime import date, timedelta
+
+from flask import current_app, has_app_context
+
+from models import MaintenanceSchedule
+
+
+class CompiledSchedule:
+    """A MaintenanceSchedule row copied once into day bitmasks, target id sets and date bounds."""
+
+    __slots__ = ('id', 'name', 'schedule_type', 'is_availability', 'resource_selection_type',
+                 'weekday_mask', 'month_day_mask', 'start_date', 'end_date',
+                 'resource_ids', 'floor_ids', 'building_id')
+
+    def __init__(self, schedule: MaintenanceSchedule):
+        self.id = schedule.id
+        self.name = schedule.name
+        self.schedule_type = schedule.schedule_type
+        self.is_availability = bool(schedule.is_availability)
+        self.resource_selection_type = schedule.resource_selection_type
+        self.weekday_mask = schedule.weekday_mask or 0
+        self.month_day_mask = schedule.month_day_mask or 0
+        self.start_date = schedule.start_date
+        self.end_date = schedule.end_date
+        self.resource_ids = frozenset(schedule.resource_id_list)
+        self.floor_ids = frozenset(schedule.floor_id_list)
+        self.building_id = schedule.building_id
+
+    def matches_date(self, target_date: date) -> bool:
+        if self.schedule_type == 'date_range':
+            return bool(self.start_date and self.end_date and self.start_date <= target_date <= self.end_date)
+        if self.schedule_type == 'recurring_day':
+            return bool(self.weekday_mask >> target_date.weekday() & 1)
+        if self.schedule_type == 'specific_day':
+            return bool(self.month_day_mask >> target_date.day & 1)
+        return False
+
+    def dates_in_range(self, start_range: date, end_range: date) -> set:
+        if self.schedule_type == 'date_range':
+            if not (self.start_date and self.end_date):
+                return set()
+            first_day = max(self.start_date, start_range)
+            last_day = min(self.end_date, end_range)
+            return {first_day + timedelta(days=offset) for offset in range((last_day - first_day).days + 1)}
+        return {start_range + timedelta(days=offset)
+                for offset in range((end_range - start_range).days + 1)
+                if self.matches_date(start_range + timedelta(days=offset))}
+
+
+class CompiledScheduleSet:
+    """
+    All maintenance schedules compiled into lookup maps keyed by resource, floor and building.
+    Answers "is resource R blocked on date D" from a memo after the first evaluation.
+    """
+
+    MAX_MEMO_ENTRIES = 200000
+
+    def __init__(self, compiled_schedules):
+        self.schedules = list(compiled_schedules)
+        self.has_whitelists = any(s.is_availability for s in self.schedules)
+        self.global_schedules = []
+        self.by_resource = {}
+        self.by_floor = {}
+        self.by_building = {}
+        for schedule in self.schedules:
+            if schedule.resource_selection_type == 'all':
+                self.global_schedules.append(schedule)
+            elif schedule.resource_selection_type == 'building':
+                if schedule.building_id is not None:
+                    self.by_building.setdefault(schedule.building_id, []).append(schedule)
+            elif schedule.resource_selection_type == 'floor':
+                for floor_id in schedule.floor_ids:
+                    self.by_floor.setdefault(floor_id, []).append(schedule)
+            elif schedule.resource_selection_type == 'specific':
+                for resource_id in schedule.resource_ids:
+                    self.by_resource.setdefault(resource_id, []).append(schedule)
+        self._blocked_memo = {}
+        self._dates_memo = {}
+
+    def _resource_key(self, resource) -> tuple:
+        location = None
+        if self.by_building and resource.floor_map:
+            location = resource.floor_map.location
+        return resource.id, resource.floor_map_id, location
+
+    def schedules_for_key(self, resource_key: tuple) -> list:
+        resource_id, floor_map_id, location = resource_key
+        applicable = list(self.global_schedules)
+        if location:
+            applicable.extend(self.by_building.get(location, ()))
+        if floor_map_id is not None:
+            applicable.extend(self.by_floor.get(floor_map_id, ()))
+        applicable.extend(self.by_resource.get(resource_id, ()))
+        return applicable
+
+    def schedules_for(self, resource) -> list:
+        return self.schedules_for_key(self._resource_key(resource))
+
+    def is_resource_blocked(self, resource, target_date: date) -> bool:
+        """
+        True if a blacklist schedule covers the resource on target_date, or if any
+        whitelist exists and none of the resource's whitelists covers target_date.
+        """
+        if not self.schedules:
+            return False
+        memo_key = self._resource_key(resource) + (target_date,)
+        blocked = self._blocked_memo.get(memo_key)
+        if blocked is None:
+            is_whitelisted = False
+            blocked = False
+            for schedule in self.schedules_for_key(memo_key[:3]):
+                if schedule.matches_date(target_date):
+                    if schedule.is_availability:
+                        is_whitelisted = True
+                    else:
+                        blocked = True
+                        break
+            if not blocked and self.has_whitelists and not is_whitelisted:
+                blocked = True
+            if len(self._blocked_memo) >= self.MAX_MEMO_ENTRIES:
+                self._blocked_memo.clear()
+            self._blocked_memo[memo_key] = blocked
+        return blocked
+
+    def schedule_dates(self, schedule: CompiledSchedule, start_range: date, end_range: date) -> set:
+        memo_key = (schedule.id, start_range, end_range)
+        dates = self._dates_memo.get(memo_key)
+        if dates is None:
+            if len(self._dates_memo) >= self.MAX_MEMO_ENTRIES:
+                self._dates_memo.clear()
+            dates = self._dates_memo[memo_key] = frozenset(schedule.dates_in_range(start_range, end_range))
+        return dates
+
+    def blocked_dates(self, resource, start_range: date, end_range: date) -> set:
+        """Every date in [start_range, end_range] on which the resource is blocked by schedules."""
+        applicable = self.schedules_for(resource)
+        if self.has_whitelists:
+            blocked = {start_range + timedelta(days=offset) for offset in range((end_range - start_range).days + 1)}
+            for schedule in applicable:
+                if schedule.is_availability:
+                    blocked -= self.schedule_dates(schedule, start_range, end_range)
+        else:
+            blocked = set()
+        for schedule in applicable:
+            if not schedule.is_availability:
+                blocked |= self.schedule_dates(schedule, start_range, end_range)
+        return blocked
+
+    def filtered(self, predicate) -> 'CompiledScheduleSet':
+        """A new (uncached) set holding only the schedules for which predicate(schedule) is true."""
+        return CompiledScheduleSet(s for s in self.schedules if predicate(s))
+
+
+_compiled_schedules = None
+_compiled_at = 0.0
+_compiled_lock = threading.Lock()
+
+
+def get_compiled_maintenance_schedules() -> CompiledScheduleSet:
+    """
+    Returns the process-wide compiled schedule set, rebuilding it after an explicit
+    invalidation or once MAINTENANCE_SCHEDULE_CACHE_TTL_SECONDS has elapsed (which is
+    how other worker processes pick up edits made elsewhere).
+    """
+    global _compiled_schedules, _compiled_at
+    ttl_seconds = current_app.config.get('MAINTENANCE_SCHEDULE_CACHE_TTL_SECONDS', 60) if has_app_context() else 60
+    compiled = _compiled_schedules
+    if compiled is not None and (time_module.monotonic() - _compiled_at) < ttl_seconds:
+        return compiled
+    with _compiled_lock:
+        if _compiled_schedules is None or (time_module.monotonic() - _compiled_at) >= ttl_seconds:
+            _compiled_schedules = CompiledScheduleSet(CompiledSchedule(s) for s in MaintenanceSchedule.query.all())
+            _compiled_at = time_module.monotonic()
+        return _compiled_schedules
+
+
+def invalidate_compiled_maintenance_schedules():
+    """Drops the cached schedule set; the next lookup recompiles from the database."""
+    global _compiled_schedules
+    with _compiled_lock:
+        _compiled_schedules = None
@@ -0,0 +1,34 @@
+"""Add resource_day_occupancy table
+
+Revision ID: 3c1f2a7d9e41
+Revises: 6a9939d8040b
+Create Date: 2026-10-16 09:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3c1f2a7d9e41'
+down_revision = '6a9939d8040b'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Populate after upgrading with: flask rebuild_resource_day_occupancy
+    op.create_table('resource_day_occupancy',
+    sa.Column('resource_id', sa.Integer(), nullable=False),
+    sa.Column('day', sa.Date(), nullable=False),
+    sa.Column('slot_bits', sa.BigInteger(), nullable=False),
+    sa.Column('booking_count', sa.Integer(), nullable=False),
+    sa.Column('booked_minutes', sa.Integer(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['resource_id'], ['resource.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('resource_id', 'day')
+    )
+
+
+def downgrade():
+    op.drop_table('resource_day_occupancy')
@@ -0,0 +1,36 @@
+"""Add booking.user_id foreign key and backfill it from user_name
+
+Revision ID: 5e7b1c3a9d20
+Revises: d2a9c4e6b813
+Create Date: 2026-10-16 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5e7b1c3a9d20'
+down_revision = 'd2a9c4e6b813'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('booking', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('user_id', sa.Integer(), nullable=True))
+        batch_op.create_foreign_key('fk_booking_user_id_user', 'user', ['user_id'], ['id'], ondelete='SET NULL')
+        batch_op.create_index('ix_booking_user_id_start_time', ['user_id', 'start_time'], unique=False)
+
+    # Bookings whose user_name no longer matches any account (e.g. renamed users) stay NULL.
+    op.execute(
+        'UPDATE booking SET user_id = (SELECT "user".id FROM "user" WHERE "user".username = booking.user_name) '
+        'WHERE user_id IS NULL AND user_name IS NOT NULL'
+    )
+
+
+def downgrade():
+    with op.batch_alter_table('booking', schema=None) as batch_op:
+        batch_op.drop_index('ix_booking_user_id_start_time')
+        batch_op.drop_constraint('fk_booking_user_id_user', type_='foreignkey')
+        batch_op.drop_column('user_id')
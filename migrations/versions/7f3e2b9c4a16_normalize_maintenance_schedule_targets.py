@@ -0,0 +1,130 @@
+"""Move maintenance_schedule targets into join tables and day lists into bitmasks
+
+Revision ID: 7f3e2b9c4a16
+Revises: 5e7b1c3a9d20
+Create Date: 2026-10-16 13:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7f3e2b9c4a16'
+down_revision = '5e7b1c3a9d20'
+branch_labels = None
+depends_on = None
+
+
+def _parse_int_list(value):
+    if not value:
+        return []
+    return sorted({int(part.strip()) for part in str(value).split(',') if part.strip().isdigit()})
+
+
+def _mask(values, lowest, highest):
+    mask = 0
+    for value in values:
+        if lowest <= value <= highest:
+            mask |= 1 << value
+    return mask
+
+
+def _csv(mask):
+    if not mask:
+        return None
+    return ','.join(str(bit) for bit in range(mask.bit_length()) if mask >> bit & 1)
+
+
+def upgrade():
+    op.create_table('maintenance_schedule_resource',
+    sa.Column('schedule_id', sa.Integer(), nullable=False),
+    sa.Column('resource_id', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['schedule_id'], ['maintenance_schedule.id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['resource_id'], ['resource.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('schedule_id', 'resource_id')
+    )
+    op.create_index('ix_maintenance_schedule_resource_resource_id', 'maintenance_schedule_resource', ['resource_id'], unique=False)
+    op.create_table('maintenance_schedule_floor',
+    sa.Column('schedule_id', sa.Integer(), nullable=False),
+    sa.Column('floor_map_id', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['schedule_id'], ['maintenance_schedule.id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['floor_map_id'], ['floor_map.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('schedule_id', 'floor_map_id')
+    )
+    op.create_index('ix_maintenance_schedule_floor_floor_map_id', 'maintenance_schedule_floor', ['floor_map_id'], unique=False)
+
+    with op.batch_alter_table('maintenance_schedule', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('weekday_mask', sa.Integer(), nullable=False, server_default='0'))
+        batch_op.add_column(sa.Column('month_day_mask', sa.BigInteger(), nullable=False, server_default='0'))
+
+    bind = op.get_bind()
+    schedule_table = sa.table('maintenance_schedule',
+                              sa.column('id', sa.Integer), sa.column('day_of_week', sa.String),
+                              sa.column('day_of_month', sa.String), sa.column('resource_ids', sa.Text),
+                              sa.column('floor_ids', sa.Text),
+                              sa.column('weekday_mask', sa.Integer), sa.column('month_day_mask', sa.BigInteger))
+    resource_link_table = sa.table('maintenance_schedule_resource', sa.column('schedule_id'), sa.column('resource_id'))
+    floor_link_table = sa.table('maintenance_schedule_floor', sa.column('schedule_id'), sa.column('floor_map_id'))
+    existing_resource_ids = {row[0] for row in bind.execute(sa.text('SELECT id FROM resource'))}
+    existing_floor_ids = {row[0] for row in bind.execute(sa.text('SELECT id FROM floor_map'))}
+
+    rows = bind.execute(sa.select(schedule_table.c.id, schedule_table.c.day_of_week, schedule_table.c.day_of_month,
+                                  schedule_table.c.resource_ids, schedule_table.c.floor_ids)).all()
+    for schedule_id, day_of_week, day_of_month, resource_ids, floor_ids in rows:
+        bind.execute(schedule_table.update().where(schedule_table.c.id == schedule_id).values(
+            weekday_mask=_mask(_parse_int_list(day_of_week), 0, 6),
+            month_day_mask=_mask(_parse_int_list(day_of_month), 1, 31)))
+        # Ids pointing at deleted resources/floors never matched anything; they are dropped here.
+        resource_links = [{'schedule_id': schedule_id, 'resource_id': resource_id}
+                          for resource_id in _parse_int_list(resource_ids) if resource_id in existing_resource_ids]
+        if resource_links:
+            bind.execute(resource_link_table.insert(), resource_links)
+        floor_links = [{'schedule_id': schedule_id, 'floor_map_id': floor_map_id}
+                       for floor_map_id in _parse_int_list(floor_ids) if floor_map_id in existing_floor_ids]
+        if floor_links:
+            bind.execute(floor_link_table.insert(), floor_links)
+
+    with op.batch_alter_table('maintenance_schedule', schema=None) as batch_op:
+        batch_op.drop_column('day_of_week')
+        batch_op.drop_column('day_of_month')
+        batch_op.drop_column('resource_ids')
+        batch_op.drop_column('floor_ids')
+
+
+def downgrade():
+    with op.batch_alter_table('maintenance_schedule', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('day_of_week', sa.String(length=50), nullable=True))
+        batch_op.add_column(sa.Column('day_of_month', sa.String(length=200), nullable=True))
+        batch_op.add_column(sa.Column('resource_ids', sa.Text(), nullable=True))
+        batch_op.add_column(sa.Column('floor_ids', sa.Text(), nullable=True))
+
+    bind = op.get_bind()
+    schedule_table = sa.table('maintenance_schedule',
+                              sa.column('id', sa.Integer), sa.column('day_of_week', sa.String),
+                              sa.column('day_of_month', sa.String), sa.column('resource_ids', sa.Text),
+                              sa.column('floor_ids', sa.Text),
+                              sa.column('weekday_mask', sa.Integer), sa.column('month_day_mask', sa.BigInteger))
+    resource_ids_by_schedule = {}
+    for schedule_id, resource_id in bind.execute(sa.text('SELECT schedule_id, resource_id FROM maintenance_schedule_resource')):
+        resource_ids_by_schedule.setdefault(schedule_id, []).append(resource_id)
+    floor_ids_by_schedule = {}
+    for schedule_id, floor_map_id in bind.execute(sa.text('SELECT schedule_id, floor_map_id FROM maintenance_schedule_floor')):
+        floor_ids_by_schedule.setdefault(schedule_id, []).append(floor_map_id)
+
+    rows = bind.execute(sa.select(schedule_table.c.id, schedule_table.c.weekday_mask, schedule_table.c.month_day_mask)).all()
+    for schedule_id, weekday_mask, month_day_mask in rows:
+        bind.execute(schedule_table.update().where(schedule_table.c.id == schedule_id).values(
+            day_of_week=_csv(weekday_mask),
+            day_of_month=_csv(month_day_mask),
+            resource_ids=','.join(map(str, sorted(resource_ids_by_schedule.get(schedule_id, [])))) or None,
+            floor_ids=','.join(map(str, sorted(floor_ids_by_schedule.get(schedule_id, [])))) or None))
+
+    with op.batch_alter_table('maintenance_schedule', schema=None) as batch_op:
+        batch_op.drop_column('month_day_mask')
+        batch_op.drop_column('weekday_mask')
+
+    op.drop_index('ix_maintenance_schedule_floor_floor_map_id', table_name='maintenance_schedule_floor')
+    op.drop_table('maintenance_schedule_floor')
+    op.drop_index('ix_maintenance_schedule_resource_resource_id', table_name='maintenance_schedule_resource')
+    op.drop_table('maintenance_schedule_resource')
@@ -0,0 +1,24 @@
+"""Index booking.start_time for day-range filters
+
+Revision ID: 8b4d6e2f1a57
+Revises: 3c1f2a7d9e41
+Create Date: 2026-10-16 10:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8b4d6e2f1a57'
+down_revision = '3c1f2a7d9e41'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index(op.f('ix_booking_start_time'), 'booking', ['start_time'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_booking_start_time'), table_name='booking')
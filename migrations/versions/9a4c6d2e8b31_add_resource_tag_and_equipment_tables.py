@@ -0,0 +1,70 @@
+"""Add indexed resource_tag / resource_equipment tables split from the comma-separated columns
+
+Revision ID: 9a4c6d2e8b31
+Revises: 7f3e2b9c4a16
+Create Date: 2026-10-16 14:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9a4c6d2e8b31'
+down_revision = '7f3e2b9c4a16'
+branch_labels = None
+depends_on = None
+
+
+def _split_terms(value):
+    terms = []
+    for part in (value or '').split(','):
+        term = part.strip().lower()
+        if term and term not in terms:
+            terms.append(term)
+    return terms
+
+
+def _create_entry_table(table_name):
+    op.create_table(table_name,
+    sa.Column('resource_id', sa.Integer(), nullable=False),
+    sa.Column('name', sa.String(length=200), nullable=False),
+    sa.ForeignKeyConstraint(['resource_id'], ['resource.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('resource_id', 'name')
+    )
+    op.create_index(f'ix_{table_name}_name', table_name, ['name'], unique=False)
+
+
+def upgrade():
+    _create_entry_table('resource_tag')
+    _create_entry_table('resource_equipment')
+
+    bind = op.get_bind()
+    tag_table = sa.table('resource_tag', sa.column('resource_id'), sa.column('name'))
+    equipment_table = sa.table('resource_equipment', sa.column('resource_id'), sa.column('name'))
+    tag_rows, equipment_rows = [], []
+    for resource_id, tags, equipment in bind.execute(sa.text('SELECT id, tags, equipment FROM resource')):
+        tag_rows += [{'resource_id': resource_id, 'name': term} for term in _split_terms(tags)]
+        equipment_rows += [{'resource_id': resource_id, 'name': term} for term in _split_terms(equipment)]
+    if tag_rows:
+        bind.execute(tag_table.insert(), tag_rows)
+    if equipment_rows:
+        bind.execute(equipment_table.insert(), equipment_rows)
+
+    # Optional on Postgres: trigram GIN indexes serve substring (LIKE '%term%') and fuzzy (%) matching.
+    if bind.dialect.name == 'postgresql':
+        has_trgm = bind.execute(sa.text("SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm'")).first()
+        if has_trgm:
+            op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+            op.execute('CREATE INDEX ix_resource_tag_name_trgm ON resource_tag USING gin (name gin_trgm_ops)')
+            op.execute('CREATE INDEX ix_resource_equipment_name_trgm ON resource_equipment USING gin (name gin_trgm_ops)')
+
+
+def downgrade():
+    if op.get_bind().dialect.name == 'postgresql':
+        op.execute('DROP INDEX IF EXISTS ix_resource_equipment_name_trgm')
+        op.execute('DROP INDEX IF EXISTS ix_resource_tag_name_trgm')
+    op.drop_index('ix_resource_equipment_name', table_name='resource_equipment')
+    op.drop_table('resource_equipment')
+    op.drop_index('ix_resource_tag_name', table_name='resource_tag')
+    op.drop_table('resource_tag')
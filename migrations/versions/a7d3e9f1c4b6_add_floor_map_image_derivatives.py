@@ -0,0 +1,26 @@
+"""Add floor_map.image_derivatives, the manifest of resized copies generated at upload
+
+Revision ID: a7d3e9f1c4b6
+Revises: f3a9c1e7b5d2
+Create Date: 2026-10-16 21:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a7d3e9f1c4b6'
+down_revision = 'f3a9c1e7b5d2'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('floor_map', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('image_derivatives', sa.Text(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('floor_map', schema=None) as batch_op:
+        batch_op.drop_column('image_derivatives')
@@ -0,0 +1,26 @@
+"""Add floor_map.image_tiles, the descriptor of the deep-zoom tile pyramid for large floor maps
+
+Revision ID: b2e8f4a6d9c1
+Revises: a7d3e9f1c4b6
+Create Date: 2026-10-16 22:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b2e8f4a6d9c1'
+down_revision = 'a7d3e9f1c4b6'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('floor_map', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('image_tiles', sa.Text(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('floor_map', schema=None) as batch_op:
+        batch_op.drop_column('image_tiles')
@@ -0,0 +1,53 @@
+"""Add database-level booking overlap guards: Postgres exclusion constraint and resource_booking_lock rows
+
+Revision ID: b6e1d8f3a2c5
+Revises: 9a4c6d2e8b31
+Create Date: 2026-10-16 15:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b6e1d8f3a2c5'
+down_revision = '9a4c6d2e8b31'
+branch_labels = None
+depends_on = None
+
+ACTIVE_STATUS_SQL = "status IN ('approved', 'pending', 'checked_in', 'confirmed')"
+
+
+def upgrade():
+    op.create_table('resource_booking_lock',
+    sa.Column('resource_id', sa.Integer(), nullable=False),
+    sa.Column('version', sa.Integer(), nullable=False, server_default='0'),
+    sa.ForeignKeyConstraint(['resource_id'], ['resource.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('resource_id')
+    )
+
+    bind = op.get_bind()
+    if bind.dialect.name != 'postgresql':
+        return
+
+    overlapping = bind.execute(sa.text(
+        'SELECT count(*) FROM booking a JOIN booking b ON a.resource_id = b.resource_id AND a.id < b.id '
+        'AND a.start_time < b.end_time AND a.end_time > b.start_time '
+        f'WHERE a.{ACTIVE_STATUS_SQL} AND b.{ACTIVE_STATUS_SQL}'
+    )).scalar()
+    if overlapping:
+        raise RuntimeError(
+            f'{overlapping} pair(s) of active bookings overlap on the same resource; '
+            'cancel or reschedule them before adding ex_booking_active_overlap.'
+        )
+    op.execute('CREATE EXTENSION IF NOT EXISTS btree_gist')
+    op.execute(
+        'ALTER TABLE booking ADD CONSTRAINT ex_booking_active_overlap EXCLUDE USING gist '
+        f'(resource_id WITH =, tsrange(start_time, end_time) WITH &&) WHERE ({ACTIVE_STATUS_SQL})'
+    )
+
+
+def downgrade():
+    if op.get_bind().dialect.name == 'postgresql':
+        op.execute('ALTER TABLE booking DROP CONSTRAINT IF EXISTS ex_booking_active_overlap')
+    op.drop_table('resource_booking_lock')
@@ -0,0 +1,51 @@
+"""Add booking_archive table for finished bookings moved out of the live booking table
+
+Revision ID: c4f7a9e2d6b8
+Revises: b6e1d8f3a2c5
+Create Date: 2026-10-16 16:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c4f7a9e2d6b8'
+down_revision = 'b6e1d8f3a2c5'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('booking_archive',
+    sa.Column('id', sa.Integer(), autoincrement=False, nullable=False),
+    sa.Column('resource_id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=True),
+    sa.Column('user_name', sa.String(length=100), nullable=True),
+    sa.Column('start_time', sa.DateTime(), nullable=False),
+    sa.Column('end_time', sa.DateTime(), nullable=False),
+    sa.Column('title', sa.String(length=100), nullable=True),
+    sa.Column('checked_in_at', sa.DateTime(), nullable=True),
+    sa.Column('checked_out_at', sa.DateTime(), nullable=True),
+    sa.Column('status', sa.String(length=20), nullable=False),
+    sa.Column('recurrence_rule', sa.String(length=200), nullable=True),
+    sa.Column('admin_deleted_message', sa.String(length=255), nullable=True),
+    sa.Column('check_in_token', sa.String(length=255), nullable=True),
+    sa.Column('check_in_token_expires_at', sa.DateTime(), nullable=True),
+    sa.Column('checkin_reminder_sent_at', sa.DateTime(), nullable=True),
+    sa.Column('last_modified', sa.DateTime(), nullable=False),
+    sa.Column('booking_display_start_time', sa.Time(), nullable=True),
+    sa.Column('booking_display_end_time', sa.Time(), nullable=True),
+    sa.Column('archived_at', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['resource_id'], ['resource.id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['user_id'], ['user.id'], ondelete='SET NULL'),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_booking_archive_start_time', 'booking_archive', ['start_time'], unique=False)
+    op.create_index('ix_booking_archive_user_id_start_time', 'booking_archive', ['user_id', 'start_time'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_booking_archive_user_id_start_time', table_name='booking_archive')
+    op.drop_index('ix_booking_archive_start_time', table_name='booking_archive')
+    op.drop_table('booking_archive')
@@ -0,0 +1,35 @@
+"""Make booking.id AUTOINCREMENT on SQLite so ids moved to booking_archive are never handed out again
+
+Revision ID: c6a1d8e3f5b7
+Revises: b2e8f4a6d9c1
+Create Date: 2026-10-17 09:00:00.000000
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'c6a1d8e3f5b7'
+down_revision = 'b2e8f4a6d9c1'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    if op.get_bind().dialect.name != 'sqlite':
+        return # Postgres sequences never reuse an id
+    with op.batch_alter_table('booking', recreate='always', table_kwargs={'sqlite_autoincrement': True}):
+        pass
+    # Start the counter past every id already used, including rows that were archived from the top of the range.
+    op.execute("INSERT INTO sqlite_sequence (name, seq) SELECT 'booking', 0 "
+               "WHERE NOT EXISTS (SELECT 1 FROM sqlite_sequence WHERE name = 'booking')")
+    op.execute("UPDATE sqlite_sequence SET seq = max(seq, "
+               "coalesce((SELECT max(id) FROM booking), 0), coalesce((SELECT max(id) FROM booking_archive), 0)) "
+               "WHERE name = 'booking'")
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+    with op.batch_alter_table('booking', recreate='always', table_kwargs={'sqlite_autoincrement': False}):
+        pass
@@ -0,0 +1,49 @@
+"""Normalize booking.status, add status check constraint and active-slot indexes
+
+Revision ID: d2a9c4e6b813
+Revises: 8b4d6e2f1a57
+Create Date: 2026-10-16 11:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd2a9c4e6b813'
+down_revision = '8b4d6e2f1a57'
+branch_labels = None
+depends_on = None
+
+# Frozen copies of models.BOOKING_STATUSES / ACTIVE_BOOKING_STATUSES at the time of this revision.
+BOOKING_STATUSES = (
+    'pending', 'approved', 'confirmed', 'checked_in', 'checked_out', 'completed',
+    'rejected', 'cancelled', 'cancelled_by_user', 'cancelled_by_admin', 'cancelled_admin_acknowledged',
+    'cancelled_by_system', 'system_cancelled_no_checkin', 'no_show', 'on_hold', 'under_review',
+)
+ACTIVE_BOOKING_STATUSES = ('approved', 'pending', 'checked_in', 'confirmed')
+
+
+def _in_list(values):
+    return ', '.join(f"'{value}'" for value in values)
+
+
+def upgrade():
+    op.execute("UPDATE booking SET status = lower(trim(status)) WHERE status <> lower(trim(status))")
+    # Anything still unrecognised was never treated as active by the conflict queries; park it as cancelled.
+    op.execute(f"UPDATE booking SET status = 'cancelled' WHERE status IS NULL OR status NOT IN ({_in_list(BOOKING_STATUSES)})")
+
+    with op.batch_alter_table('booking', schema=None) as batch_op:
+        batch_op.create_check_constraint('ck_booking_status_valid', f"status IN ({_in_list(BOOKING_STATUSES)})")
+        batch_op.create_index('ix_booking_user_name_start_time', ['user_name', 'start_time'], unique=False)
+
+    active_predicate = sa.text(f"status IN ({_in_list(ACTIVE_BOOKING_STATUSES)})")
+    op.create_index('ix_booking_active_resource_time', 'booking', ['resource_id', 'start_time', 'end_time'], unique=False,
+                    postgresql_where=active_predicate, sqlite_where=active_predicate)
+
+
+def downgrade():
+    op.drop_index('ix_booking_active_resource_time', table_name='booking')
+    with op.batch_alter_table('booking', schema=None) as batch_op:
+        batch_op.drop_index('ix_booking_user_name_start_time')
+        batch_op.drop_constraint('ck_booking_status_valid', type_='check')
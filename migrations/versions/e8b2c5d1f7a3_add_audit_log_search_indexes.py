@@ -0,0 +1,59 @@
+"""Index audit_log for time-range scans and full-text search (Postgres tsvector GIN, SQLite FTS5)
+
+Revision ID: e8b2c5d1f7a3
+Revises: c4f7a9e2d6b8
+Create Date: 2026-10-16 17:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e8b2c5d1f7a3'
+down_revision = 'c4f7a9e2d6b8'
+branch_labels = None
+depends_on = None
+
+SEARCH_SQL = "to_tsvector('simple', coalesce(username, '') || ' ' || action || ' ' || coalesce(details, ''))"
+
+SQLITE_FTS_DDL = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS audit_log_fts USING fts5("
+    "username, action, details, content='audit_log', content_rowid='id')",
+    "CREATE TRIGGER IF NOT EXISTS audit_log_fts_ai AFTER INSERT ON audit_log BEGIN "
+    "INSERT INTO audit_log_fts(rowid, username, action, details) "
+    "VALUES (new.id, new.username, new.action, new.details); END",
+    "CREATE TRIGGER IF NOT EXISTS audit_log_fts_ad AFTER DELETE ON audit_log BEGIN "
+    "INSERT INTO audit_log_fts(audit_log_fts, rowid, username, action, details) "
+    "VALUES ('delete', old.id, old.username, old.action, old.details); END",
+    "CREATE TRIGGER IF NOT EXISTS audit_log_fts_au AFTER UPDATE ON audit_log BEGIN "
+    "INSERT INTO audit_log_fts(audit_log_fts, rowid, username, action, details) "
+    "VALUES ('delete', old.id, old.username, old.action, old.details); "
+    "INSERT INTO audit_log_fts(rowid, username, action, details) "
+    "VALUES (new.id, new.username, new.action, new.details); END",
+    "INSERT INTO audit_log_fts(audit_log_fts) VALUES ('rebuild')",
+)
+
+
+def upgrade():
+    op.create_index('ix_audit_log_timestamp', 'audit_log', ['timestamp'], unique=False)
+
+    bind = op.get_bind()
+    if bind.dialect.name == 'postgresql':
+        op.execute(f'CREATE INDEX ix_audit_log_search ON audit_log USING gin ({SEARCH_SQL})')
+    elif bind.dialect.name == 'sqlite':
+        has_fts5 = bind.execute(sa.text("SELECT 1 FROM pragma_compile_options WHERE compile_options = 'ENABLE_FTS5'")).first()
+        if has_fts5: # Without FTS5 the audit search falls back to LIKE
+            for statement in SQLITE_FTS_DDL:
+                op.execute(statement)
+
+
+def downgrade():
+    bind = op.get_bind()
+    if bind.dialect.name == 'postgresql':
+        op.execute('DROP INDEX IF EXISTS ix_audit_log_search')
+    elif bind.dialect.name == 'sqlite':
+        for trigger_name in ('audit_log_fts_ai', 'audit_log_fts_ad', 'audit_log_fts_au'):
+            op.execute(f'DROP TRIGGER IF EXISTS {trigger_name}')
+        op.execute('DROP TABLE IF EXISTS audit_log_fts')
+    op.drop_index('ix_audit_log_timestamp', table_name='audit_log')
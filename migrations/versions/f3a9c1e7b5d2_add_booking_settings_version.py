@@ -0,0 +1,26 @@
+"""Add booking_settings.version, bumped on every change so workers can revalidate cached settings
+
+Revision ID: f3a9c1e7b5d2
+Revises: e8b2c5d1f7a3
+Create Date: 2026-10-16 19:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f3a9c1e7b5d2'
+down_revision = 'e8b2c5d1f7a3'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('booking_settings', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('version', sa.Integer(), server_default='1', nullable=False))
+
+
+def downgrade():
+    with op.batch_alter_table('booking_settings', schema=None) as batch_op:
+        batch_op.drop_column('version')
@@ -1,6 +1,7 @@
 from flask_login import UserMixin
 from werkzeug.security import generate_password_hash, check_password_hash
 from datetime import datetime, timezone
+from functools import lru_cache
 import json # Required for Resource.map_coordinates if methods involving it are moved
 
 # Assuming 'db' is initialized in 'extensions.py' and will be imported
@@ -8,6 +9,71 @@ import json # Required for Resource.map_coordinates if methods involving it are
 # Or: from extensions import db (if extensions.py is in PYTHONPATH and can be imported directly)
 # For this task, we'll use `from extensions import db`
 from extensions import db
+from sqlalchemy import DDL, event, inspect
+from sqlalchemy.dialects.postgresql import ExcludeConstraint
+from sqlalchemy.orm import reconstructor, validates
+
+# Canonical booking statuses. Booking.status is normalized to one of these on write and
+# guarded by a check constraint, so queries can compare the column directly.
+BOOKING_STATUSES = (
+    'pending', 'approved', 'confirmed', 'checked_in', 'checked_out', 'completed',
+    'rejected', 'cancelled', 'cancelled_by_user', 'cancelled_by_admin', 'cancelled_admin_acknowledged',
+    'cancelled_by_system', 'system_cancelled_no_checkin', 'no_show', 'on_hold', 'under_review',
+)
+# Statuses that hold a slot. Keep the order: the partial index predicate below uses it.
+ACTIVE_BOOKING_STATUSES = ('approved', 'pending', 'checked_in', 'confirmed')
+_ACTIVE_BOOKING_STATUS_SQL = "status IN ({})".format(', '.join(f"'{s}'" for s in ACTIVE_BOOKING_STATUSES))
+# Finished statuses that may move to booking_archive once old enough. on_hold/under_review still await a decision.
+ARCHIVABLE_BOOKING_STATUSES = tuple(s for s in BOOKING_STATUSES if s not in ACTIVE_BOOKING_STATUSES + ('on_hold', 'under_review'))
+
+
+def coerce_booking_status(value) -> str:
+    """
+    Canonical status for a value read from a backup or import. Unrecognised or missing statuses become
+    'cancelled', as migration d2a9c4e6b813 did for existing rows; Booking.status itself rejects them.
+    """
+    normalized = (value or '').strip().lower()
+    return normalized if normalized in BOOKING_STATUSES else 'cancelled'
+
+# Bumped whenever a role's permissions change; compiled per-user permission sets older than
+# this are rebuilt on next use. Each request loads its user afresh, so this only matters in-process.
+_permission_generation = 0
+
+
+def invalidate_compiled_permissions():
+    global _permission_generation
+    _permission_generation += 1
+
+
+@lru_cache(maxsize=4096)
+def parse_allowed_user_ids(raw: str) -> tuple:
+    """
+    Resource.allowed_user_ids JSON ('[1, 5]') -> (frozenset of ids, None), or (None, 'invalid_json' | 'malformed').
+    Cached on the raw string, so availability loops don't json.loads the same value per check.
+    """
+    try:
+        parsed = json.loads(raw)
+    except (TypeError, ValueError):
+        return None, 'invalid_json'
+    if not isinstance(parsed, list) or not all(isinstance(uid, int) for uid in parsed):
+        return None, 'malformed'
+    return frozenset(parsed), None
+
+
+@lru_cache(maxsize=4096)
+def parse_map_allowed_role_ids(raw: str) -> tuple:
+    """Resource.map_allowed_role_ids JSON -> (frozenset of ids, None), or (None, 'invalid_json' | 'not_a_list' | 'non_integer')."""
+    try:
+        parsed = json.loads(raw)
+    except (TypeError, ValueError):
+        return None, 'invalid_json'
+    if not isinstance(parsed, list):
+        return None, 'not_a_list'
+    try:
+        return frozenset(int(role_id) for role_id in parsed), None
+    except (TypeError, ValueError):
+        return None, 'non_integer'
+
 
 # Association table for User and Role (Many-to-Many)
 user_roles_table = db.Table('user_roles',
@@ -48,6 +114,30 @@ class User(db.Model, UserMixin):
     def __repr__(self):
         return f'<User {self.username} (Admin: {self.is_admin})>'
 
+    @reconstructor
+    def _reset_compiled_permissions(self):
+        self._compiled_permissions = None
+
+    def _get_compiled_permissions(self) -> tuple:
+        """(generation, permission names, role ids), compiled from self.roles once per load."""
+        compiled = getattr(self, '_compiled_permissions', None)
+        if compiled is None or compiled[0] != _permission_generation:
+            permission_names = set()
+            for role in self.roles:
+                if role.permissions:
+                    permission_names.update(p.strip() for p in role.permissions.split(',') if p.strip())
+            compiled = (_permission_generation, frozenset(permission_names), frozenset(role.id for role in self.roles))
+            self._compiled_permissions = compiled
+        return compiled
+
+    @property
+    def permission_names(self) -> frozenset:
+        return self._get_compiled_permissions()[1]
+
+    @property
+    def role_ids(self) -> frozenset:
+        return self._get_compiled_permissions()[2]
+
     def set_password(self, password):
         self.password_hash = generate_password_hash(password, method='pbkdf2:sha256')
 
@@ -57,14 +147,8 @@ class User(db.Model, UserMixin):
     def has_permission(self, permission):
         if self.is_admin: # Super admin (legacy) has all permissions
             return True
-        # Check for 'all_permissions' in any role
-        if any('all_permissions' in role.permissions.split(',') for role in self.roles if role.permissions):
-            return True
-        # Check for the specific permission string
-        for role in self.roles:
-            if role.permissions and permission in role.permissions.split(','):
-                return True
-        return False
+        permission_names = self.permission_names
+        return 'all_permissions' in permission_names or permission in permission_names
 
 class FloorMap(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -79,6 +163,10 @@ class FloorMap(db.Model):
     is_published = db.Column(db.Boolean, nullable=True, default=True)
     description = db.Column(db.Text, nullable=True)
     map_data_json = db.Column(db.Text, nullable=True)
+    # JSON manifest of the resized/WebP/AVIF copies generated at upload (see floor_map_derivatives.py)
+    image_derivatives = db.Column(db.Text, nullable=True)
+    # JSON descriptor of the deep-zoom tile pyramid for very large images (see floor_map_tiles.py)
+    image_tiles = db.Column(db.Text, nullable=True)
 
     def __repr__(self):
         # Consider adding offsets to repr if useful for debugging
@@ -110,6 +198,8 @@ class BookingSettings(db.Model):
     # Negative values make "now" seem later (restricting past bookings more, or allowing future bookings sooner).
     global_time_offset_hours = db.Column(db.Integer, nullable=False, default=0, server_default='0')
     auto_release_if_not_checked_in_minutes = db.Column(db.Integer, nullable=True, default=None)
+    # Bumped on every change (see booking_settings_cache); workers compare it to their cached snapshot.
+    version = db.Column(db.Integer, nullable=False, default=1, server_default='1')
 
     def to_dict(self):
         """Serializes the BookingSettings object to a dictionary."""
@@ -166,6 +256,31 @@ resource_roles_table = db.Table('resource_roles',
     db.Column('role_id', db.Integer, db.ForeignKey('role.id'), primary_key=True)
 )
 
+def split_csv_terms(value) -> list:
+    """'Projector, whiteboard,projector' -> ['projector', 'whiteboard']: stripped, lower-cased, distinct, in order."""
+    if not value:
+        return []
+    parts = value if isinstance(value, (list, tuple)) else str(value).split(',')
+    terms = []
+    for part in parts:
+        term = str(part).strip().lower()
+        if term and term not in terms:
+            terms.append(term)
+    return terms
+
+
+class ResourceTag(db.Model):
+    __tablename__ = 'resource_tag'
+    resource_id = db.Column(db.Integer, db.ForeignKey('resource.id', ondelete='CASCADE'), primary_key=True)
+    name = db.Column(db.String(200), primary_key=True, index=True)
+
+
+class ResourceEquipment(db.Model):
+    __tablename__ = 'resource_equipment'
+    resource_id = db.Column(db.Integer, db.ForeignKey('resource.id', ondelete='CASCADE'), primary_key=True)
+    name = db.Column(db.String(200), primary_key=True, index=True)
+
+
 class Resource(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), unique=True, nullable=False)
@@ -192,6 +307,45 @@ class Resource(db.Model):
     roles = db.relationship('Role', secondary=resource_roles_table,
                             backref=db.backref('allowed_resources', lazy='dynamic'))
     pins = db.relationship('ResourcePIN', backref='resource', lazy='dynamic', cascade="all, delete-orphan")
+    # Normalized, indexed copies of the comma-separated tags/equipment strings, used for search.
+    tag_entries = db.relationship('ResourceTag', cascade="all, delete-orphan")
+    equipment_entries = db.relationship('ResourceEquipment', cascade="all, delete-orphan")
+
+    @validates('tags')
+    def _sync_tag_entries(self, key, value):
+        existing = {entry.name: entry for entry in self.tag_entries}
+        self.tag_entries = [existing.get(term) or ResourceTag(name=term) for term in split_csv_terms(value)]
+        return value
+
+    @validates('equipment')
+    def _sync_equipment_entries(self, key, value):
+        existing = {entry.name: entry for entry in self.equipment_entries}
+        self.equipment_entries = [existing.get(term) or ResourceEquipment(name=term) for term in split_csv_terms(value)]
+        return value
+
+    @reconstructor
+    def _reset_parsed_access_lists(self):
+        self._role_id_set = None
+
+    @property
+    def role_id_set(self) -> frozenset:
+        """Ids of self.roles, built once per load (reset when the collection changes)."""
+        role_ids = getattr(self, '_role_id_set', None)
+        if role_ids is None:
+            role_ids = self._role_id_set = frozenset(role.id for role in self.roles)
+        return role_ids
+
+    def parsed_allowed_user_ids(self) -> tuple:
+        """(frozenset, None) / (None, reason) for allowed_user_ids; an unset list parses as an empty set."""
+        if not self.allowed_user_ids or not self.allowed_user_ids.strip():
+            return frozenset(), None
+        return parse_allowed_user_ids(self.allowed_user_ids)
+
+    def parsed_map_allowed_role_ids(self) -> tuple:
+        """(frozenset, None) / (None, reason) for map_allowed_role_ids; an unset list parses as an empty set."""
+        if not self.map_allowed_role_ids or not self.map_allowed_role_ids.strip():
+            return frozenset(), None
+        return parse_map_allowed_role_ids(self.map_allowed_role_ids)
 
     def __repr__(self):
         return f"<Resource {self.name}>"
@@ -214,8 +368,9 @@ class ResourcePIN(db.Model):
 class Booking(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     resource_id = db.Column(db.Integer, db.ForeignKey('resource.id'), nullable=False)
-    user_name = db.Column(db.String(100), nullable=True)
-    start_time = db.Column(db.DateTime, nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='SET NULL'), nullable=True) # Indexed with start_time below
+    user_name = db.Column(db.String(100), nullable=True) # Display copy of User.username, kept in sync on rename
+    start_time = db.Column(db.DateTime, nullable=False, index=True) # Indexed for the day-range filters in query_helpers
     end_time = db.Column(db.DateTime, nullable=False)
     title = db.Column(db.String(100), nullable=True)
     checked_in_at = db.Column(db.DateTime, nullable=True)
@@ -234,11 +389,84 @@ class Booking(db.Model):
 
     __table_args__ = (
         db.UniqueConstraint('resource_id', 'start_time', 'end_time', name='uq_booking_resource_time'),
+        db.CheckConstraint("status IN ({})".format(', '.join(f"'{s}'" for s in BOOKING_STATUSES)), name='ck_booking_status_valid'),
+        db.Index('ix_booking_active_resource_time', 'resource_id', 'start_time', 'end_time',
+                 postgresql_where=db.text(_ACTIVE_BOOKING_STATUS_SQL), sqlite_where=db.text(_ACTIVE_BOOKING_STATUS_SQL)),
+        db.Index('ix_booking_user_name_start_time', 'user_name', 'start_time'),
+        db.Index('ix_booking_user_id_start_time', 'user_id', 'start_time'),
+        # Postgres rejects overlapping active bookings on one resource outright (needs btree_gist, see below).
+        # Other databases serialize booking writes through ResourceBookingLock instead (booking_locks.py).
+        ExcludeConstraint(('resource_id', '='), (db.func.tsrange(db.column('start_time'), db.column('end_time')), '&&'),
+                          name='ex_booking_active_overlap', using='gist',
+                          where=db.text(_ACTIVE_BOOKING_STATUS_SQL)).ddl_if(dialect='postgresql'),
+        # Archived ids stay taken: without AUTOINCREMENT SQLite would reuse max(id)+1 after the newest rows are archived.
+        {'sqlite_autoincrement': True},
     )
 
+    user = db.relationship('User', backref=db.backref('bookings', lazy='dynamic'))
+
+    @validates('status')
+    def _normalize_status(self, key, value):
+        normalized = (value or '').strip().lower()
+        if normalized not in BOOKING_STATUSES:
+            raise ValueError(f"Invalid booking status: {value!r}")
+        return normalized
+
     def __repr__(self):
         return f"<Booking {self.title or self.id} for Resource {self.resource_id} from {self.start_time.strftime('%Y-%m-%d %H:%M')} to {self.end_time.strftime('%Y-%m-%d %H:%M')}>"
 
+class BookingArchive(db.Model):
+    """Cold copy of finished Booking rows moved out by booking_archive.py; same columns and ids, plus archived_at."""
+    __tablename__ = 'booking_archive'
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False) # The original booking.id
+    resource_id = db.Column(db.Integer, db.ForeignKey('resource.id', ondelete='CASCADE'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='SET NULL'), nullable=True)
+    user_name = db.Column(db.String(100), nullable=True)
+    start_time = db.Column(db.DateTime, nullable=False, index=True)
+    end_time = db.Column(db.DateTime, nullable=False)
+    title = db.Column(db.String(100), nullable=True)
+    checked_in_at = db.Column(db.DateTime, nullable=True)
+    checked_out_at = db.Column(db.DateTime, nullable=True)
+    status = db.Column(db.String(20), nullable=False)
+    recurrence_rule = db.Column(db.String(200), nullable=True)
+    admin_deleted_message = db.Column(db.String(255), nullable=True)
+    check_in_token = db.Column(db.String(255), nullable=True)
+    check_in_token_expires_at = db.Column(db.DateTime, nullable=True)
+    checkin_reminder_sent_at = db.Column(db.DateTime, nullable=True)
+    last_modified = db.Column(db.DateTime, nullable=False)
+    booking_display_start_time = db.Column(db.Time, nullable=True)
+    booking_display_end_time = db.Column(db.Time, nullable=True)
+    archived_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.Index('ix_booking_archive_user_id_start_time', 'user_id', 'start_time'),
+    )
+
+    def __repr__(self):
+        return f"<BookingArchive {self.title or self.id} for Resource {self.resource_id} from {self.start_time.strftime('%Y-%m-%d %H:%M')}>"
+
+class ResourceBookingLock(db.Model):
+    """One row per resource, bumped at the start of a booking write to serialize conflict checks on non-Postgres databases."""
+    __tablename__ = 'resource_booking_lock'
+    resource_id = db.Column(db.Integer, db.ForeignKey('resource.id', ondelete='CASCADE'), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f"<ResourceBookingLock resource={self.resource_id} version={self.version}>"
+
+class ResourceDayOccupancy(db.Model):
+    """Materialized per-resource, per-day occupancy, kept in step with Booking writes by occupancy.py."""
+    __tablename__ = 'resource_day_occupancy'
+    resource_id = db.Column(db.Integer, db.ForeignKey('resource.id', ondelete='CASCADE'), primary_key=True)
+    day = db.Column(db.Date, primary_key=True)
+    slot_bits = db.Column(db.BigInteger, nullable=False, default=0) # Bit i set = half-hour cell i (00:00 + 30*i min) is booked
+    booking_count = db.Column(db.Integer, nullable=False, default=0)
+    booked_minutes = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, nullable=False, default=lambda: datetime.now(timezone.utc))
+
+    def __repr__(self):
+        return f"<ResourceDayOccupancy resource={self.resource_id} day={self.day} bookings={self.booking_count}>"
+
 class WaitlistEntry(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     resource_id = db.Column(db.Integer, db.ForeignKey('resource.id'), nullable=False)
@@ -251,6 +479,9 @@ class WaitlistEntry(db.Model):
     def __repr__(self):
         return f"<WaitlistEntry resource={self.resource_id} user={self.user_id}>"
 
+# Expression behind the Postgres GIN full-text index on audit_log; audit_log.py searches with the same text.
+AUDIT_LOG_SEARCH_SQL = "to_tsvector('simple', coalesce(username, '') || ' ' || action || ' ' || coalesce(details, ''))"
+
 class AuditLog(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     timestamp = db.Column(db.DateTime, nullable=False, default=lambda: datetime.now(timezone.utc))
@@ -261,22 +492,172 @@ class AuditLog(db.Model):
 
     user = db.relationship('User')
 
+    __table_args__ = (
+        db.Index('ix_audit_log_timestamp', 'timestamp'),
+        # SQLite gets an FTS5 table instead, created alongside this one (see audit_log.py).
+        db.Index('ix_audit_log_search', db.text(AUDIT_LOG_SEARCH_SQL), postgresql_using='gin').ddl_if(dialect='postgresql'),
+    )
+
     def __repr__(self):
         return f'<AuditLog {self.timestamp} - {self.username or "System"} - {self.action}>'
 
+def _parse_int_list(value) -> list:
+    """Accepts '0,2, 4', a single int or a list of ints/strings; returns the sorted distinct ints, skipping junk."""
+    if value is None or value == '':
+        return []
+    parts = value if isinstance(value, (list, tuple, set, frozenset)) else str(value).split(',')
+    return sorted({int(str(part).strip()) for part in parts if str(part).strip().isdigit()})
+
+
+def _ints_to_mask(values, lowest: int, highest: int) -> int:
+    mask = 0
+    for value in values:
+        if lowest <= value <= highest:
+            mask |= 1 << value
+    return mask
+
+
+def _mask_to_csv(mask) -> str | None:
+    if not mask:
+        return None
+    return ','.join(str(bit) for bit in range(mask.bit_length()) if mask >> bit & 1)
+
+
+class MaintenanceScheduleResource(db.Model):
+    __tablename__ = 'maintenance_schedule_resource'
+    schedule_id = db.Column(db.Integer, db.ForeignKey('maintenance_schedule.id', ondelete='CASCADE'), primary_key=True)
+    resource_id = db.Column(db.Integer, db.ForeignKey('resource.id', ondelete='CASCADE'), primary_key=True, index=True)
+
+
+class MaintenanceScheduleFloor(db.Model):
+    __tablename__ = 'maintenance_schedule_floor'
+    schedule_id = db.Column(db.Integer, db.ForeignKey('maintenance_schedule.id', ondelete='CASCADE'), primary_key=True)
+    floor_map_id = db.Column(db.Integer, db.ForeignKey('floor_map.id', ondelete='CASCADE'), primary_key=True, index=True)
+
+
 class MaintenanceSchedule(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False)
     schedule_type = db.Column(db.String(50), nullable=False)  # 'recurring_day', 'specific_day', 'date_range'
-    day_of_week = db.Column(db.String(50), nullable=True)  # Comma-separated list of days (0-6)
-    day_of_month = db.Column(db.String(200), nullable=True)  # 1-31
+    weekday_mask = db.Column(db.Integer, nullable=False, default=0)  # Bit n set = weekday n (0=Monday .. 6=Sunday)
+    month_day_mask = db.Column(db.BigInteger, nullable=False, default=0)  # Bit n set = day n of the month (1-31)
     start_date = db.Column(db.Date, nullable=True)
     end_date = db.Column(db.Date, nullable=True)
     is_availability = db.Column(db.Boolean, default=False, nullable=False)
     resource_selection_type = db.Column(db.String(50), nullable=False)  # 'all', 'building', 'floor', 'specific'
-    resource_ids = db.Column(db.Text, nullable=True)  # Comma-separated list of resource IDs
     building_id = db.Column(db.Integer, nullable=True)
-    floor_ids = db.Column(db.Text, nullable=True)
+
+    resource_links = db.relationship('MaintenanceScheduleResource', cascade='all, delete-orphan', lazy='selectin')
+    floor_links = db.relationship('MaintenanceScheduleFloor', cascade='all, delete-orphan', lazy='selectin')
+
+    # The comma-separated accessors below keep the admin API and callers working
+    # with the same '0,4' / '12,13' strings they used before normalization.
+    @property
+    def day_of_week(self):
+        return _mask_to_csv(self.weekday_mask)
+
+    @day_of_week.setter
+    def day_of_week(self, value):
+        self.weekday_mask = _ints_to_mask(_parse_int_list(value), 0, 6)
+
+    @property
+    def day_of_month(self):
+        return _mask_to_csv(self.month_day_mask)
+
+    @day_of_month.setter
+    def day_of_month(self, value):
+        self.month_day_mask = _ints_to_mask(_parse_int_list(value), 1, 31)
+
+    @property
+    def resource_id_list(self) -> list:
+        return sorted(link.resource_id for link in self.resource_links)
+
+    @property
+    def resource_ids(self):
+        return ','.join(map(str, self.resource_id_list)) or None
+
+    @resource_ids.setter
+    def resource_ids(self, value):
+        existing = {link.resource_id: link for link in self.resource_links}
+        self.resource_links = [existing.get(resource_id) or MaintenanceScheduleResource(resource_id=resource_id)
+                               for resource_id in _parse_int_list(value)]
+
+    @property
+    def floor_id_list(self) -> list:
+        return sorted(link.floor_map_id for link in self.floor_links)
+
+    @property
+    def floor_ids(self):
+        return ','.join(map(str, self.floor_id_list)) or None
+
+    @floor_ids.setter
+    def floor_ids(self, value):
+        existing = {link.floor_map_id: link for link in self.floor_links}
+        self.floor_links = [existing.get(floor_map_id) or MaintenanceScheduleFloor(floor_map_id=floor_map_id)
+                            for floor_map_id in _parse_int_list(value)]
 
     def __repr__(self):
         return f'<MaintenanceSchedule {self.name}>'
+
+
+def _drop_compiled_user_permissions(target, *args):
+    if target is not None: # Expire events can fire for instances already garbage-collected
+        target._compiled_permissions = None
+
+
+def _drop_resource_role_ids(target, *args):
+    if target is not None:
+        target._role_id_set = None
+
+
+def _role_permissions_changed(target, value, oldvalue, initiator):
+    if value != oldvalue:
+        invalidate_compiled_permissions()
+
+
+def _link_bookings_to_users(session, flush_context, instances):
+    """
+    Points user_id at the user named by user_name for every booking whose user_name changed in this
+    flush while user_id (or the user relationship) did not, so assigning a username never leaves the
+    previous owner's id behind. Sites that already know the user set user_id too and pay no lookup.
+    """
+    unresolved = {}
+    for obj in list(session.new) + list(session.dirty):
+        if not isinstance(obj, Booking):
+            continue
+        attrs = inspect(obj).attrs
+        if (not attrs.user_name.history.has_changes() or attrs.user_id.history.has_changes()
+                or attrs.user.history.has_changes()):
+            continue
+        if obj.user_name:
+            unresolved.setdefault(obj.user_name, []).append(obj)
+        else:
+            obj.user_id = None
+    if not unresolved:
+        return
+    # Users in the session win over the database: they may be new or renamed in this same flush.
+    session_users = {obj.username: obj for obj in session if isinstance(obj, User) and obj.username in unresolved}
+    stored_ids = {}
+    if set(unresolved) - set(session_users):
+        with session.no_autoflush:
+            stored_ids = dict(session.query(User.username, User.id)
+                              .filter(User.username.in_(set(unresolved) - set(session_users))).all())
+    for username, bookings in unresolved.items():
+        for booking in bookings:
+            if username in session_users:
+                booking.user = session_users[username]
+            else:
+                booking.user_id = stored_ids.get(username)
+
+
+for _event_name in ('append', 'remove'):
+    event.listen(User.roles, _event_name, _drop_compiled_user_permissions)
+    event.listen(Resource.roles, _event_name, _drop_resource_role_ids)
+for _event_name in ('expire', 'refresh'):
+    event.listen(User, _event_name, _drop_compiled_user_permissions)
+    event.listen(Resource, _event_name, _drop_resource_role_ids)
+event.listen(Role.permissions, 'set', _role_permissions_changed)
+event.listen(db.session, 'before_flush', _link_bookings_to_users)
+# The overlap exclusion constraint compares resource_id with '=' inside a GiST index.
+event.listen(Booking.__table__, 'before_create',
+             DDL('CREATE EXTENSION IF NOT EXISTS btree_gist').execute_if(dialect='postgresql'))
@@ -0,0 +1,222 @@
+from datetime import date, datetime, time, timedelta, timezone
+
+from sqlalchemy import delete, event, func, insert, inspect, select
+
+from extensions import db
+from models import ACTIVE_BOOKING_STATUSES, Booking, Resource, ResourceDayOccupancy
+from slot_grid import SlotGrid
+
+OCCUPANCY_SLOT_MINUTES = 30
+OCCUPANCY_ACTIVE_STATUSES = ACTIVE_BOOKING_STATUSES
+_PENDING_KEYS = 'resource_day_occupancy_keys'
+_PENDING_RESOURCE_PURGES = 'resource_day_occupancy_purges'
+_TRACKED_BOOKING_ATTRS = ('resource_id', 'start_time', 'end_time', 'status')
+_REBUILD_BATCH_SIZE = 1000
+
+
+def booking_days(start_time: datetime, end_time: datetime) -> list[date]:
+    """Every calendar day that [start_time, end_time) touches; a booking ending at midnight stops the day before."""
+    if not start_time or not end_time or end_time <= start_time:
+        return []
+    first_day = start_time.date()
+    last_day = (end_time - timedelta(microseconds=1)).date()
+    return [first_day + timedelta(days=offset) for offset in range((last_day - first_day).days + 1)]
+
+
+def _is_active_status(status) -> bool:
+    return status in OCCUPANCY_ACTIVE_STATUSES
+
+
+def _summarize_day(day: date, intervals) -> tuple[int, int, int]:
+    """(slot_bits, booking_count, booked_minutes) for intervals already known to touch day."""
+    grid = SlotGrid(day, OCCUPANCY_SLOT_MINUTES)
+    day_start = datetime.combine(day, time.min)
+    day_end = day_start + timedelta(days=1)
+    clipped = sorted((max(start, day_start), min(end, day_end)) for start, end in intervals)
+    booked_seconds = 0
+    run_start = run_end = None
+    for start, end in clipped:
+        grid.paint(start, end)
+        if run_end is None or start > run_end:
+            if run_end is not None:
+                booked_seconds += (run_end - run_start).total_seconds()
+            run_start, run_end = start, end
+        elif end > run_end:
+            run_end = end
+    if run_end is not None:
+        booked_seconds += (run_end - run_start).total_seconds()
+    return grid.busy_bits, len(clipped), int(booked_seconds // 60)
+
+
+def refresh_resource_day_occupancy(connection, keys):
+    """Recomputes the occupancy rows for the given (resource_id, day) keys from the booking table."""
+    occupancy_table = ResourceDayOccupancy.__table__
+    booking_table = Booking.__table__
+    now_utc = datetime.now(timezone.utc)
+    for resource_id, day in sorted(keys):
+        day_start = datetime.combine(day, time.min)
+        rows = connection.execute(
+            select(booking_table.c.start_time, booking_table.c.end_time).where(
+                booking_table.c.resource_id == resource_id,
+                booking_table.c.start_time < day_start + timedelta(days=1),
+                booking_table.c.end_time > day_start,
+                booking_table.c.status.in_(OCCUPANCY_ACTIVE_STATUSES)
+            )
+        ).all()
+        connection.execute(delete(occupancy_table).where(
+            occupancy_table.c.resource_id == resource_id, occupancy_table.c.day == day
+        ))
+        if rows:
+            slot_bits, booking_count, booked_minutes = _summarize_day(day, rows)
+            connection.execute(insert(occupancy_table).values(
+                resource_id=resource_id, day=day, slot_bits=slot_bits,
+                booking_count=booking_count, booked_minutes=booked_minutes, updated_at=now_utc
+            ))
+
+
+def rebuild_all_resource_day_occupancy(connection) -> int:
+    """Drops every occupancy row and rebuilds the table from active bookings. Returns rows written."""
+    occupancy_table = ResourceDayOccupancy.__table__
+    booking_table = Booking.__table__
+    connection.execute(delete(occupancy_table))
+
+    intervals_by_key = {}
+    rows = connection.execute(
+        select(booking_table.c.resource_id, booking_table.c.start_time, booking_table.c.end_time).where(
+            booking_table.c.status.in_(OCCUPANCY_ACTIVE_STATUSES)
+        )
+    )
+    for resource_id, start_time, end_time in rows:
+        for day in booking_days(start_time, end_time):
+            intervals_by_key.setdefault((resource_id, day), []).append((start_time, end_time))
+
+    now_utc = datetime.now(timezone.utc)
+    batch = []
+    written = 0
+    for (resource_id, day), intervals in sorted(intervals_by_key.items()):
+        slot_bits, booking_count, booked_minutes = _summarize_day(day, intervals)
+        batch.append({'resource_id': resource_id, 'day': day, 'slot_bits': slot_bits,
+                      'booking_count': booking_count, 'booked_minutes': booked_minutes, 'updated_at': now_utc})
+        if len(batch) >= _REBUILD_BATCH_SIZE:
+            connection.execute(insert(occupancy_table), batch)
+            written += len(batch)
+            batch = []
+    if batch:
+        connection.execute(insert(occupancy_table), batch)
+        written += len(batch)
+    return written
+
+
+def clear_resource_day_occupancy(connection, resource_ids=None):
+    """Deletes occupancy rows for the given resources (all rows when resource_ids is None)."""
+    occupancy_table = ResourceDayOccupancy.__table__
+    statement = delete(occupancy_table)
+    if resource_ids is not None:
+        statement = statement.where(occupancy_table.c.resource_id.in_(list(resource_ids)))
+    connection.execute(statement)
+
+
+def get_occupancy_slot_bits(resource_ids, start_date: date, end_date: date) -> dict:
+    """{(resource_id, day): slot_bits} for every stored row in the range; missing keys mean no bookings."""
+    if not resource_ids:
+        return {}
+    rows = db.session.query(
+        ResourceDayOccupancy.resource_id, ResourceDayOccupancy.day, ResourceDayOccupancy.slot_bits
+    ).filter(
+        ResourceDayOccupancy.resource_id.in_(list(resource_ids)),
+        ResourceDayOccupancy.day >= start_date,
+        ResourceDayOccupancy.day <= end_date
+    ).all()
+    return {(resource_id, day): slot_bits for resource_id, day, slot_bits in rows}
+
+
+def occupancy_cell_mask(slot_start: time, slot_end: time):
+    """
+    Mask of the stored half-hour cells covering [slot_start, slot_end), or None when the slot
+    does not line up with the cell grid (callers then fall back to scanning bookings).
+    """
+    start_minutes = slot_start.hour * 60 + slot_start.minute
+    end_minutes = slot_end.hour * 60 + slot_end.minute
+    if slot_start.second or slot_end.second or start_minutes % OCCUPANCY_SLOT_MINUTES or end_minutes % OCCUPANCY_SLOT_MINUTES:
+        return None
+    if end_minutes <= start_minutes:
+        return None
+    first_cell = start_minutes // OCCUPANCY_SLOT_MINUTES
+    last_cell = end_minutes // OCCUPANCY_SLOT_MINUTES
+    return ((1 << (last_cell - first_cell)) - 1) << first_cell
+
+
+def _booking_keys(resource_id, start_time, end_time, status) -> set:
+    if resource_id is None or not _is_active_status(status):
+        return set()
+    return {(resource_id, day) for day in booking_days(start_time, end_time)}
+
+
+def _booking_has_tracked_changes(obj) -> bool:
+    state = inspect(obj)
+    return any(state.attrs[attr].history.has_changes() for attr in _TRACKED_BOOKING_ATTRS)
+
+
+def _collect_stored_keys(session, flush_context, instances):
+    # Before the flush: the days that updated/deleted bookings occupy as currently stored.
+    booking_ids = [obj.id for obj in session.deleted if isinstance(obj, Booking) and obj.id is not None]
+    booking_ids += [obj.id for obj in session.dirty
+                    if isinstance(obj, Booking) and obj.id is not None and _booking_has_tracked_changes(obj)]
+    purged_resource_ids = {obj.id for obj in session.deleted if isinstance(obj, Resource) and obj.id is not None}
+    if not booking_ids and not purged_resource_ids:
+        return
+    keys = session.info.setdefault(_PENDING_KEYS, set())
+    if booking_ids:
+        booking_table = Booking.__table__
+        rows = session.connection().execute(
+            select(booking_table.c.resource_id, booking_table.c.start_time, booking_table.c.end_time, booking_table.c.status)
+            .where(booking_table.c.id.in_(booking_ids))
+        )
+        for resource_id, start_time, end_time, status in rows:
+            keys |= _booking_keys(resource_id, start_time, end_time, status)
+    if purged_resource_ids:
+        session.info.setdefault(_PENDING_RESOURCE_PURGES, set()).update(purged_resource_ids)
+
+
+def _refresh_after_flush(session, flush_context):
+    """
+    Runs inside the flush, so the occupancy rows are written in the same transaction as the
+    Booking changes. session.new/dirty still describe what was just flushed here.
+    """
+    keys = session.info.pop(_PENDING_KEYS, set())
+    purged_resource_ids = session.info.pop(_PENDING_RESOURCE_PURGES, set())
+    for obj in session.new:
+        if isinstance(obj, Booking):
+            status = obj.status if obj.status is not None else Booking.__table__.c.status.default.arg
+            keys |= _booking_keys(obj.resource_id, obj.start_time, obj.end_time, status)
+    for obj in session.dirty:
+        if isinstance(obj, Booking) and _booking_has_tracked_changes(obj):
+            keys |= _booking_keys(obj.resource_id, obj.start_time, obj.end_time, obj.status)
+
+    if not keys and not purged_resource_ids:
+        return
+    connection = session.connection()
+    if purged_resource_ids:
+        clear_resource_day_occupancy(connection, purged_resource_ids)
+        keys = {key for key in keys if key[0] not in purged_resource_ids}
+    if keys:
+        refresh_resource_day_occupancy(connection, keys)
+
+
+def _discard_pending_keys(session, *args):
+    session.info.pop(_PENDING_KEYS, None)
+    session.info.pop(_PENDING_RESOURCE_PURGES, None)
+
+
+def register_occupancy_tracking(session=None):
+    """
+    Hooks the session so that every flush touching a Booking refreshes the affected
+    resource_day_occupancy rows in the same transaction. This covers create/update/delete,
+    admin cancellations and the scheduler release tasks alike. Safe to call repeatedly.
+    """
+    target = session if session is not None else db.session
+    for event_name, handler in (('before_flush', _collect_stored_keys),
+                                ('after_flush', _refresh_after_flush),
+                                ('after_rollback', _discard_pending_keys)):
+        if not event.contains(target, event_name, handler):
+            event.listen(target, event_name, handler)
@@ -0,0 +1,28 @@
+from datetime import date, datetime, time, timedelta
+
+from sqlalchemy import and_
+
+
+def day_range(day: date) -> tuple[datetime, datetime]:
+    """Half-open [day_start, next_day_start) bounds for a calendar day of naive venue-local datetimes."""
+    day_start = datetime.combine(day, time.min)
+    return day_start, day_start + timedelta(days=1)
+
+
+def date_span_range(start_date: date, end_date: date) -> tuple[datetime, datetime]:
+    """Half-open bounds covering start_date through end_date inclusive."""
+    return datetime.combine(start_date, time.min), datetime.combine(end_date + timedelta(days=1), time.min)
+
+
+def on_date(column, day: date):
+    """
+    Sargable replacement for `func.date(column) == day`: a plain range on the column,
+    so an index on it (e.g. booking.start_time) can be used.
+    """
+    day_start, next_day_start = day_range(day)
+    return and_(column >= day_start, column < next_day_start)
+
+
+def overlaps_range(start_column, end_column, range_start: datetime, range_end: datetime):
+    """Rows whose [start_column, end_column) interval overlaps [range_start, range_end)."""
+    return and_(start_column < range_end, end_column > range_start)
@@ -2,13 +2,24 @@ import boto3
 from botocore.exceptions import ClientError
 from flask import current_app
 import os
+import threading
+import time
+from collections import OrderedDict
 
 class R2Storage:
     def __init__(self, app=None):
+        # object key -> (expiration, url, monotonic time after which the url is re-signed)
+        self._presigned_urls = OrderedDict()
+        self._presigned_lock = threading.Lock()
+        self.presigned_cache_size = 2048
+        self.presigned_safety_margin = 300
         if app:
             self.init_app(app)
 
     def init_app(self, app):
+        self.presigned_cache_size = app.config.get('R2_PRESIGNED_URL_CACHE_SIZE', 2048)
+        self.presigned_safety_margin = app.config.get('R2_PRESIGNED_URL_SAFETY_MARGIN', 300)
+        self.clear_presigned_url_cache()
         self.access_key = app.config.get('R2_ACCESS_KEY')
         self.secret_key = app.config.get('R2_SECRET_KEY')
         self.bucket_name = app.config.get('R2_BUCKET_NAME')
@@ -57,6 +68,7 @@ class R2Storage:
                     file_obj.seek(0)
                 self.client.upload_fileobj(file_obj, self.bucket_name, key)
 
+            self._forget_presigned_url(key) # Same key, new content: hand browsers a fresh URL
             current_app.logger.info(f"Successfully uploaded {key} to R2.")
             return True
         except ClientError as e:
@@ -66,12 +78,17 @@ class R2Storage:
              current_app.logger.error(f"Unexpected error uploading {key} to R2: {e}")
              return False
 
-    def download_file(self, filename, folder=None, target_path=None):
+    @staticmethod
+    def _is_missing(error):
+        return error.response.get('Error', {}).get('Code') in ('NoSuchKey', '404', 'NotFound')
+
+    def download_file(self, filename, folder=None, target_path=None, missing_ok=False):
         """
         Downloads a file from R2.
         :param filename: The name of the file
         :param folder: Optional folder prefix
         :param target_path: Local path to save the file. If None, returns bytes.
+        :param missing_ok: Don't log an error when the object doesn't exist (e.g. a cache lookup).
         :return: True if saved to target_path, or bytes content if target_path is None. None on failure.
         """
         if not self.client:
@@ -87,12 +104,29 @@ class R2Storage:
                 response = self.client.get_object(Bucket=self.bucket_name, Key=key)
                 return response['Body'].read()
         except ClientError as e:
-            current_app.logger.error(f"Failed to download {key} from R2: {e}")
+            if not (missing_ok and self._is_missing(e)):
+                current_app.logger.error(f"Failed to download {key} from R2: {e}")
             return None
         except Exception as e:
             current_app.logger.error(f"Unexpected error downloading {key} from R2: {e}")
             return None
 
+    def head_file(self, filename, folder=None):
+        """
+        Object metadata from a HEAD request (ETag, LastModified, ContentLength, ...).
+        :return: The head_object response, or None if the object doesn't exist or on failure.
+        """
+        if not self.client:
+            return None
+
+        key = f"{folder}/{filename}" if folder else filename
+        try:
+            return self.client.head_object(Bucket=self.bucket_name, Key=key)
+        except ClientError as e:
+            if not self._is_missing(e):
+                current_app.logger.error(f"Failed to read metadata of {key} from R2: {e}")
+            return None
+
     def delete_file(self, filename, folder=None):
         """
         Deletes a file from R2.
@@ -103,6 +137,7 @@ class R2Storage:
         key = f"{folder}/{filename}" if folder else filename
         try:
             self.client.delete_object(Bucket=self.bucket_name, Key=key)
+            self._forget_presigned_url(key)
             current_app.logger.info(f"Successfully deleted {key} from R2.")
             return True
         except ClientError as e:
@@ -138,20 +173,44 @@ class R2Storage:
     def generate_presigned_url(self, filename, folder=None, expiration=3600):
         """
         Generates a presigned URL for viewing the file.
+        URLs are cached per object key (LRU, R2_PRESIGNED_URL_CACHE_SIZE entries) and reused until
+        R2_PRESIGNED_URL_SAFETY_MARGIN seconds before they expire, so repeated listings skip the
+        signing and browsers see the same URL across requests.
         """
         if not self.client:
             return None
 
         key = f"{folder}/{filename}" if folder else filename
+        now = time.monotonic()
+        with self._presigned_lock:
+            cached = self._presigned_urls.get(key)
+            if cached and cached[0] == expiration and now < cached[2]:
+                self._presigned_urls.move_to_end(key)
+                return cached[1]
         try:
             url = self.client.generate_presigned_url(
                 'get_object',
                 Params={'Bucket': self.bucket_name, 'Key': key},
                 ExpiresIn=expiration
             )
-            return url
         except ClientError as e:
             current_app.logger.error(f"Failed to generate presigned URL for {key}: {e}")
             return None
+        # Short expirations still get half their lifetime of reuse
+        reusable_for = max(expiration - self.presigned_safety_margin, expiration / 2)
+        with self._presigned_lock:
+            self._presigned_urls[key] = (expiration, url, now + reusable_for)
+            self._presigned_urls.move_to_end(key)
+            while len(self._presigned_urls) > self.presigned_cache_size:
+                self._presigned_urls.popitem(last=False)
+        return url
+
+    def _forget_presigned_url(self, key):
+        with self._presigned_lock:
+            self._presigned_urls.pop(key, None)
+
+    def clear_presigned_url_cache(self):
+        with self._presigned_lock:
+            self._presigned_urls.clear()
 
 r2_storage = R2Storage()
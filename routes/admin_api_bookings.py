@@ -5,9 +5,13 @@ from datetime import timezone, timedelta # Added timezone and timedelta
 # Assuming extensions.py contains db # socketio and mail removed
 from extensions import db # socketio and mail removed
 # Assuming models.py contains these model definitions
-from models import Booking, User, Resource, BookingSettings # Added Resource and BookingSettings
+from models import Booking, Resource, BookingSettings, ACTIVE_BOOKING_STATUSES # Added Resource and BookingSettings
 # Assuming utils.py contains these helper functions
 from utils import add_audit_log, send_email, send_slack_notification # Added other utils as needed
+from booking_settings_cache import current_booking_settings
+from booking_locks import lock_resources_for_booking, is_booking_conflict_error
+from query_helpers import overlaps_range
+from sqlalchemy.exc import IntegrityError
 # Assuming auth.py contains permission_required decorator
 from auth import permission_required
 
@@ -19,7 +23,7 @@ admin_api_bookings_bp = Blueprint('admin_api_bookings', __name__, url_prefix='/a
 def list_pending_bookings():
     # The @permission_required decorator handles auth and permission.
 
-    booking_settings = BookingSettings.query.first()
+    booking_settings = current_booking_settings()
     current_offset_hours = 0
     if booking_settings and hasattr(booking_settings, 'global_time_offset_hours') and booking_settings.global_time_offset_hours is not None:
         current_offset_hours = booking_settings.global_time_offset_hours
@@ -50,7 +54,7 @@ def approve_booking_admin(booking_id):
         return jsonify({'error': 'Booking not pending'}), 400
     booking.status = 'approved'
     db.session.commit()
-    user = User.query.filter_by(username=booking.user_name).first()
+    user = booking.user
     if user and user.email:
         send_email(user.email, 'Booking Approved',
                    f"Your booking for {booking.resource_booked.name if booking.resource_booked else 'resource'} on {booking.start_time.strftime('%Y-%m-%d %H:%M')} has been approved.")
@@ -70,7 +74,7 @@ def reject_booking_admin(booking_id):
         return jsonify({'error': 'Booking not pending'}), 400
     booking.status = 'rejected'
     db.session.commit()
-    user = User.query.filter_by(username=booking.user_name).first()
+    user = booking.user
     if user and user.email:
         send_email(user.email, 'Booking Rejected',
                    f"Your booking for {booking.resource_booked.name if booking.resource_booked else 'resource'} on {booking.start_time.strftime('%Y-%m-%d %H:%M')} has been rejected.")
@@ -184,7 +188,7 @@ def admin_cancel_booking(booking_id):
         # }) # Removed
 
         # Notify user
-        user = User.query.filter_by(username=booking.user_name).first()
+        user = booking.user
         if user and user.email:
             try:
                 email_reason_text = f"Reason: {booking.admin_deleted_message}" if booking.admin_deleted_message else "No specific reason was provided."
@@ -279,7 +283,7 @@ def admin_clear_booking_message(booking_id):
 @permission_required('manage_bookings')
 def send_booking_confirmation_email(booking_id):
     booking = Booking.query.get_or_404(booking_id)
-    user = User.query.filter_by(username=booking.user_name).first()
+    user = booking.user
 
     if not user:
         current_app.logger.error(f"User {booking.user_name} not found for booking {booking.id} when trying to send confirmation email.")
@@ -295,7 +299,7 @@ def send_booking_confirmation_email(booking_id):
     # Assuming start_time and end_time are stored in UTC and need to be displayed in a user-friendly format.
     # For simplicity, using ISO format. Adjust formatting as needed.
     # Also, consider applying the global time offset if applicable, similar to list_pending_bookings
-    booking_settings = BookingSettings.query.first()
+    booking_settings = current_booking_settings()
     current_offset_hours = 0
     if booking_settings and hasattr(booking_settings, 'global_time_offset_hours') and booking_settings.global_time_offset_hours is not None:
         current_offset_hours = booking_settings.global_time_offset_hours
@@ -437,13 +441,26 @@ def update_booking_status(booking_id):
         current_app.logger.warning(f"Invalid status transition attempt for booking {booking_id}: {message}")
         return jsonify({'error': 'Invalid status transition', 'message': message}), 409 # 409 Conflict is suitable
 
-    booking.status = new_status
     try:
+        if new_status in ACTIVE_BOOKING_STATUSES and current_status not in ACTIVE_BOOKING_STATUSES:
+            # Reactivating (e.g. from on_hold or no_show): the slot may have been taken meanwhile.
+            lock_resources_for_booking([booking.resource_id])
+            conflicting_booking = Booking.query.filter(
+                Booking.resource_id == booking.resource_id,
+                Booking.id != booking.id,
+                overlaps_range(Booking.start_time, Booking.end_time, booking.start_time, booking.end_time),
+                Booking.status.in_(ACTIVE_BOOKING_STATUSES)
+            ).first()
+            if conflicting_booking:
+                db.session.rollback()
+                current_app.logger.warning(f"Status change of booking {booking_id} to '{new_status}' conflicts with active booking {conflicting_booking.id}.")
+                return jsonify({'error': 'Booking conflict', 'message': f"The time slot is now taken by booking {conflicting_booking.id}."}), 409
+        booking.status = new_status
         db.session.commit()
 
         # Send email notification about status change
         try:
-            user = User.query.filter_by(username=booking.user_name).first()
+            user = booking.user
             resource = Resource.query.get(booking.resource_id)
 
             if user and user.email and resource:
@@ -501,6 +518,13 @@ def update_booking_status(booking_id):
         # }) # Removed
         current_app.logger.info(f"Booking {booking.id} status updated from '{current_status}' to '{new_status}' by admin {current_user.username}.")
         return jsonify({'success': True, 'message': 'Booking status updated.', 'new_status': booking.status}), 200
+    except IntegrityError as ie:
+        db.session.rollback()
+        if not is_booking_conflict_error(ie):
+            current_app.logger.exception(f"IntegrityError updating status for booking {booking_id}: {ie}")
+            return jsonify({'error': 'Failed to update booking status due to a server error.'}), 500
+        current_app.logger.warning(f"Status change of booking {booking_id} to '{new_status}' rejected by the database overlap guard: {ie}")
+        return jsonify({'error': 'Booking conflict', 'message': 'The time slot conflicts with an active booking on this resource.'}), 409
     except Exception as e:
         db.session.rollback()
         current_app.logger.error(f"Failed to update status for booking {booking.id}: {str(e)}")
@@ -1,6 +1,7 @@
 from flask import Blueprint, request, jsonify, current_app
 from flask_login import login_required, current_user
-from models import db, MaintenanceSchedule
+from models import db, MaintenanceSchedule, MaintenanceScheduleResource, MaintenanceScheduleFloor
+from maintenance_schedules import invalidate_compiled_maintenance_schedules
 from auth import permission_required
 from datetime import time, date
 
@@ -29,12 +30,6 @@ def create_maintenance_schedule():
         return jsonify({'error': 'Invalid resource_selection_type'}), 400
 
     try:
-        day_of_week = data.get('day_of_week')
-        if isinstance(day_of_week, list):
-            day_of_week = ','.join(day_of_week)
-        day_of_month = data.get('day_of_month')
-        if isinstance(day_of_month, list):
-            day_of_month = ','.join(day_of_month)
         start_date = date.fromisoformat(data['start_date']) if data.get('start_date') else None
         end_date = date.fromisoformat(data['end_date']) if data.get('end_date') else None
 
@@ -42,25 +37,23 @@ def create_maintenance_schedule():
         if isinstance(is_availability, str):
             is_availability = is_availability.lower() == 'true'
 
-        floor_ids = data.get('floor_ids')
-        if isinstance(floor_ids, list):
-            floor_ids = ','.join(floor_ids)
-
+        # day_of_week/day_of_month/resource_ids/floor_ids accept lists or comma-separated strings.
         new_schedule = MaintenanceSchedule(
             name=data['name'],
             schedule_type=schedule_type,
-            day_of_week=day_of_week,
-            day_of_month=day_of_month,
+            day_of_week=data.get('day_of_week'),
+            day_of_month=data.get('day_of_month'),
             start_date=start_date,
             end_date=end_date,
             is_availability=is_availability,
             resource_selection_type=resource_selection_type,
             resource_ids=data.get('resource_ids'),
             building_id=data.get('building_id'),
-            floor_ids=floor_ids
+            floor_ids=data.get('floor_ids')
         )
         db.session.add(new_schedule)
         db.session.commit()
+        invalidate_compiled_maintenance_schedules()
         return jsonify(id=new_schedule.id), 201
     except Exception as e:
         current_app.logger.error(f"Error creating maintenance schedule: {e}")
@@ -72,7 +65,15 @@ def create_maintenance_schedule():
 @permission_required('manage_maintenance')
 def get_maintenance_schedules():
     try:
-        schedules = MaintenanceSchedule.query.all()
+        query = MaintenanceSchedule.query
+        # Optional target filters, answered through the indexed join tables.
+        resource_id = request.args.get('resource_id', type=int)
+        if resource_id is not None:
+            query = query.join(MaintenanceScheduleResource).filter(MaintenanceScheduleResource.resource_id == resource_id)
+        floor_id = request.args.get('floor_id', type=int)
+        if floor_id is not None:
+            query = query.join(MaintenanceScheduleFloor).filter(MaintenanceScheduleFloor.floor_map_id == floor_id)
+        schedules = query.order_by(MaintenanceSchedule.id).all()
         return jsonify([{
             'id': s.id,
             'name': s.name,
@@ -101,26 +102,18 @@ def update_maintenance_schedule(schedule_id):
     try:
         schedule.name = data.get('name', schedule.name)
         schedule.schedule_type = data.get('schedule_type', schedule.schedule_type)
-        day_of_week = data.get('day_of_week')
-        if isinstance(day_of_week, list):
-            day_of_week = ','.join(day_of_week)
-        schedule.day_of_week = day_of_week
-        day_of_month = data.get('day_of_month')
-        if isinstance(day_of_month, list):
-            day_of_month = ','.join(day_of_month)
-        schedule.day_of_month = day_of_month
+        schedule.day_of_week = data.get('day_of_week')
+        schedule.day_of_month = data.get('day_of_month')
         schedule.start_date = date.fromisoformat(data['start_date']) if data.get('start_date') else None
         schedule.end_date = date.fromisoformat(data['end_date']) if data.get('end_date') else None
         schedule.is_availability = data.get('is_availability', schedule.is_availability)
         schedule.resource_selection_type = data.get('resource_selection_type', schedule.resource_selection_type)
         schedule.resource_ids = data.get('resource_ids', schedule.resource_ids)
         schedule.building_id = data.get('building_id', schedule.building_id)
-        floor_ids = data.get('floor_ids')
-        if isinstance(floor_ids, list):
-            floor_ids = ','.join(floor_ids)
-        schedule.floor_ids = floor_ids
+        schedule.floor_ids = data.get('floor_ids')
 
         db.session.commit()
+        invalidate_compiled_maintenance_schedules()
         return jsonify({'message': 'Schedule updated successfully'})
     except Exception as e:
         current_app.logger.error(f"Error updating maintenance schedule {schedule_id}: {e}")
@@ -135,6 +128,7 @@ def delete_maintenance_schedule(schedule_id):
     try:
         db.session.delete(schedule)
         db.session.commit()
+        invalidate_compiled_maintenance_schedules()
         return jsonify({'message': 'Schedule deleted successfully'})
     except Exception as e:
         current_app.logger.error(f"Error deleting maintenance schedule {schedule_id}: {e}")
@@ -7,13 +7,15 @@ from werkzeug.utils import secure_filename # For CSV import
 import uuid # For task_id generation
 
 # Assuming Booking, Resource, User models are in models.py
-from models import Booking, Resource, User, FloorMap, BookingSettings # Added FloorMap
+from models import Booking, BookingArchive, Resource, User, FloorMap, BookingSettings, coerce_booking_status # Added FloorMap
 # Assuming db is in extensions.py
 from extensions import db # socketio removed
 # Assuming permission_required is in auth.py
 from auth import permission_required # Corrected: auth.py is at root
 from datetime import datetime, timedelta, timezone # Add datetime imports
 from utils import load_scheduler_settings, save_scheduler_settings, DEFAULT_BOOKING_CSV_BACKUP_SCHEDULE, add_audit_log # Ensure add_audit_log is imported
+from occupancy import clear_resource_day_occupancy
+from query_helpers import on_date
 
 # Import backup/restore functions
 # Other legacy imports (list_available_booking_csv_backups, list_available_backups, etc.) removed
@@ -28,6 +30,8 @@ from apscheduler.jobstores.base import JobLookupError
 # from scheduler_tasks import run_scheduled_booking_csv_backup # run_scheduled_booking_csv_backup is legacy
 from translations import _ # For flash messages and other translatable strings
 from r2_storage import r2_storage
+from db_routing import reads_from_replica
+from booking_settings_cache import current_booking_settings
 
 admin_ui_bp = Blueprint('admin_ui', __name__, url_prefix='/admin', template_folder='../templates')
 
@@ -77,14 +81,14 @@ def serve_admin_bookings_page():
             Booking.id, Booking.title, Booking.start_time, Booking.end_time, Booking.status,
             Booking.admin_deleted_message, User.username.label('user_username'), Resource.name.label('resource_name')
         ).join(Resource, Booking.resource_id == Resource.id)\
-         .join(User, Booking.user_name == User.username)
+         .join(User, Booking.user_id == User.id)
 
         if status_filter: bookings_query = bookings_query.filter(Booking.status == status_filter)
         if user_filter: bookings_query = bookings_query.filter(User.username == user_filter)
         if date_filter_str:
             try:
                 date_filter_obj = datetime.strptime(date_filter_str, '%Y-%m-%d').date()
-                bookings_query = bookings_query.filter(func.date(Booking.start_time) == date_filter_obj)
+                bookings_query = bookings_query.filter(on_date(Booking.start_time, date_filter_obj))
             except ValueError: logger.warning(f"Invalid date format for date_filter: '{date_filter_str}'. Ignoring filter.")
 
         all_booking_rows = bookings_query.all()
@@ -124,7 +128,7 @@ def serve_backup_system_page():
     current_app.logger.info(f"User {current_user.username} accessed System Backup & Restore page.")
     time_offset_value = 0
     try:
-        booking_settings = BookingSettings.query.first()
+        booking_settings = current_booking_settings()
         if booking_settings and booking_settings.global_time_offset_hours is not None: time_offset_value = booking_settings.global_time_offset_hours
         elif not booking_settings: current_app.logger.info("No BookingSettings found for system page, defaulting offset to 0.")
         else: current_app.logger.warning("BookingSettings.global_time_offset_hours is None for system page, defaulting offset to 0.")
@@ -144,7 +148,7 @@ def serve_backup_booking_data_page():
 
     time_offset_value = 0
     try:
-        booking_settings = BookingSettings.query.first()
+        booking_settings = current_booking_settings()
         if booking_settings and booking_settings.global_time_offset_hours is not None: time_offset_value = booking_settings.global_time_offset_hours
         elif not booking_settings: current_app.logger.info("No BookingSettings found for booking data page, defaulting offset to 0.")
         else: current_app.logger.warning("BookingSettings.global_time_offset_hours is None for booking data page, defaulting offset to 0.")
@@ -455,6 +459,7 @@ def system_settings_page():
 @admin_ui_bp.route('/analytics/data')
 @login_required
 @permission_required('view_analytics')
+@reads_from_replica
 def analytics_bookings_data():
     current_app.logger.info(f"User {current_user.username} attempting to fetch analytics data.")
     try:
@@ -524,44 +529,47 @@ def init_admin_ui_routes(app):
 #     # ... (body previously commented out) ...
 #     pass
 
+def _booking_export_dict(booking):
+    """JSON export shape shared by live and archived booking rows."""
+    return {
+        'id': booking.id,
+        'resource_id': booking.resource_id,
+        'user_name': booking.user_name,
+        'start_time': booking.start_time.isoformat() if booking.start_time else None,
+        'end_time': booking.end_time.isoformat() if booking.end_time else None,
+        'title': booking.title,
+        'checked_in_at': booking.checked_in_at.isoformat() if booking.checked_in_at else None,
+        'checked_out_at': booking.checked_out_at.isoformat() if booking.checked_out_at else None,
+        'status': booking.status,
+        'recurrence_rule': booking.recurrence_rule,
+        'admin_deleted_message': booking.admin_deleted_message,
+        'check_in_token': booking.check_in_token,
+        'check_in_token_expires_at': booking.check_in_token_expires_at.isoformat() if booking.check_in_token_expires_at else None,
+        'checkin_reminder_sent_at': booking.checkin_reminder_sent_at.isoformat() if booking.checkin_reminder_sent_at else None,
+        'last_modified': booking.last_modified.isoformat() if booking.last_modified else None,
+        'booking_display_start_time': booking.booking_display_start_time.isoformat() if booking.booking_display_start_time else None,
+        'booking_display_end_time': booking.booking_display_end_time.isoformat() if booking.booking_display_end_time else None
+    }
+
 @admin_ui_bp.route('/export_all_bookings_json')
 @login_required
 @permission_required('manage_system')
 def export_all_bookings_json():
     try:
-        all_bookings = Booking.query.all()
-        booking_list_for_json = []
-        for booking in all_bookings:
-            booking_dict = {
-                'id': booking.id,
-                'resource_id': booking.resource_id,
-                'user_name': booking.user_name,
-                'start_time': booking.start_time.isoformat() if booking.start_time else None,
-                'end_time': booking.end_time.isoformat() if booking.end_time else None,
-                'title': booking.title,
-                'checked_in_at': booking.checked_in_at.isoformat() if booking.checked_in_at else None,
-                'checked_out_at': booking.checked_out_at.isoformat() if booking.checked_out_at else None,
-                'status': booking.status,
-                'recurrence_rule': booking.recurrence_rule,
-                'admin_deleted_message': booking.admin_deleted_message,
-                'check_in_token': booking.check_in_token,
-                'check_in_token_expires_at': booking.check_in_token_expires_at.isoformat() if booking.check_in_token_expires_at else None,
-                'checkin_reminder_sent_at': booking.checkin_reminder_sent_at.isoformat() if booking.checkin_reminder_sent_at else None,
-                'last_modified': booking.last_modified.isoformat() if booking.last_modified else None,
-                'booking_display_start_time': booking.booking_display_start_time.isoformat() if booking.booking_display_start_time else None,
-                'booking_display_end_time': booking.booking_display_end_time.isoformat() if booking.booking_display_end_time else None
-            }
-            booking_list_for_json.append(booking_dict)
+        booking_list_for_json = [_booking_export_dict(booking) for booking in Booking.query.all()]
+        # Archived rows go under their own key so an import of this file does not revive them as live bookings.
+        archived_booking_list_for_json = [_booking_export_dict(booking) for booking in BookingArchive.query.all()]
 
         export_data = {
             "export_timestamp": datetime.now(timezone.utc).isoformat(),
-            "bookings": booking_list_for_json
+            "bookings": booking_list_for_json,
+            "archived_bookings": archived_booking_list_for_json
         }
         json_data_string = json.dumps(export_data, indent=4)
         timestamp_str = datetime.now(timezone.utc).strftime('%Y%m%d_%H%M%S')
         filename = f"booking_records_export_{timestamp_str}.json"
 
-        add_audit_log(action='EXPORT_ALL_BOOKINGS_JSON', details=f'Exported {len(booking_list_for_json)} bookings.', user_id=current_user.id)
+        add_audit_log(action='EXPORT_ALL_BOOKINGS_JSON', details=f'Exported {len(booking_list_for_json)} bookings and {len(archived_booking_list_for_json)} archived bookings.', user_id=current_user.id)
         current_app.logger.info(f"User {current_user.username} exported {len(booking_list_for_json)} bookings to JSON.")
 
         return Response(
@@ -601,6 +609,26 @@ def import_bookings_json():
             success_count = 0
             fail_count = 0
 
+            # Helper for datetimes
+            def parse_dt(dt_str):
+                if not dt_str: return None
+                if isinstance(dt_str, str) and dt_str.endswith('Z'):
+                    return datetime.fromisoformat(dt_str[:-1] + '+00:00')
+                return datetime.fromisoformat(dt_str)
+
+            # Helper for times
+            def parse_time(t_str):
+                if not t_str: return None
+                try:
+                    return datetime.strptime(t_str, '%H:%M:%S').time()
+                except ValueError:
+                    # Try without seconds
+                    return datetime.strptime(t_str, '%H:%M').time()
+
+            # One query for every owner in the file instead of a lookup per row in Booking's user_name validator
+            import_user_names = {b_data.get('user_name') for b_data in bookings_data if isinstance(b_data, dict) and b_data.get('user_name')}
+            user_ids_by_name = dict(db.session.query(User.username, User.id).filter(User.username.in_(import_user_names)).all()) if import_user_names else {}
+
             for b_data in bookings_data:
                 try:
                     booking_id = b_data.get('id')
@@ -616,44 +644,38 @@ def import_bookings_json():
                         fail_count += 1
                         continue # Cannot import without valid resource
 
+                    # Parse the whole row before a Booking exists, so a bad row can't leave a
+                    # half-built object in the session and fail the final commit for every row.
+                    row_values = {
+                        'resource_id': resource_id,
+                        'user_id': user_ids_by_name.get(b_data.get('user_name')),
+                        'user_name': b_data.get('user_name'),
+                        'title': b_data.get('title'),
+                        'status': coerce_booking_status(b_data['status']) if 'status' in b_data else 'approved',
+                        'recurrence_rule': b_data.get('recurrence_rule'),
+                        'admin_deleted_message': b_data.get('admin_deleted_message'),
+                        'check_in_token': b_data.get('check_in_token'),
+                        'start_time': parse_dt(b_data.get('start_time')),
+                        'end_time': parse_dt(b_data.get('end_time')),
+                        'checked_in_at': parse_dt(b_data.get('checked_in_at')),
+                        'checked_out_at': parse_dt(b_data.get('checked_out_at')),
+                        'check_in_token_expires_at': parse_dt(b_data.get('check_in_token_expires_at')),
+                        'checkin_reminder_sent_at': parse_dt(b_data.get('checkin_reminder_sent_at')),
+                        'last_modified': parse_dt(b_data.get('last_modified')) or datetime.now(timezone.utc),
+                        'booking_display_start_time': parse_time(b_data.get('booking_display_start_time')),
+                        'booking_display_end_time': parse_time(b_data.get('booking_display_end_time')),
+                    }
+                    if not row_values['start_time'] or not row_values['end_time']:
+                        logger.warning(f"Skipping booking {booking_id}: start_time and end_time are required.")
+                        fail_count += 1
+                        continue
+
                     booking = Booking.query.get(booking_id)
                     if not booking:
                         booking = Booking(id=booking_id)
                         db.session.add(booking)
-
-                    booking.resource_id = resource_id
-                    booking.user_name = b_data.get('user_name')
-                    booking.title = b_data.get('title')
-                    booking.status = b_data.get('status', 'approved')
-                    booking.recurrence_rule = b_data.get('recurrence_rule')
-                    booking.admin_deleted_message = b_data.get('admin_deleted_message')
-                    booking.check_in_token = b_data.get('check_in_token')
-
-                    # Helper for datetimes
-                    def parse_dt(dt_str):
-                        if not dt_str: return None
-                        if isinstance(dt_str, str) and dt_str.endswith('Z'):
-                            return datetime.fromisoformat(dt_str[:-1] + '+00:00')
-                        return datetime.fromisoformat(dt_str)
-
-                    # Helper for times
-                    def parse_time(t_str):
-                        if not t_str: return None
-                        try:
-                            return datetime.strptime(t_str, '%H:%M:%S').time()
-                        except ValueError:
-                            # Try without seconds
-                            return datetime.strptime(t_str, '%H:%M').time()
-
-                    booking.start_time = parse_dt(b_data.get('start_time'))
-                    booking.end_time = parse_dt(b_data.get('end_time'))
-                    booking.checked_in_at = parse_dt(b_data.get('checked_in_at'))
-                    booking.checked_out_at = parse_dt(b_data.get('checked_out_at'))
-                    booking.check_in_token_expires_at = parse_dt(b_data.get('check_in_token_expires_at'))
-                    booking.checkin_reminder_sent_at = parse_dt(b_data.get('checkin_reminder_sent_at'))
-                    booking.last_modified = parse_dt(b_data.get('last_modified')) or datetime.now(timezone.utc)
-                    booking.booking_display_start_time = parse_time(b_data.get('booking_display_start_time'))
-                    booking.booking_display_end_time = parse_time(b_data.get('booking_display_end_time'))
+                    for field, value in row_values.items():
+                        setattr(booking, field, value)
 
                     success_count += 1
 
@@ -683,6 +705,7 @@ def clear_all_bookings_data():
     logger = current_app.logger
     try:
         num_deleted = db.session.query(Booking).delete()
+        clear_resource_day_occupancy(db.session.connection()) # Bulk delete bypasses the flush hook
         db.session.commit()
         add_audit_log(action='CLEAR_ALL_BOOKINGS', details=f'All {num_deleted} booking entries deleted by user {current_user.username}.')
         logger.info(f"User {current_user.username} cleared all {num_deleted} booking entries.")
@@ -12,12 +12,17 @@ from datetime import datetime, timedelta, timezone, time
 # Assuming extensions.py contains db # socketio and mail removed
 from extensions import db # socketio and mail removed
 # Assuming models.py contains these model definitions
-from models import Booking, Resource, User, WaitlistEntry, BookingSettings, ResourcePIN, FloorMap # Added ResourcePIN & FloorMap
+from models import Booking, BookingArchive, Resource, User, WaitlistEntry, BookingSettings, ResourcePIN, FloorMap # Added ResourcePIN & FloorMap
 # Assuming utils.py contains these helper functions
 from utils import add_audit_log, parse_simple_rrule, send_email, send_teams_notification, check_booking_permission, generate_booking_image, get_current_effective_time, retry_on_db_error
 # Assuming auth.py contains permission_required decorator
 from auth import permission_required
-from models import MaintenanceSchedule
+from maintenance_schedules import get_compiled_maintenance_schedules
+from query_helpers import on_date
+from booking_locks import lock_resources_for_booking, is_booking_conflict_error
+from booking_archive import filtered_history_query
+from db_routing import reads_from_replica
+from booking_settings_cache import current_booking_settings
 
 # Blueprint Configuration
 api_bookings_bp = Blueprint('api_bookings', __name__, url_prefix='/api')
@@ -26,69 +31,23 @@ def is_resource_unavailable(resource, start_time, end_time):
     """
     Checks if a resource is unavailable due to a maintenance schedule.
     """
-    schedules = MaintenanceSchedule.query.all()
-
-    availability_schedules = [s for s in schedules if s.is_availability]
-    maintenance_schedules = [s for s in schedules if not s.is_availability]
-
-    # If there are any availability schedules, the resource is only available if it falls within one of them
-    if availability_schedules:
-        is_available = False
-        for schedule in availability_schedules:
-            if check_schedule_conflict(schedule, start_time, end_time, resource):
-                is_available = True
-                break
-        if not is_available:
-            return True
-
-    # Check for maintenance schedules
-    for schedule in maintenance_schedules:
-        if check_schedule_conflict(schedule, start_time, end_time, resource):
-            return True
-
-    return False
-
-def check_schedule_conflict(schedule, start_time, end_time, resource):
-    conflict = False
-    # First, check if the resource is affected by the schedule
-    if schedule.resource_selection_type == 'all':
-        conflict = True
-    elif schedule.resource_selection_type == 'building':
-        if resource.floor_map and resource.floor_map.location and schedule.building_id == resource.floor_map.location:
-            conflict = True
-    elif schedule.resource_selection_type == 'floor':
-        if resource.floor_map and str(resource.floor_map.id) in (schedule.floor_ids or '').split(','):
-            conflict = True
-    elif schedule.resource_selection_type == 'specific':
-        if str(resource.id) in (schedule.resource_ids or '').split(','):
-            conflict = True
-
-    if not conflict:
-        return False
-
-    # If the resource is affected, check the time
-    if schedule.schedule_type == 'date_range':
-        if schedule.start_date <= start_time.date() <= schedule.end_date:
-            return True
-    elif schedule.schedule_type == 'recurring_day':
-        if schedule.day_of_week and str(start_time.weekday()) in schedule.day_of_week.split(','):
-            return True
-    elif schedule.schedule_type == 'specific_day':
-        if schedule.day_of_month and str(start_time.day) in schedule.day_of_month.split(','):
-            return True
-    return False
+    return get_compiled_maintenance_schedules().is_resource_blocked(resource, start_time.date())
+
+def _first_overlapping(bookings, start_time, end_time):
+    """First booking in an already-fetched list that overlaps [start_time, end_time), or None."""
+    return next((b for b in bookings if b.start_time < end_time and b.end_time > start_time), None)
 
 # Initialization function
 def init_api_bookings_routes(app):
     app.register_blueprint(api_bookings_bp)
 
 # Helper function to fetch and paginate user bookings
-def _fetch_user_bookings_data(user_name, booking_type, page, per_page, status_filter, resource_name_filter, date_filter_str, logger):
+def _fetch_user_bookings_data(user_id, booking_type, page, per_page, status_filter, resource_name_filter, date_filter_str, logger):
     """
     Helper function to fetch, filter, sort, and paginate bookings for a user.
     """
     try:
-        booking_settings = BookingSettings.query.first()
+        booking_settings = current_booking_settings()
         enable_check_in_out = booking_settings.enable_check_in_out if booking_settings else False
         if booking_settings:
             logger.info(f"BookingSettings found. enable_check_in_out determined as: {enable_check_in_out}")
@@ -102,29 +61,23 @@ def _fetch_user_bookings_data(user_name, booking_type, page, per_page, status_fi
         if not booking_settings: # This check might be redundant if individual attributes are checked with hasattr, but kept for general warning.
             logger.warning("BookingSettings not found or some settings are missing, using default values for _fetch_user_bookings_data.")
 
-        base_query = Booking.query.filter_by(user_name=user_name)
-
-        if status_filter and status_filter.lower() != 'all' and status_filter.lower() != '':
-            base_query = base_query.filter(
-                sqlfunc.trim(sqlfunc.lower(Booking.status)) == status_filter.lower()
-            )
-
-        if resource_name_filter:
-            base_query = base_query.join(Resource).filter(Resource.name.ilike(f"%{resource_name_filter}%"))
-
+        selected_date = None
         if date_filter_str:
             try:
+                # Booking.start_time is naive venue local; filter on the day's [start, next start) range
+                # rather than sqlfunc.date() so the start_time index stays usable.
                 selected_date = datetime.strptime(date_filter_str, '%Y-%m-%d').date()
-                # Booking.start_time is naive venue local. To filter by a specific date,
-                # it's generally fine to use sqlfunc.date() directly if the DB handles it well.
-                # Or, convert selected_date to a range in venue local time if more precision is needed.
-                # For now, assume sqlfunc.date(Booking.start_time) works as intended for local times.
-                base_query = base_query.filter(sqlfunc.date(Booking.start_time) == selected_date)
             except ValueError:
                 logger.warning(f"Invalid date_filter format: '{date_filter_str}'. Ignoring date filter.")
                 pass
 
-        all_user_bookings_from_db = base_query.all()
+        # Past bookings read through to booking_archive; archived rows are always finished, never upcoming.
+        history_models = (Booking, BookingArchive) if booking_type == 'past' else (Booking,)
+        all_user_bookings_from_db = []
+        for history_model in history_models:
+            all_user_bookings_from_db += filtered_history_query(
+                history_model, user_id, status_filter, resource_name_filter, selected_date
+            ).all()
 
         relevant_bookings_dicts = []
         effective_now_aware = get_current_effective_time() # This is aware (UTC or with offset)
@@ -240,7 +193,7 @@ def _fetch_user_bookings_data(user_name, booking_type, page, per_page, status_fi
         return paginated_bookings, pagination_info, enable_check_in_out, allow_check_in_without_pin_setting
 
     except Exception as e:
-        logger.exception(f"Error in _fetch_user_bookings_data for user {user_name}, type {booking_type}: {e}")
+        logger.exception(f"Error in _fetch_user_bookings_data for user {user_id}, type {booking_type}: {e}")
         raise # Re-raise to be caught by the calling route
 
 
@@ -264,7 +217,7 @@ def get_upcoming_bookings():
 
 
         paginated_bookings, pagination_info, check_in_out_enabled, allow_check_in_without_pin = _fetch_user_bookings_data(
-            current_user.username, 'upcoming', page, per_page, status_filter, resource_name_filter, date_filter, logger
+            current_user.id, 'upcoming', page, per_page, status_filter, resource_name_filter, date_filter, logger
         )
 
         pagination_info['per_page_options'] = my_bookings_per_page_options
@@ -301,7 +254,7 @@ def get_past_bookings():
              per_page = my_bookings_per_page_options[0]
 
         paginated_bookings, pagination_info, check_in_out_enabled, allow_check_in_without_pin = _fetch_user_bookings_data(
-            current_user.username, 'past', page, per_page, status_filter, resource_name_filter, date_filter, logger
+            current_user.id, 'past', page, per_page, status_filter, resource_name_filter, date_filter, logger
         )
 
         pagination_info['per_page_options'] = my_bookings_per_page_options
@@ -355,13 +308,17 @@ def create_booking():
         current_app.logger.warning(f"Booking attempt by {current_user.username} missing user_name_for_record in payload.")
         return jsonify({'error': 'user_name for the booking record is required in payload.'}), 400
 
+    # Match the record owner's bookings on the indexed user_id; unknown names fall back to the stored user_name.
+    record_user_id = db.session.query(User.id).filter_by(username=user_name_for_record).scalar()
+    record_owner_clause = (Booking.user_id == record_user_id) if record_user_id is not None else (Booking.user_name == user_name_for_record)
+
     resource = Resource.query.get(resource_id)
     if not resource:
         current_app.logger.warning(f"Booking attempt by {current_user.username} for non-existent resource ID: {resource_id}")
         return jsonify({'error': 'Resource not found.'}), 404
 
     # Fetch Booking Settings
-    booking_settings = BookingSettings.query.first()
+    booking_settings = current_booking_settings()
 
     # Define effective settings, using defaults if booking_settings is None or specific values are not set
     allow_past_bookings_effective = booking_settings.allow_past_bookings if booking_settings else False
@@ -466,28 +423,49 @@ def create_booking():
         delta = timedelta(days=i) if freq == 'DAILY' else timedelta(weeks=i) if freq == 'WEEKLY' else timedelta(0)
         occurrences.append((new_booking_start_time + delta, new_booking_end_time + delta))
 
+    # Serialize with other booking writes on this resource before any check reads the table.
+    # On Postgres the overlap exclusion constraint makes this a no-op: a racing insert fails at flush instead.
+    lock_resources_for_booking([resource_id])
+
     # Enforce max_bookings_per_user
     if max_bookings_per_user_effective is not None and occurrences:
         # Count active (non-past, non-cancelled/rejected) bookings for the user
         user_booking_count = Booking.query.filter(
-            Booking.user_name == current_user.username, # Assuming current_user.username is the correct field
+            Booking.user_id == current_user.id,
             Booking.end_time > now_for_logic,      # Booking has not ended yet (compare naive to naive)
-            sqlfunc.trim(sqlfunc.lower(Booking.status)).in_(active_quota_statuses) # Booking is active
+            Booking.status.in_(active_quota_statuses) # Booking is active
         ).count()
 
         if user_booking_count + len(occurrences) > max_bookings_per_user_effective:
             current_app.logger.warning(f"Booking attempt by {current_user.username} for resource {resource_id} would exceed max bookings per user ({max_bookings_per_user_effective}). Current: {user_booking_count}, Requested: {len(occurrences)}.")
             return jsonify({'error': f'Cannot create new booking(s). You would exceed the maximum of {max_bookings_per_user_effective} bookings allowed per user.'}), 400
 
+    # Fetch everything the per-occurrence checks need once for the whole series, instead of
+    # exact-match, resource-conflict and user-conflict SELECTs for every occurrence.
+    resource_series_bookings, user_series_bookings = [], []
+    if occurrences:
+        series_start = min(occ_start for occ_start, _ in occurrences)
+        series_end = max(occ_end for _, occ_end in occurrences)
+        resource_series_bookings = Booking.query.filter(
+            Booking.resource_id == resource_id,
+            Booking.start_time < series_end,
+            Booking.end_time > series_start
+        ).all()
+        if not allow_multiple_resources_same_time_effective:
+            user_series_bookings = Booking.query.filter(
+                record_owner_clause,
+                Booking.start_time < series_end,
+                Booking.end_time > series_start,
+                Booking.status.in_(active_conflict_statuses)
+            ).all()
+    exact_slot_bookings = {(b.start_time, b.end_time): b for b in resource_series_bookings}
+    active_resource_bookings = [b for b in resource_series_bookings if b.status in active_conflict_statuses]
+    other_resource_user_bookings = [b for b in user_series_bookings if b.resource_id != resource_id]
+
     if occurrences:
         first_occ_start, first_occ_end = occurrences[0]
         if not allow_multiple_resources_same_time_effective:
-            first_slot_user_conflict = Booking.query.filter(
-                Booking.user_name == user_name_for_record,
-                Booking.start_time < first_occ_end,
-                Booking.end_time > first_occ_start,
-                sqlfunc.trim(sqlfunc.lower(Booking.status)).in_(active_conflict_statuses)
-            ).first()
+            first_slot_user_conflict = _first_overlapping(user_series_bookings, first_occ_start, first_occ_end)
 
             if first_slot_user_conflict:
                 conflicting_resource_name = first_slot_user_conflict.resource_booked.name if first_slot_user_conflict.resource_booked else "an unknown resource"
@@ -498,14 +476,11 @@ def create_booking():
     try: # Moved try block to encompass the loop for potential reused bookings
         for occ_start, occ_end in occurrences: # Renamed occ_start_local, occ_end_local to occ_start, occ_end for clarity
 
-            exact_match_booking = Booking.query.filter_by(
-                resource_id=resource_id,
-                start_time=occ_start, # occ_start is naive local
-                end_time=occ_end      # occ_end is naive local
-            ).first()
+            exact_match_booking = exact_slot_bookings.get((occ_start, occ_end)) # Both naive local
 
             if exact_match_booking and exact_match_booking.status and exact_match_booking.status.strip().lower() in released_statuses:
                 current_app.logger.info(f"Reusing existing released booking ID {exact_match_booking.id} for resource {resource_id} by user {user_name_for_record} for slot {occ_start}-{occ_end}.")
+                exact_match_booking.user_id = record_user_id # Explicit, so the flush doesn't look the user up by name
                 exact_match_booking.user_name = user_name_for_record
                 exact_match_booking.title = title
                 exact_match_booking.status = 'approved'
@@ -527,16 +502,12 @@ def create_booking():
                 exact_match_booking.booking_display_end_time = occ_end.time()
 
                 created_bookings.append(exact_match_booking)
+                active_resource_bookings.append(exact_match_booking)
                 # db.session.flush([exact_match_booking]) # Flush changes for this reused booking
                 continue # Skip to next occurrence
 
             # If no exact match, or exact match is not in a released status, proceed with conflict checks and new booking creation.
-            conflicting = Booking.query.filter(
-                Booking.resource_id == resource_id,
-                Booking.start_time < occ_end,
-                Booking.end_time > occ_start,
-                sqlfunc.trim(sqlfunc.lower(Booking.status)).in_(active_conflict_statuses)
-            ).first()
+            conflicting = _first_overlapping(active_resource_bookings, occ_start, occ_end)
 
             if conflicting:
                 current_app.logger.info(f"Booking conflict for resource {resource_id} on slot {occ_start}-{occ_end} with existing booking ID: {conflicting.id}, Status: '{conflicting.status}'.")
@@ -549,13 +520,7 @@ def create_booking():
                 return jsonify({'error': f"This time slot ({occ_start.strftime('%Y-%m-%d %H:%M')} to {occ_end.strftime('%Y-%m-%d %H:%M')}) on resource '{resource.name}' is already booked or conflicts. You may have been added to the waitlist if available."}), 409
 
             if not allow_multiple_resources_same_time_effective:
-                user_conflicting_recurring = Booking.query.filter(
-                    Booking.user_name == user_name_for_record,
-                    Booking.resource_id != resource_id,
-                    Booking.start_time < occ_end,
-                    Booking.end_time > occ_start,
-                    sqlfunc.trim(sqlfunc.lower(Booking.status)).in_(active_conflict_statuses)
-                ).first()
+                user_conflicting_recurring = _first_overlapping(other_resource_user_bookings, occ_start, occ_end)
                 if user_conflicting_recurring:
                     conflicting_resource_name = user_conflicting_recurring.resource_booked.name if user_conflicting_recurring.resource_booked else "an unknown resource"
                     current_app.logger.info(f"User {user_name_for_record} booking conflict (recurring slot) with booking ID: {user_conflicting_recurring.id}, Status: '{user_conflicting_recurring.status}' for resource '{conflicting_resource_name}' due to allow_multiple_resources_same_time=False.")
@@ -567,6 +532,7 @@ def create_booking():
                 start_time=occ_start, # Store venue local time directly
                 end_time=occ_end,   # Store venue local time directly
                 title=title,
+                user_id=record_user_id, # Resolved once above; an explicit user_id skips the lookup by user_name
                 user_name=user_name_for_record,
                 recurrence_rule=recurrence_rule_str,
                 booking_display_start_time=occ_start.time(),
@@ -575,6 +541,7 @@ def create_booking():
             # For newly created bookings, token generation will happen after commit
             db.session.add(new_booking)
             created_bookings.append(new_booking)
+            active_resource_bookings.append(new_booking) # Later occurrences of a self-overlapping series conflict with it
 
         # Commit all new bookings and updates to reused bookings
         db.session.commit()
@@ -599,7 +566,7 @@ def create_booking():
         # Prepare and log email data for each booking (new or reused)
         for booking_obj in created_bookings: # Changed variable name to booking_obj
             try:
-                user = User.query.filter_by(username=booking_obj.user_name).first()
+                user = booking_obj.user
                 if not user or not user.email:
                     current_app.logger.warning(f"User {booking_obj.user_name} not found or has no email. Skipping confirmation email data preparation for booking {booking_obj.id}.")
                     continue
@@ -735,7 +702,7 @@ def get_my_bookings():
         # date_filter_value_str = request.args.get('date_filter_value') # This seems to be from an older version, new JS uses resource_name_filter
         resource_name_filter = request.args.get('resource_name_filter') # Added for new filter
 
-        booking_settings = BookingSettings.query.first()
+        booking_settings = current_booking_settings()
         enable_check_in_out = booking_settings.enable_check_in_out if booking_settings else False
         allow_check_in_without_pin_setting = booking_settings.allow_check_in_without_pin if booking_settings and hasattr(booking_settings, 'allow_check_in_without_pin') else True
         check_in_minutes_before = booking_settings.check_in_minutes_before if booking_settings and booking_settings.check_in_minutes_before is not None else 15
@@ -745,15 +712,7 @@ def get_my_bookings():
         if not booking_settings: # General warning if settings are missing
              logger.warning("BookingSettings not found or some settings are missing, using default values for get_my_bookings.")
 
-        user_bookings_query = Booking.query.filter_by(user_name=current_user.username)
-
-        if status_filter and status_filter.lower() != 'all' and status_filter.lower() != '':
-            user_bookings_query = user_bookings_query.filter(
-                sqlfunc.trim(sqlfunc.lower(Booking.status)) == status_filter.lower()
-            )
-
-        if resource_name_filter: # New filter for resource name
-            user_bookings_query = user_bookings_query.join(Resource).filter(Resource.name.ilike(f"%{resource_name_filter}%"))
+        user_bookings_query = filtered_history_query(Booking, current_user.id, status_filter, resource_name_filter)
 
         # Note: date_filter_value_str is not used by current JS, but kept for compatibility if needed.
         # if date_filter_value_str:
@@ -765,8 +724,9 @@ def get_my_bookings():
         #     except ValueError:
         #         logger.warning(f"Invalid date_filter_value format: {date_filter_value_str}. Ignoring date filter.")
 
-        # Fetch ALL bookings matching filters first
+        # Fetch ALL bookings matching filters first, reading past ones through to the archive
         all_user_bookings_from_db = user_bookings_query.all()
+        all_user_bookings_from_db += filtered_history_query(BookingArchive, current_user.id, status_filter, resource_name_filter).all()
 
         all_upcoming_bookings_dicts = []
         all_past_bookings_dicts = []
@@ -911,10 +871,10 @@ def get_my_bookings_for_date():
                 Booking.end_time
             )
             .join(Resource, Booking.resource_id == Resource.id)
-            .filter(Booking.user_name == current_user.username)
-            .filter(func.date(Booking.start_time) == target_date_obj)
+            .filter(Booking.user_id == current_user.id)
+            .filter(on_date(Booking.start_time, target_date_obj))
             .filter(
-                sqlfunc.trim(sqlfunc.lower(Booking.status)).in_(
+                Booking.status.in_(
                     active_booking_statuses_for_user_schedule
                 )
             )
@@ -944,12 +904,13 @@ def get_my_bookings_for_date():
 @api_bookings_bp.route('/bookings/calendar', methods=['GET'])
 @login_required
 @retry_on_db_error
+@reads_from_replica
 def bookings_calendar():
     """Return bookings for the current user in FullCalendar format, optionally filtered by status."""
     try:
         status_filter_str = request.args.get('status_filter')
 
-        query = Booking.query.filter_by(user_name=current_user.username)
+        query = Booking.query.filter_by(user_id=current_user.id)
 
         if status_filter_str:
             # Handle comma-separated statuses for groups like 'cancelled'
@@ -1048,9 +1009,8 @@ def get_my_booked_resources():
     """
     try:
         # Step 1: Get distinct resource_ids booked by the current user
-        # Assuming Booking.user_name stores the username of the user who made the booking.
         booked_resource_ids_query = db.session.query(Booking.resource_id)\
-            .filter(Booking.user_name == current_user.username)\
+            .filter(Booking.user_id == current_user.id)\
             .distinct()\
             .all()
 
@@ -1108,7 +1068,7 @@ def update_booking_by_user(booking_id):
 
     try:
         # Fetch Booking Settings for global_time_offset_hours
-        booking_settings = BookingSettings.query.first()
+        booking_settings = current_booking_settings()
         current_offset_hours = 0
         if booking_settings and booking_settings.global_time_offset_hours is not None:
             current_offset_hours = booking_settings.global_time_offset_hours
@@ -1121,7 +1081,7 @@ def update_booking_by_user(booking_id):
             current_app.logger.warning(f"[API PUT /api/bookings/{booking_id}] User '{current_user.username}' attempted to update non-existent booking ID.")
             return jsonify({'error': 'Booking not found.'}), 404
 
-        if booking.user_name != current_user.username:
+        if booking.user_id != current_user.id:
             current_app.logger.warning(f"[API PUT /api/bookings/{booking_id}] User '{current_user.username}' unauthorized attempt to update booking ID owned by '{booking.user_name}'.")
             return jsonify({'error': 'You are not authorized to update this booking.'}), 403
 
@@ -1253,6 +1213,7 @@ def update_booking_by_user(booking_id):
                     return jsonify({'error': f'Resource is under maintenance until {maint_until_str} (venue local) and the new time slot falls within this period.'}), 403
 
             if time_changed:
+                lock_resources_for_booking([booking.resource_id])
                 # Tentatively set new times on the booking object for conflict checking
                 booking.start_time = parsed_new_start_time
                 booking.end_time = parsed_new_end_time
@@ -1273,12 +1234,12 @@ def update_booking_by_user(booking_id):
                         if not allow_multiple:
                             active_conflict_statuses = ['approved', 'pending', 'checked_in', 'confirmed']
                             user_own_conflict = Booking.query.filter(
-                                Booking.user_name == current_user.username,
+                                Booking.user_id == current_user.id,
                                 Booking.resource_id != booking.resource_id,
                                 Booking.id != booking_id,
                                 Booking.start_time < booking.end_time, # Uses new booking.end_time
                                 Booking.end_time > booking.start_time,   # Uses new booking.start_time
-                                sqlfunc.trim(sqlfunc.lower(Booking.status)).in_(active_conflict_statuses)
+                                Booking.status.in_(active_conflict_statuses)
                             ).first()
 
                     user_self_conflict_check = None
@@ -1287,11 +1248,11 @@ def update_booking_by_user(booking_id):
                         if not allow_multiple:
                             active_conflict_statuses_for_self_check = ['approved', 'pending', 'checked_in', 'confirmed']
                             user_self_conflict_check = Booking.query.filter(
-                                Booking.user_name == current_user.username,
+                                Booking.user_id == current_user.id,
                                 Booking.id != booking_id,
                                 Booking.start_time < booking.end_time, # Uses new booking.end_time
                                 Booking.end_time > booking.start_time,  # Uses new booking.start_time
-                                sqlfunc.trim(sqlfunc.lower(Booking.status)).in_(active_conflict_statuses_for_self_check)
+                                Booking.status.in_(active_conflict_statuses_for_self_check)
                             ).first()
 
                 if conflicting_booking:
@@ -1505,6 +1466,15 @@ def update_booking_by_user(booking_id):
         current_app.logger.info(f"[API PUT /api/bookings/{booking_id}] Sending successful response: {response_data}")
         return jsonify(response_data), 200
 
+    except IntegrityError as ie:
+        db.session.rollback()
+        if not is_booking_conflict_error(ie):
+            current_app.logger.exception(f"[API PUT /api/bookings/{booking_id}] IntegrityError during booking update: {ie}")
+            add_audit_log(action="UPDATE_BOOKING_USER_FAILED", details=f"User '{current_user.username}' failed to update booking ID: {booking_id}. Error: {str(ie)}")
+            return jsonify({'error': 'Failed to update booking due to a server error.'}), 500
+        current_app.logger.warning(f"[API PUT /api/bookings/{booking_id}] Update for user '{current_user.username}' rejected by the database overlap guard: {ie}")
+        return jsonify({'error': 'The updated time slot conflicts with an existing booking on this resource.'}), 409
+
     except Exception as e:
         db.session.rollback()
         current_app.logger.exception(f"[API PUT /api/bookings/{booking_id}] Critical error during booking update for user '{current_user.username if current_user.is_authenticated else 'Anonymous'}'. Error: {str(e)}")
@@ -1527,7 +1497,7 @@ def delete_booking_by_user(booking_id):
             return jsonify({'error': 'Booking not found.'}), 404
 
         # Authorization: User can only delete their own bookings.
-        if booking.user_name != current_user.username:
+        if booking.user_id != current_user.id:
             current_app.logger.warning(f"User '{current_user.username}' unauthorized attempt to delete booking ID: {booking_id} owned by '{booking.user_name}'.")
             return jsonify({'error': 'You are not authorized to delete this booking.'}), 403
 
@@ -1715,7 +1685,7 @@ def check_in_booking(booking_id):
             current_app.logger.warning(f"Check-in attempt for non-existent booking ID: {booking_id} by user {current_user.username}")
             return jsonify({'error': 'Booking not found.'}), 404
 
-        if booking.user_name != current_user.username:
+        if booking.user_id != current_user.id:
             # Admin/manager override could be a feature, handled by a different endpoint or permission.
             current_app.logger.warning(f"User {current_user.username} unauthorized check-in attempt for booking {booking_id} owned by {booking.user_name}.")
             return jsonify({'error': 'You are not authorized to check into this booking.'}), 403
@@ -1724,7 +1694,7 @@ def check_in_booking(booking_id):
             current_app.logger.info(f"User {current_user.username} attempt to check-in to already checked-in booking {booking_id} at {booking.checked_in_at.isoformat()} UTC")
             return jsonify({'message': 'Already checked in.', 'checked_in_at': booking.checked_in_at.replace(tzinfo=timezone.utc).isoformat()}), 200
 
-        booking_settings = BookingSettings.query.first()
+        booking_settings = current_booking_settings()
         check_in_minutes_before = 15
         check_in_minutes_after = 15
         past_booking_adjustment_hours = 0
@@ -1817,7 +1787,7 @@ def check_in_booking(booking_id):
         current_app.logger.info(f"User '{current_user.username}' successfully checked into booking ID: {booking_id} at {effective_now_aware.isoformat()}{' using PIN' if provided_pin else ''}.")
 
         # Send Email Notification for Check-in
-        user = User.query.filter_by(username=booking.user_name).first()
+        user = booking.user
         resource_details = Resource.query.get(booking.resource_id) # Renamed to avoid conflict
 
         current_app.logger.info(f"Preparing to send check-in email for booking ID {booking.id} to user {booking.user_name}.")
@@ -1924,7 +1894,7 @@ def check_out_booking(booking_id):
             current_app.logger.warning(f"Check-out attempt for non-existent booking ID: {booking_id} by user {current_user.username}")
             return jsonify({'error': 'Booking not found.'}), 404
 
-        if booking.user_name != current_user.username:
+        if booking.user_id != current_user.id:
             current_app.logger.warning(f"User {current_user.username} unauthorized check-out attempt for booking {booking_id} owned by {booking.user_name}.")
             return jsonify({'error': 'You are not authorized to check out of this booking.'}), 403
 
@@ -1939,7 +1909,7 @@ def check_out_booking(booking_id):
         effective_now_aware = get_current_effective_time()
         effective_now_local_naive = effective_now_aware.replace(tzinfo=None) # Naive local "now"
 
-        booking_settings = BookingSettings.query.first() # For offset, if needed for email formatting
+        booking_settings = current_booking_settings() # For offset, if needed for email formatting
         current_offset_hours = booking_settings.global_time_offset_hours if booking_settings and hasattr(booking_settings, 'global_time_offset_hours') and booking_settings.global_time_offset_hours is not None else 0
 
 
@@ -1955,7 +1925,7 @@ def check_out_booking(booking_id):
         current_app.logger.info(f"User '{current_user.username}' successfully checked out of booking ID: {booking_id} at {effective_now_aware.isoformat()}. Status set to completed.")
 
         # Send Email Notification for Check-out
-        user = User.query.filter_by(username=booking.user_name).first()
+        user = booking.user
         resource_details = Resource.query.get(booking.resource_id) # Renamed
 
         current_app.logger.info(f"Preparing to send check-out email for booking ID {booking.id} to user {booking.user_name}.")
@@ -2082,7 +2052,7 @@ def qr_check_in(token):
         current_app.logger.warning(f"QR Check-in attempt for booking {booking.id} with status '{booking.status}' using token {token}")
         return jsonify({'error': f'Booking is not active (status: {booking.status}). Cannot check in.'}), 403
 
-    booking_settings = BookingSettings.query.first()
+    booking_settings = current_booking_settings()
     check_in_minutes_before = 15
     check_in_minutes_after = 15
     past_booking_adjustment_hours = 0
@@ -2181,7 +2151,7 @@ def resource_pin_check_in(resource_id):
         return render_template('check_in_status_public.html', message=msg, status='error'), 403
 
     # Fetch BookingSettings
-    booking_settings = BookingSettings.query.first()
+    booking_settings = current_booking_settings()
     requires_login = True # Default
     check_in_minutes_before = 15
     check_in_minutes_after = 15
@@ -2225,7 +2195,7 @@ def resource_pin_check_in(resource_id):
     )
 
     if current_user.is_authenticated: # If login is required or user is simply logged in
-        potential_bookings_query = potential_bookings_query.filter_by(user_name=current_user.username)
+        potential_bookings_query = potential_bookings_query.filter_by(user_id=current_user.id)
 
     # Iterate to find a booking within the check-in window
     # Order by start_time to get the most relevant (e.g., soonest) booking.
@@ -5,10 +5,10 @@ import zipfile
 from datetime import datetime, timezone, date, time # Added time
 from werkzeug.utils import secure_filename
 
-from flask import Blueprint, jsonify, request, url_for, current_app, send_file
+from flask import Blueprint, jsonify, request, url_for, current_app, send_file, Response
 from flask_login import login_required, current_user
-from sqlalchemy import func # For func.date in get_map_details
 from sqlalchemy.sql import func as sqlfunc # Added for explicit use of sqlfunc.trim/lower
+from sqlalchemy.orm import selectinload
 
 # Local imports
 from extensions import db
@@ -16,7 +16,12 @@ from r2_storage import r2_storage
 from models import FloorMap, Resource, Booking, Role # Role removed if no longer needed
 from auth import permission_required
 # Assuming these utils will be moved to utils.py or are already there
-from utils import add_audit_log, allowed_file, _get_map_configuration_data, _import_map_configuration_data, check_resources_availability_for_user, get_detailed_map_availability_for_user, _get_map_configuration_data_zip, retry_on_db_error
+from utils import add_audit_log, allowed_file, _get_map_configuration_data, _import_map_configuration_data, get_batch_map_availability_for_user, _get_map_configuration_data_zip, retry_on_db_error
+from query_helpers import on_date
+from db_routing import reads_from_replica
+from booking_image_cache import invalidate_booking_images
+from floor_map_derivatives import delete_floor_map_derivatives, floor_map_derivatives_payload, refresh_floor_map_derivatives
+from floor_map_tiles import TILE_SET_PATTERN, delete_floor_map_tiles, floor_map_tiles_payload, read_floor_map_tile, refresh_floor_map_tiles
 
 # Conditional import for Storage (R2)
 try:
@@ -31,6 +36,15 @@ api_maps_bp = Blueprint('api_maps', __name__, url_prefix='/api')
 def init_api_maps_routes(app):
     app.register_blueprint(api_maps_bp)
 
+def _get_published_resources_for_maps(floor_map_ids):
+    """Loads every published resource on the given maps (with roles) in one query."""
+    if not floor_map_ids:
+        return []
+    return Resource.query.options(selectinload(Resource.roles)).filter(
+        Resource.floor_map_id.in_(floor_map_ids),
+        Resource.status == 'published'
+    ).all()
+
 # --- Map API Routes ---
 
 @api_maps_bp.route('/locations-availability', methods=['GET'])
@@ -61,26 +75,21 @@ def get_locations_availability():
             (time(13, 0), time(17, 0))
         ]
 
-        for loc_name in location_names:
-            location_available = False
-            floor_maps_in_location = FloorMap.query.filter_by(location=loc_name).all()
-
-            for floor_map in floor_maps_in_location:
-                if location_available: # Already found an available resource in this location
-                    break
-
-                resources_on_map = Resource.query.filter(
-                    Resource.floor_map_id == floor_map.id,
-                    Resource.status == 'published'
-                ).all()
+        floor_maps_with_location = FloorMap.query.filter(FloorMap.location.in_(location_names)).all() if location_names else []
+        published_resources = _get_published_resources_for_maps([fm.id for fm in floor_maps_with_location])
+        availability_by_map = get_batch_map_availability_for_user(
+            published_resources, target_date, current_user, primary_slots, current_app.logger
+        )
 
-                # Use the new helper function for the list of resources on this map
-                if resources_on_map:
-                    if check_resources_availability_for_user(resources_on_map, target_date, current_user, primary_slots, current_app.logger):
-                        location_available = True
-                        # Found an available resource in this location, no need to check other maps in this location
-                        break
+        map_ids_by_location = {}
+        for floor_map in floor_maps_with_location:
+            map_ids_by_location.setdefault(floor_map.location, []).append(floor_map.id)
 
+        for loc_name in location_names:
+            location_available = any(
+                availability_by_map.get(map_id, {}).get('available_primary_slots_for_user', 0) > 0
+                for map_id in map_ids_by_location.get(loc_name, [])
+            )
             results.append({"location_name": loc_name, "is_available": location_available})
 
         return jsonify(results), 200
@@ -113,24 +122,16 @@ def get_maps_availability():
             (time(13, 0), time(17, 0))
         ]
 
+        published_resources = _get_published_resources_for_maps([fm.id for fm in all_floor_maps])
+        availability_by_map = get_batch_map_availability_for_user(
+            published_resources, target_date, current_user, primary_slots, current_app.logger
+        )
+
         for floor_map_item in all_floor_maps:
             availability_status = "low" # Default status
 
-            resources_on_map = Resource.query.filter(
-                Resource.floor_map_id == floor_map_item.id,
-                Resource.status == 'published'
-            ).all()
-
-            if not resources_on_map:
-                availability_status = "low"
-            else:
-                details = get_detailed_map_availability_for_user(
-                    resources_on_map,
-                    target_date,
-                    current_user,
-                    primary_slots,
-                    current_app.logger
-                )
+            details = availability_by_map.get(floor_map_item.id)
+            if details:
                 total_slots = details.get('total_primary_slots', 0)
                 available_slots = details.get('available_primary_slots_for_user', 0)
 
@@ -162,6 +163,7 @@ def get_maps_availability():
 
 @api_maps_bp.route('/maps', methods=['GET'])
 @retry_on_db_error
+@reads_from_replica
 def get_public_floor_maps():
     try:
         maps = FloorMap.query.all()
@@ -183,13 +185,30 @@ def get_public_floor_maps():
                 'floor': m.floor,
                 'offset_x': m.offset_x,
                 'offset_y': m.offset_y,
-                'image_url': image_url
+                'image_url': image_url,
+                'image_derivatives': floor_map_derivatives_payload(m)
             })
         return jsonify(maps_list), 200
     except Exception as e:
         current_app.logger.exception("Error fetching public floor maps:")
         return jsonify({'error': 'Failed to fetch maps due to a server error.'}), 500
 
+@api_maps_bp.route('/maps/tiles/<tile_set>/<int:level>/<int:col>_<int:row>.<ext>', methods=['GET'])
+@login_required
+def get_floor_map_tile(tile_set, level, col, row, ext):
+    # Tile sets are content addressed (see floor_map_tiles.tile_set_id), so a URL never changes content.
+    # Plans are only shown to signed-in users, so only the browser may cache them (not shared caches).
+    if not TILE_SET_PATTERN.match(tile_set) or ext not in ('webp', 'png'):
+        return jsonify({'error': 'Tile not found.'}), 404
+    data = read_floor_map_tile(tile_set, f"{level}/{col}_{row}.{ext}")
+    if data is None:
+        return jsonify({'error': 'Tile not found.'}), 404
+    response = Response(data, mimetype=f'image/{ext}')
+    response.cache_control.private = True
+    response.cache_control.max_age = 31536000
+    response.cache_control.immutable = True
+    return response
+
 @api_maps_bp.route('/admin/maps', methods=['POST'])
 @login_required
 @permission_required('manage_floor_maps')
@@ -230,6 +249,7 @@ def upload_floor_map():
 
         storage_provider = current_app.config.get('STORAGE_PROVIDER', 'local')
         file_path = None
+        new_map = None
         try:
             # Check using the standardized filename
             existing_map_by_filename = FloorMap.query.filter_by(image_filename=filename).first()
@@ -239,6 +259,9 @@ def upload_floor_map():
             else:
                 current_app.logger.info(f"Duplicate check: No existing map found for standardized filename '{filename}'. Proceeding with upload.")
 
+            image_bytes = file.read() # Kept for the derivatives below
+            file.seek(0)
+
             # Note: existing_map_by_name check can remain as is, as map names might have legitimate case differences.
             existing_map_by_name = FloorMap.query.filter_by(name=map_name).first()
             if existing_map_by_name: # This check is fine as is
@@ -273,6 +296,9 @@ def upload_floor_map():
             new_map = FloorMap(name=map_name, image_filename=filename, # Use standardized filename
                                location=location, floor=floor,
                                offset_x=offset_x, offset_y=offset_y) # Assuming offsets are handled
+            # Resized/WebP/AVIF copies next to the original; a failure here only costs clients the srcset
+            refresh_floor_map_derivatives(new_map, image_bytes)
+            refresh_floor_map_tiles(new_map, image_bytes) # Only for very large plans
 
             current_app.logger.info(f"Adding FloorMap instance to session: {new_map!r}") # Use !r for repr
             db.session.add(new_map)
@@ -288,13 +314,17 @@ def upload_floor_map():
                 'id': new_map.id, 'name': new_map.name, 'image_filename': new_map.image_filename, # This is the standardized filename
                 'location': new_map.location, 'floor': new_map.floor,
                 'offset_x': new_map.offset_x, 'offset_y': new_map.offset_y, # Already included
-                'image_url': image_url # Uses standardized filename
+                'image_url': image_url, # Uses standardized filename
+                'image_derivatives': floor_map_derivatives_payload(new_map)
             }), 201
         except Exception as e:
             db.session.rollback()
             if storage_provider != 'r2' and file_path and os.path.exists(file_path):
                  os.remove(file_path)
                  current_app.logger.info(f"Cleaned up partially uploaded file: {file_path} (original: {original_filename})")
+            if new_map is not None:
+                delete_floor_map_derivatives(new_map.image_derivatives)
+                delete_floor_map_tiles(new_map.image_tiles)
             current_app.logger.error(f"Error during DB commit or file handling for map '{map_name}' (standardized filename: '{filename}'). Exception: {str(e)}", exc_info=True)
             add_audit_log(action="CREATE_MAP_FAILED", details=f"Failed to upload floor map '{map_name}' (original filename: {original_filename}) by {current_user.username}. Error: {str(e)}")
             return jsonify({'error': f'Failed to upload map due to a server error: {str(e)}'}), 500
@@ -325,7 +355,8 @@ def get_floor_maps():
                 'id': m.id, 'name': m.name, 'image_filename': m.image_filename,
                 'location': m.location, 'floor': m.floor,
                 'offset_x': m.offset_x, 'offset_y': m.offset_y,
-                'image_url': image_url
+                'image_url': image_url,
+                'image_derivatives': floor_map_derivatives_payload(m)
                 # 'assigned_role_ids' removed
             })
         current_app.logger.info(f"Admin {current_user.username} fetched all floor maps.") # Log message reverted
@@ -371,8 +402,11 @@ def delete_floor_map(map_id):
                         current_app.logger.warning(f"Map image file not found for deletion: {image_path}")
                 except OSError as e_os:
                     current_app.logger.error(f"Error deleting map image file {image_path}: {e_os}", exc_info=True)
+            delete_floor_map_derivatives(floor_map.image_derivatives)
+            delete_floor_map_tiles(floor_map.image_tiles)
 
         db.session.commit()
+        invalidate_booking_images(map_id)
         current_app.logger.info(f"Floor map ID {map_id} ('{map_name_for_log}') and image '{image_filename_for_log}' deleted by {current_user.username}.")
         add_audit_log(action="DELETE_MAP_SUCCESS", details=f"Floor map ID {map_id} ('{map_name_for_log}', image: '{image_filename_for_log}') deleted by {current_user.username}.")
         return jsonify({'message': f"Floor map '{map_name_for_log}' deleted."}), 200
@@ -470,6 +504,7 @@ def import_map_configuration():
             current_app.logger.info(f"Ensured image upload folder exists: {upload_folder_maps}")
 
             extracted_images_count = 0
+            extracted_images = {}
             for member_name in zip_ref.namelist():
                 if member_name.lower().endswith(('.png', '.jpg', '.jpeg', '.gif')) and member_name != 'map_configuration.json':
                     s_filename = secure_filename(os.path.basename(member_name)) # Use os.path.basename to avoid issues with paths in zip
@@ -485,6 +520,7 @@ def import_map_configuration():
                             if r2_storage.upload_file(io.BytesIO(image_data), s_filename, 'floor_map_uploads'):
                                 current_app.logger.info(f"Extracted and uploaded map image to R2: {s_filename}")
                                 extracted_images_count += 1
+                                extracted_images[s_filename] = image_data
                             else:
                                 current_app.logger.error(f"Failed to upload image '{s_filename}' to R2.")
                         else:
@@ -492,6 +528,7 @@ def import_map_configuration():
                                 f_img.write(image_data)
                             current_app.logger.info(f"Extracted and saved map image: {s_filename} to {image_save_path}")
                             extracted_images_count += 1
+                            extracted_images[s_filename] = image_data
                     except Exception as e_img_save:
                         current_app.logger.error(f"Error saving image '{s_filename}' from ZIP: {e_img_save}", exc_info=True)
                         # Decide if this is a critical error. For now, log and continue.
@@ -499,6 +536,12 @@ def import_map_configuration():
 
         # Proceed with data import using the extracted config_data
         summary, status_code = _import_map_configuration_data(config_data)
+        invalidate_booking_images() # Extracted images may have replaced map files under the same names
+        if extracted_images:
+            for floor_map in FloorMap.query.filter(FloorMap.image_filename.in_(list(extracted_images))).all():
+                refresh_floor_map_derivatives(floor_map, extracted_images[floor_map.image_filename])
+                refresh_floor_map_tiles(floor_map, extracted_images[floor_map.image_filename])
+            db.session.commit()
 
         # Add details about ZIP processing to summary if possible, or just log
         log_message = f"User {current_user.username} imported map configuration from ZIP '{original_filename}'. Images extracted: {extracted_images_count}."
@@ -525,6 +568,7 @@ def import_map_configuration():
 @api_maps_bp.route('/map_details/<int:map_id>', methods=['GET'])
 @login_required
 @retry_on_db_error
+@reads_from_replica
 def get_map_details(map_id):
     active_booking_statuses_for_conflict_map_details = ['approved', 'pending', 'checked_in', 'confirmed']
 
@@ -556,6 +600,8 @@ def get_map_details(map_id):
         map_details_response = {
             'id': floor_map.id, 'name': floor_map.name,
             'image_url': map_image_url,
+            'image_derivatives': floor_map_derivatives_payload(floor_map),
+            'image_tiles': floor_map_tiles_payload(floor_map),
             'location': floor_map.location, 'floor': floor_map.floor,
             'offset_x': floor_map.offset_x, 'offset_y': floor_map.offset_y
         }
@@ -577,44 +623,24 @@ def get_map_details(map_id):
                 current_app.logger.debug(f"User {current_user.username} is admin. Access granted for resource {resource.id}.")
                 current_user_can_book_flag = True
             else:
-                # map_allowed_role_ids is a string from the DB
+                # map_allowed_role_ids is a JSON string from the DB; parsed once per distinct value.
                 if resource.map_allowed_role_ids and resource.map_allowed_role_ids.strip(): # Check if not None and not empty/whitespace
-                    current_app.logger.debug(f"Resource {resource.id} has map_allowed_role_ids: '{resource.map_allowed_role_ids}'. Processing...")
-                    try:
-                        allowed_roles_from_json = json.loads(resource.map_allowed_role_ids)
-
-                        if not isinstance(allowed_roles_from_json, list):
-                            current_app.logger.warning(f"Resource {resource.id} 'map_allowed_role_ids' ('{resource.map_allowed_role_ids}') is not a list after JSON parsing. Denying access for safety.")
-                            current_user_can_book_flag = False
-                        elif not allowed_roles_from_json: # Parsed to an empty list e.g., from '[]'
-                            current_app.logger.debug(f"Resource {resource.id} 'map_allowed_role_ids' ('{resource.map_allowed_role_ids}') is an empty list. Granting access (public for authenticated users).")
-                            current_user_can_book_flag = True
-                        else:
-                            # It's a populated list of role IDs. Attempt to convert to integers and check for intersection.
-                            malformed_id_found = False
-                            processed_allowed_role_ids = set()
-                            for r_id in allowed_roles_from_json:
-                                try:
-                                    processed_allowed_role_ids.add(int(r_id)) # Ensure conversion to int
-                                except (ValueError, TypeError):
-                                    malformed_id_found = True
-                                    current_app.logger.warning(f"Resource {resource.id} 'map_allowed_role_ids' ('{resource.map_allowed_role_ids}') contains a non-integer role ID: '{r_id}'. Denying access due to malformed ID.")
-                                    break
-
-                            if malformed_id_found:
-                                current_user_can_book_flag = False
-                            else:
-                                user_role_ids_set = {role.id for role in current_user.roles}
-                                current_app.logger.debug(f"Resource {resource.id}: Comparing user roles {user_role_ids_set} with processed resource roles {processed_allowed_role_ids}.")
-                                if not user_role_ids_set.isdisjoint(processed_allowed_role_ids):
-                                    current_app.logger.debug(f"Resource {resource.id}: Overlap found. Access granted.")
-                                    current_user_can_book_flag = True
-                                else:
-                                    current_app.logger.debug(f"Resource {resource.id}: No overlap. Access denied.")
-                                    current_user_can_book_flag = False # Explicitly set, though already default
-                    except json.JSONDecodeError:
+                    allowed_role_ids, parse_error = resource.parsed_map_allowed_role_ids()
+                    if parse_error == 'invalid_json':
                         current_app.logger.warning(f"Resource {resource.id} has invalid JSON in 'map_allowed_role_ids' ('{resource.map_allowed_role_ids}'). Denying access for safety.")
                         current_user_can_book_flag = False
+                    elif parse_error == 'not_a_list':
+                        current_app.logger.warning(f"Resource {resource.id} 'map_allowed_role_ids' ('{resource.map_allowed_role_ids}') is not a list after JSON parsing. Denying access for safety.")
+                        current_user_can_book_flag = False
+                    elif parse_error:
+                        current_app.logger.warning(f"Resource {resource.id} 'map_allowed_role_ids' ('{resource.map_allowed_role_ids}') contains a non-integer role ID. Denying access due to malformed ID.")
+                        current_user_can_book_flag = False
+                    elif not allowed_role_ids: # Parsed to an empty list e.g., from '[]'
+                        current_app.logger.debug(f"Resource {resource.id} 'map_allowed_role_ids' ('{resource.map_allowed_role_ids}') is an empty list. Granting access (public for authenticated users).")
+                        current_user_can_book_flag = True
+                    else:
+                        current_user_can_book_flag = not current_user.role_ids.isdisjoint(allowed_role_ids)
+                        current_app.logger.debug(f"Resource {resource.id}: user roles {current_user.role_ids} vs resource roles {allowed_role_ids}. Access {'granted' if current_user_can_book_flag else 'denied'}.")
                 else:
                     # resource.map_allowed_role_ids is None, empty string, or whitespace only.
                     # This means the resource is considered public to all authenticated users.
@@ -625,8 +651,8 @@ def get_map_details(map_id):
             # The 'if can_view_resource:' block is removed. All resources are processed.
             bookings_on_date = Booking.query.filter(
                 Booking.resource_id == resource.id,
-                func.date(Booking.start_time) == target_date_obj, # func.date needs sqlalchemy import
-                sqlfunc.trim(sqlfunc.lower(Booking.status)).in_(active_booking_statuses_for_conflict_map_details)
+                on_date(Booking.start_time, target_date_obj),
+                Booking.status.in_(active_booking_statuses_for_conflict_map_details)
             ).all()
             bookings_info = [{'title': b.title, 'user_name': b.user_name,
                               'start_time': b.start_time.strftime('%H:%M:%S'),
@@ -655,13 +681,10 @@ def get_map_details(map_id):
 
             allowed_roles_info = []
             if resource.map_allowed_role_ids:
-                try:
-                    role_ids = json.loads(resource.map_allowed_role_ids)
-                    if isinstance(role_ids, list) and all(isinstance(rid, int) for rid in role_ids):
-                        roles = Role.query.filter(Role.id.in_(role_ids)).all()
-                        allowed_roles_info = [{'id': role.id, 'name': role.name} for role in roles]
-                except (json.JSONDecodeError, TypeError):
-                     pass # Error already logged when determining current_user_can_book_flag
+                role_ids, parse_error = resource.parsed_map_allowed_role_ids()
+                if role_ids and not parse_error: # Errors were already logged when determining current_user_can_book_flag
+                    roles = Role.query.filter(Role.id.in_(role_ids)).all()
+                    allowed_roles_info = [{'id': role.id, 'name': role.name} for role in roles]
             resource_info['roles'] = allowed_roles_info # This remains, contains roles that CAN book, not if current user CAN book
             mapped_resources_list.append(resource_info)
 
@@ -719,6 +742,7 @@ def update_floor_map_offsets(map_id):
 
     try:
         db.session.commit()
+        invalidate_booking_images(map_id) # Every marker on this map moved
         current_app.logger.info(f"Offsets for floor map ID {map_id} ('{floor_map.name}') updated by {current_user.username}. New offsets: X={floor_map.offset_x}, Y={floor_map.offset_y}")
         add_audit_log(
             action="UPDATE_MAP_OFFSETS_SUCCESS",
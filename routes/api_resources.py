@@ -3,7 +3,7 @@ import json
 from datetime import datetime, date, time, timedelta, timezone
 from flask import Blueprint, jsonify, request, url_for, current_app
 from flask_login import login_required, current_user
-from sqlalchemy import func
+from sqlalchemy import func, intersect, select
 from sqlalchemy.orm import joinedload
 from werkzeug.utils import secure_filename
 import secrets # For PIN generation
@@ -13,34 +13,67 @@ import string # For PIN generation
 from extensions import db
 from r2_storage import r2_storage
 # Assuming models are defined in models.py
-from models import User, Resource, Booking, FloorMap, Role, ResourcePIN, BookingSettings # Added User, Role, ResourcePIN, BookingSettings
+from models import User, Resource, Booking, FloorMap, Role, ResourcePIN, BookingSettings, ResourceTag, ResourceEquipment, split_csv_terms # Added User, Role, ResourcePIN, BookingSettings
 # Assuming utility functions are in utils.py
-from utils import add_audit_log, resource_to_dict, allowed_file, _import_resource_configurations_data, check_booking_permission, retry_on_db_error
+from utils import add_audit_log, resource_to_dict, allowed_file, _import_resource_configurations_data, check_booking_permission, retry_on_db_error, get_unavailable_dates_for_user, find_free_slots_for_user, get_current_effective_time, build_availability_matrix
 # Assuming permission_required is in auth.py
 from auth import permission_required
-from models import MaintenanceSchedule
+from maintenance_schedules import get_compiled_maintenance_schedules
+from slot_grid import build_slot_grid
+from query_helpers import on_date, day_range, date_span_range, overlaps_range
+from db_routing import reads_from_replica
+from booking_settings_cache import current_booking_settings
 
 api_resources_bp = Blueprint('api_resources', __name__, url_prefix='/api')
 
+FREE_SLOT_SEARCH_MAX_DAYS = 92
+FREE_SLOT_SEARCH_MAX_RESULTS = 200
+AVAILABILITY_MATRIX_MAX_DAYS = 62
+
+STANDARD_SLOTS_DEFINITION = {
+    "first_half": {"name": "First Half-Day", "start_time_str": "08:00:00", "end_time_str": "12:00:00"},
+    "second_half": {"name": "Second Half-Day", "start_time_str": "13:00:00", "end_time_str": "17:00:00"},
+    "full_day": {"name": "Full Day", "start_time_str": "08:00:00", "end_time_str": "17:00:00"}
+}
+
+def _term_resource_ids(entry_model, term, match_mode):
+    """Select of resource ids whose normalized tag/equipment entries match term."""
+    if match_mode == 'exact':
+        condition = entry_model.name == term
+    elif match_mode == 'fuzzy' and db.engine.dialect.name == 'postgresql':
+        # pg_trgm similarity; served by the trigram GIN index when the migration could create it.
+        condition = entry_model.name.op('%')(term)
+    else:
+        condition = entry_model.name.contains(term, autoescape=True)
+    return select(entry_model.resource_id).where(condition)
+
+
+def _apply_resource_search_filters(query, args):
+    """
+    Applies the capacity / equipment / tags filters shared by resource search endpoints.
+    Every equipment item and tag must match (substring by default, or match=exact|fuzzy);
+    the per-term id sets from resource_equipment / resource_tag are intersected in one subquery.
+    """
+    capacity = args.get('capacity', type=int)
+    if capacity is not None:
+        query = query.filter(Resource.capacity >= capacity)
+    match_mode = (args.get('match') or 'contains').strip().lower()
+    term_selects = [_term_resource_ids(ResourceEquipment, item, match_mode) for item in split_csv_terms(args.get('equipment'))]
+    term_selects += [_term_resource_ids(ResourceTag, tag, match_mode) for tag in split_csv_terms(args.get('tags'))]
+    if term_selects:
+        matching_ids = term_selects[0] if len(term_selects) == 1 else intersect(*term_selects)
+        query = query.filter(Resource.id.in_(matching_ids))
+    return query
+
 @api_resources_bp.route('/resources', methods=['GET'])
 @retry_on_db_error
+@reads_from_replica
 def get_resources():
     logger = current_app.logger
     try:
-        query = Resource.query.options(
+        query = _apply_resource_search_filters(Resource.query.options(
             joinedload(Resource.roles)
-        ).filter_by(status='published')
-        capacity = request.args.get('capacity', type=int)
-        if capacity is not None:
-            query = query.filter(Resource.capacity >= capacity)
-        equipment = request.args.get('equipment')
-        if equipment:
-            for item in [e.strip().lower() for e in equipment.split(',') if e.strip()]:
-                query = query.filter(Resource.equipment.ilike(f'%{item}%'))
-        tags = request.args.get('tags')
-        if tags:
-            for tag in [t.strip().lower() for t in tags.split(',') if t.strip()]:
-                query = query.filter(Resource.tags.ilike(f'%{tag}%'))
+        ).filter_by(status='published'), request.args)
 
         resources_list = [resource_to_dict(r) for r in query.all()]
         logger.info("Successfully fetched published resources.")
@@ -49,6 +82,75 @@ def get_resources():
         logger.exception("Error fetching resources:")
         return jsonify({'error': 'Failed to fetch resources due to a server error.'}), 500
 
+@api_resources_bp.route('/resources/free_slots', methods=['GET'])
+@login_required
+@retry_on_db_error
+def search_free_slots():
+    """
+    Finds the first N bookable slots between start_date and end_date (inclusive) on any published
+    resource matching capacity/equipment/tags that the current user may book. Each slot is
+    duration_minutes long, aligned to multiples of it from midnight, and passes the rules
+    create_booking enforces: not in the past, within max_booking_days_in_future, and clear of the
+    user's own bookings elsewhere unless allow_multiple_resources_same_time is on.
+    Query params: start_date (required), end_date, capacity, equipment, tags,
+    duration_minutes (default 30, at most a day), limit (default 20).
+    """
+    logger = current_app.logger
+    start_date_str = request.args.get('start_date')
+    if not start_date_str:
+        return jsonify({'error': 'start_date query parameter is required (YYYY-MM-DD).'}), 400
+    end_date_str = request.args.get('end_date', start_date_str)
+    try:
+        start_date_obj = datetime.strptime(start_date_str, '%Y-%m-%d').date()
+        end_date_obj = datetime.strptime(end_date_str, '%Y-%m-%d').date()
+    except ValueError:
+        logger.warning(f"Invalid date format for free_slots: start_date='{start_date_str}', end_date='{end_date_str}'")
+        return jsonify({'error': 'Invalid date format. Please use YYYY-MM-DD.'}), 400
+    if end_date_obj < start_date_obj:
+        return jsonify({'error': 'end_date must be on or after start_date.'}), 400
+    if (end_date_obj - start_date_obj).days + 1 > FREE_SLOT_SEARCH_MAX_DAYS:
+        return jsonify({'error': f'Date range cannot exceed {FREE_SLOT_SEARCH_MAX_DAYS} days.'}), 400
+
+    duration_minutes = request.args.get('duration_minutes', 30, type=int)
+    limit = request.args.get('limit', 20, type=int)
+    if duration_minutes is None or not 0 < duration_minutes <= 24 * 60:
+        return jsonify({'error': 'duration_minutes must be a positive integer of at most 1440.'}), 400
+    if limit is None or limit <= 0:
+        return jsonify({'error': 'limit must be a positive integer.'}), 400
+    limit = min(limit, FREE_SLOT_SEARCH_MAX_RESULTS)
+
+    try:
+        resources = _apply_resource_search_filters(Resource.query.options(
+            joinedload(Resource.roles)
+        ).filter_by(status='published'), request.args).all()
+
+        # Never offer time that has already passed in venue-local terms, or days beyond the booking lead time.
+        booking_settings = current_booking_settings()
+        effective_now_local_naive = get_current_effective_time().replace(tzinfo=None)
+        if booking_settings and booking_settings.max_booking_days_in_future is not None:
+            max_days_ahead = booking_settings.max_booking_days_in_future
+        else:
+            max_days_ahead = current_app.config.get('BOOKING_LEAD_TIME_DAYS', 14) # Same fallback as create_booking
+        range_start, range_end = date_span_range(start_date_obj, end_date_obj)
+        range_start = max(range_start, effective_now_local_naive)
+        range_end = min(range_end, day_range(effective_now_local_naive.date() + timedelta(days=max_days_ahead))[1])
+        allow_multiple = booking_settings.allow_multiple_resources_same_time if booking_settings else False
+
+        free_slots = find_free_slots_for_user(
+            resources, current_user, range_start, range_end, timedelta(minutes=duration_minutes), limit, logger,
+            allow_multiple_resources_same_time=allow_multiple
+        )
+        logger.info(f"Free slot search by {current_user.username}: {len(resources)} matching resources, {len(free_slots)} slots returned for {start_date_str}..{end_date_str}.")
+        return jsonify([{
+            'resource_id': slot['resource_id'],
+            'resource_name': slot['resource_name'],
+            'start_time': slot['start_time'].isoformat(),
+            'end_time': slot['end_time'].isoformat(),
+        } for slot in free_slots]), 200
+    except Exception as e:
+        logger.exception(f"Error searching free slots for {start_date_str}..{end_date_str}:")
+        return jsonify({'error': 'Failed to search free slots due to a server error.'}), 500
+
 @api_resources_bp.route('/resources/<int:resource_id>/availability', methods=['GET'])
 @retry_on_db_error
 def get_resource_availability(resource_id):
@@ -56,7 +158,7 @@ def get_resource_availability(resource_id):
     active_booking_statuses = ['approved', 'pending', 'checked_in', 'confirmed']
 
     # Fetch BookingSettings for global_time_offset_hours
-    booking_settings = BookingSettings.query.first()
+    booking_settings = current_booking_settings()
     global_time_offset_hours = 0
     if booking_settings and hasattr(booking_settings, 'global_time_offset_hours') and booking_settings.global_time_offset_hours is not None:
         global_time_offset_hours = booking_settings.global_time_offset_hours
@@ -79,14 +181,9 @@ def get_resource_availability(resource_id):
         logger.warning(f"API Availability: Invalid date format '{date_str}' for resource {resource_id}.")
         return jsonify({'error': 'Invalid date format', 'message': 'Please use YYYY-MM-DD format for the date.'}), 400
 
-    # Define standard slots and determine their "passed" status
-    standard_slots_definition = {
-        "first_half": {"name": "First Half-Day", "start_time_str": "08:00:00", "end_time_str": "12:00:00"},
-        "second_half": {"name": "Second Half-Day", "start_time_str": "13:00:00", "end_time_str": "17:00:00"},
-        "full_day": {"name": "Full Day", "start_time_str": "08:00:00", "end_time_str": "17:00:00"}
-    }
+    # Determine the "passed" status of the standard slots
     standard_slot_statuses = {}
-    for key, slot_info in standard_slots_definition.items():
+    for key, slot_info in STANDARD_SLOTS_DEFINITION.items():
         slot_end_hour, slot_end_minute, _ = map(int, slot_info["end_time_str"].split(':'))
         slot_end_datetime_on_target_date_naive = datetime.combine(target_date_obj, time(slot_end_hour, slot_end_minute))
 
@@ -109,8 +206,8 @@ def get_resource_availability(resource_id):
 
         bookings_on_date = Booking.query.filter(
             Booking.resource_id == resource_id,
-            func.date(Booking.start_time) == target_date_obj, # Compares date part of stored naive local start_time
-            func.trim(func.lower(Booking.status)).in_(active_booking_statuses)
+            on_date(Booking.start_time, target_date_obj), # Range over the stored naive local start_time
+            Booking.status.in_(active_booking_statuses)
         ).all()
 
         booked_slots_result = [] # Renamed from booked_slots to avoid confusion with variable name in loop
@@ -120,7 +217,7 @@ def get_resource_availability(resource_id):
             # For general availability, this flag might not be relevant or needs context of who is viewing.
             # Assuming here it's for the booking owner if current_user is available, otherwise false.
             can_check_in_flag_for_this_booking = False
-            if current_user.is_authenticated and booking.user_name == current_user.username:
+            if current_user.is_authenticated and booking.user_id == current_user.id:
                 if booking_settings and booking_settings.enable_check_in_out:
                     check_in_minutes_before = booking_settings.check_in_minutes_before if booking_settings.check_in_minutes_before is not None else 15
                     check_in_minutes_after = booking_settings.check_in_minutes_after if booking_settings.check_in_minutes_after is not None else 15
@@ -154,6 +251,89 @@ def get_resource_availability(resource_id):
         logger.exception(f"Error fetching availability for resource {resource_id} on {target_date_obj}:")
         return jsonify({'error': 'Failed to fetch resource availability due to a server error.'}), 500
 
+@api_resources_bp.route('/resources/availability_matrix', methods=['GET'])
+@retry_on_db_error
+def get_availability_matrix():
+    """
+    Slot occupancy for many resources over a date range in one call (week views, room boards).
+    Query params: resource_ids (comma-separated) or floor_map_id, start_date, end_date (inclusive).
+
+    The response is columnar: 'resource_ids' and 'dates' index the rows and columns of
+    'occupied' (per-day bitmask over 'slots', bit i = slot i booked) and 'blocked'
+    (1 = maintenance). 'passed' is the per-day bitmask of slots already over.
+    """
+    logger = current_app.logger
+    start_date_str = request.args.get('start_date')
+    if not start_date_str:
+        return jsonify({'error': 'start_date query parameter is required (YYYY-MM-DD).'}), 400
+    end_date_str = request.args.get('end_date', start_date_str)
+    try:
+        start_date_obj = datetime.strptime(start_date_str, '%Y-%m-%d').date()
+        end_date_obj = datetime.strptime(end_date_str, '%Y-%m-%d').date()
+    except ValueError:
+        logger.warning(f"Availability matrix: invalid date format start_date='{start_date_str}', end_date='{end_date_str}'")
+        return jsonify({'error': 'Invalid date format. Please use YYYY-MM-DD.'}), 400
+    if end_date_obj < start_date_obj:
+        return jsonify({'error': 'end_date must be on or after start_date.'}), 400
+    day_count = (end_date_obj - start_date_obj).days + 1
+    if day_count > AVAILABILITY_MATRIX_MAX_DAYS:
+        return jsonify({'error': f'Date range cannot exceed {AVAILABILITY_MATRIX_MAX_DAYS} days.'}), 400
+
+    resource_ids_str = request.args.get('resource_ids')
+    floor_map_id = request.args.get('floor_map_id', type=int)
+    if resource_ids_str:
+        try:
+            resource_ids = sorted({int(r_id) for r_id in resource_ids_str.split(',') if r_id.strip()})
+        except ValueError:
+            return jsonify({'error': 'resource_ids must be a comma-separated list of integers.'}), 400
+        query = Resource.query.filter(Resource.id.in_(resource_ids), Resource.status == 'published') # Anonymous callers see published resources only
+    elif floor_map_id is not None:
+        query = Resource.query.filter_by(floor_map_id=floor_map_id, status='published')
+    else:
+        return jsonify({'error': 'Either resource_ids or floor_map_id is required.'}), 400
+
+    try:
+        resources = query.order_by(Resource.id).all()
+        if not resources:
+            return jsonify({'error': 'No matching resources found.'}), 404
+
+        slot_keys = list(STANDARD_SLOTS_DEFINITION.keys())
+        slot_definitions = [
+            (datetime.strptime(STANDARD_SLOTS_DEFINITION[key]['start_time_str'], '%H:%M:%S').time(),
+             datetime.strptime(STANDARD_SLOTS_DEFINITION[key]['end_time_str'], '%H:%M:%S').time())
+            for key in slot_keys
+        ]
+        matrix = build_availability_matrix(resources, start_date_obj, end_date_obj, slot_definitions, logger)
+
+        effective_now_local_naive = get_current_effective_time().replace(tzinfo=None)
+        dates = [start_date_obj + timedelta(days=offset) for offset in range(day_count)]
+        passed = []
+        for day in dates:
+            day_bits = 0
+            for slot_index, (_, slot_end) in enumerate(slot_definitions):
+                if datetime.combine(day, slot_end) < effective_now_local_naive:
+                    day_bits |= 1 << slot_index
+            passed.append(day_bits)
+
+        return jsonify({
+            'start_date': start_date_obj.isoformat(),
+            'end_date': end_date_obj.isoformat(),
+            'dates': [day.isoformat() for day in dates],
+            'slots': {
+                'keys': slot_keys,
+                'start_times': [STANDARD_SLOTS_DEFINITION[key]['start_time_str'] for key in slot_keys],
+                'end_times': [STANDARD_SLOTS_DEFINITION[key]['end_time_str'] for key in slot_keys],
+            },
+            'resource_ids': [r.id for r in resources],
+            'resource_names': [r.name for r in resources],
+            'occupied': [matrix['occupied'][r.id] for r in resources],
+            'blocked': [matrix['blocked'][r.id] for r in resources],
+            'passed': passed,
+        }), 200
+    except Exception as e:
+        logger.exception(f"Error building availability matrix for {start_date_str}..{end_date_str}:")
+        return jsonify({'error': 'Failed to build availability matrix due to a server error.'}), 500
+
 @api_resources_bp.route('/resources/<int:resource_id>/available_slots', methods=['GET'])
 @login_required
 @retry_on_db_error
@@ -176,107 +356,39 @@ def get_resource_available_slots(resource_id):
         until_str = resource.maintenance_until.isoformat() if resource.maintenance_until else 'indefinitely'
         return jsonify({'error': f'Resource under maintenance until {until_str}. No slots available.'}), 403
 
-    bookings_on_date = Booking.query.filter(Booking.resource_id == resource_id, func.date(Booking.start_time) == target_date_obj).all()
-    available_slots = []
-    slot_start_hour, slot_start_minute, slot_duration_minutes = 0, 0, 30
-    while slot_start_hour < 24:
-        slot_start_dt = datetime.combine(target_date_obj, time(slot_start_hour, slot_start_minute))
-        slot_end_dt = slot_start_dt + timedelta(minutes=slot_duration_minutes)
-        if slot_end_dt.date() > target_date_obj: break
-        is_available = not any((slot_start_dt < b.end_time) and (slot_end_dt > b.start_time) for b in bookings_on_date)
-        if is_available:
-            available_slots.append({'start_time': slot_start_dt.strftime('%H:%M'), 'end_time': slot_end_dt.strftime('%H:%M')})
-        new_minute = slot_start_minute + slot_duration_minutes
-        slot_start_hour += new_minute // 60
-        slot_start_minute = new_minute % 60
-        if slot_start_hour >= 24: break
+    bookings_on_date = Booking.query.filter(Booking.resource_id == resource_id, on_date(Booking.start_time, target_date_obj)).all()
+    slot_duration_minutes = 30
+    slot_grid = build_slot_grid(target_date_obj, ((b.start_time, b.end_time) for b in bookings_on_date), slot_duration_minutes)
+    available_slots = [{'start_time': start_label, 'end_time': end_label} for start_label, end_label in slot_grid.free_slot_labels(slot_duration_minutes)]
     logger.info(f"Generated {len(available_slots)} slots for resource {resource_id} on {date_str}.")
     return jsonify(available_slots), 200
 
 
-def get_dates_for_schedule(schedule, start_range, end_range):
-    dates = set()
-    if schedule.schedule_type == 'date_range':
-        current_date = schedule.start_date
-        while current_date <= schedule.end_date:
-            if start_range <= current_date <= end_range:
-                dates.add(current_date)
-            current_date += timedelta(days=1)
-    elif schedule.schedule_type == 'recurring_day':
-        days_of_week = [int(d) for d in schedule.day_of_week.split(',')]
-        current_date = start_range
-        while current_date <= end_range:
-            if current_date.weekday() in days_of_week:
-                dates.add(current_date)
-            current_date += timedelta(days=1)
-    elif schedule.schedule_type == 'specific_day':
-        days_of_month = [int(d) for d in schedule.day_of_month.split(',')]
-        current_date = start_range
-        while current_date <= end_range:
-            if current_date.day in days_of_month:
-                dates.add(current_date)
-            current_date += timedelta(days=1)
-    return dates
-
 def get_unavailable_dates_from_schedules(start_date, end_date, resources, floor_ids=None):
-    schedules_query = MaintenanceSchedule.query
+    compiled_schedules = get_compiled_maintenance_schedules()
     if floor_ids:
         # Assuming floor_ids is a comma-separated string of IDs
-        floor_id_list = [int(fid) for fid in floor_ids.split(',') if fid.isdigit()]
-        if floor_id_list:
-            schedules_query = schedules_query.filter(
-                (MaintenanceSchedule.floor_ids.op('regexp')(fr'(^|,)({",".join(map(str, floor_id_list))})(,|$)')) |
-                (MaintenanceSchedule.resource_selection_type.in_(['all', 'building']))
+        floor_id_set = {int(fid) for fid in floor_ids.split(',') if fid.isdigit()}
+        if floor_id_set:
+            compiled_schedules = compiled_schedules.filtered(
+                lambda schedule: bool(schedule.floor_ids & floor_id_set) or schedule.resource_selection_type in ('all', 'building')
             )
-    schedules = schedules_query.all()
-    resource_unavailable_dates = {resource.id: set() for resource in resources}
-    all_dates_in_range = {start_date + timedelta(days=x) for x in range((end_date - start_date).days + 1)}
-
-    # Separate schedules into blacklists (maintenance) and whitelists (availability)
-    blacklists = [s for s in schedules if not s.is_availability]
-    whitelists = [s for s in schedules if s.is_availability]
-
-    # If there are any whitelists, the logic changes:
-    # We start by assuming all dates are unavailable, and then add back available dates.
-    if whitelists:
-        # Initially, all dates are unavailable for all resources
-        for resource in resources:
-            resource_unavailable_dates[resource.id] = all_dates_in_range.copy()
-
-        # For each whitelist, find the resources it applies to and mark the corresponding dates as available
-        for schedule in whitelists:
-            available_dates_for_schedule = get_dates_for_schedule(schedule, start_date, end_date)
-            for resource in resources:
-                applies = (
-                    (schedule.resource_selection_type == 'all') or
-                    (schedule.resource_selection_type == 'building' and resource.floor_map and schedule.building_id == resource.floor_map.location) or
-                    (schedule.resource_selection_type == 'floor' and resource.floor_map and str(resource.floor_map.id) in (schedule.floor_ids or '').split(',')) or
-                    (schedule.resource_selection_type == 'specific' and str(resource.id) in (schedule.resource_ids or '').split(','))
-                )
-                if applies:
-                    # Remove the available dates from this resource's unavailable set
-                    resource_unavailable_dates[resource.id] -= available_dates_for_schedule
-
-    # Process blacklists: these add to the unavailable dates regardless of whitelists
-    for schedule in blacklists:
-        unavailable_dates_for_schedule = get_dates_for_schedule(schedule, start_date, end_date)
-        for resource in resources:
-            applies = (
-                (schedule.resource_selection_type == 'all') or
-                (schedule.resource_selection_type == 'building' and resource.floor_map and schedule.building_id == resource.floor_map.location) or
-                (schedule.resource_selection_type == 'floor' and resource.floor_map and str(resource.floor_map.id) in (schedule.floor_ids or '').split(',')) or
-                (schedule.resource_selection_type == 'specific' and str(resource.id) in (schedule.resource_ids or '').split(','))
-            )
-            if applies:
-                resource_unavailable_dates[resource.id].update(unavailable_dates_for_schedule)
 
     # A date is unavailable for the user if it's unavailable for ALL resources they can potentially book.
-    if not resource_unavailable_dates:
+    if not resources:
         return set()
 
-    # The final set of unavailable dates is the intersection of all individual resource unavailable date sets.
-    # This means a date is only truly unavailable if every single resource is unavailable on that day.
-    unavailable_for_all_resources = set.intersection(*resource_unavailable_dates.values())
+    # Whitelists make every date unavailable unless one of the resource's whitelists covers it;
+    # blacklists add to the unavailable dates regardless of whitelists.
+    unavailable_for_all_resources = None
+    for resource in resources:
+        resource_unavailable_dates = compiled_schedules.blocked_dates(resource, start_date, end_date)
+        if unavailable_for_all_resources is None:
+            unavailable_for_all_resources = resource_unavailable_dates
+        else:
+            unavailable_for_all_resources &= resource_unavailable_dates
+        if not unavailable_for_all_resources:
+            break
 
     return {d.strftime('%Y-%m-%d') for d in unavailable_for_all_resources}
 
@@ -316,7 +428,7 @@ def get_unavailable_dates():
         now = datetime.now(timezone.utc) # Use timezone-aware datetime
 
         # Fetch booking settings
-        booking_settings = BookingSettings.query.first()
+        booking_settings = current_booking_settings()
         if not booking_settings:
             # Use default settings if none are configured
             booking_settings = BookingSettings(allow_past_bookings=False, past_booking_time_adjustment_hours=0)
@@ -336,7 +448,7 @@ def get_unavailable_dates():
         end_range_date = start_range_date + timedelta(days=max_days)
 
         # Fetch all published resources once
-        all_published_resources = Resource.query.filter_by(status='published').all()
+        all_published_resources = Resource.query.options(joinedload(Resource.roles)).filter_by(status='published').all()
         total_published_resources = len(all_published_resources) # Ensure this is defined
 
         if total_published_resources == 0:
@@ -351,218 +463,17 @@ def get_unavailable_dates():
         else: # This case implies booking_settings was None (or became None if logic changes)
             logger.info("Relevant settings: Using default values as BookingSettings were not found or applicable (global_time_offset_hours defaults to 0).")
 
-        # Loop through the generated date range
-        current_iter_date = start_range_date
-        while current_iter_date <= end_range_date:
-            current_processing_date = current_iter_date
-            logger.debug(f"--- Processing date: {current_processing_date} ---")
-            logger.debug(f"[VERBOSE_UNAVAIL] Processing Date: {current_processing_date}")
-
-            # a. Past Date Check
-            date_is_past = current_processing_date < now.date() # 'now' is datetime.now(timezone.utc)
-
-            # Ensure booking_settings is fetched and has defaults
-            # Note: global_time_offset_hours is already defined before this loop from booking_settings
-            past_adjustment_hours = booking_settings.past_booking_time_adjustment_hours if booking_settings and booking_settings.past_booking_time_adjustment_hours is not None else 0
-            # global_time_offset_hours is defined above
-
-            # Calculate effective_venue_now_utc by applying global offset
-            effective_venue_now_utc = now + timedelta(hours=global_time_offset_hours)
-
-            # Calculate effective_cutoff_datetime_utc based on the venue's effective now
-            effective_cutoff_datetime_utc = effective_venue_now_utc - timedelta(hours=past_adjustment_hours)
-
-            # Log the components for debugging
-            logger.debug(f"For date {current_processing_date}: now_utc={now}, global_time_offset_hours={global_time_offset_hours}, effective_venue_now_utc={effective_venue_now_utc}, past_adjustment_hours={past_adjustment_hours}, effective_cutoff_datetime_utc={effective_cutoff_datetime_utc}")
-
-            # Exception: Users with 'manage_bookings' permission can book past dates.
-            user_can_book_past = target_user.has_permission('manage_bookings')
-
-            # New Rule for allow_past_bookings == FALSE and strictly past dates
-            if booking_settings and not booking_settings.allow_past_bookings and date_is_past and not user_can_book_past:
-                unavailable_dates_set.add(current_processing_date.strftime('%Y-%m-%d'))
-                logger.debug(f"Date {current_processing_date} is strictly past and allow_past_bookings is false. Added to unavailable. Skipping slot checks.")
-                current_iter_date += timedelta(days=1)
-                continue
-
-            # If allow_past_bookings is true, the original logic for checking slots on past dates will still run.
-            # If date_is_past is true AND allow_past_bookings is true, we log and proceed.
-            if date_is_past and booking_settings and booking_settings.allow_past_bookings: # Ensure booking_settings is checked here too
-                 logger.debug(f"Date {current_processing_date} is past and allow_past_bookings is true. Proceeding to check slot availability for this date.")
-
-            # b. User's Existing Bookings for the Day (for conflict checking against other resources)
-            user_bookings_on_this_date = Booking.query.filter(
-                Booking.user_name == target_user.username,
-                func.date(Booking.start_time) <= current_processing_date,
-                func.date(Booking.end_time) >= current_processing_date,
-                Booking.status.in_(['approved', 'pending', 'checked_in', 'confirmed'])
-            ).all()
-
-            # c. Check User's Booking Possibility
-            any_slot_bookable_for_user_this_date = False
-            active_resources_for_date = []
-            # Corrected variable name here:
-            for res_loop_item in all_published_resources:
-                if not (res_loop_item.is_under_maintenance and (res_loop_item.maintenance_until is None or current_processing_date <= res_loop_item.maintenance_until.date())):
-                    active_resources_for_date.append(res_loop_item)
-
-            logger.debug(f"--- Starting loop through {len(active_resources_for_date)} active resources for date {current_processing_date} ---")
-            if not active_resources_for_date:
-                if total_published_resources > 0 : # Use the defined total_published_resources
-                    unavailable_dates_set.add(current_processing_date.strftime('%Y-%m-%d'))
-                    logger.debug(f"No active resources (all under maintenance or none published) on {current_processing_date}. Added to unavailable.")
-                else:
-                    logger.debug(f"No published resources in system for date {current_processing_date}. Not marking as unavailable based on this rule.")
-                current_iter_date += timedelta(days=1)
-                continue
-
-            is_server_today = (current_processing_date == now.date())
-
-            if is_server_today:
-                logger.debug(f"[UNAVAIL_DATES][TODAY] Processing for user {target_user.username} on {current_processing_date.strftime('%Y-%m-%d')}. Effective cutoff UTC: {effective_cutoff_datetime_utc.isoformat()}")
-                logger.debug(f"[UNAVAIL_DATES][TODAY] BookingSetting allow_multiple_resources_same_time: {booking_settings.allow_multiple_resources_same_time}")
-                logger.debug(f"[UNAVAIL_DATES][TODAY] User bookings for conflict check ({len(user_bookings_on_this_date)}): {[(b.id, b.resource_id, b.start_time.isoformat(), b.end_time.isoformat()) for b in user_bookings_on_this_date]}")
-
-            resource_that_made_date_bookable = None
-            slot_that_made_date_bookable = None
-
-            for resource_to_check in active_resources_for_date:
-                # Ensure target_user is defined in this function's scope (it is, as a parameter)
-                # Ensure logger is defined (it is, as current_app.logger)
-
-                logger.debug(f"--- (get_unavailable_dates) About to call check_booking_permission for resource ID {resource_to_check.id} ('{resource_to_check.name}') on date {current_processing_date} ---")
-                can_book_this_resource, _ = check_booking_permission(
-                    user=target_user,
-                    resource=resource_to_check,
-                    logger_instance=logger
-                )
-                logger.debug(f"--- (get_unavailable_dates) Returned from check_booking_permission for resource ID {resource_to_check.id} ('{resource_to_check.name}') (can_book: {can_book_this_resource}) on date {current_processing_date} ---")
-                logger.debug(f"[VERBOSE_UNAVAIL] Date: {current_processing_date}, Resource: {resource_to_check.id} ('{resource_to_check.name}'), Permitted: {can_book_this_resource}")
-
-                if not can_book_this_resource:
-                    if is_server_today: # Log if checking for today
-                        logger.debug(f"[UNAVAIL_DATES][TODAY] User {target_user.username} does not have permission for resource {resource_to_check.id} ('{resource_to_check.name}'). Skipping its slots for availability check.")
-                    logger.debug(f"[VERBOSE_UNAVAIL]   User {target_user.username} no permission for R_ID: {resource_to_check.id}. Skipping.")
-                    continue # Skip to the next resource if user cannot book this one
-
-                if is_server_today:
-                    logger.debug(f"[UNAVAIL_DATES][TODAY] Iterating Resource ID: {resource_to_check.id}, Name: '{resource_to_check.name}' (User has permission)")
-
-                resource_had_bookable_slot_for_user = False # Specific for the diagnostic log
-                for slot_def in STANDARD_SLOTS:
-
-                    logger.debug(f"[VERBOSE_UNAVAIL] Date: {current_processing_date}, R_ID: {resource_to_check.id}, Slot: {slot_def['start'].strftime('%H:%M')}-{slot_def['end'].strftime('%H:%M')} (Venue Local)")
-                    # global_time_offset_hours is already fetched and available here
-                    slot_start_local_naive = datetime.combine(current_processing_date, slot_def['start'])
-                    slot_end_local_naive = datetime.combine(current_processing_date, slot_def['end'])
-
-                    # Convert venue local naive slot times to actual UTC by subtracting the offset
-                    # (e.g., if venue is UTC-5, global_time_offset_hours = -5. 8:00 local is 8:00 - (-5) = 13:00 UTC)
-                    slot_start_for_comparison_utc = (slot_start_local_naive - timedelta(hours=global_time_offset_hours)).replace(tzinfo=timezone.utc) # Still needed for user conflict check if that remains UTC based
-                    slot_end_for_comparison_utc = (slot_end_local_naive - timedelta(hours=global_time_offset_hours)).replace(tzinfo=timezone.utc) # Still needed for user conflict check
-
-                    # Corrected "is_passed" logic to align with venue local time reasoning
-                    # effective_venue_now_utc is calculated earlier. We need its naive local equivalent.
-                    effective_venue_now_local_naive_for_check = effective_venue_now_utc.replace(tzinfo=None)
-                    # Calculate the cutoff point in naive local time
-                    cutoff_for_slot_passing_local_naive = effective_venue_now_local_naive_for_check - timedelta(hours=past_adjustment_hours)
-                    # A slot is "passed" if its local start time is before this local cutoff time
-                    is_slot_time_passed = slot_start_local_naive < cutoff_for_slot_passing_local_naive
-
-                    if user_can_book_past:
-                        is_slot_time_passed = False
-
-                    logger.debug(f"[VERBOSE_UNAVAIL]   Attempting to check if slot passed (local time logic). Venue Local Cutoff: {cutoff_for_slot_passing_local_naive.isoformat()}, Slot Start (Local): {slot_start_local_naive.isoformat()}, Passed?: {is_slot_time_passed}")
-
-                    if is_server_today: # Conditional logging is fine
-                        logger.debug(f"[UNAVAIL_DATES][TODAY]   Checking slot: Resource ID {resource_to_check.id}, Slot {slot_def['start'].strftime('%H:%M')}-{slot_def['end'].strftime('%H:%M')} (Venue Local Time)")
-                        logger.debug(f"[UNAVAIL_DATES][TODAY]     Effective Cutoff Venue Time (as UTC): {effective_cutoff_datetime_utc.isoformat()}, Slot START Venue Time (as UTC): {slot_start_for_comparison_utc.isoformat()}. Passed?: {is_slot_time_passed}")
-
-                    if is_slot_time_passed:
-                        if is_server_today: # More specific logging for today if needed
-                            logger.debug(f"[UNAVAIL_DATES][TODAY]     SLOT SKIPPED (time passed).")
-                        continue # Skip this slot if it's passed
-
-                    # Corrected: Compare naive local Booking times with naive local slot times
-                    # slot_start_local_naive and slot_end_local_naive are already defined
-                    general_bookings_query = Booking.query.filter(
-                        Booking.resource_id == resource_to_check.id,
-                        Booking.start_time < slot_end_local_naive,  # Compare naive local Booking.start_time with naive local slot_end
-                        Booking.end_time > slot_start_local_naive,    # Compare naive local Booking.end_time with naive local slot_start
-                        Booking.status.in_(['approved', 'pending', 'checked_in', 'confirmed'])
-                    )
-                    conflicting_general_booking = general_bookings_query.first()
-                    is_generally_booked = conflicting_general_booking is not None
-                    logger.debug(f"[VERBOSE_UNAVAIL]   Generally Booked?: {is_generally_booked}")
-
-                    if is_server_today:
-                        logger.debug(f"[UNAVAIL_DATES][TODAY]     Is Generally Booked? {is_generally_booked}")
-
-                    if is_generally_booked:
-                        if is_server_today:
-                            logger.debug(f"[UNAVAIL_DATES][TODAY]     SLOT SKIPPED (generally booked).")
-                        continue
-
-                    user_schedule_conflicts = False
-                    conflicting_user_booking = None
-                    if not booking_settings.allow_multiple_resources_same_time:
-                        if is_server_today: # Log setting value only if today and relevant
-                             logger.debug(f"[UNAVAIL_DATES][TODAY]     Allow Multiple Resources Same Time? {booking_settings.allow_multiple_resources_same_time}. Checking user conflicts.")
-                        for user_booking in user_bookings_on_this_date:
-                            if user_booking.resource_id != resource_to_check.id:
-                                # Correctly convert naive local booking times to aware UTC by applying global_time_offset_hours
-                                user_booking_start_aware_utc = (user_booking.start_time - timedelta(hours=global_time_offset_hours)).replace(tzinfo=timezone.utc)
-                                user_booking_end_aware_utc = (user_booking.end_time - timedelta(hours=global_time_offset_hours)).replace(tzinfo=timezone.utc)
-
-                                if user_booking_start_aware_utc < slot_end_for_comparison_utc and \
-                                   user_booking_end_aware_utc > slot_start_for_comparison_utc:
-                                    user_schedule_conflicts = True
-                                    conflicting_user_booking = user_booking # Keep this for general info if needed
-                                    if is_server_today: # Detailed conflict log only for today
-                                        logger.debug(
-                                            f"[UNAVAIL_DATES][TODAY]       User conflict FOUND with their booking ID: {user_booking.id} "
-                                            f"(Original local times: {user_booking.start_time.strftime('%H:%M')}-{user_booking.end_time.strftime('%H:%M')} on resource {user_booking.resource_id}). "
-                                            f"Converted to UTC for comparison: {user_booking_start_aware_utc.isoformat()} - {user_booking_end_aware_utc.isoformat()}. "
-                                            f"Comparing with slot (UTC): {slot_start_for_comparison_utc.strftime('%H:%M')}-{slot_end_for_comparison_utc.strftime('%H:%M')} on resource {resource_to_check.id}."
-                                        )
-                                    # The specific diagnostic log below will use these corrected UTC times.
-                                    break
-                    elif is_server_today : # allow_multiple_resources_same_time is TRUE
-                        logger.debug(f"[UNAVAIL_DATES][TODAY]     Allow Multiple Resources Same Time? {booking_settings.allow_multiple_resources_same_time}. Skipping user conflict check.")
-                    logger.debug(f"[VERBOSE_UNAVAIL]   User Conflict (allow_multiple={booking_settings.allow_multiple_resources_same_time})?: {user_schedule_conflicts}")
-
-                    if is_server_today:
-                        logger.debug(f"[UNAVAIL_DATES][TODAY]     User Schedule Conflicts? {user_schedule_conflicts}")
-
-                    if user_schedule_conflicts: # This implies allow_multiple_resources_same_time was false
-                        if is_server_today:
-                            logger.debug(f"[UNAVAIL_DATES][TODAY]     SLOT SKIPPED (user conflict).")
-                        continue
-
-                    # If a bookable slot is found on this permitted resource:
-                    if not is_slot_time_passed and not is_generally_booked and not user_schedule_conflicts:
-                        logger.debug(f"[VERBOSE_UNAVAIL]   DECISION: Slot determined BOOKABLE for user. Setting any_slot_bookable_for_user_this_date = True. Breaking from slots loop for this resource.")
-                        any_slot_bookable_for_user_this_date = True
-                        resource_had_bookable_slot_for_user = True # For diagnostic log
-                        if is_server_today:
-                            logger.debug(f"[UNAVAIL_DATES][TODAY]     SLOT IS BOOKABLE for user on permitted resource {resource_to_check.id}. Marking date as potentially available.")
-                        break # Found a bookable slot on this resource
-
-
-                if any_slot_bookable_for_user_this_date: # This is the original any_slot_bookable_for_user_this_date
-                    logger.debug(f"[VERBOSE_UNAVAIL] Date: {current_processing_date}, Found bookable slot on R_ID: {resource_to_check.id}. Breaking from resources loop for this date.")
-                    break # Found a bookable resource for the day
-
-
-            if is_server_today:
-                logger.debug(f"[UNAVAIL_DATES][TODAY] Final check for today ({current_processing_date.strftime('%Y-%m-%d')}): any_slot_bookable_for_user_this_date = {any_slot_bookable_for_user_this_date}. Adding to unavailable_dates_set: {not any_slot_bookable_for_user_this_date}")
-
-            if not any_slot_bookable_for_user_this_date:
-                logger.debug(f"[VERBOSE_UNAVAIL] Date: {current_processing_date}, FINAL: No bookable slot found for user. Adding to unavailable_dates_set.")
-                unavailable_dates_set.add(current_processing_date.strftime('%Y-%m-%d'))
-                logger.debug(f"Date {current_processing_date.strftime('%Y-%m-%d')} determined unavailable for user {target_user.username} (no bookable standard slots found). Added to unavailable.")
-
-            current_iter_date += timedelta(days=1)
+        # One bitmap pass over the whole range instead of per-day/per-slot queries.
+        unavailable_dates_set.update(get_unavailable_dates_for_user(
+            target_user,
+            all_published_resources,
+            start_range_date,
+            end_range_date,
+            [(slot_def['start'], slot_def['end']) for slot_def in STANDARD_SLOTS],
+            booking_settings,
+            now,
+            logger
+        ))
 
         # The old 5 PM server logic block is now removed.
 
@@ -1290,8 +1201,8 @@ def get_all_bookings_for_resource_api(resource_id):
         end_dt = datetime.fromisoformat(end_str.replace('Z', '+00:00')).astimezone(timezone.utc).replace(tzinfo=None)
     except ValueError:
         try: # Fallback for YYYY-MM-DD
-            start_dt = datetime.combine(datetime.strptime(start_str, '%Y-%m-%d').date(), time.min)
-            end_dt = datetime.combine(datetime.strptime(end_str, '%Y-%m-%d').date(), time.max)
+            start_dt, end_dt = date_span_range(datetime.strptime(start_str, '%Y-%m-%d').date(),
+                                               datetime.strptime(end_str, '%Y-%m-%d').date())
         except ValueError:
             return jsonify({'error': 'Invalid date format.'}), 400
 
@@ -1300,8 +1211,7 @@ def get_all_bookings_for_resource_api(resource_id):
 
     bookings = Booking.query.filter(
         Booking.resource_id == resource_id,
-        Booking.start_time < end_dt,
-        Booking.end_time > start_dt
+        overlaps_range(Booking.start_time, Booking.end_time, start_dt, end_dt)
     ).all()
     events = [{'id': b.id, 'title': b.title or resource.name,
                'start': b.start_time.isoformat(), 'end': b.end_time.isoformat()} for b in bookings]
@@ -1371,7 +1281,7 @@ def add_resource_pin(resource_id):
     manual_pin_value = data.get('pin_value', '').strip()
     notes = data.get('notes', '').strip()
 
-    booking_settings = BookingSettings.query.first()
+    booking_settings = current_booking_settings()
     pin_auto_generation_enabled = booking_settings.pin_auto_generation_enabled if booking_settings else True
     pin_length = booking_settings.pin_length if booking_settings else 6
     pin_allow_manual = booking_settings.pin_allow_manual_override if booking_settings else True
@@ -1619,7 +1529,7 @@ def bulk_resource_pin_action():
     if action not in allowed_actions:
         return jsonify({'error': f'Invalid action. Allowed actions are: {", ".join(allowed_actions)}'}), 400
 
-    booking_settings = BookingSettings.query.first() # Needed for pin_length
+    booking_settings = current_booking_settings() # Needed for pin_length
     pin_length = booking_settings.pin_length if booking_settings and booking_settings.pin_length else 6
 
     processed_count = 0
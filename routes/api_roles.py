@@ -5,7 +5,7 @@ from sqlalchemy import func, exc as sqlalchemy_exc # Added sqlalchemy_exc for da
 # Assuming these paths are correct relative to how the app is structured.
 from auth import permission_required
 from extensions import db
-from models import Role, User, user_roles_table # User might be needed for audit logging or future role assignments
+from models import Role, User, user_roles_table, invalidate_compiled_permissions # User might be needed for audit logging or future role assignments
 from utils import add_audit_log
 
 api_roles_bp = Blueprint('api_roles', __name__, url_prefix='/api/admin/roles')
@@ -134,6 +134,7 @@ def update_role(role_id):
 
     try:
         db.session.commit()
+        invalidate_compiled_permissions()
         add_audit_log(action="UPDATE_ROLE", details=f"Role '{original_name}' (ID: {role_id}) updated by {current_user.username}. New data: {data}", user_id=current_user.id)
         current_app.logger.info(f"Role '{role.name}' (ID: {role_id}) updated successfully by {current_user.username}.")
         # Prepare role data for response, similar to get_roles
@@ -183,6 +184,7 @@ def delete_role(role_id):
         role_name_for_audit = role.name # Capture before deletion
         db.session.delete(role)
         db.session.commit()
+        invalidate_compiled_permissions()
         add_audit_log(action="DELETE_ROLE", details=f"Role '{role_name_for_audit}' (ID: {role_id}) deleted by {current_user.username}.", user_id=current_user.id)
         current_app.logger.info(f"Role '{role_name_for_audit}' (ID: {role_id}) deleted successfully by {current_user.username}.")
         return jsonify({'message': f"Role '{role_name_for_audit}' deleted successfully."}), 200
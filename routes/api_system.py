@@ -3,6 +3,7 @@ import uuid
 import json
 import math # Added for math.ceil
 import traceback
+import hmac
 from datetime import datetime, timezone, timedelta, time
 
 from flask import Blueprint, jsonify, request, current_app, url_for, Response
@@ -13,7 +14,10 @@ from sqlalchemy import func # For count query
 # Relative imports from project structure
 from auth import permission_required
 from extensions import db # socketio removed
-from models import AuditLog, User, Resource, FloorMap, Booking, Role, BookingSettings # Added BookingSettings
+from models import AuditLog, User, Resource, FloorMap, Booking, Role, BookingSettings, BookingArchive, ResourceDayOccupancy, ResourceBookingLock, MaintenanceScheduleResource, MaintenanceScheduleFloor, ResourceTag, ResourceEquipment # Added BookingSettings
+from audit_log import audit_log_search_filter
+from booking_settings_cache import current_booking_settings
+from db_pool import pool_metrics, render_prometheus
 from utils import (
     add_audit_log,
     _get_map_configuration_data,
@@ -104,25 +108,50 @@ def get_task_status_api(task_id):
 @permission_required('view_audit_logs')
 @retry_on_db_error
 def get_audit_logs():
-    """Fetches audit logs with pagination."""
+    """
+    Fetches audit logs newest first with keyset pagination: pass the returned next_cursor as
+    before_id for older entries, or prev_cursor as after_id for newer ones. No total count is run.
+    """
     try:
-        page = request.args.get('page', 1, type=int)
-        per_page = request.args.get('per_page', 25, type=int)
+        per_page = min(max(request.args.get('per_page', 25, type=int), 1), 200)
+        before_id = request.args.get('before_id', type=int)
+        after_id = request.args.get('after_id', type=int)
 
-        logs_query = AuditLog.query.order_by(AuditLog.timestamp.desc())
+        logs_query = AuditLog.query
 
         search_term = request.args.get('search')
         if search_term:
-            search_filter = f'%{search_term}%'
-            logs_query = logs_query.filter(
-                AuditLog.username.ilike(search_filter) |
-                AuditLog.action.ilike(search_filter) |
-                AuditLog.details.ilike(search_filter)
-            )
-
-        total_logs = logs_query.count()
-        logs_pagination = logs_query.paginate(page=page, per_page=per_page, error_out=False)
-        logs = logs_pagination.items
+            search_filter = audit_log_search_filter(search_term)
+            if search_filter is not None:
+                logs_query = logs_query.filter(search_filter)
+        username_filter = request.args.get('username_filter')
+        if username_filter:
+            logs_query = logs_query.filter(AuditLog.username.ilike(f"%{username_filter}%"))
+        action_filter = request.args.get('action_filter')
+        if action_filter:
+            logs_query = logs_query.filter(AuditLog.action.ilike(f"%{action_filter}%"))
+        try:
+            start_date_str, end_date_str = request.args.get('start_date'), request.args.get('end_date')
+            if start_date_str: # Timestamps are UTC; the end date is inclusive
+                logs_query = logs_query.filter(AuditLog.timestamp >= datetime.strptime(start_date_str, '%Y-%m-%d'))
+            if end_date_str:
+                logs_query = logs_query.filter(AuditLog.timestamp < datetime.strptime(end_date_str, '%Y-%m-%d') + timedelta(days=1))
+        except ValueError:
+            return jsonify({'error': 'Invalid date format. Use YYYY-MM-DD.'}), 400
+
+        # One extra row tells whether another page exists in the direction of travel.
+        if after_id is not None:
+            rows = logs_query.filter(AuditLog.id > after_id).order_by(AuditLog.id.asc()).limit(per_page + 1).all()
+            has_more = len(rows) > per_page
+            logs = list(reversed(rows[:per_page]))
+            has_next, has_prev = True, has_more
+        else:
+            if before_id is not None:
+                logs_query = logs_query.filter(AuditLog.id < before_id)
+            rows = logs_query.order_by(AuditLog.id.desc()).limit(per_page + 1).all()
+            has_more = len(rows) > per_page
+            logs = rows[:per_page]
+            has_next, has_prev = has_more, before_id is not None
 
         logs_data = [{
             'id': log.id,
@@ -133,17 +162,14 @@ def get_audit_logs():
             'details': log.details
         } for log in logs]
 
-        current_app.logger.info(f"User {current_user.username} fetched audit logs page {page} with search '{search_term or ''}'.")
+        current_app.logger.info(f"User {current_user.username} fetched audit logs (before_id={before_id}, after_id={after_id}) with search '{search_term or ''}'.")
         return jsonify({
             'logs': logs_data,
-            'total': total_logs,
-            'current_page': page,
             'per_page': per_page,
-            'has_next': logs_pagination.has_next,
-            'has_prev': logs_pagination.has_prev,
-            'next_num': logs_pagination.next_num,
-            'prev_num': logs_pagination.prev_num,
-            'pages': logs_pagination.pages
+            'has_next': has_next and bool(logs),
+            'has_prev': has_prev and bool(logs),
+            'next_cursor': logs[-1].id if logs else None,
+            'prev_cursor': logs[0].id if logs else None
         }), 200
     except Exception as e:
         current_app.logger.error(f"Error fetching audit logs by {current_user.username}: {e}", exc_info=True)
@@ -153,6 +179,24 @@ def get_audit_logs():
 def ping():
     return jsonify(message='pong', timestamp=datetime.now(timezone.utc).isoformat()), 200
 
+@api_system_bp.route('/metrics', methods=['GET'])
+def get_metrics():
+    """
+    Connection pool gauges and checkout-wait counters for the worker that serves the request,
+    in Prometheus text format (?format=json for JSON). Scrapers send Authorization: Bearer METRICS_TOKEN;
+    otherwise a logged-in user with manage_system is required.
+    """
+    metrics_token = current_app.config.get('METRICS_TOKEN')
+    auth_header = request.headers.get('Authorization', '')
+    token_ok = bool(metrics_token) and hmac.compare_digest(auth_header, f"Bearer {metrics_token}")
+    if not token_ok and not (current_user.is_authenticated and current_user.has_permission('manage_system')):
+        return jsonify({'error': 'Unauthorized'}), 401
+
+    metrics = pool_metrics(db.engine)
+    if request.args.get('format') == 'json':
+        return jsonify(metrics), 200
+    return Response(render_prometheus(metrics), mimetype='text/plain; version=0.0.4')
+
 @api_system_bp.route('/debug/list_routes', methods=['GET'])
 @login_required
 def debug_list_routes():
@@ -1348,7 +1392,7 @@ def init_api_system_routes(app):
 @retry_on_db_error
 def get_booking_settings():
     try:
-        settings = BookingSettings.query.first()
+        settings = current_booking_settings()
         if settings:
             settings_data = {
                 'allow_past_bookings': settings.allow_past_bookings,
@@ -1505,7 +1549,8 @@ def api_admin_get_table_data(table_name: str):
 @retry_on_db_error
 def api_admin_cleanup_system_data():
     try:
-        num_bookings_deleted = Booking.query.delete(); add_audit_log(action="DB_CLEANUP", details=f"Deleted {num_bookings_deleted} Bookings.", user_id=current_user.id)
+        num_bookings_deleted = Booking.query.delete(); BookingArchive.query.delete(); ResourceDayOccupancy.query.delete(); add_audit_log(action="DB_CLEANUP", details=f"Deleted {num_bookings_deleted} Bookings.", user_id=current_user.id)
+        MaintenanceScheduleResource.query.delete(); MaintenanceScheduleFloor.query.delete(); ResourceTag.query.delete(); ResourceEquipment.query.delete(); ResourceBookingLock.query.delete()
         num_resources_deleted = Resource.query.delete(); add_audit_log(action="DB_CLEANUP", details=f"Deleted {num_resources_deleted} Resources.", user_id=current_user.id)
         num_floormaps_deleted = FloorMap.query.delete(); add_audit_log(action="DB_CLEANUP", details=f"Deleted {num_floormaps_deleted} FloorMaps.", user_id=current_user.id)
         db.session.commit()
@@ -1534,7 +1579,7 @@ def api_admin_reload_configurations():
 @retry_on_db_error
 def get_booking_config_status():
     try:
-        settings = BookingSettings.query.first()
+        settings = current_booking_settings()
         allow_multiple = settings.allow_multiple_resources_same_time if settings and hasattr(settings, 'allow_multiple_resources_same_time') else False
         return jsonify({'allow_multiple_resources_same_time': allow_multiple}), 200
     except Exception as e:
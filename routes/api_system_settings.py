@@ -3,9 +3,9 @@ import json
 from flask import Blueprint, jsonify, request, current_app
 from flask_login import login_required, current_user
 from auth import permission_required
-from models import BookingSettings
 from extensions import db
 from utils import get_map_opacity_value
+from booking_settings_cache import current_booking_settings
 
 # Blueprint Configuration
 api_system_settings_bp = Blueprint('api_system_settings', __name__, url_prefix='/api/system-settings')
@@ -15,7 +15,7 @@ def get_booking_lead_days():
     """
     Returns the maximum number of days in the future a booking can be made.
     """
-    settings = BookingSettings.query.first()
+    settings = current_booking_settings()
     if settings and settings.max_booking_days_in_future is not None:
         return jsonify({'max_booking_days_in_future': settings.max_booking_days_in_future})
     else:
@@ -5,7 +5,7 @@ from sqlalchemy import func # For func.lower in create_resource, and func.ilike
 # Local imports
 from extensions import db
 from models import User, Role # Assuming Role is needed for export/import and updates
-from utils import add_audit_log, retry_on_db_error
+from utils import add_audit_log, retry_on_db_error, sync_booking_user_names
 from auth import permission_required
 
 # Blueprint Configuration
@@ -233,6 +233,7 @@ def update_user(user_id):
         if User.query.filter(User.id != user_id).filter(func.lower(User.username) == func.lower(data['username'].strip())).first():
             return jsonify({'error': f"Username '{data['username'].strip()}' already exists."}), 409
         user_to_update.username = data['username'].strip()
+        sync_booking_user_names(user_to_update)
 
     if 'email' in data and data['email'] and data['email'].strip() and user_to_update.email != data['email'].strip():
         if '@' not in data['email'] or '.' not in data['email'].split('@')[-1]:
@@ -1096,6 +1097,7 @@ def bulk_edit_users():
                 errors.append({'id': user_id, 'error': f"Username '{new_username}' already exists."})
                 continue
             user_to_update.username = new_username
+            sync_booking_user_names(user_to_update)
 
         # Email validation
         if 'email' in user_data and user_data['email'] and user_data['email'].strip() and \
@@ -4,7 +4,9 @@ from scheduler_tasks import (
     cancel_unchecked_bookings,
     send_checkin_reminders,
     auto_release_unclaimed_bookings,
-    apply_scheduled_resource_status_changes
+    apply_scheduled_resource_status_changes,
+    archive_old_bookings,
+    prune_old_audit_logs
 )
 import os
 
@@ -91,3 +93,29 @@ def trigger_apply_resource_status():
     except Exception as e:
         current_app.logger.error(f"Error in apply_resource_status task: {e}")
         return jsonify({'status': 'error', 'message': str(e)}), 500
+
+@tasks_bp.route('/tasks/archive_bookings', methods=['POST'])
+def trigger_archive_bookings():
+    if not verify_task_secret():
+        return jsonify({'error': 'Unauthorized'}), 401
+
+    current_app.logger.info("Triggering archive_old_bookings via webhook.")
+    try:
+        archived_count = archive_old_bookings(current_app)
+        return jsonify({'status': 'success', 'message': f'Booking archive task completed. {archived_count} bookings archived.', 'archived': archived_count}), 200
+    except Exception as e:
+        current_app.logger.error(f"Error in archive_bookings task: {e}")
+        return jsonify({'status': 'error', 'message': str(e)}), 500
+
+@tasks_bp.route('/tasks/prune_audit_logs', methods=['POST'])
+def trigger_prune_audit_logs():
+    if not verify_task_secret():
+        return jsonify({'error': 'Unauthorized'}), 401
+
+    current_app.logger.info("Triggering prune_old_audit_logs via webhook.")
+    try:
+        deleted_count = prune_old_audit_logs(current_app)
+        return jsonify({'status': 'success', 'message': f'Audit log pruning completed. {deleted_count} entries deleted.', 'deleted': deleted_count}), 200
+    except Exception as e:
+        current_app.logger.error(f"Error in prune_audit_logs task: {e}")
+        return jsonify({'status': 'error', 'message': str(e)}), 500
@@ -14,6 +14,7 @@ from datetime import datetime, timezone, timedelta
 from models import db, Booking, Resource, User, BookingSettings, FloorMap # Added Resource, User, db, BookingSettings
 # Assuming add_audit_log is in utils.py
 from utils import add_audit_log
+from booking_settings_cache import current_booking_settings
 # Assuming socketio is in extensions.py # Removed: from extensions import socketio
 
 # The template_folder is specified relative to the blueprint's location.
@@ -35,7 +36,7 @@ def serve_index():
         now = datetime.now(timezone.utc)
         three_days_from_now = now + timedelta(days=3)
         upcoming_bookings = Booking.query.filter(
-            Booking.user_name == current_user.username,
+            Booking.user_id == current_user.id,
             Booking.start_time > now,
             Booking.start_time <= three_days_from_now,
             Booking.status.in_(valid_statuses)  # Filter by valid statuses
@@ -44,7 +45,7 @@ def serve_index():
         # Get global_time_offset_hours
         time_offset_value = 0 # Default
         try:
-            booking_settings_record = BookingSettings.query.first()
+            booking_settings_record = current_booking_settings()
             if booking_settings_record and booking_settings_record.global_time_offset_hours is not None:
                 time_offset_value = booking_settings_record.global_time_offset_hours
         except Exception as e:
@@ -64,7 +65,7 @@ def serve_resources():
     adjustment_hours = 0  # Default value for past_booking_time_adjustment_hours
     global_offset_hours = 0 # Default value for global_time_offset_hours
     try:
-        booking_settings = BookingSettings.query.first()
+        booking_settings = current_booking_settings()
         if booking_settings:
             if booking_settings.past_booking_time_adjustment_hours is not None:
                 adjustment_hours = booking_settings.past_booking_time_adjustment_hours
@@ -129,7 +130,7 @@ def serve_my_bookings_page():
     # Get global_time_offset_hours
     time_offset_value = 0 # Default
     try:
-        booking_settings_record = BookingSettings.query.first()
+        booking_settings_record = current_booking_settings()
         if booking_settings_record and booking_settings_record.global_time_offset_hours is not None:
             time_offset_value = booking_settings_record.global_time_offset_hours
     except Exception as e:
@@ -147,7 +148,7 @@ def serve_calendar():
     allow_multiple = False # Default
 
     try:
-        booking_settings_record = BookingSettings.query.first()
+        booking_settings_record = current_booking_settings()
         if booking_settings_record:
             if booking_settings_record.global_time_offset_hours is not None:
                 time_offset_value = booking_settings_record.global_time_offset_hours
@@ -174,7 +175,7 @@ def check_in_at_resource(resource_id):
     resource = Resource.query.get_or_404(resource_id)
 
     # Fetch booking settings
-    booking_settings = BookingSettings.query.first()
+    booking_settings = current_booking_settings()
     if not booking_settings:
         flash("System error: Booking settings not configured.", "danger")
         return render_template('check_in_status.html', success=False, resource_name=resource.name, message="Booking settings not found."), 500
@@ -232,12 +233,12 @@ def check_in_at_resource(resource_id):
             # 'post_login_pin_entry_required' will be popped by the POST handler after successful PIN.
             return render_template('check_in_pin_entry.html', resource=resource)
 
-        user_name_to_check = current_user.username
+        user_id_to_check = current_user.id
 
         # If coming from POST (PIN success), or GET by authenticated user who might not need PIN (or already passed PIN screen)
         # Find booking for this user and resource within the check-in window
         active_booking = Booking.query.filter(
-            Booking.user_name == user_name_to_check,
+            Booking.user_id == user_id_to_check,
             Booking.resource_id == resource_id,
             Booking.status == 'approved',
             Booking.checked_in_at.is_(None),
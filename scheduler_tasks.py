@@ -1,8 +1,13 @@
-from datetime import datetime, timedelta, timezone
+from datetime import timedelta, timezone
 from flask import current_app, render_template, url_for
+from sqlalchemy.orm import joinedload
 from extensions import db
-from models import Booking, User, Resource, FloorMap, BookingSettings
-from utils import add_audit_log, send_email, get_current_effective_time
+from models import Booking, Resource, FloorMap
+from booking_settings_cache import current_booking_settings
+from utils import add_audit_log, send_email
+from effective_clock import current_clock
+from booking_archive import archive_finished_bookings
+from audit_log import prune_audit_logs
 # Ensure current_app is available if not passed directly
 # from flask import current_app # current_app is already imported by the other functions
 
@@ -20,7 +25,7 @@ def auto_checkout_overdue_bookings(app_instance=None):
         logger = app.logger
         logger.info("Scheduler: Starting auto_checkout_overdue_bookings task...")
 
-        booking_settings = BookingSettings.query.first()
+        booking_settings = current_booking_settings()
         if not booking_settings:
             logger.warning("Scheduler: BookingSettings not found. Auto-checkout task will not run.")
             return
@@ -35,12 +40,12 @@ def auto_checkout_overdue_bookings(app_instance=None):
             logger.info("Scheduler: Auto-checkout feature is disabled in settings. Task will not run.")
             return
 
-        effective_now_aware = get_current_effective_time()
-        effective_now_local_naive = effective_now_aware.replace(tzinfo=None)
+        clock = current_clock()
+        effective_now_local_naive = clock.venue_now
         cutoff_time_local_naive = effective_now_local_naive - timedelta(minutes=auto_checkout_delay_minutes)
 
         try:
-            overdue_bookings = Booking.query.filter(
+            overdue_bookings = Booking.query.options(joinedload(Booking.user)).filter(
                 Booking.status == 'checked_in',
                 Booking.checked_out_at.is_(None),
                 Booking.end_time < cutoff_time_local_naive
@@ -70,7 +75,7 @@ def auto_checkout_overdue_bookings(app_instance=None):
                 )
                 logger.info(f"Scheduler: Booking ID {booking.id} successfully auto checked-out in DB (local time: {actual_checkout_time_local_naive}).")
 
-                user = User.query.filter_by(username=booking.user_name).first()
+                user = booking.user
                 if user and user.email:
                     resource = db.session.get(Resource, booking.resource_id)
                     floor_map_location = "N/A"
@@ -130,7 +135,7 @@ def cancel_unchecked_bookings(app):
         logger = app.logger
         logger.info("Scheduler: Starting cancel_unchecked_bookings task...")
 
-        booking_settings = BookingSettings.query.first()
+        booking_settings = current_booking_settings()
         if not booking_settings:
             logger.warning("Scheduler: BookingSettings not found. Task will not run.")
             return
@@ -142,12 +147,12 @@ def cancel_unchecked_bookings(app):
         grace_minutes = booking_settings.check_in_minutes_after or 0
         current_offset_hours = booking_settings.global_time_offset_hours or 0
 
-        effective_now_aware = get_current_effective_time()
-        effective_now_local_naive = effective_now_aware.replace(tzinfo=None)
+        clock = current_clock()
+        effective_now_local_naive = clock.venue_now
         cutoff_time_local_naive = effective_now_local_naive - timedelta(minutes=grace_minutes)
 
         try:
-            bookings_to_cancel = Booking.query.filter(
+            bookings_to_cancel = Booking.query.options(joinedload(Booking.user)).filter(
                 Booking.status == 'approved',
                 Booking.checked_in_at.is_(None),
                 Booking.start_time < cutoff_time_local_naive
@@ -179,7 +184,7 @@ def cancel_unchecked_bookings(app):
                 add_audit_log(action="AUTO_CANCEL_NO_CHECKIN", details=audit_details)
                 logger.info(f"Scheduler: Booking ID {booking.id} status changed to 'cancelled_by_system'. {audit_details}")
 
-                user = User.query.filter_by(username=booking.user_name).first() if booking.user_name else None
+                user = booking.user
                 if user and user.email:
                     resource = db.session.get(Resource, booking.resource_id)
                     floor_map_location = "N/A"
@@ -248,13 +253,9 @@ def apply_scheduled_resource_status_changes(app=None):
         logger = app.logger
         logger.info("Scheduler: Starting apply_scheduled_resource_status_changes task...")
 
-        booking_settings_for_offset = BookingSettings.query.first()
-        current_offset_hours = 0
-        if booking_settings_for_offset and hasattr(booking_settings_for_offset, 'global_time_offset_hours') and booking_settings_for_offset.global_time_offset_hours is not None:
-            current_offset_hours = booking_settings_for_offset.global_time_offset_hours
-
-        effective_now_aware = get_current_effective_time() # Aware, in venue's effective timezone
-        effective_now_local_naive = effective_now_aware.replace(tzinfo=None) # Naive representation of venue's current time
+        clock = current_clock()
+        current_offset_hours = clock.offset_hours
+        effective_now_local_naive = clock.venue_now # Naive representation of venue's current time
 
         try:
             resources_to_update = []
@@ -318,7 +319,7 @@ def auto_release_unclaimed_bookings(app_instance=None):
         logger = app.logger
         logger.info("Scheduler: Starting auto_release_unclaimed_bookings task...")
 
-        booking_settings = BookingSettings.query.first()
+        booking_settings = current_booking_settings()
         if not booking_settings:
             logger.warning("Scheduler: BookingSettings not found. Auto-release task will not run.")
             return
@@ -337,11 +338,11 @@ def auto_release_unclaimed_bookings(app_instance=None):
             logger.info("Scheduler: Auto-release minutes not configured or is zero/negative. Auto-release task will not run.")
             return
 
-        effective_now_aware = get_current_effective_time()
-        effective_now_local_naive = effective_now_aware.replace(tzinfo=None)
+        clock = current_clock()
+        effective_now_local_naive = clock.venue_now
 
         try:
-            unclaimed_bookings = Booking.query.filter(
+            unclaimed_bookings = Booking.query.options(joinedload(Booking.user)).filter(
                 Booking.status == 'approved',
                 Booking.checked_in_at.is_(None)
             ).all()
@@ -377,7 +378,7 @@ def auto_release_unclaimed_bookings(app_instance=None):
                     add_audit_log(action="AUTO_RELEASE_NO_CHECKIN", details=audit_log_details)
                     logger.info(f"Scheduler: Booking ID {booking.id} status changed to '{booking.status}'. {audit_log_details}")
 
-                    user = User.query.filter_by(username=booking.user_name).first()
+                    user = booking.user
                     if user and user.email:
                         resource = db.session.get(Resource, booking.resource_id)
                         floor_map_location = "N/A"
@@ -427,7 +428,7 @@ def send_checkin_reminders(app):
         logger = app.logger
         logger.info("Scheduler: Starting send_checkin_reminders task...")
         try:
-            booking_settings = BookingSettings.query.first()
+            booking_settings = current_booking_settings()
             if not booking_settings:
                 logger.warning("Scheduler: BookingSettings not found. Check-in reminder task will not run.")
                 return
@@ -440,13 +441,13 @@ def send_checkin_reminders(app):
             current_offset_hours = booking_settings.global_time_offset_hours if hasattr(booking_settings, 'global_time_offset_hours') and booking_settings.global_time_offset_hours is not None else 0
 
             # Effective current time in venue's local timezone (naive)
-            effective_now_aware = get_current_effective_time() # Aware, in venue's effective timezone
-            effective_now_local_naive = effective_now_aware.replace(tzinfo=None) # Naive representation of venue's current time
+            clock = current_clock()
+            effective_now_local_naive = clock.venue_now # Naive representation of venue's current time
 
             logger.info(f"Scheduler: Effective local time for processing: {effective_now_local_naive.strftime('%Y-%m-%d %H:%M:%S')}")
 
             # Fetch all approved bookings where checked_in_at is None
-            potential_bookings_local_query = Booking.query.filter(
+            potential_bookings_local_query = Booking.query.options(joinedload(Booking.user)).filter(
                 Booking.status == 'approved',
                 Booking.checked_in_at.is_(None)
             ).all()
@@ -457,7 +458,7 @@ def send_checkin_reminders(app):
             cancelled_bookings_count = 0
 
             for booking in potential_bookings_local_query:
-                user = User.query.filter_by(username=booking.user_name).first()
+                user = booking.user
                 resource = db.session.get(Resource, booking.resource_id)
 
                 if not user:
@@ -527,7 +528,7 @@ def send_checkin_reminders(app):
                                 body=text_body,
                                 html_body=html_body
                             )
-                            booking.checkin_reminder_sent_at = datetime.now(timezone.utc) # Mark as sent with current UTC time
+                            booking.checkin_reminder_sent_at = clock.utc_now # Mark as sent with the run's UTC time
                             db.session.add(booking)
                             db.session.commit()
                             sent_reminders_count += 1
@@ -620,3 +621,51 @@ def send_checkin_reminders(app):
             logger.error(f"Scheduler: Error in send_checkin_reminders task's main try block: {e_task}", exc_info=True)
         finally:
             logger.info("Scheduler: Task 'send_checkin_reminders' finished.")
+
+
+def archive_old_bookings(app_instance=None):
+    """
+    Moves finished bookings older than BOOKING_ARCHIVE_AFTER_DAYS into booking_archive.
+    Returns the number of bookings archived.
+    """
+    app = app_instance or current_app
+    with app.app_context():
+        logger = app.logger
+        archive_after_days = app.config.get('BOOKING_ARCHIVE_AFTER_DAYS', 180)
+        batch_size = app.config.get('BOOKING_ARCHIVE_BATCH_SIZE', 500)
+        # Booking times are naive venue local, so the cutoff is taken from the venue's effective clock.
+        cutoff_local_naive = current_clock().venue_now - timedelta(days=archive_after_days)
+        logger.info(f"Scheduler: Archiving finished bookings that ended before {cutoff_local_naive} (batches of {batch_size}).")
+        try:
+            archived_count = archive_finished_bookings(cutoff_local_naive, batch_size)
+        except Exception:
+            db.session.rollback()
+            raise
+        if archived_count:
+            add_audit_log(action="ARCHIVE_BOOKINGS", details=f"Scheduler: Archived {archived_count} bookings that ended before {cutoff_local_naive}.")
+        logger.info(f"Scheduler: archive_old_bookings task finished. {archived_count} bookings archived.")
+        return archived_count
+
+
+def prune_old_audit_logs(app_instance=None):
+    """
+    Deletes audit log entries older than AUDIT_LOG_RETENTION_DAYS (0 disables pruning).
+    Returns the number of entries deleted.
+    """
+    app = app_instance or current_app
+    with app.app_context():
+        logger = app.logger
+        retention_days = app.config.get('AUDIT_LOG_RETENTION_DAYS', 365)
+        if not retention_days or retention_days <= 0:
+            logger.info("Scheduler: AUDIT_LOG_RETENTION_DAYS is 0; audit log pruning is disabled.")
+            return 0
+        cutoff_utc = current_clock().utc_now - timedelta(days=retention_days)
+        try:
+            deleted_count = prune_audit_logs(cutoff_utc)
+        except Exception:
+            db.session.rollback()
+            raise
+        if deleted_count:
+            add_audit_log(action="PRUNE_AUDIT_LOGS", details=f"Scheduler: Deleted {deleted_count} audit log entries older than {retention_days} days.")
+        logger.info(f"Scheduler: prune_old_audit_logs task finished. {deleted_count} entries deleted.")
+        return deleted_count
@@ -0,0 +1,117 @@
+from datetime import date, datetime, time, timedelta
+from functools import lru_cache
+
+MINUTES_PER_DAY = 24 * 60
+
+
+@lru_cache(maxsize=None)
+def _cell_offsets(granularity_minutes: int) -> tuple:
+    return tuple(timedelta(minutes=minutes) for minutes in range(0, MINUTES_PER_DAY + 1, granularity_minutes))
+
+
+@lru_cache(maxsize=None)
+def _cell_labels(granularity_minutes: int) -> tuple:
+    # 'HH:MM' per cell boundary; midnight at the end of the day reads '00:00' like strftime does.
+    return tuple(f"{(minutes // 60) % 24:02d}:{minutes % 60:02d}" for minutes in range(0, MINUTES_PER_DAY + 1, granularity_minutes))
+
+
+class SlotGrid:
+    """
+    One day at a fixed granularity (e.g. 5/15/30 minutes), packed into a Python int
+    with bit i set when cell i is busy. Painting a booking is a single shifted-mask
+    OR, and free runs are read back with bit arithmetic instead of per-slot loops.
+    """
+
+    __slots__ = ('day', 'granularity_minutes', 'cell_count', 'busy_bits', '_day_start')
+
+    def __init__(self, day: date, granularity_minutes: int = 30):
+        if granularity_minutes <= 0 or MINUTES_PER_DAY % granularity_minutes:
+            raise ValueError(f"granularity_minutes must divide {MINUTES_PER_DAY}, got {granularity_minutes}")
+        self.day = day
+        self.granularity_minutes = granularity_minutes
+        self.cell_count = MINUTES_PER_DAY // granularity_minutes
+        self.busy_bits = 0
+        self._day_start = datetime.combine(day, time.min)
+
+    @property
+    def full_mask(self) -> int:
+        return (1 << self.cell_count) - 1
+
+    def cell_range(self, start_dt: datetime, end_dt: datetime) -> tuple[int, int]:
+        """[first, last) cells that [start_dt, end_dt) touches on this day, clamped to the day."""
+        start_minutes = (start_dt - self._day_start).total_seconds() / 60
+        end_minutes = (end_dt - self._day_start).total_seconds() / 60
+        first = max(0, int(start_minutes // self.granularity_minutes))
+        last = min(self.cell_count, -int(-end_minutes // self.granularity_minutes))
+        return first, max(first, last)
+
+    def range_mask(self, first: int, last: int) -> int:
+        return ((1 << (last - first)) - 1) << first if last > first else 0
+
+    def paint(self, start_dt: datetime, end_dt: datetime):
+        """Marks every cell overlapped by [start_dt, end_dt) as busy."""
+        self.busy_bits |= self.range_mask(*self.cell_range(start_dt, end_dt))
+
+    def paint_all(self, intervals):
+        for start_dt, end_dt in intervals:
+            self.paint(start_dt, end_dt)
+        return self
+
+    def is_free(self, start_dt: datetime, end_dt: datetime) -> bool:
+        return not self.busy_bits & self.range_mask(*self.cell_range(start_dt, end_dt))
+
+    def cell_start(self, cell_index: int) -> datetime:
+        return self._day_start + _cell_offsets(self.granularity_minutes)[cell_index]
+
+    def free_runs(self, min_cells: int = 1) -> list[tuple[int, int]]:
+        """Maximal runs of free cells as [first, last) index pairs, at least min_cells long."""
+        runs = []
+        free_bits = self.full_mask & ~self.busy_bits
+        while free_bits:
+            first = (free_bits & -free_bits).bit_length() - 1
+            shifted = free_bits >> first
+            run_length = (shifted ^ (shifted + 1)).bit_length() - 1
+            if run_length >= min_cells:
+                runs.append((first, first + run_length))
+            free_bits &= ~self.range_mask(first, first + run_length)
+        return runs
+
+    def free_intervals(self, min_duration: timedelta = None) -> list[tuple[datetime, datetime]]:
+        """Free runs as (start, end) datetimes."""
+        min_cells = 1
+        if min_duration:
+            min_cells = max(1, -int(-(min_duration.total_seconds() / 60) // self.granularity_minutes))
+        return [(self.cell_start(first), self.cell_start(last)) for first, last in self.free_runs(min_cells)]
+
+    def free_slot_indices(self, slot_minutes: int) -> list[tuple[int, int]]:
+        """
+        [first, last) cell pairs of back-to-back slot_minutes slots (aligned to midnight)
+        that contain no busy cell. Only free runs are walked, so busy stretches cost nothing.
+        """
+        if slot_minutes <= 0 or slot_minutes % self.granularity_minutes:
+            raise ValueError(f"slot_minutes must be a positive multiple of {self.granularity_minutes}, got {slot_minutes}")
+        cells_per_slot = slot_minutes // self.granularity_minutes
+        slots = []
+        for run_first, run_last in self.free_runs(cells_per_slot):
+            first = -(-run_first // cells_per_slot) * cells_per_slot
+            while first + cells_per_slot <= run_last:
+                slots.append((first, first + cells_per_slot))
+                first += cells_per_slot
+        return slots
+
+    def free_slots(self, slot_minutes: int) -> list[tuple[datetime, datetime]]:
+        """Free aligned slots as (start, end) datetimes."""
+        offsets = _cell_offsets(self.granularity_minutes)
+        day_start = self._day_start
+        return [(day_start + offsets[first], day_start + offsets[last]) for first, last in self.free_slot_indices(slot_minutes)]
+
+    def free_slot_labels(self, slot_minutes: int) -> list[tuple[str, str]]:
+        """Free aligned slots as ('HH:MM', 'HH:MM') pairs, without building datetimes."""
+        labels = _cell_labels(self.granularity_minutes)
+        return [(labels[first], labels[last]) for first, last in self.free_slot_indices(slot_minutes)]
+
+
+def build_slot_grid(day: date, intervals, granularity_minutes: int = 30) -> SlotGrid:
+    """Convenience constructor: a grid for day with every (start, end) interval painted in."""
+    return SlotGrid(day, granularity_minutes).paint_all(intervals)
+
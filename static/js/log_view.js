@@ -18,12 +18,14 @@ document.addEventListener('DOMContentLoaded', function() {
     const logFilterEndDateInput = document.getElementById('log-filter-end-date');   // Changed ID
     const logFilterUsernameInput = document.getElementById('log-filter-username'); // Changed ID
     const logFilterActionInput = document.getElementById('log-filter-action');     // Changed ID
+    const logFilterSearchInput = document.getElementById('log-filter-search');
     // const logApplyFiltersBtn = document.getElementById('log-apply-filters-btn'); // This will be the form submit
     const logClearFiltersBtn = document.getElementById('log-clear-filters-btn');
 
     let currentPage = 1;
     const defaultPerPage = 30; 
     let currentFilters = {}; // Store current filter values
+    let lastResponse = null; // Keyset cursors (next_cursor / prev_cursor) come from the latest response
 
     // --- Helper Function Availability (Assume from script.js) ---
     // apiCall, showLoading, showSuccess, showError, hideMessage
@@ -42,25 +44,26 @@ document.addEventListener('DOMContentLoaded', function() {
     function updatePaginationControls(apiResponse) {
         if (!apiResponse) return;
 
-        currentPage = apiResponse.current_page;
-        const totalPages = apiResponse.total_pages;
+        lastResponse = apiResponse;
+        if (pageInfoSpan) pageInfoSpan.textContent = `Page ${currentPage}`;
+        if (totalLogsInfoSpan) totalLogsInfoSpan.textContent = `Showing ${apiResponse.logs ? apiResponse.logs.length : 0} entries`;
 
-        if (pageInfoSpan) pageInfoSpan.textContent = `Page ${currentPage} of ${totalPages}`;
-        if (totalLogsInfoSpan) totalLogsInfoSpan.textContent = `Total logs: ${apiResponse.total_logs}`;
-
-        if (prevPageBtn) prevPageBtn.disabled = currentPage <= 1;
-        if (nextPageBtn) nextPageBtn.disabled = currentPage >= totalPages;
+        if (prevPageBtn) prevPageBtn.disabled = !apiResponse.has_prev;
+        if (nextPageBtn) nextPageBtn.disabled = !apiResponse.has_next;
     }
 
 
-    async function fetchLogs(page = 1, filters = {}) {
+    // cursor: {before_id} for older entries, {after_id} for newer ones, {} for the newest page.
+    async function fetchLogs(cursor = {}, filters = {}) {
         if (!logTableBody || !logViewStatusDiv) {
             console.error("Required table elements not found for displaying logs.");
             return;
         }
         showLoading(logViewStatusDiv, 'Fetching audit logs...');
         
-        let queryParams = `page=${page}&per_page=${defaultPerPage}`;
+        let queryParams = `per_page=${defaultPerPage}`;
+        if (cursor.before_id) queryParams += `&before_id=${cursor.before_id}`;
+        if (cursor.after_id) queryParams += `&after_id=${cursor.after_id}`;
         
         // Use the global currentFilters if filters arg is not explicitly passed with new values
         const activeFilters = Object.keys(filters).length > 0 ? filters : currentFilters;
@@ -69,6 +72,7 @@ document.addEventListener('DOMContentLoaded', function() {
         if (activeFilters.endDate) queryParams += `&end_date=${encodeURIComponent(activeFilters.endDate)}`;
         if (activeFilters.username) queryParams += `&username_filter=${encodeURIComponent(activeFilters.username)}`;
         if (activeFilters.action) queryParams += `&action_filter=${encodeURIComponent(activeFilters.action)}`;
+        if (activeFilters.search) queryParams += `&search=${encodeURIComponent(activeFilters.search)}`;
 
         try {
             const response = await apiCall(`/api/admin/logs?${queryParams}`); 
@@ -94,8 +98,8 @@ document.addEventListener('DOMContentLoaded', function() {
             showError(logViewStatusDiv, `Error fetching audit logs: ${error.message}`);
             if (logTableBody) logTableBody.innerHTML = '<tr><td colspan="5">Error loading logs.</td></tr>';
             // Reset pagination on error
-            if (pageInfoSpan) pageInfoSpan.textContent = 'Page 1 of 1';
-            if (totalLogsInfoSpan) totalLogsInfoSpan.textContent = 'Total logs: 0';
+            if (pageInfoSpan) pageInfoSpan.textContent = 'Page 1';
+            if (totalLogsInfoSpan) totalLogsInfoSpan.textContent = '';
             if (prevPageBtn) prevPageBtn.disabled = true;
             if (nextPageBtn) nextPageBtn.disabled = true;
         }
@@ -104,18 +108,18 @@ document.addEventListener('DOMContentLoaded', function() {
     // Pagination Controls Event Listeners
     if (prevPageBtn) {
         prevPageBtn.addEventListener('click', () => {
-            if (currentPage > 1) {
-                fetchLogs(currentPage - 1, currentFilters); 
+            if (lastResponse && lastResponse.has_prev) {
+                currentPage = Math.max(currentPage - 1, 1);
+                fetchLogs({ after_id: lastResponse.prev_cursor }, currentFilters);
             }
         });
     }
 
     if (nextPageBtn) {
         nextPageBtn.addEventListener('click', () => {
-            // totalPages is updated by updatePaginationControls
-            const totalPages = parseInt(pageInfoSpan.textContent.split(' of ')[1] || '1', 10); 
-            if (currentPage < totalPages) {
-                fetchLogs(currentPage + 1, currentFilters);
+            if (lastResponse && lastResponse.has_next) {
+                currentPage += 1;
+                fetchLogs({ before_id: lastResponse.next_cursor }, currentFilters);
             }
         });
     }
@@ -130,7 +134,8 @@ document.addEventListener('DOMContentLoaded', function() {
                 startDate: logFilterStartDateInput.value,
                 endDate: logFilterEndDateInput.value,
                 username: logFilterUsernameInput.value.trim(),
-                action: logFilterActionInput.value.trim()
+                action: logFilterActionInput.value.trim(),
+                search: logFilterSearchInput ? logFilterSearchInput.value.trim() : ''
             };
             // Remove empty filters to avoid sending empty params
             for (const key in currentFilters) {
@@ -138,7 +143,8 @@ document.addEventListener('DOMContentLoaded', function() {
                     delete currentFilters[key];
                 }
             }
-            fetchLogs(1, currentFilters); // Reset to page 1, use currentFilters
+            currentPage = 1;
+            fetchLogs({}, currentFilters); // Back to the newest page, use currentFilters
         });
     }
 
@@ -149,11 +155,13 @@ document.addEventListener('DOMContentLoaded', function() {
             if (logFilterEndDateInput) logFilterEndDateInput.value = '';
             if (logFilterUsernameInput) logFilterUsernameInput.value = '';
             if (logFilterActionInput) logFilterActionInput.value = '';
+            if (logFilterSearchInput) logFilterSearchInput.value = '';
             currentFilters = {};
-            fetchLogs(1, currentFilters); 
+            currentPage = 1;
+            fetchLogs({}, currentFilters); 
         });
     }
 
     // Initial Load
-    fetchLogs(1, currentFilters); 
+    fetchLogs({}, currentFilters); 
 });
@@ -344,7 +344,7 @@ document.addEventListener('DOMContentLoaded', function () {
             const offsetY = parseInt(mapDetails.offset_y) || 0;
 
             if (mapContainer) {
-                mapContainer.style.backgroundImage = `url(${mapDetails.image_url})`;
+                renderFloorMapImage(mapContainer, mapDetails);
             }
             const colorMap = {
                 'map-area-green': '212, 237, 218',
@@ -138,6 +138,76 @@ async function apiCall(url, options = {}, messageElement = null) {
     }
 }
 
+/**
+ * Paints a floor map into a map container sized by CSS (background-size: contain, anchored top left).
+ * Maps with a tile pyramid (mapDetails.image_tiles) are drawn from the smallest level that covers the
+ * container at the device pixel ratio, so only the tiles for the visible image are downloaded instead
+ * of the full-size plan. Other maps use the smallest resized derivative (mapDetails.image_derivatives)
+ * that covers the container, offered as AVIF/WebP through image-set() with the PNG/JPEG variant as the
+ * fallback, and image_url when there are no derivatives. Derivatives keep the original's aspect ratio,
+ * so with background-size: contain the painted map, and the resource areas placed on it, do not move.
+ * @param {HTMLElement} container - The map container; resource areas are appended after this call.
+ * @param {object} mapDetails - The map_details object from /api/map_details.
+ */
+const FLOOR_MAP_IMAGE_TYPES = { avif: 'image/avif', webp: 'image/webp', png: 'image/png', jpg: 'image/jpeg' };
+
+function floorMapDerivativeBackground(container, derivatives) {
+    const variants = ['thumb', 'display', 'base'].map(name => derivatives.variants[name]).filter(Boolean);
+    if (!variants.length) return null;
+    const scale = Math.min(container.clientWidth / derivatives.width, container.clientHeight / derivatives.height) || 1;
+    const neededWidth = derivatives.width * scale * (window.devicePixelRatio || 1);
+    const variant = variants.find(v => v.width >= neededWidth) || variants[variants.length - 1];
+    const formats = (derivatives.formats || Object.keys(variant.urls)).filter(ext => variant.urls[ext]);
+    const fallbackUrl = variant.urls[formats[0]]; // The PNG/JPEG rendition is listed first
+    const candidates = formats.slice(1).concat(formats[0])
+        .map(ext => `url("${variant.urls[ext]}") type("${FLOOR_MAP_IMAGE_TYPES[ext]}")`);
+    return { fallback: `url("${fallbackUrl}")`, imageSet: `image-set(${candidates.join(', ')})` };
+}
+
+function renderFloorMapImage(container, mapDetails) {
+    if (!container) return;
+    const previousLayer = container.querySelector('.floor-map-tile-layer');
+    if (previousLayer) previousLayer.remove();
+    const tiles = mapDetails && mapDetails.image_tiles;
+    if (!tiles || !tiles.levels || !tiles.levels.length || !container.clientWidth || !container.clientHeight) {
+        const derivatives = mapDetails && mapDetails.image_derivatives;
+        const background = derivatives && derivatives.variants ? floorMapDerivativeBackground(container, derivatives) : null;
+        if (background) {
+            container.style.backgroundImage = background.fallback;
+            container.style.backgroundImage = background.imageSet; // Ignored by browsers without image-set() type()
+        } else {
+            container.style.backgroundImage = mapDetails && mapDetails.image_url ? `url(${mapDetails.image_url})` : '';
+        }
+        return;
+    }
+    container.style.backgroundImage = 'none';
+
+    const scale = Math.min(container.clientWidth / tiles.width, container.clientHeight / tiles.height);
+    const displayWidth = tiles.width * scale;
+    const displayHeight = tiles.height * scale;
+    const neededWidth = displayWidth * (window.devicePixelRatio || 1);
+    const level = tiles.levels.find(l => l.width >= neededWidth) || tiles.levels[tiles.levels.length - 1];
+    const levelScale = displayWidth / level.width;
+
+    const layer = document.createElement('div');
+    layer.className = 'floor-map-tile-layer';
+    layer.style.cssText = `position: absolute; left: 0; top: 0; width: ${displayWidth}px; height: ${displayHeight}px; overflow: hidden; pointer-events: none;`;
+    for (let col = 0; col < level.columns; col++) {
+        for (let row = 0; row < level.rows; row++) {
+            const x = col * tiles.tile_size;
+            const y = row * tiles.tile_size;
+            const tile = document.createElement('img');
+            tile.alt = '';
+            tile.decoding = 'async';
+            tile.src = tiles.url_template.replace('{level}', level.level).replace('{col}', col).replace('{row}', row);
+            tile.style.cssText = `position: absolute; left: ${x * levelScale}px; top: ${y * levelScale}px; ` +
+                `width: ${Math.min(tiles.tile_size, level.width - x) * levelScale}px; height: ${Math.min(tiles.tile_size, level.height - y) * levelScale}px;`;
+            layer.appendChild(tile);
+        }
+    }
+    container.insertBefore(layer, container.firstChild); // Before the resource areas, so they stay on top
+}
+
 // --- Authentication Logic ---
 async function updateAuthLink() {
     // ... (Keep existing updateAuthLink function as is) ...
@@ -2825,7 +2895,7 @@ document.addEventListener('DOMContentLoaded', function() {
                 const apiUrl = dateString ? `/api/map_details/${currentMapId}?date=${dateString}` : `/api/map_details/${currentMapId}`;
                 const data = await apiCall(apiUrl, {}, mapLoadingStatusDiv); 
 
-                mapContainer.style.backgroundImage = `url(${data.map_details.image_url})`;
+                renderFloorMapImage(mapContainer, data.map_details);
                 if (mapViewTitleH1) mapViewTitleH1.textContent = `Map View: ${data.map_details.name}`;
                 
                 if (data.mapped_resources && data.mapped_resources.length > 0) {
@@ -3,6 +3,7 @@ import unittest.mock
 import json
 import urllib.parse
 from sqlalchemy import text, func
+from sqlalchemy.exc import IntegrityError
 
 from datetime import datetime, time, date, timedelta, timezone as timezone_original
 from datetime import datetime as datetime_original, timedelta as timedelta_original # For mocking
@@ -12,12 +13,14 @@ from app import app # app object
 from extensions import db # socketio removed
 from models import User, Resource, Booking, WaitlistEntry, FloorMap, AuditLog, BookingSettings, ResourcePIN, Role
 from utils import teams_log, slack_log, email_log
+from maintenance_schedules import invalidate_compiled_maintenance_schedules
 from unittest.mock import patch, mock_open, MagicMock, ANY
 from datetime import datetime, timedelta, time as dt_time # datetime is already imported, this line might be redundant if not used for specific aliasing.
 from googleapiclient.errors import HttpError
 from google.oauth2.credentials import Credentials as UserCredentials
 
 from scheduler_tasks import auto_checkout_overdue_bookings, auto_release_unclaimed_bookings
+from effective_clock import freeze_time
 
 import os
 import tempfile
@@ -25,9 +28,10 @@ from utils import generate_booking_image, send_email as utils_send_email
 import utils
 
 
-class AppTests(unittest.TestCase):
+class AppTestBase(unittest.TestCase):
+    """App, database and fixture setup shared by the test classes, without test methods of its own."""
     def __init__(self, *args, **kwargs):
-        super(AppTests, self).__init__(*args, **kwargs)
+        super(AppTestBase, self).__init__(*args, **kwargs)
         self.app = app
 
     def setUp(self):
@@ -44,6 +48,7 @@ class AppTests(unittest.TestCase):
 
         db.drop_all()
         db.create_all()
+        invalidate_compiled_maintenance_schedules()
 
         email_log.clear()
         teams_log.clear()
@@ -167,6 +172,8 @@ class AppTests(unittest.TestCase):
             else: final_data[k] = v
         return final_data
 
+
+class AppTests(AppTestBase):
     def test_update_allow_check_in_without_pin_setting(self):
         admin = self._create_admin_user(username="settings_allow_no_pin_admin")
         self.login(admin.username, "adminpass")
@@ -231,12 +238,9 @@ class TestAutoCheckoutTask(AppTests):
 
     @patch('scheduler_tasks.send_email')
     @patch('scheduler_tasks.add_audit_log')
-    @patch('scheduler_tasks.datetime')
-    def test_auto_checkout_success(self, mock_scheduler_datetime, mock_add_audit_log, mock_send_email):
+    def test_auto_checkout_success(self, mock_add_audit_log, mock_send_email):
         with self.app.app_context():
             mocked_now = datetime_original(2024, 1, 1, 14, 0, 0, tzinfo=timezone_original.utc)
-            mock_scheduler_datetime.now.return_value = mocked_now
-            mock_scheduler_datetime.side_effect = lambda *args, **kwargs: datetime_original(*args, **kwargs) if args else mocked_now
 
             settings = BookingSettings.query.first()
             settings.enable_auto_checkout = True
@@ -255,7 +259,8 @@ class TestAutoCheckoutTask(AppTests):
             db.session.commit()
             booking_id = overdue_booking.id
 
-            auto_checkout_overdue_bookings(app_instance=self.app)
+            with freeze_time(mocked_now):
+                auto_checkout_overdue_bookings(app_instance=self.app)
 
             checked_out_booking = db.session.get(Booking, booking_id)
             self.assertIsNotNone(checked_out_booking.checked_out_at, "checked_out_at should be populated")
@@ -266,12 +271,9 @@ class TestAutoCheckoutTask(AppTests):
             mock_add_audit_log.assert_called_once()
 
     @patch('scheduler_tasks.send_email')
-    @patch('scheduler_tasks.datetime')
-    def test_auto_checkout_not_overdue_yet(self, mock_scheduler_datetime, mock_send_email):
+    def test_auto_checkout_not_overdue_yet(self, mock_send_email):
         with self.app.app_context():
             mocked_now = datetime_original(2024, 1, 1, 14, 0, 0, tzinfo=timezone_original.utc)
-            mock_scheduler_datetime.now.return_value = mocked_now
-            mock_scheduler_datetime.side_effect = lambda *args, **kwargs: datetime_original(*args, **kwargs) if args else mocked_now
             booking_end_time = mocked_now - timedelta_original(minutes=30)
             not_overdue_booking = Booking(
                 user_name=self.task_user.username, resource_id=self.task_resource.id,
@@ -280,19 +282,17 @@ class TestAutoCheckoutTask(AppTests):
             )
             db.session.add(not_overdue_booking)
             db.session.commit()
-            auto_checkout_overdue_bookings(app_instance=self.app)
+            with freeze_time(mocked_now):
+                auto_checkout_overdue_bookings(app_instance=self.app)
             db.session.refresh(not_overdue_booking)
             self.assertIsNone(not_overdue_booking.checked_out_at)
             self.assertEqual(not_overdue_booking.status, 'checked_in')
             mock_send_email.assert_not_called()
 
     @patch('scheduler_tasks.send_email')
-    @patch('scheduler_tasks.datetime')
-    def test_auto_checkout_already_checked_out(self, mock_scheduler_datetime, mock_send_email):
+    def test_auto_checkout_already_checked_out(self, mock_send_email):
         with self.app.app_context():
             mocked_now = datetime_original(2024, 1, 1, 14, 0, 0, tzinfo=timezone_original.utc)
-            mock_scheduler_datetime.now.return_value = mocked_now
-            mock_scheduler_datetime.side_effect = lambda *args, **kwargs: datetime_original(*args, **kwargs) if args else mocked_now
             booking_end_time = mocked_now - timedelta_original(hours=2)
             already_checked_out_booking = Booking(
                 user_name=self.task_user.username, resource_id=self.task_resource.id,
@@ -302,16 +302,14 @@ class TestAutoCheckoutTask(AppTests):
             )
             db.session.add(already_checked_out_booking)
             db.session.commit()
-            auto_checkout_overdue_bookings(app_instance=self.app)
+            with freeze_time(mocked_now):
+                auto_checkout_overdue_bookings(app_instance=self.app)
             mock_send_email.assert_not_called()
 
     @patch('scheduler_tasks.send_email')
-    @patch('scheduler_tasks.datetime')
-    def test_auto_checkout_not_checked_in(self, mock_scheduler_datetime, mock_send_email):
+    def test_auto_checkout_not_checked_in(self, mock_send_email):
         with self.app.app_context():
             mocked_now = datetime_original(2024, 1, 1, 14, 0, 0, tzinfo=timezone_original.utc)
-            mock_scheduler_datetime.now.return_value = mocked_now
-            mock_scheduler_datetime.side_effect = lambda *args, **kwargs: datetime_original(*args, **kwargs) if args else mocked_now
             booking_end_time = mocked_now - timedelta_original(hours=2)
             not_checked_in_booking = Booking(
                 user_name=self.task_user.username, resource_id=self.task_resource.id,
@@ -320,19 +318,17 @@ class TestAutoCheckoutTask(AppTests):
             )
             db.session.add(not_checked_in_booking)
             db.session.commit()
-            auto_checkout_overdue_bookings(app_instance=self.app)
+            with freeze_time(mocked_now):
+                auto_checkout_overdue_bookings(app_instance=self.app)
             mock_send_email.assert_not_called()
             db.session.refresh(not_checked_in_booking)
             self.assertEqual(not_checked_in_booking.status, 'approved')
 
     @patch('scheduler_tasks.send_email')
     @patch('scheduler_tasks.add_audit_log')
-    @patch('scheduler_tasks.datetime')
-    def test_auto_checkout_multiple_bookings(self, mock_scheduler_datetime, mock_add_audit_log, mock_send_email):
+    def test_auto_checkout_multiple_bookings(self, mock_add_audit_log, mock_send_email):
         with self.app.app_context():
             mocked_now = datetime_original(2024, 1, 1, 14, 0, 0, tzinfo=timezone_original.utc)
-            mock_scheduler_datetime.now.return_value = mocked_now
-            mock_scheduler_datetime.side_effect = lambda *args, **kwargs: datetime_original(*args, **kwargs) if args else mocked_now
 
             settings = BookingSettings.query.first()
             settings.enable_auto_checkout = True
@@ -356,7 +352,8 @@ class TestAutoCheckoutTask(AppTests):
             db.session.commit()
             overdue_id = b_overdue.id
 
-            auto_checkout_overdue_bookings(app_instance=self.app)
+            with freeze_time(mocked_now):
+                auto_checkout_overdue_bookings(app_instance=self.app)
 
             self.assertEqual(mock_send_email.call_count, 1)
             self.assertEqual(mock_add_audit_log.call_count, 1)
@@ -376,12 +373,9 @@ class TestAutoCheckoutTask(AppTests):
     @patch('scheduler_tasks.User.query')
     @patch('scheduler_tasks.send_email')
     @patch('scheduler_tasks.add_audit_log')
-    @patch('scheduler_tasks.datetime')
-    def test_auto_checkout_no_user_email(self, mock_scheduler_datetime, mock_add_audit_log, mock_send_email, mock_user_query_in_task):
+    def test_auto_checkout_no_user_email(self, mock_add_audit_log, mock_send_email, mock_user_query_in_task):
         with self.app.app_context():
             mocked_now = datetime_original(2024, 1, 1, 14, 0, 0, tzinfo=timezone_original.utc)
-            mock_scheduler_datetime.now.return_value = mocked_now
-            mock_scheduler_datetime.side_effect = lambda *args, **kwargs: datetime_original(*args, **kwargs) if args else mocked_now
 
             user_for_this_test = User.query.filter_by(username="no_email_test_user").first()
             if not user_for_this_test:
@@ -408,7 +402,8 @@ class TestAutoCheckoutTask(AppTests):
             )
             mock_user_query_in_task.filter_by.return_value.first.return_value = stub_booker
 
-            auto_checkout_overdue_bookings(app_instance=app)
+            with freeze_time(mocked_now):
+                auto_checkout_overdue_bookings(app_instance=app)
 
             mock_send_email.assert_not_called()
             processed_booking = db.session.get(Booking, booking_id)
@@ -2078,10 +2073,49 @@ class TestMapAvailabilityAPI(AppTests):
 
         self.logout()
 
+    def test_booking_interval_index_matches_overlap_rules(self):
+        from utils import build_booking_interval_index, booking_index_has_conflict
+        target_date = date(2025, 7, 1)
+        # A long booking followed by a short one nested inside it, plus a cancelled booking.
+        self._make_booking('someone', self.map_res1.id, target_date, time(8, 0), time(16, 0), 'Long')
+        self._make_booking('someone', self.map_res1.id, target_date, time(9, 0), time(10, 0), 'Nested')
+        cancelled = self._make_booking('someone', self.map_res2.id, target_date, time(8, 0), time(12, 0), 'Cancelled')
+        cancelled.status = 'cancelled'
+        db.session.commit()
+
+        index = build_booking_interval_index([self.map_res1.id, self.map_res2.id], target_date)
+
+        def slot(start, end):
+            return datetime.combine(target_date, start), datetime.combine(target_date, end)
+
+        self.assertTrue(booking_index_has_conflict(index, self.map_res1.id, *slot(time(13, 0), time(17, 0))))
+        self.assertFalse(booking_index_has_conflict(index, self.map_res1.id, *slot(time(16, 0), time(17, 0))))
+        self.assertFalse(booking_index_has_conflict(index, self.map_res1.id, *slot(time(7, 0), time(8, 0))))
+        self.assertFalse(booking_index_has_conflict(index, self.map_res2.id, *slot(time(8, 0), time(12, 0))))
+
+    def test_batch_map_availability_matches_per_map_result(self):
+        from utils import get_batch_map_availability_for_user, get_detailed_map_availability_for_user
+        target_date = date.today() + timedelta(days=3)
+        other_map = FloorMap(name='Second Availability Map', image_filename='map_avail_test_2.png')
+        db.session.add(other_map)
+        db.session.commit()
+        other_res = Resource(name='OtherMapResource', capacity=2, floor_map_id=other_map.id, status='published')
+        db.session.add(other_res)
+        db.session.commit()
+        self._make_booking('someone', self.map_res1.id, target_date, time(8, 0), time(12, 0), 'Morning')
+
+        primary_slots = [(time(8, 0), time(12, 0)), (time(13, 0), time(17, 0))]
+        all_resources = [self.map_res1, self.map_res2, other_res]
+        batch = get_batch_map_availability_for_user(all_resources, target_date, self.map_user, primary_slots, flask_current_app.logger)
+
+        for floor_map, resources in ((self.test_map, [self.map_res1, self.map_res2]), (other_map, [other_res])):
+            expected = get_detailed_map_availability_for_user(resources, target_date, self.map_user, primary_slots, flask_current_app.logger)
+            self.assertEqual(batch[floor_map.id], expected)
+        self.assertEqual(batch[self.test_map.id]['available_primary_slots_for_user'], 3)
+
 # Scheduler Task Unit Tests
 # Importing the tasks and other necessary components
 from scheduler_tasks import auto_release_unclaimed_bookings, auto_checkout_overdue_bookings
-from utils import get_current_effective_time # To mock this
 
 # Ensure datetime, date, time are imported for type hinting and usage if not already at the top
 from datetime import datetime, date, time
@@ -2104,14 +2138,14 @@ class TestAutoReleaseTask(AppTests):
     @patch('scheduler_tasks.send_email')
     @patch('scheduler_tasks.add_audit_log')
     @patch('scheduler_tasks.db.session.commit')
-    @patch('scheduler_tasks.BookingSettings.query')
-    def test_auto_release_disabled_by_main_flag(self, mock_settings_query, mock_commit, mock_audit, mock_send_email):
+    @patch('scheduler_tasks.current_booking_settings')
+    def test_auto_release_disabled_by_main_flag(self, mock_current_settings, mock_commit, mock_audit, mock_send_email):
         with self.app.app_context():
             mock_settings = MagicMock(spec=BookingSettings)
             mock_settings.enable_check_in_out = False
             mock_settings.auto_release_if_not_checked_in_minutes = 30
             mock_settings.global_time_offset_hours = 0
-            mock_settings_query.first.return_value = mock_settings
+            mock_current_settings.return_value = mock_settings
 
             booking = self._create_booking(self.test_user.username, self.test_resource.id, start_offset_hours=-1)
             booking.status = 'approved'
@@ -2130,14 +2164,14 @@ class TestAutoReleaseTask(AppTests):
     @patch('scheduler_tasks.send_email')
     @patch('scheduler_tasks.add_audit_log')
     @patch('scheduler_tasks.db.session.commit')
-    @patch('scheduler_tasks.BookingSettings.query')
-    def test_auto_release_disabled_by_minutes_none(self, mock_settings_query, mock_commit, mock_audit, mock_send_email):
+    @patch('scheduler_tasks.current_booking_settings')
+    def test_auto_release_disabled_by_minutes_none(self, mock_current_settings, mock_commit, mock_audit, mock_send_email):
         with self.app.app_context():
             mock_settings = MagicMock(spec=BookingSettings)
             mock_settings.enable_check_in_out = True
             mock_settings.auto_release_if_not_checked_in_minutes = None
             mock_settings.global_time_offset_hours = 0
-            mock_settings_query.first.return_value = mock_settings
+            mock_current_settings.return_value = mock_settings
 
             booking = self._create_booking(self.test_user.username, self.test_resource.id, start_offset_hours=-1)
             booking.status = 'approved'
@@ -2151,21 +2185,19 @@ class TestAutoReleaseTask(AppTests):
             self.assertEqual(booking.status, 'approved')
             mock_commit.assert_not_called()
 
-    @patch('scheduler_tasks.get_current_effective_time')
     @patch('scheduler_tasks.send_email')
     @patch('scheduler_tasks.add_audit_log')
     @patch('scheduler_tasks.db.session.commit')
-    @patch('scheduler_tasks.BookingSettings.query')
-    def test_booking_released_successfully(self, mock_settings_query, mock_commit, mock_audit, mock_send_email, mock_effective_time):
+    @patch('scheduler_tasks.current_booking_settings')
+    def test_booking_released_successfully(self, mock_current_settings, mock_commit, mock_audit, mock_send_email):
         with self.app.app_context():
             mock_settings = MagicMock(spec=BookingSettings)
             mock_settings.enable_check_in_out = True
             mock_settings.auto_release_if_not_checked_in_minutes = 30
             mock_settings.global_time_offset_hours = 0
-            mock_settings_query.first.return_value = mock_settings
+            mock_current_settings.return_value = mock_settings
 
             mocked_now_aware = datetime(2024, 1, 1, 12, 0, 0, tzinfo=timezone_original.utc)
-            mock_effective_time.return_value = mocked_now_aware
 
             booking_start_local_naive = mocked_now_aware.replace(tzinfo=None) - timedelta(minutes=60)
 
@@ -2177,7 +2209,8 @@ class TestAutoReleaseTask(AppTests):
             db.session.add(booking)
             db.session.commit()
 
-            auto_release_unclaimed_bookings(app_instance=self.app)
+            with freeze_time(mocked_now_aware):
+                auto_release_unclaimed_bookings(app_instance=self.app)
 
             booking = db.session.get(Booking, booking.id)
             self.assertEqual(booking.status, 'system_cancelled_no_checkin')
@@ -2185,19 +2218,17 @@ class TestAutoReleaseTask(AppTests):
             mock_audit.assert_called_once_with(action="AUTO_RELEASE_NO_CHECKIN", details=ANY)
             mock_send_email.assert_called_once()
 
-    @patch('scheduler_tasks.get_current_effective_time')
     @patch('scheduler_tasks.db.session.commit')
-    @patch('scheduler_tasks.BookingSettings.query')
-    def test_booking_not_yet_due_for_release(self, mock_settings_query, mock_commit, mock_effective_time):
+    @patch('scheduler_tasks.current_booking_settings')
+    def test_booking_not_yet_due_for_release(self, mock_current_settings, mock_commit):
         with self.app.app_context():
             mock_settings = MagicMock(spec=BookingSettings)
             mock_settings.enable_check_in_out = True
             mock_settings.auto_release_if_not_checked_in_minutes = 30
             mock_settings.global_time_offset_hours = 0
-            mock_settings_query.first.return_value = mock_settings
+            mock_current_settings.return_value = mock_settings
 
             mocked_now_aware = datetime(2024, 1, 1, 12, 0, 0, tzinfo=timezone_original.utc)
-            mock_effective_time.return_value = mocked_now_aware
 
             booking_start_local_naive = mocked_now_aware.replace(tzinfo=None) - timedelta(minutes=15)
             booking = Booking(
@@ -2208,24 +2239,23 @@ class TestAutoReleaseTask(AppTests):
             db.session.add(booking)
             db.session.commit()
 
-            auto_release_unclaimed_bookings(app_instance=self.app)
+            with freeze_time(mocked_now_aware):
+                auto_release_unclaimed_bookings(app_instance=self.app)
             booking = db.session.get(Booking, booking.id)
             self.assertEqual(booking.status, 'approved')
             mock_commit.assert_not_called()
 
-    @patch('scheduler_tasks.get_current_effective_time')
     @patch('scheduler_tasks.db.session.commit')
-    @patch('scheduler_tasks.BookingSettings.query')
-    def test_booking_already_checked_in_not_released(self, mock_settings_query, mock_commit, mock_effective_time):
+    @patch('scheduler_tasks.current_booking_settings')
+    def test_booking_already_checked_in_not_released(self, mock_current_settings, mock_commit):
         with self.app.app_context():
             mock_settings = MagicMock(spec=BookingSettings)
             mock_settings.enable_check_in_out = True
             mock_settings.auto_release_if_not_checked_in_minutes = 30
             mock_settings.global_time_offset_hours = 0
-            mock_settings_query.first.return_value = mock_settings
+            mock_current_settings.return_value = mock_settings
 
             mocked_now_aware = datetime(2024, 1, 1, 12, 0, 0, tzinfo=timezone_original.utc)
-            mock_effective_time.return_value = mocked_now_aware
 
             booking_start_local_naive = mocked_now_aware.replace(tzinfo=None) - timedelta(minutes=60)
             checked_in_time_local_naive = mocked_now_aware.replace(tzinfo=None) - timedelta(minutes=50)
@@ -2238,7 +2268,8 @@ class TestAutoReleaseTask(AppTests):
             db.session.add(booking)
             db.session.commit()
 
-            auto_release_unclaimed_bookings(app_instance=self.app)
+            with freeze_time(mocked_now_aware):
+                auto_release_unclaimed_bookings(app_instance=self.app)
             booking = db.session.get(Booking, booking.id)
             self.assertEqual(booking.status, 'approved')
             mock_commit.assert_not_called()
@@ -2256,21 +2287,19 @@ class TestAutoCheckoutTaskUpdated(AppTests):
         self.test_user = User.query.filter_by(username='testuser').first()
         self.test_resource = self.resource1
 
-    @patch('scheduler_tasks.get_current_effective_time')
     @patch('scheduler_tasks.send_email')
     @patch('scheduler_tasks.add_audit_log')
     @patch('scheduler_tasks.db.session.commit')
-    @patch('scheduler_tasks.BookingSettings.query')
-    def test_booking_checked_out_successfully_minutes(self, mock_settings_query, mock_commit, mock_audit, mock_send_email, mock_effective_time):
+    @patch('scheduler_tasks.current_booking_settings')
+    def test_booking_checked_out_successfully_minutes(self, mock_current_settings, mock_commit, mock_audit, mock_send_email):
         with self.app.app_context():
             mock_settings = MagicMock(spec=BookingSettings)
             mock_settings.enable_auto_checkout = True
             mock_settings.auto_checkout_delay_minutes = 60 # Test with 60 minutes
             mock_settings.global_time_offset_hours = 0
-            mock_settings_query.first.return_value = mock_settings
+            mock_current_settings.return_value = mock_settings
 
             mocked_now_aware = datetime(2024, 1, 1, 12, 0, 0, tzinfo=timezone_original.utc)
-            mock_effective_time.return_value = mocked_now_aware
 
             # Booking ended 90 minutes ago (local naive). Delay is 60 minutes. So, it's overdue.
             booking_end_local_naive = mocked_now_aware.replace(tzinfo=None) - timedelta(minutes=90)
@@ -2285,7 +2314,8 @@ class TestAutoCheckoutTaskUpdated(AppTests):
             db.session.add(booking)
             db.session.commit()
 
-            auto_checkout_overdue_bookings(app_instance=self.app)
+            with freeze_time(mocked_now_aware):
+                auto_checkout_overdue_bookings(app_instance=self.app)
 
             booking = db.session.get(Booking, booking.id)
             self.assertEqual(booking.status, 'completed')
@@ -2296,19 +2326,17 @@ class TestAutoCheckoutTaskUpdated(AppTests):
             mock_audit.assert_called_once()
             mock_send_email.assert_called_once()
 
-    @patch('scheduler_tasks.get_current_effective_time')
     @patch('scheduler_tasks.db.session.commit')
-    @patch('scheduler_tasks.BookingSettings.query')
-    def test_booking_not_yet_due_for_checkout_minutes(self, mock_settings_query, mock_commit, mock_effective_time):
+    @patch('scheduler_tasks.current_booking_settings')
+    def test_booking_not_yet_due_for_checkout_minutes(self, mock_current_settings, mock_commit):
         with self.app.app_context():
             mock_settings = MagicMock(spec=BookingSettings)
             mock_settings.enable_auto_checkout = True
             mock_settings.auto_checkout_delay_minutes = 60
             mock_settings.global_time_offset_hours = 0
-            mock_settings_query.first.return_value = mock_settings
+            mock_current_settings.return_value = mock_settings
 
             mocked_now_aware = datetime(2024, 1, 1, 12, 0, 0, tzinfo=timezone_original.utc)
-            mock_effective_time.return_value = mocked_now_aware
 
             # Booking ended 30 minutes ago (local naive). Delay is 60 minutes. Not overdue.
             booking_end_local_naive = mocked_now_aware.replace(tzinfo=None) - timedelta(minutes=30)
@@ -2321,7 +2349,8 @@ class TestAutoCheckoutTaskUpdated(AppTests):
             db.session.add(booking)
             db.session.commit()
 
-            auto_checkout_overdue_bookings(app_instance=self.app)
+            with freeze_time(mocked_now_aware):
+                auto_checkout_overdue_bookings(app_instance=self.app)
             booking = db.session.get(Booking, booking.id)
             self.assertEqual(booking.status, 'checked_in')
             self.assertIsNone(booking.checked_out_at)
@@ -2906,6 +2935,804 @@ class TestUnavailableDatesAPI(AppTests):
             db.session.commit()
 
 
+class TestUnavailableDatesBitmap(AppTestBase):
+    def setUp(self):
+        super().setUp()
+        self.test_user = User.query.filter_by(username='testuser').first()
+
+    def _set_booking_settings(self, allow_past_bookings, past_booking_time_adjustment_hours, global_time_offset_hours):
+        settings = BookingSettings.query.first()
+        if not settings:
+            settings = BookingSettings()
+            db.session.add(settings)
+        settings.allow_past_bookings = allow_past_bookings
+        settings.past_booking_time_adjustment_hours = past_booking_time_adjustment_hours
+        settings.global_time_offset_hours = global_time_offset_hours
+        settings.allow_multiple_resources_same_time = True
+        db.session.commit()
+
+    def test_bitmap_engine_marks_fully_booked_and_maintenance_days(self):
+        from utils import get_unavailable_dates_for_user
+        self._set_booking_settings(allow_past_bookings=False, past_booking_time_adjustment_hours=0, global_time_offset_hours=0)
+        now_utc = datetime_original(2025, 7, 15, 6, 0, 0, tzinfo=timezone_original.utc)
+        start_date = now_utc.date()
+        end_date = start_date + timedelta_original(days=3)
+        slots = [(time(8, 0), time(12, 0)), (time(13, 0), time(17, 0))]
+
+        # Resource 1 is fully booked on the 16th; resource 2 is under maintenance until the 17th.
+        db.session.add(Booking(user_name='someone_else', resource_id=self.resource1.id, title='All day',
+                               start_time=datetime_original(2025, 7, 16, 8, 0), end_time=datetime_original(2025, 7, 16, 17, 0), status='approved'))
+        self.resource2.is_under_maintenance = True
+        self.resource2.maintenance_until = datetime_original(2025, 7, 17, 0, 0)
+        db.session.commit()
+
+        settings = BookingSettings.query.first()
+        result = get_unavailable_dates_for_user(self.test_user, [self.resource1, self.resource2], start_date, end_date,
+                                                slots, settings, now_utc, flask_current_app.logger)
+        self.assertEqual(result, {'2025-07-16'})
+
+        result_single = get_unavailable_dates_for_user(self.test_user, [self.resource2], start_date, end_date,
+                                                       slots, settings, now_utc, flask_current_app.logger)
+        self.assertEqual(result_single, {'2025-07-15', '2025-07-16', '2025-07-17'})
+
+
+class TestFreeSlotSearch(AppTestBase):
+    def setUp(self):
+        super().setUp()
+        self.test_user = User.query.filter_by(username='testuser').first()
+
+    def test_find_free_slots_returns_aligned_duration_slots_across_resources(self):
+        from utils import find_free_slots_for_user
+        db.session.add(Booking(user_name='someone_else', resource_id=self.resource1.id, title='Morning',
+                               start_time=datetime_original(2025, 7, 16, 0, 0), end_time=datetime_original(2025, 7, 16, 10, 0), status='approved'))
+        db.session.add(Booking(user_name='someone_else', resource_id=self.resource2.id, title='Early',
+                               start_time=datetime_original(2025, 7, 16, 0, 0), end_time=datetime_original(2025, 7, 16, 9, 0), status='approved'))
+        db.session.add(Booking(user_name='someone_else', resource_id=self.resource2.id, title='Cancelled',
+                               start_time=datetime_original(2025, 7, 16, 9, 0), end_time=datetime_original(2025, 7, 16, 12, 0), status='cancelled'))
+        db.session.add(Booking(user_id=self.test_user.id, user_name='testuser', resource_id=self.resource1.id, title='Own',
+                               start_time=datetime_original(2025, 7, 16, 16, 0), end_time=datetime_original(2025, 7, 16, 17, 0), status='approved'))
+        db.session.commit()
+
+        def found(**kwargs):
+            slots = find_free_slots_for_user([self.resource1, self.resource2], self.test_user, datetime_original(2025, 7, 16, 0, 0),
+                                             datetime_original(2025, 7, 18, 0, 0), timedelta_original(hours=4), 4, flask_current_app.logger, **kwargs)
+            return [(s['resource_id'], s['start_time'].hour, s['end_time'] - s['start_time']) for s in slots]
+        four_hours = timedelta_original(hours=4)
+        self.assertEqual(found(), [
+            (self.resource1.id, 12, four_hours), (self.resource2.id, 12, four_hours),
+            (self.resource2.id, 16, four_hours), (self.resource1.id, 20, four_hours),
+        ])
+        # The user's own booking blocks the same time on every other resource too
+        self.assertEqual(found(allow_multiple_resources_same_time=False), [
+            (self.resource1.id, 12, four_hours), (self.resource2.id, 12, four_hours),
+            (self.resource1.id, 20, four_hours), (self.resource2.id, 20, four_hours),
+        ])
+
+    def test_search_stops_at_the_booking_lead_time(self):
+        self._create_admin_user() # Otherwise every request gets the "setup required" 503
+        self.login('testuser', 'password')
+        settings = BookingSettings.query.first() or BookingSettings()
+        settings.max_booking_days_in_future = 2
+        db.session.add(settings)
+        db.session.commit()
+        today = datetime_original.now().date()
+        def search(start_offset_days):
+            day = (today + timedelta_original(days=start_offset_days)).isoformat()
+            response = self.client.get(f'/api/resources/free_slots?start_date={day}&duration_minutes=60&limit=5')
+            self.assertEqual(response.status_code, 200, response.get_data(as_text=True))
+            return response.get_json()
+        self.assertEqual(len(search(2)), 5)
+        self.assertEqual(search(4), [])
+        self.assertEqual(self.client.get(f'/api/resources/free_slots?start_date={today.isoformat()}&duration_minutes=1441').status_code, 400)
+
+
+class TestResourceSearch(AppTestBase):
+    def setUp(self):
+        super().setUp()
+        self.resource3 = Resource(name='Room C for resource search', capacity=5, status='published', floor_map_id=self.floor_map.id)
+        db.session.add(self.resource3)
+        db.session.commit()
+
+    def test_resource_search_intersects_normalized_tags_and_equipment(self):
+        from urllib.parse import parse_qsl
+        from werkzeug.datastructures import MultiDict
+        from models import ResourceTag
+        from routes.api_resources import _apply_resource_search_filters
+        def names(query_string):
+            query = _apply_resource_search_filters(Resource.query, MultiDict(parse_qsl(query_string)))
+            return sorted(r.name for r in query.all())
+
+        self.assertEqual(names('equipment=whiteboard'), ['Room A', 'Room B'])
+        self.assertEqual(names('equipment=WHITE,proj'), ['Room A'])
+        self.assertEqual(names('equipment=whiteboard&tags=small'), ['Room B'])
+        self.assertEqual(names('equipment=white&match=exact'), [])
+        self.assertEqual(names('tags=100%'), [])
+
+        self.resource3.tags = ' Quiet, small ,quiet'
+        db.session.commit()
+        self.assertEqual(sorted(t.name for t in ResourceTag.query.filter_by(resource_id=self.resource3.id)), ['quiet', 'small'])
+        self.assertEqual(names('tags=small&match=exact'), sorted(['Room B', self.resource3.name]))
+        self.assertEqual(names('tags=quiet&capacity=5'), [self.resource3.name])
+        self.assertEqual(self.resource3.tags, ' Quiet, small ,quiet')
+
+
+class TestAvailabilityMatrix(AppTestBase):
+    def test_availability_matrix_marks_booked_slots_and_maintenance_days(self):
+        from utils import build_availability_matrix
+        db.session.add(Booking(user_name='someone_else', resource_id=self.resource1.id, title='Afternoon',
+                               start_time=datetime_original(2025, 7, 16, 13, 0), end_time=datetime_original(2025, 7, 16, 14, 0), status='approved'))
+        db.session.add(Booking(user_name='someone_else', resource_id=self.resource1.id, title='Cancelled',
+                               start_time=datetime_original(2025, 7, 15, 8, 0), end_time=datetime_original(2025, 7, 15, 9, 0), status='cancelled'))
+        self.resource2.is_under_maintenance = True
+        self.resource2.maintenance_until = datetime_original(2025, 7, 15, 0, 0)
+        db.session.commit()
+
+        slots = [(time(8, 0), time(12, 0)), (time(13, 0), time(17, 0)), (time(8, 0), time(17, 0))]
+        matrix = build_availability_matrix([self.resource1, self.resource2], date(2025, 7, 15), date(2025, 7, 17),
+                                           slots, flask_current_app.logger)
+        self.assertEqual(matrix['occupied'][self.resource1.id], [0, 0b110, 0])
+        self.assertEqual(matrix['occupied'][self.resource2.id], [0, 0, 0])
+        self.assertEqual(matrix['blocked'][self.resource1.id], [0, 0, 0])
+        self.assertEqual(matrix['blocked'][self.resource2.id], [1, 0, 0])
+
+        self._create_admin_user() # Otherwise every request gets the "setup required" 503
+        draft = Resource(name='Draft Room', capacity=2, status='draft')
+        db.session.add(draft)
+        db.session.commit()
+        response = self.client.get(f'/api/resources/availability_matrix?resource_ids={self.resource1.id},{draft.id}&start_date=2025-07-16')
+        self.assertEqual(response.status_code, 200, response.get_data(as_text=True))
+        self.assertEqual(response.get_json()['resource_ids'], [self.resource1.id]) # Drafts stay hidden from anonymous callers
+
+    def test_availability_matrix_with_slots_off_the_hour(self):
+        from utils import build_availability_matrix
+        for start, end in ((datetime_original(2025, 7, 16, 8, 0), datetime_original(2025, 7, 16, 8, 15)),
+                           (datetime_original(2025, 7, 16, 9, 40), datetime_original(2025, 7, 16, 9, 50)),
+                           (datetime_original(2025, 7, 16, 23, 50), datetime_original(2025, 7, 17, 0, 5))):
+            db.session.add(Booking(user_name='someone_else', resource_id=self.resource1.id, title='Short',
+                                   start_time=start, end_time=end, status='approved'))
+        db.session.commit()
+
+        slots = [(time(8, 15), time(9, 0)), (time(9, 0), time(9, 45)), (time(9, 45), time(10, 30)), (time(0, 0), time(0, 5))]
+        matrix = build_availability_matrix([self.resource1], date(2025, 7, 16), date(2025, 7, 17), slots, flask_current_app.logger)
+        self.assertEqual(matrix['occupied'][self.resource1.id], [0b0110, 0b1000])
+        with self.assertRaises(ValueError):
+            build_availability_matrix([self.resource1], date(2025, 7, 16), date(2025, 7, 16), [(time(8, 0, 30), time(9, 0))], flask_current_app.logger)
+
+
+class TestResourceDayOccupancy(AppTestBase):
+    def test_resource_day_occupancy_follows_booking_writes(self):
+        from models import ResourceDayOccupancy
+        from occupancy import rebuild_all_resource_day_occupancy
+        from utils import build_availability_matrix
+
+        def stored_rows():
+            return {(row.resource_id, row.day): (row.slot_bits, row.booking_count, row.booked_minutes)
+                    for row in ResourceDayOccupancy.query.filter_by(resource_id=self.resource1.id).all()}
+
+        booking = Booking(user_name='someone_else', resource_id=self.resource1.id, title='Overnight',
+                          start_time=datetime_original(2025, 7, 16, 23, 0), end_time=datetime_original(2025, 7, 17, 1, 0))
+        db.session.add(booking)
+        db.session.commit()
+        self.assertEqual(stored_rows(), {
+            (self.resource1.id, date(2025, 7, 16)): (0b11 << 46, 1, 60),
+            (self.resource1.id, date(2025, 7, 17)): (0b11, 1, 60),
+        })
+
+        booking.start_time = datetime_original(2025, 7, 18, 8, 0)
+        booking.end_time = datetime_original(2025, 7, 18, 9, 15)
+        db.session.commit()
+        self.assertEqual(stored_rows(), {(self.resource1.id, date(2025, 7, 18)): (0b111 << 16, 1, 75)})
+
+        slots = [(time(8, 0), time(12, 0)), (time(13, 0), time(17, 0))]
+        scanned = build_availability_matrix([self.resource1], date(2025, 7, 17), date(2025, 7, 19), slots, flask_current_app.logger)
+        flask_current_app.config['OCCUPANCY_TABLE_READS_ENABLED'] = True
+        try:
+            from_table = build_availability_matrix([self.resource1], date(2025, 7, 17), date(2025, 7, 19), slots, flask_current_app.logger)
+        finally:
+            flask_current_app.config['OCCUPANCY_TABLE_READS_ENABLED'] = False
+        self.assertEqual(from_table, scanned)
+
+        booking.status = 'cancelled'
+        db.session.commit()
+        self.assertEqual(stored_rows(), {})
+
+        booking.status = 'approved'
+        db.session.commit()
+        db.session.delete(booking)
+        db.session.commit()
+        self.assertEqual(stored_rows(), {})
+
+        db.session.add(Booking(user_name='someone_else', resource_id=self.resource1.id, title='Again',
+                               start_time=datetime_original(2025, 7, 20, 10, 0), end_time=datetime_original(2025, 7, 20, 10, 30)))
+        db.session.commit()
+        expected = stored_rows()
+        ResourceDayOccupancy.query.delete()
+        db.session.commit()
+        rebuild_all_resource_day_occupancy(db.session.connection())
+        db.session.commit()
+        self.assertEqual(stored_rows(), expected)
+
+
+class TestBookingStatus(AppTestBase):
+    def test_booking_status_is_normalized_on_write(self):
+        booking = Booking(user_name='someone_else', resource_id=self.resource1.id, title='Normalized',
+                          start_time=datetime_original(2025, 7, 16, 8, 0), end_time=datetime_original(2025, 7, 16, 9, 0),
+                          status='  Checked_In ')
+        db.session.add(booking)
+        db.session.commit()
+        self.assertEqual(booking.status, 'checked_in')
+        self.assertEqual(Booking.query.filter(Booking.status == 'checked_in').count(), 1)
+        with self.assertRaises(ValueError):
+            booking.status = 'bogus'
+        with self.assertRaises(IntegrityError):
+            db.session.execute(text("UPDATE booking SET status = 'bogus' WHERE id = :id"), {'id': booking.id})
+        db.session.rollback()
+
+
+class TestBookingUserLink(AppTestBase):
+    def test_booking_user_id_follows_user_name_and_renames(self):
+        from utils import sync_booking_user_names
+        user = User.query.filter_by(username='testuser').first()
+        booking = Booking(user_name='testuser', resource_id=self.resource1.id, title='Linked',
+                          start_time=datetime_original(2025, 7, 16, 8, 0), end_time=datetime_original(2025, 7, 16, 9, 0))
+        orphan = Booking(user_name='nobody_by_that_name', resource_id=self.resource1.id, title='Orphan',
+                         start_time=datetime_original(2025, 7, 16, 10, 0), end_time=datetime_original(2025, 7, 16, 11, 0))
+        db.session.add_all([booking, orphan])
+        db.session.commit()
+        self.assertEqual(booking.user_id, user.id)
+        self.assertIsNone(orphan.user_id)
+
+        user.username = 'renamed_testuser'
+        self.assertEqual(sync_booking_user_names(user), 1)
+        db.session.commit()
+        self.assertEqual(db.session.get(Booking, booking.id).user_name, 'renamed_testuser')
+        self.assertEqual([b.id for b in user.bookings], [booking.id])
+
+        # Reassigning by username moves the ownership, whatever the order of assignments
+        other = User(username='other_owner', email='other_owner@example.com')
+        other.set_password('password')
+        db.session.add(other)
+        db.session.commit()
+        booking.user_name = 'other_owner'
+        db.session.commit()
+        self.assertEqual(booking.user_id, other.id)
+        newcomer = User(username='newcomer', email='newcomer@example.com')
+        newcomer.set_password('password')
+        db.session.add(newcomer)
+        booking.user_name = 'newcomer' # The user is only flushed together with the booking
+        db.session.commit()
+        self.assertEqual(booking.user_id, newcomer.id)
+
+        # A creation site that already knows the user pays no lookup query
+        import re
+        from sqlalchemy import event
+        user_id, username, resource_id = user.id, user.username, self.resource1.id
+        statements = []
+        def record(conn, cursor, statement, *args):
+            statements.append(statement)
+        event.listen(db.engine, 'before_cursor_execute', record)
+        try:
+            explicit = Booking(user_name=username, user_id=user_id, resource_id=resource_id, title='Explicit',
+                               start_time=datetime_original(2025, 7, 17, 8, 0), end_time=datetime_original(2025, 7, 17, 9, 0))
+            db.session.add(explicit)
+            db.session.flush()
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', record)
+        self.assertFalse([s for s in statements if re.search(r'FROM "?user"?\s', s)], statements)
+        self.assertEqual(explicit.user_id, user_id)
+        db.session.rollback()
+
+
+class TestCompiledPermissions(AppTestBase):
+    def test_compiled_permissions_follow_role_changes(self):
+        from models import parse_allowed_user_ids
+        from utils import check_booking_permission
+        user = User.query.filter_by(username='testuser').first()
+        role = Role(name='Compiled Perms Role', permissions='manage_bookings, view_reports')
+        user.roles.append(role)
+        db.session.commit()
+        self.assertTrue(user.has_permission('view_reports'))
+        self.assertFalse(user.has_permission('manage_users'))
+        self.assertEqual(user.role_ids, frozenset({role.id}))
+
+        role.permissions = 'all_permissions'
+        self.assertTrue(user.has_permission('manage_users'))
+        user.roles.remove(role)
+        self.assertFalse(user.has_permission('manage_users'))
+
+        self.resource1.booking_restriction = 'restricted_roles'
+        self.resource1.roles.append(role)
+        db.session.commit()
+        logger = flask_current_app.logger
+        self.assertFalse(check_booking_permission(user, self.resource1, logger)[0])
+        user.roles.append(role)
+        self.assertTrue(check_booking_permission(user, self.resource1, logger)[0])
+
+        self.resource1.booking_restriction = 'specific_users_only'
+        self.resource1.allowed_user_ids = json.dumps([user.id])
+        self.assertEqual(check_booking_permission(user, self.resource1, logger), (True, "User is in the allowed list"))
+        self.resource1.allowed_user_ids = '[1, "x"]'
+        self.assertEqual(check_booking_permission(user, self.resource1, logger), (False, "Resource has malformed allowed user list"))
+        self.resource1.allowed_user_ids = '[1,'
+        self.assertEqual(check_booking_permission(user, self.resource1, logger), (False, "Resource has invalid allowed user list format"))
+        self.assertGreater(parse_allowed_user_ids.cache_info().hits + parse_allowed_user_ids.cache_info().currsize, 0)
+        db.session.rollback()
+
+
+class TestBookingOverlapGuards(AppTestBase):
+    def test_booking_overlap_guards(self):
+        from booking_locks import lock_resources_for_booking, is_booking_conflict_error, database_enforces_booking_overlaps
+        from models import ResourceBookingLock
+        from routes.api_bookings import _first_overlapping
+        if database_enforces_booking_overlaps():
+            self.skipTest("Postgres relies on the exclusion constraint instead of lock rows")
+
+        lock_resources_for_booking([self.resource2.id, self.resource1.id, None])
+        lock_resources_for_booking([self.resource1.id])
+        db.session.commit()
+        versions = dict(db.session.query(ResourceBookingLock.resource_id, ResourceBookingLock.version).all())
+        self.assertEqual(versions, {self.resource1.id: 2, self.resource2.id: 1})
+
+        start = datetime_original(2031, 3, 3, 9, 0)
+        existing = Booking(user_name='someone_else', resource_id=self.resource1.id, title='Existing',
+                           start_time=start, end_time=start + timedelta_original(hours=1), status='approved')
+        db.session.add(existing)
+        db.session.commit()
+        self.assertIs(_first_overlapping([existing], start + timedelta_original(minutes=30), start + timedelta_original(hours=2)), existing)
+        self.assertIsNone(_first_overlapping([existing], start + timedelta_original(hours=1), start + timedelta_original(hours=2)))
+
+        db.session.add(Booking(user_name='someone_else', resource_id=self.resource1.id, title='Duplicate',
+                               start_time=existing.start_time, end_time=existing.end_time, status='approved'))
+        with self.assertRaises(IntegrityError) as raised:
+            db.session.commit()
+        db.session.rollback()
+        self.assertTrue(is_booking_conflict_error(raised.exception))
+
+    def test_reactivating_a_booking_over_a_taken_slot_is_a_conflict(self):
+        admin = self._create_admin_user()
+        self.login(admin.username, 'adminpass')
+        start = datetime_original(2031, 3, 4, 9, 0)
+        held = Booking(user_name='someone_else', resource_id=self.resource1.id, title='Held',
+                       start_time=start, end_time=start + timedelta_original(hours=1), status='on_hold')
+        db.session.add(held)
+        db.session.add(Booking(user_name='someone_else', resource_id=self.resource1.id, title='Taken meanwhile',
+                               start_time=start + timedelta_original(minutes=30), end_time=start + timedelta_original(hours=2), status='approved'))
+        db.session.commit()
+        held_id = held.id
+
+        response = self.client.post(f'/api/admin/bookings/{held_id}/update_status', json={'new_status': 'approved'})
+        self.assertEqual(response.status_code, 409, response.get_data(as_text=True))
+        db.session.expire_all()
+        self.assertEqual(db.session.get(Booking, held_id).status, 'on_hold')
+        response = self.client.post(f'/api/admin/bookings/{held_id}/update_status', json={'new_status': 'under_review'})
+        self.assertEqual(response.status_code, 200, response.get_data(as_text=True))
+
+
+class TestBookingArchive(AppTestBase):
+    def test_archive_moves_finished_bookings_and_past_reads_through(self):
+        from booking_archive import archive_finished_bookings
+        from models import BookingArchive
+        from routes.api_bookings import _fetch_user_bookings_data
+        user = User.query.filter_by(username='testuser').first()
+        old_start = datetime_original(2020, 5, 4, 10, 0)
+        finished = Booking(user_name='testuser', resource_id=self.resource1.id, title='Old Cancelled',
+                           start_time=old_start, end_time=old_start + timedelta_original(hours=1), status='cancelled')
+        old_active = Booking(user_name='testuser', resource_id=self.resource1.id, title='Old Approved',
+                             start_time=old_start + timedelta_original(hours=2), end_time=old_start + timedelta_original(hours=3), status='approved')
+        recent_start = datetime_original(2020, 6, 20, 10, 0)
+        recent = Booking(user_name='testuser', resource_id=self.resource2.id, title='Recent Completed',
+                         start_time=recent_start, end_time=recent_start + timedelta_original(hours=1), status='completed')
+        db.session.add_all([finished, old_active, recent])
+        db.session.commit()
+        finished_id = finished.id
+
+        self.assertEqual(archive_finished_bookings(datetime_original(2020, 6, 1), batch_size=1), 1)
+        self.assertIsNone(db.session.get(Booking, finished_id))
+        archived = db.session.get(BookingArchive, finished_id)
+        self.assertEqual((archived.title, archived.user_id, archived.status), ('Old Cancelled', user.id, 'cancelled'))
+        self.assertEqual(Booking.query.filter(Booking.title.in_(['Old Approved', 'Recent Completed'])).count(), 2)
+
+        past, pagination, _, _ = _fetch_user_bookings_data(user.id, 'past', 1, 50, None, None, None, flask_current_app.logger)
+        past_titles = [b['title'] for b in past]
+        self.assertIn('Old Cancelled', past_titles)
+        self.assertIn('Recent Completed', past_titles)
+        filtered, _, _, _ = _fetch_user_bookings_data(user.id, 'past', 1, 50, 'cancelled', None, '2020-05-04', flask_current_app.logger)
+        self.assertEqual([b['id'] for b in filtered], [finished_id])
+
+        # Archiving the newest row must not free its id for the next booking
+        recent_id = recent.id
+        self.assertIsNone(Booking.query.filter(Booking.id > recent_id).first())
+        self.assertEqual(archive_finished_bookings(datetime_original(2020, 7, 1)), 1)
+        later = Booking(user_name='testuser', resource_id=self.resource2.id, title='After archive',
+                        start_time=recent_start + timedelta_original(days=1), end_time=recent_start + timedelta_original(days=1, hours=1))
+        db.session.add(later)
+        db.session.commit()
+        self.assertGreater(later.id, recent_id)
+
+
+class TestAuditLogBuffer(AppTestBase):
+    def test_audit_log_buffer_search_and_retention(self):
+        from audit_log import audit_log_search_filter, flush_audit_log_buffer, prune_audit_logs
+        from utils import add_audit_log
+        db.session.query(AuditLog).delete()
+        db.session.commit()
+
+        add_audit_log(action='CREATE_BOOKING', details='Booking 41 for Conference Room Alpha', username='alice')
+        add_audit_log(action='DELETE_USER', details='Removed account bob', username='carol')
+        self.assertEqual(AuditLog.query.count(), 0) # Buffered until the next commit
+        db.session.commit()
+        self.assertEqual(AuditLog.query.count(), 2)
+
+        add_audit_log(action='CHECK_IN_SUCCESS', details='Checked into Alpha', username='alice')
+        flush_audit_log_buffer()
+        self.assertEqual(AuditLog.query.count(), 3)
+
+        def search(term):
+            return sorted(log.action for log in AuditLog.query.filter(audit_log_search_filter(term)).all())
+        self.assertEqual(search('alpha'), ['CHECK_IN_SUCCESS', 'CREATE_BOOKING'])
+        self.assertEqual(search('conf roo'), ['CREATE_BOOKING'])
+        self.assertEqual(search('create_booking'), ['CREATE_BOOKING'])
+        self.assertEqual(search('carol'), ['DELETE_USER'])
+        self.assertIsNone(audit_log_search_filter('%%'))
+
+        old_log = AuditLog.query.filter_by(action='DELETE_USER').first()
+        old_log.timestamp = datetime_original(2020, 1, 1)
+        db.session.commit()
+        self.assertEqual(prune_audit_logs(datetime_original(2021, 1, 1), batch_size=1), 1)
+        self.assertEqual(search('carol'), [])
+        self.assertEqual(AuditLog.query.count(), 2)
+
+
+class TestDbPool(AppTestBase):
+    def test_pool_options_and_metrics(self):
+        from sqlalchemy import create_engine
+        from db_pool import InstrumentedQueuePool, build_engine_options, checkout_stats, pool_metrics, render_prometheus
+        self.assertEqual(build_engine_options({'SQLALCHEMY_DATABASE_URI': 'sqlite:///:memory:'}), {})
+        pg_config = {'SQLALCHEMY_DATABASE_URI': 'postgresql://u@db/app', 'DB_POOL_SIZE': 8, 'DB_MAX_OVERFLOW': 2,
+                     'DB_STATEMENT_TIMEOUT_MS': 5000}
+        options = build_engine_options(pg_config)
+        self.assertIs(options['poolclass'], InstrumentedQueuePool)
+        self.assertEqual((options['pool_size'], options['max_overflow'], options['pool_pre_ping']), (8, 2, True))
+        self.assertEqual(options['connect_args'], {'options': '-c statement_timeout=5000'})
+        self.assertNotIn('connect_args', build_engine_options(dict(pg_config, DB_PGBOUNCER_TRANSACTION_MODE=True)))
+
+        engine = create_engine('sqlite://', poolclass=InstrumentedQueuePool, pool_size=1, max_overflow=0)
+        checkouts_before = checkout_stats.snapshot()['checkouts_total']
+        with engine.connect():
+            metrics = pool_metrics(engine)
+            self.assertEqual((metrics['pool_size'], metrics['connections_in_use']), (1, 1))
+        self.assertEqual(pool_metrics(engine)['connections_in_use'], 0)
+        self.assertEqual(checkout_stats.snapshot()['checkouts_total'], checkouts_before + 1)
+        exposition = render_prometheus(pool_metrics(engine))
+        self.assertIn('# TYPE db_pool_checkouts_total counter', exposition)
+        self.assertIn('db_pool_connections_in_use{pid=', exposition)
+        engine.dispose()
+
+
+class TestReadReplicaRouting(AppTestBase):
+    def test_read_replica_routing(self):
+        from flask import Flask, request
+        from flask_sqlalchemy import SQLAlchemy
+        from sqlalchemy import column, insert, select, table
+        from db_routing import RoutingSession, reads_from_replica
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            routed_app = Flask('replica_routing_test')
+            routed_app.config.update(SQLALCHEMY_DATABASE_URI=f"sqlite:///{os.path.join(tmp_dir, 'primary.db')}",
+                                     SQLALCHEMY_BINDS={'replica': f"sqlite:///{os.path.join(tmp_dir, 'replica.db')}"})
+            routed_db = SQLAlchemy(session_options={'class_': RoutingSession})
+            routed_db.init_app(routed_app)
+            note = table('note', column('body'))
+            with routed_app.app_context():
+                for bind_key, body in ((None, 'primary'), ('replica', 'replica')):
+                    with routed_db.engines[bind_key].begin() as connection:
+                        connection.exec_driver_sql("CREATE TABLE note (body VARCHAR(20))")
+                        connection.execute(insert(note).values(body=body))
+
+            def read_bodies():
+                return sorted(routed_db.session.execute(select(note.c.body)).scalars())
+
+            @routed_app.route('/notes', methods=['GET', 'POST'])
+            @reads_from_replica
+            def notes():
+                before_write = read_bodies()
+                if 'write' in request.args:
+                    routed_db.session.execute(insert(note).values(body='new'))
+                    routed_db.session.commit()
+                return {'before': before_write, 'after': read_bodies()}
+
+            client = routed_app.test_client()
+            self.assertEqual(client.get('/notes').get_json(), {'before': ['replica'], 'after': ['replica']})
+            self.assertEqual(client.get('/notes?write=1').get_json(), {'before': ['replica'], 'after': ['new', 'primary']})
+            self.assertEqual(client.post('/notes').get_json(), {'before': ['new', 'primary'], 'after': ['new', 'primary']})
+            with routed_app.app_context():
+                self.assertEqual(read_bodies(), ['new', 'primary']) # Outside a marked view
+                routed_db.session.remove()
+                for engine in routed_db.engines.values():
+                    engine.dispose()
+
+
+class TestBookingSettingsCache(AppTestBase):
+    def test_booking_settings_snapshot_cache(self):
+        from booking_settings_cache import BookingSettingsSnapshot, current_booking_settings
+        settings = BookingSettings.query.first()
+        if not settings:
+            settings = BookingSettings()
+            db.session.add(settings)
+        settings.max_booking_days_in_future = 14
+        db.session.commit()
+
+        snapshot = current_booking_settings()
+        self.assertIsInstance(snapshot, BookingSettingsSnapshot)
+        self.assertEqual((snapshot.id, snapshot.max_booking_days_in_future), (settings.id, 14))
+        self.assertIs(current_booking_settings(), snapshot) # Unchanged version: the process-wide copy is reused
+        with self.assertRaises(AttributeError):
+            snapshot.max_booking_days_in_future = 30
+
+        version_before = settings.version
+        settings.max_booking_days_in_future = 21
+        db.session.commit()
+        self.assertEqual(settings.version, version_before + 1)
+        self.assertEqual(current_booking_settings().max_booking_days_in_future, 21)
+
+        # A write from another worker only bumps the version in the database
+        db.session.execute(text("UPDATE booking_settings SET max_booking_days_in_future = 28, version = version + 1"))
+        db.session.commit()
+        with app.test_request_context('/'):
+            request_snapshot = current_booking_settings()
+            self.assertEqual(request_snapshot.max_booking_days_in_future, 28)
+            db.session.execute(text("UPDATE booking_settings SET max_booking_days_in_future = 35, version = version + 1"))
+            db.session.commit()
+            self.assertIs(current_booking_settings(), request_snapshot) # Checked at most once per request
+        self.assertEqual(current_booking_settings().max_booking_days_in_future, 35)
+
+
+class TestEffectiveClock(AppTestBase):
+    def _set_booking_settings(self, allow_past_bookings, past_booking_time_adjustment_hours, global_time_offset_hours):
+        settings = BookingSettings.query.first()
+        if not settings:
+            settings = BookingSettings()
+            db.session.add(settings)
+        settings.allow_past_bookings = allow_past_bookings
+        settings.past_booking_time_adjustment_hours = past_booking_time_adjustment_hours
+        settings.global_time_offset_hours = global_time_offset_hours
+        settings.allow_multiple_resources_same_time = True
+        db.session.commit()
+
+    def test_effective_clock_per_request_and_freeze_hook(self):
+        from effective_clock import current_clock, freeze_time
+        from utils import get_current_effective_time
+        self._set_booking_settings(allow_past_bookings=False, past_booking_time_adjustment_hours=2, global_time_offset_hours=3)
+        frozen_utc = datetime_original(2025, 6, 11, 16, 0, 0, tzinfo=timezone_original.utc)
+        with freeze_time(frozen_utc):
+            with app.test_request_context('/'):
+                clock = current_clock()
+                self.assertEqual(clock.effective_now, frozen_utc + timedelta_original(hours=3))
+                self.assertEqual(clock.venue_now, datetime_original(2025, 6, 11, 19, 0))
+                self.assertEqual(clock.past_booking_cutoff, datetime_original(2025, 6, 11, 17, 0))
+                self.assertIs(current_clock(), clock)
+                self.assertEqual(get_current_effective_time(), clock.effective_now)
+
+                # A settings change mid-request re-derives the offsets but keeps the request's "now"
+                self._set_booking_settings(allow_past_bookings=False, past_booking_time_adjustment_hours=0, global_time_offset_hours=-1)
+                self.assertEqual(current_clock().venue_now, datetime_original(2025, 6, 11, 15, 0))
+                self.assertEqual(current_clock().utc_now, frozen_utc)
+        with app.test_request_context('/'):
+            self.assertNotEqual(current_clock().utc_now, frozen_utc)
+
+
+class TestPresignedUrlCache(AppTestBase):
+    def test_presigned_url_cache(self):
+        from time import monotonic
+        from r2_storage import R2Storage
+        storage = R2Storage()
+        storage.presigned_cache_size = 2
+        storage.bucket_name = 'bucket'
+        storage.client = MagicMock()
+        storage.client.generate_presigned_url.side_effect = lambda op, Params, ExpiresIn: f"https://r2/{Params['Key']}?sig={storage.client.generate_presigned_url.call_count}"
+
+        first_url = storage.generate_presigned_url('a.png', 'resource_uploads')
+        self.assertEqual(storage.generate_presigned_url('a.png', 'resource_uploads'), first_url) # Stable, not re-signed
+        self.assertEqual(storage.client.generate_presigned_url.call_count, 1)
+
+        storage.generate_presigned_url('b.png', 'resource_uploads')
+        storage.generate_presigned_url('a.png', 'resource_uploads') # a is now most recently used
+        storage.generate_presigned_url('c.png', 'resource_uploads') # evicts b
+        self.assertEqual(storage.client.generate_presigned_url.call_count, 3)
+        storage.generate_presigned_url('b.png', 'resource_uploads')
+        self.assertEqual(storage.client.generate_presigned_url.call_count, 4)
+
+        with patch('r2_storage.time.monotonic', return_value=monotonic() + 3400):
+            self.assertNotEqual(storage.generate_presigned_url('b.png', 'resource_uploads'), first_url) # Inside the safety margin
+        self.assertEqual(storage.client.generate_presigned_url.call_count, 5)
+
+        storage.upload_file(io.BytesIO(b'new image'), 'b.png', 'resource_uploads')
+        storage.generate_presigned_url('b.png', 'resource_uploads')
+        self.assertEqual(storage.client.generate_presigned_url.call_count, 6)
+
+
+class TestBookingImageCache(AppTestBase):
+    def test_booking_image_cache(self):
+        from PIL import Image
+        import booking_image_cache
+        coordinates = json.dumps({'x': 10, 'y': 20, 'width': 30, 'height': 20})
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            Image.new('RGB', (200, 150), 'white').save(os.path.join(tmp_dir, self.floor_map.image_filename), format='PNG')
+            cache_dir = os.path.join(tmp_dir, 'rendered')
+            with patch.dict(app.config, {'UPLOAD_FOLDER_MAPS': tmp_dir, 'BOOKING_IMAGE_CACHE_DIR': cache_dir, 'STORAGE_PROVIDER': 'local'}):
+                first = generate_booking_image(self.resource1.id, coordinates, 'Room A')
+                self.assertTrue(first)
+                with patch('utils.Image.open', wraps=Image.open) as opened:
+                    self.assertEqual(generate_booking_image(self.resource1.id, coordinates, 'Room A'), first) # Memory hit
+                    booking_image_cache._rendered.clear()
+                    self.assertEqual(generate_booking_image(self.resource1.id, coordinates, 'Room A'), first) # Disk hit
+                    self.assertEqual(opened.call_count, 0)
+                    generate_booking_image(self.resource1.id, coordinates, 'Room A renamed') # New content address
+                    self.assertEqual(opened.call_count, 1)
+
+                rendered_files = [name for _, _, names in os.walk(cache_dir) for name in names]
+                self.assertEqual(len(rendered_files), 2)
+                booking_image_cache.invalidate_booking_images(self.floor_map.id)
+                self.assertEqual([name for _, _, names in os.walk(cache_dir) for name in names], [])
+
+    def test_booking_image_cache_on_r2_follows_etag(self):
+        from botocore.exceptions import ClientError
+        from PIL import Image
+        import booking_image_cache
+        from r2_storage import r2_storage
+        coordinates = json.dumps({'x': 10, 'y': 20, 'width': 30, 'height': 20})
+        images = {}
+        for etag, colour in (('"v1"', 'white'), ('"v2"', 'black')):
+            buffer = io.BytesIO()
+            Image.new('RGB', (200, 150), colour).save(buffer, format='PNG')
+            images[etag] = buffer.getvalue()
+        current = {'etag': '"v1"'}
+        client = MagicMock()
+        client.head_object.side_effect = lambda **kwargs: {'ETag': current['etag']}
+        client.download_fileobj.side_effect = lambda bucket, key, stream: stream.write(images[current['etag']])
+        client.get_object.side_effect = ClientError({'Error': {'Code': 'NoSuchKey'}}, 'GetObject')
+        booking_image_cache.invalidate_booking_images()
+        with patch.dict(app.config, {'STORAGE_PROVIDER': 'r2', 'UPLOAD_FOLDER_MAPS': 'unused-on-r2'}), patch.object(r2_storage, 'client', client), \
+                patch.object(app.logger, 'error') as logged_error:
+            first = generate_booking_image(self.resource1.id, coordinates, 'Room A')
+            self.assertEqual(generate_booking_image(self.resource1.id, coordinates, 'Room A'), first)
+            self.assertEqual(client.download_fileobj.call_count, 1) # Same ETag: the remembered hash is reused
+            current['etag'] = '"v2"' # The map image was replaced under the same name
+            second = generate_booking_image(self.resource1.id, coordinates, 'Room A')
+            self.assertEqual(client.download_fileobj.call_count, 2)
+            self.assertNotEqual(second, first)
+            logged_error.assert_not_called() # Cache misses on R2 are not errors
+        booking_image_cache.invalidate_booking_images()
+
+
+class TestFloorMapDerivatives(AppTestBase):
+    def test_floor_map_derivatives(self):
+        from PIL import Image
+        from floor_map_derivatives import delete_floor_map_derivatives, floor_map_derivatives_payload, refresh_floor_map_derivatives
+        source = io.BytesIO()
+        exif = Image.Exif()
+        exif[0x0112] = 6 # Rotated 90 degrees: displayed as 1000x2000
+        Image.new('RGB', (2000, 1000), 'white').save(source, format='JPEG', exif=exif)
+        self.floor_map.image_filename = 'tall_map.jpg'
+        with tempfile.TemporaryDirectory() as tmp_dir, app.test_request_context():
+            with patch.dict(app.config, {'UPLOAD_FOLDER': tmp_dir, 'STORAGE_PROVIDER': 'local'}):
+                self.assertIsNone(floor_map_derivatives_payload(self.floor_map))
+                self.assertTrue(refresh_floor_map_derivatives(self.floor_map, source.getvalue()))
+                payload = floor_map_derivatives_payload(self.floor_map)
+                self.assertEqual((payload['width'], payload['height']), (1000, 2000))
+                self.assertEqual((payload['variants']['base']['width'], payload['variants']['base']['height']), (600, 1200))
+                self.assertEqual(payload['variants']['thumb']['height'], 240)
+                self.assertIn('webp', payload['formats'])
+                self.assertEqual(payload['srcset']['webp'],
+                                 '/static/floor_map_uploads/tall_map__thumb.webp 120w, '
+                                 '/static/floor_map_uploads/tall_map__display.webp 400w, '
+                                 '/static/floor_map_uploads/tall_map__base.webp 600w')
+                with Image.open(os.path.join(tmp_dir, 'tall_map__display.jpg')) as display:
+                    self.assertEqual(display.size, (400, 800))
+                self.assertEqual(len(os.listdir(tmp_dir)), 3 * len(payload['formats']))
+
+                self.floor_map.image_filename = 'replaced.png'
+                self.assertIsNone(floor_map_derivatives_payload(self.floor_map)) # Manifest is for the old image
+                delete_floor_map_derivatives(self.floor_map.image_derivatives)
+                self.assertEqual(os.listdir(tmp_dir), [])
+        db.session.rollback()
+
+
+class TestFloorMapTiles(AppTestBase):
+    def test_floor_map_tiles(self):
+        from PIL import Image
+        from floor_map_tiles import delete_floor_map_tiles, floor_map_tiles_payload, refresh_floor_map_tiles
+        source = io.BytesIO()
+        Image.new('RGB', (600, 300), 'white').save(source, format='PNG')
+        self._create_admin_user()
+        with tempfile.TemporaryDirectory() as tmp_dir, app.test_request_context():
+            with patch.dict(app.config, {'FLOOR_MAP_TILE_DIR': tmp_dir, 'FLOOR_MAP_TILE_MIN_EDGE': 1000, 'STORAGE_PROVIDER': 'local'}):
+                self.assertFalse(refresh_floor_map_tiles(self.floor_map, source.getvalue())) # Below the threshold
+                self.assertIsNone(floor_map_tiles_payload(self.floor_map))
+            with patch.dict(app.config, {'FLOOR_MAP_TILE_DIR': tmp_dir, 'FLOOR_MAP_TILE_MIN_EDGE': 500, 'STORAGE_PROVIDER': 'local'}):
+                self.assertTrue(refresh_floor_map_tiles(self.floor_map, source.getvalue()))
+                tiles = floor_map_tiles_payload(self.floor_map)
+                self.assertEqual((tiles['min_level'], tiles['max_level'], tiles['tile_size']), (8, 10, 256))
+                self.assertEqual([(l['width'], l['height'], l['columns'], l['rows']) for l in tiles['levels']],
+                                 [(150, 75, 1, 1), (300, 150, 2, 1), (600, 300, 3, 2)])
+                tile_set = json.loads(self.floor_map.image_tiles)['tile_set']
+                self.assertEqual(tiles['url_template'], f"/api/maps/tiles/{tile_set}/{{level}}/{{col}}_{{row}}.{tiles['format']}")
+
+                tile_url = tiles['url_template'].format(level=10, col=2, row=1)
+                self.assertNotEqual(self.client.get(tile_url).status_code, 200) # Tiles need a login, like map_details
+                self.login('testuser', 'password')
+                response = self.client.get(tile_url)
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response.headers['Cache-Control'], 'private, max-age=31536000, immutable')
+                with Image.open(io.BytesIO(response.get_data())) as edge_tile:
+                    self.assertEqual(edge_tile.size, (600 - 512, 300 - 256))
+                self.assertEqual(self.client.get(tiles['url_template'].format(level=10, col=3, row=0)).status_code, 404)
+                self.assertEqual(self.client.get(f"/api/maps/tiles/{tile_set[:-1]}x/10/0_0.{tiles['format']}").status_code, 404)
+                self.logout()
+
+                delete_floor_map_tiles(self.floor_map.image_tiles)
+                self.assertEqual(os.listdir(tmp_dir), [])
+        db.session.rollback()
+
+
+class TestOnDateQueries(AppTestBase):
+    def _explain(self, query):
+        dialect_name = db.engine.dialect.name
+        compiled = query.statement.compile(dialect=db.engine.dialect, compile_kwargs={'literal_binds': True})
+        if dialect_name == 'sqlite':
+            rows = db.session.execute(text(f"EXPLAIN QUERY PLAN {compiled}")).all()
+            return ' '.join(str(row[-1]) for row in rows)
+        if dialect_name == 'postgresql':
+            db.session.execute(text("SET LOCAL enable_seqscan = off"))
+            rows = db.session.execute(text(f"EXPLAIN {compiled}")).all()
+            return ' '.join(row[0] for row in rows)
+        self.skipTest(f"No query plan check for dialect {dialect_name}")
+
+    def test_on_date_matches_func_date_and_uses_start_time_index(self):
+        from query_helpers import on_date
+        target = date(2025, 7, 16)
+        for start in (datetime_original(2025, 7, 15, 23, 59), datetime_original(2025, 7, 16, 0, 0),
+                      datetime_original(2025, 7, 16, 23, 59, 59), datetime_original(2025, 7, 17, 0, 0)):
+            db.session.add(Booking(user_name='someone_else', resource_id=self.resource1.id, title='Edge',
+                                   start_time=start, end_time=start + timedelta_original(minutes=30), status='approved'))
+        db.session.commit()
+
+        by_range = {b.id for b in Booking.query.filter(on_date(Booking.start_time, target)).all()}
+        by_func_date = {b.id for b in Booking.query.filter(func.date(Booking.start_time) == target).all()}
+        self.assertEqual(len(by_range), 2)
+        self.assertEqual(by_range, by_func_date)
+
+        plan = self._explain(Booking.query.filter(on_date(Booking.start_time, target)))
+        self.assertIn('ix_booking_start_time', plan)
+        plan = self._explain(Booking.query.filter(Booking.resource_id == self.resource1.id, on_date(Booking.start_time, target)))
+        self.assertRegex(plan, r'(?i)index')
+        self.assertNotRegex(plan, r'(?i)\bSCAN booking\b(?! USING)')
+
+
+class TestImportBookingsJson(AppTestBase):
+    def test_bad_rows_do_not_abort_the_import(self):
+        admin = self._create_admin_user()
+        self.login(admin.username, 'adminpass')
+        rows = [
+            {'id': 901, 'resource_id': self.resource1.id, 'status': None, 'user_name': 'testuser',
+             'start_time': '2030-01-01T09:00:00', 'end_time': '2030-01-01T10:00:00'},
+            {'id': 902, 'resource_id': self.resource1.id, 'status': ' Approved ',
+             'start_time': '2030-01-02T09:00:00', 'end_time': '2030-01-02T10:00:00'},
+            {'id': 903, 'resource_id': self.resource1.id, 'status': 'legacy-status',
+             'start_time': '2030-01-03T09:00:00', 'end_time': '2030-01-03T10:00:00'},
+            {'id': 904, 'resource_id': self.resource1.id, 'status': 'approved', 'start_time': '2030-01-04T09:00:00'},
+        ]
+        payload = io.BytesIO(json.dumps({'bookings': rows}).encode('utf-8'))
+        response = self.client.post('/admin/import_bookings_json', data={'file': (payload, 'bookings.json')},
+                                    content_type='multipart/form-data')
+        self.assertEqual(response.status_code, 302)
+        db.session.expire_all()
+        self.assertEqual(db.session.get(Booking, 901).status, 'cancelled')
+        self.assertEqual(db.session.get(Booking, 901).user_id, User.query.filter_by(username='testuser').first().id)
+        self.assertEqual(db.session.get(Booking, 902).status, 'approved')
+        self.assertEqual(db.session.get(Booking, 903).status, 'cancelled')
+        self.assertIsNone(db.session.get(Booking, 904)) # No end_time: skipped on its own
+
+
 class TestMaintenanceSchedules(AppTests):
     def setUp(self):
         super().setUp()
@@ -3143,6 +3970,103 @@ class TestMaintenanceSchedules(AppTests):
         # without changes to the API.
         pass
 
+    def test_compiled_schedules_resolve_per_resource_and_refresh_on_invalidate(self):
+        from maintenance_schedules import get_compiled_maintenance_schedules
+        friday = date(2025, 7, 4)
+        thursday = date(2025, 7, 3)
+        self._create_maintenance_schedule(
+            name='Floor 1 Friday Only',
+            schedule_type='recurring_day',
+            day_of_week='4, x',
+            is_availability=True,
+            resource_selection_type='floor',
+            floor_ids=str(self.floor_map.id)
+        )
+
+        compiled = get_compiled_maintenance_schedules()
+        self.assertFalse(compiled.is_resource_blocked(self.resource1, friday))
+        self.assertTrue(compiled.is_resource_blocked(self.resource1, thursday))
+        # resource2 lives on floor 2, which has no whitelist, so it is blocked every day.
+        self.assertTrue(compiled.is_resource_blocked(self.resource2, friday))
+
+        self._create_maintenance_schedule(
+            name='Room A closed',
+            schedule_type='date_range',
+            start_date=friday,
+            end_date=friday,
+            is_availability=False,
+            resource_selection_type='specific',
+            resource_ids=str(self.resource1.id)
+        )
+        self.assertIs(get_compiled_maintenance_schedules(), compiled)
+        invalidate_compiled_maintenance_schedules()
+        refreshed = get_compiled_maintenance_schedules()
+        self.assertTrue(refreshed.is_resource_blocked(self.resource1, friday))
+        self.assertEqual(refreshed.blocked_dates(self.resource1, thursday, date(2025, 7, 5)), {thursday, friday, date(2025, 7, 5)})
+
+    def test_schedule_targets_and_days_are_stored_normalized(self):
+        from models import MaintenanceSchedule, MaintenanceScheduleFloor
+        schedule = self._create_maintenance_schedule(
+            name='Mixed', schedule_type='recurring_day', day_of_week=['4', 0, '9'], day_of_month='31, 1, junk',
+            is_availability=False, resource_selection_type='floor',
+            floor_ids=f"{self.floor_map.id},{self.floor_map2.id}", resource_ids=str(self.resource1.id)
+        )
+        self.assertEqual(schedule.weekday_mask, 0b10001)
+        self.assertEqual(schedule.day_of_week, '0,4')
+        self.assertEqual(schedule.day_of_month, '1,31')
+        self.assertEqual(MaintenanceScheduleFloor.query.filter_by(schedule_id=schedule.id).count(), 2)
+
+        schedule.floor_ids = str(self.floor_map2.id)
+        db.session.commit()
+        matches = MaintenanceSchedule.query.join(MaintenanceScheduleFloor).filter(
+            MaintenanceScheduleFloor.floor_map_id == self.floor_map.id).all()
+        self.assertEqual(matches, [])
+        self.assertEqual(schedule.floor_ids, str(self.floor_map2.id))
+
+        db.session.delete(schedule)
+        db.session.commit()
+        self.assertEqual(MaintenanceScheduleFloor.query.count(), 0)
+
+
+
+class TestSlotGrid(unittest.TestCase):
+    def test_free_slots_match_naive_scan_at_several_granularities(self):
+        import random
+        from slot_grid import build_slot_grid
+
+        def naive_free_slots(day, intervals, slot_minutes):
+            slot_starts = [datetime_original.combine(day, time.min) + timedelta_original(minutes=m) for m in range(0, 24 * 60, slot_minutes)]
+            return [(start, start + timedelta_original(minutes=slot_minutes)) for start in slot_starts
+                    if not any(start < end and start + timedelta_original(minutes=slot_minutes) > busy_start for busy_start, end in intervals)]
+
+        day = date(2025, 7, 16)
+        day_start = datetime_original.combine(day, time.min)
+        rng = random.Random(7)
+        intervals = [(day_start - timedelta_original(hours=1), day_start + timedelta_original(minutes=20))]
+        for _ in range(25):
+            start = day_start + timedelta_original(minutes=rng.randrange(0, 23 * 60))
+            intervals.append((start, start + timedelta_original(minutes=rng.randrange(1, 120))))
+        for granularity in (5, 15, 30):
+            grid = build_slot_grid(day, intervals, granularity)
+            self.assertEqual(grid.free_slots(30), naive_free_slots(day, intervals, 30))
+            self.assertEqual([(s.strftime('%H:%M'), e.strftime('%H:%M')) for s, e in grid.free_slots(30)], grid.free_slot_labels(30))
+
+    def test_free_runs_and_validation(self):
+        from slot_grid import SlotGrid
+        day = date(2025, 7, 16)
+        grid = SlotGrid(day, 15)
+        grid.paint(datetime_original(2025, 7, 16, 8, 0), datetime_original(2025, 7, 16, 12, 0))
+        self.assertEqual(grid.free_intervals(), [
+            (datetime_original(2025, 7, 16, 0, 0), datetime_original(2025, 7, 16, 8, 0)),
+            (datetime_original(2025, 7, 16, 12, 0), datetime_original(2025, 7, 17, 0, 0)),
+        ])
+        self.assertFalse(grid.is_free(datetime_original(2025, 7, 16, 11, 50), datetime_original(2025, 7, 16, 12, 30)))
+        self.assertTrue(grid.is_free(datetime_original(2025, 7, 16, 12, 0), datetime_original(2025, 7, 16, 12, 30)))
+        with self.assertRaises(ValueError):
+            SlotGrid(day, 7)
+        with self.assertRaises(ValueError):
+            grid.free_slots(20)
+
 
 if __name__ == '__main__':
     unittest.main()
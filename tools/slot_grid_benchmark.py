@@ -0,0 +1,57 @@
+"""
+Times SlotGrid.free_slots against the per-slot, per-booking scan it replaced.
+Run from the repository root: python tools/slot_grid_benchmark.py
+"""
+import os
+import random
+import sys
+import timeit
+from datetime import date, datetime, time, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from slot_grid import MINUTES_PER_DAY, build_slot_grid
+
+
+def naive_free_slots(day: date, intervals, slot_minutes: int) -> list[tuple[datetime, datetime]]:
+    slots = []
+    slot_start = datetime.combine(day, time.min)
+    day_end = slot_start + timedelta(days=1)
+    while slot_start + timedelta(minutes=slot_minutes) <= day_end:
+        slot_end = slot_start + timedelta(minutes=slot_minutes)
+        if not any(slot_start < end and slot_end > start for start, end in intervals):
+            slots.append((slot_start, slot_end))
+        slot_start = slot_end
+    return slots
+
+
+def benchmark(granularity_minutes: int = 5, booking_count: int = 60, repeat: int = 200):
+    """Times both on one synthetic day of booking_count random bookings."""
+    day = date(2030, 1, 1)
+    rng = random.Random(42)
+    day_start = datetime.combine(day, time.min)
+    intervals = []
+    for _ in range(booking_count):
+        start = day_start + timedelta(minutes=rng.randrange(0, MINUTES_PER_DAY - 60, 5))
+        intervals.append((start, start + timedelta(minutes=rng.choice((5, 15, 30, 60)))))
+
+    expected = naive_free_slots(day, intervals, granularity_minutes)
+    actual = build_slot_grid(day, intervals, granularity_minutes).free_slots(granularity_minutes)
+    assert expected == actual, "SlotGrid result differs from the naive scan"
+
+    naive_seconds = timeit.timeit(lambda: naive_free_slots(day, intervals, granularity_minutes), number=repeat) / repeat
+    grid_seconds = timeit.timeit(lambda: build_slot_grid(day, intervals, granularity_minutes).free_slots(granularity_minutes), number=repeat) / repeat
+    return {
+        'granularity_minutes': granularity_minutes,
+        'bookings': booking_count,
+        'naive_ms': naive_seconds * 1000,
+        'grid_ms': grid_seconds * 1000,
+        'speedup': naive_seconds / grid_seconds if grid_seconds else float('inf'),
+    }
+
+
+if __name__ == '__main__':
+    for granularity in (5, 15, 30):
+        result = benchmark(granularity)
+        print(f"{result['granularity_minutes']:>2} min, {result['bookings']} bookings: "
+              f"naive {result['naive_ms']:.3f} ms, grid {result['grid_ms']:.3f} ms, {result['speedup']:.1f}x")
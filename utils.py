@@ -3,6 +3,10 @@ import json
 import logging
 import tempfile
 import re
+import bisect
+import math
+import heapq
+import itertools
 from PIL import Image, ImageDraw, ImageFont, ImageOps
 import requests
 from datetime import datetime, date, timedelta, time, timezone # Ensure all are here
@@ -27,9 +31,15 @@ import boto3 # For S3/R2 check if needed explicitly, though r2_storage should ha
 
 from extensions import db
 from r2_storage import r2_storage
-from models import AuditLog, User, Resource, FloorMap, Role, Booking, BookingSettings, ResourcePIN # Ensure Role and ResourcePIN are imported
+from models import AuditLog, User, Resource, FloorMap, Role, Booking, BookingSettings, ResourcePIN, ACTIVE_BOOKING_STATUSES # Ensure Role and ResourcePIN are imported
 from sqlalchemy import func, exc
 from sqlalchemy.sql import func as sqlfunc
+from query_helpers import on_date, day_range, date_span_range, overlaps_range
+from slot_grid import MINUTES_PER_DAY, SlotGrid
+from audit_log import queue_audit_log
+from booking_settings_cache import current_booking_settings
+from effective_clock import current_clock
+from booking_image_cache import booking_image_key, get_cached_booking_image, map_image_version, remember_map_hash, remembered_map_hash, store_booking_image
 
 # New imports for task management
 import uuid
@@ -42,7 +52,7 @@ email_log = []
 slack_log = []
 teams_log = []
 
-active_booking_statuses_for_conflict = ['approved', 'pending', 'checked_in', 'confirmed']
+active_booking_statuses_for_conflict = list(ACTIVE_BOOKING_STATUSES)
 
 basedir = os.path.abspath(os.path.dirname(__file__))
 DATA_DIR = os.path.join(basedir, 'data')
@@ -198,22 +208,8 @@ def mark_task_done(task_id, success, result_message=""):
 # load_scheduler_settings, save_scheduler_settings, add_audit_log, resource_to_dict, etc.
 # Make sure get_current_effective_time() is defined as it was in the previous context:
 def get_current_effective_time():
-    offset_hours = 0
-    try:
-        from sqlalchemy.exc import OperationalError, ProgrammingError
-        settings = BookingSettings.query.first()
-        if settings and settings.global_time_offset_hours is not None:
-            offset_hours = settings.global_time_offset_hours
-    except (OperationalError, ProgrammingError):
-        # Table doesn't exist yet, suppress error and use default
-        pass
-    except Exception as e:
-        logger = current_app.logger if current_app else logging.getLogger(__name__)
-        logger.error(f"Error fetching time offset from BookingSettings: {e}. Defaulting offset to 0.")
-        offset_hours = 0
-    utc_now = datetime.now(timezone.utc)
-    effective_time = utc_now + timedelta(hours=offset_hours)
-    return effective_time
+    """Aware effective "now" (UTC plus the global offset), read once per request or task run."""
+    return current_clock().effective_now
 
 def check_booking_permission(user: User, resource: Resource, logger_instance) -> tuple[bool, str | None]:
     logger_instance.debug(f"Checking permission for user '{user.username}' (Admin: {user.is_admin}) on resource '{resource.name}' (ID: {resource.id}, Restriction: '{resource.booking_restriction}')")
@@ -227,12 +223,12 @@ def check_booking_permission(user: User, resource: Resource, logger_instance) ->
         return False, "Resource is admin-only"
 
     if resource.booking_restriction == 'restricted_roles':
-        resource_allowed_role_ids = {role.id for role in resource.roles}
+        resource_allowed_role_ids = resource.role_id_set
         if not resource_allowed_role_ids:
             logger_instance.debug(f"Permission denied for resource '{resource.name}': Restricted to roles, but no roles are assigned to the resource.")
             return False, "Resource is role-restricted, but no roles are assigned to it"
 
-        user_role_ids = {role.id for role in user.roles}
+        user_role_ids = user.role_ids
         if user_role_ids.isdisjoint(resource_allowed_role_ids):
             logger_instance.debug(f"Permission denied for resource '{resource.name}': User '{user.username}' roles {user_role_ids} do not overlap with resource roles {resource_allowed_role_ids}.")
             return False, "User does not have a required role for this resource"
@@ -242,20 +238,19 @@ def check_booking_permission(user: User, resource: Resource, logger_instance) ->
 
     if resource.booking_restriction == 'specific_users_only':
         if resource.allowed_user_ids and resource.allowed_user_ids.strip():
-            try:
-                allowed_ids_list = json.loads(resource.allowed_user_ids)
-                if not isinstance(allowed_ids_list, list) or not all(isinstance(uid, int) for uid in allowed_ids_list):
-                    logger_instance.warning(f"Resource {resource.id} ('{resource.name}') 'allowed_user_ids' ('{resource.allowed_user_ids}') is not a list of integers. Denying access.")
-                    return False, "Resource has malformed allowed user list"
-                if user.id not in allowed_ids_list:
-                    logger_instance.debug(f"Permission denied for resource '{resource.name}': User ID {user.id} not in allowed list {allowed_ids_list}.")
-                    return False, "User is not in the allowed list for this resource"
-                else:
-                    logger_instance.debug(f"Permission granted for resource '{resource.name}': User ID {user.id} is in allowed list {allowed_ids_list}.")
-                    return True, "User is in the allowed list"
-            except json.JSONDecodeError:
+            allowed_ids, parse_error = resource.parsed_allowed_user_ids()
+            if parse_error == 'invalid_json':
                 logger_instance.warning(f"Resource {resource.id} ('{resource.name}') 'allowed_user_ids' ('{resource.allowed_user_ids}') is invalid JSON. Denying access.")
                 return False, "Resource has invalid allowed user list format"
+            if parse_error:
+                logger_instance.warning(f"Resource {resource.id} ('{resource.name}') 'allowed_user_ids' ('{resource.allowed_user_ids}') is not a list of integers. Denying access.")
+                return False, "Resource has malformed allowed user list"
+            if user.id not in allowed_ids:
+                logger_instance.debug(f"Permission denied for resource '{resource.name}': User ID {user.id} not in allowed list {resource.allowed_user_ids}.")
+                return False, "User is not in the allowed list for this resource"
+            else:
+                logger_instance.debug(f"Permission granted for resource '{resource.name}': User ID {user.id} is in allowed list {resource.allowed_user_ids}.")
+                return True, "User is in the allowed list"
         else:
             logger_instance.debug(f"Permission denied for resource '{resource.name}': Restricted to specific users, but allowed list is empty or undefined.")
             return False, "User is not in the allowed list (list is empty or undefined)"
@@ -264,13 +259,64 @@ def check_booking_permission(user: User, resource: Resource, logger_instance) ->
     return True, "Permission granted by default (no relevant restrictions)"
 
 
-def get_detailed_map_availability_for_user(resources_list: list[Resource], target_date: date, user: User, primary_slots: list[tuple[time, time]], logger_instance) -> dict:
-    from models import MaintenanceSchedule
-    logger_instance.debug(f"get_detailed_map_availability_for_user called for date: {target_date}, user: {user.username}, {len(resources_list)} resources.")
-    total_primary_slots_on_map = 0
-    available_primary_slots_for_user_on_map = 0
+def sync_booking_user_names(user: User) -> int:
+    """
+    Copies user.username onto the user_name of every booking linked by user_id.
+    Call after changing a username; returns the number of bookings updated.
+    """
+    return Booking.query.filter(
+        Booking.user_id == user.id,
+        Booking.user_name.is_distinct_from(user.username)
+    ).update({Booking.user_name: user.username}, synchronize_session='fetch')
 
-    booking_settings = BookingSettings.query.first()
+
+def build_booking_interval_index(resource_ids, target_date: date) -> dict:
+    """
+    Loads every active booking touching target_date for the given resources in a
+    single query and returns {resource_id: (sorted_starts, running_max_ends)}.
+    Use booking_index_has_conflict() to test a slot against the index.
+    """
+    resource_ids = list(resource_ids)
+    if not resource_ids:
+        return {}
+
+    day_start, next_day_start = day_range(target_date)
+    rows = db.session.query(Booking.resource_id, Booking.start_time, Booking.end_time).filter(
+        Booking.resource_id.in_(resource_ids),
+        overlaps_range(Booking.start_time, Booking.end_time, day_start, next_day_start),
+        Booking.status.in_(active_booking_statuses_for_conflict)
+    ).order_by(Booking.resource_id, Booking.start_time).all()
+
+    index = {}
+    for resource_id, start_time, end_time in rows:
+        starts, max_ends = index.setdefault(resource_id, ([], []))
+        starts.append(start_time)
+        # Running maximum of end times so a single bisect answers "does anything
+        # that starts before the slot end also finish after the slot start".
+        max_ends.append(end_time if not max_ends or end_time > max_ends[-1] else max_ends[-1])
+    return index
+
+
+def booking_index_has_conflict(index: dict, resource_id: int, slot_start: datetime, slot_end: datetime) -> bool:
+    """True if any indexed booking on resource_id overlaps [slot_start, slot_end)."""
+    entry = index.get(resource_id)
+    if not entry:
+        return False
+    starts, max_ends = entry
+    position = bisect.bisect_left(starts, slot_end)
+    return position > 0 and max_ends[position - 1] > slot_start
+
+
+def _get_slot_availability_by_resource(resources_list: list[Resource], target_date: date, user: User, primary_slots: list[tuple[time, time]], logger_instance, booking_index: dict = None) -> dict:
+    """
+    Core availability pass shared by the single-map and batch helpers.
+    Returns {resource_id: (total_primary_slots, available_primary_slots_for_user)} using
+    a fixed number of queries regardless of how many resources are passed in.
+    """
+    from maintenance_schedules import get_compiled_maintenance_schedules
+    slot_counts_by_resource = {}
+
+    booking_settings = current_booking_settings()
     global_time_offset_hours = 0
     past_booking_time_adjustment_hours = 0
     allow_multiple_resources_same_time = False
@@ -282,48 +328,32 @@ def get_detailed_map_availability_for_user(resources_list: list[Resource], targe
     else:
         logger_instance.warning("BookingSettings not found. Using default values for availability calculation.")
 
-    now_utc = datetime.now(timezone.utc)
-    effective_venue_now_utc = now_utc + timedelta(hours=global_time_offset_hours)
+    clock = current_clock()
+    effective_venue_now_utc = clock.utc_now + timedelta(hours=global_time_offset_hours)
     effective_cutoff_datetime_utc = effective_venue_now_utc - timedelta(hours=past_booking_time_adjustment_hours)
 
     logger_instance.debug(f"Effective venue now (UTC): {effective_venue_now_utc.isoformat()}, Effective cutoff (UTC): {effective_cutoff_datetime_utc.isoformat()}")
     logger_instance.debug(f"Allow multiple bookings: {allow_multiple_resources_same_time}")
 
     user_all_bookings_for_date = Booking.query.filter(
-        Booking.user_name == user.username,
-        func.date(Booking.start_time) == target_date,
-        sqlfunc.trim(sqlfunc.lower(Booking.status)).in_(active_booking_statuses_for_conflict)
+        Booking.user_id == user.id,
+        on_date(Booking.start_time, target_date),
+        Booking.status.in_(active_booking_statuses_for_conflict)
     ).all()
     logger_instance.debug(f"User {user.username} has {len(user_all_bookings_for_date)} bookings on {target_date} for conflict checking.")
 
-    schedules = MaintenanceSchedule.query.all()
-    whitelists_exist = any(s.is_availability for s in schedules)
+    if booking_index is None:
+        booking_index = build_booking_interval_index((r.id for r in resources_list), target_date)
+
+    compiled_schedules = get_compiled_maintenance_schedules()
 
     for resource in resources_list:
         logger_instance.debug(f"Processing resource: {resource.name} (ID: {resource.id})")
         has_permission, perm_reason = check_booking_permission(user, resource, logger_instance)
 
-        is_blacklisted = False
-        is_whitelisted = False
-        applicable_schedules = [s for s in schedules if (s.resource_selection_type == 'all') or (s.resource_selection_type == 'building' and resource.floor_map and s.building_id == resource.floor_map.location) or (s.resource_selection_type == 'floor' and resource.floor_map and str(resource.floor_map.id) in (s.floor_ids or '').split(',')) or (s.resource_selection_type == 'specific' and str(resource.id) in (s.resource_ids or '').split(','))]
-
-        for schedule in applicable_schedules:
-            day_of_week_check = schedule.schedule_type == 'recurring_day' and str(target_date.weekday()) in (schedule.day_of_week or '').split(',')
-            day_of_month_check = schedule.schedule_type == 'specific_day' and str(target_date.day) in (schedule.day_of_month or '').split(',')
-            date_range_check = schedule.schedule_type == 'date_range' and schedule.start_date <= target_date <= schedule.end_date if schedule.start_date and schedule.end_date else False
-
-            if day_of_week_check or day_of_month_check or date_range_check:
-                if schedule.is_availability:
-                    is_whitelisted = True
-                else:
-                    is_blacklisted = True
-
-        if is_blacklisted:
-            logger_instance.debug(f"Resource {resource.name} is blacklisted for {target_date}.")
-            continue
-
-        if whitelists_exist and not is_whitelisted:
-            logger_instance.debug(f"Resource {resource.name} is not in any whitelist for {target_date}.")
+        if compiled_schedules.is_resource_blocked(resource, target_date):
+            logger_instance.debug(f"Resource {resource.name} is blocked by a maintenance schedule (blacklisted or outside every whitelist) for {target_date}.")
+            slot_counts_by_resource[resource.id] = (0, 0)
             continue
 
         is_resource_unavailable_all_day_due_to_maintenance = resource.is_under_maintenance and \
@@ -332,8 +362,10 @@ def get_detailed_map_availability_for_user(resources_list: list[Resource], targe
         if is_resource_unavailable_all_day_due_to_maintenance:
             logger_instance.debug(f"Resource {resource.name} is under maintenance for {target_date}.")
 
+        total_slots_for_resource = 0
+        available_slots_for_resource = 0
         for slot_start_time_obj, slot_end_time_obj in primary_slots:
-            total_primary_slots_on_map += 1
+            total_slots_for_resource += 1
             slot_desc = f"{slot_start_time_obj.strftime('%H:%M')}-{slot_end_time_obj.strftime('%H:%M')}"
             logger_instance.debug(f"  Checking slot: {slot_desc} for resource {resource.name}")
 
@@ -354,12 +386,7 @@ def get_detailed_map_availability_for_user(resources_list: list[Resource], targe
                 logger_instance.debug(f"    Slot {slot_desc} on {resource.name} (starts {slot_start_for_cutoff_check_utc.isoformat()} UTC) has passed cutoff {effective_cutoff_datetime_utc.isoformat()}. Not available.")
                 continue
 
-            is_generally_booked = Booking.query.filter(
-                Booking.resource_id == resource.id,
-                Booking.start_time < slot_end_local_naive,
-                Booking.end_time > slot_start_local_naive,
-                sqlfunc.trim(sqlfunc.lower(Booking.status)).in_(active_booking_statuses_for_conflict)
-            ).first() is not None
+            is_generally_booked = booking_index_has_conflict(booking_index, resource.id, slot_start_local_naive, slot_end_local_naive)
 
             if is_generally_booked:
                 logger_instance.debug(f"    Slot {slot_desc} on {resource.name} is generally booked by someone else. Not available to user.")
@@ -378,23 +405,350 @@ def get_detailed_map_availability_for_user(resources_list: list[Resource], targe
                 logger_instance.debug(f"    Slot {slot_desc} on {resource.name} not available due to user conflict (allow_multiple_resources_same_time is False).")
                 continue
 
-            available_primary_slots_for_user_on_map += 1
+            available_slots_for_resource += 1
             logger_instance.debug(f"    Slot {slot_desc} on {resource.name} IS AVAILABLE for user {user.username}.")
 
+        slot_counts_by_resource[resource.id] = (total_slots_for_resource, available_slots_for_resource)
+
+    return slot_counts_by_resource
+
+
+def get_detailed_map_availability_for_user(resources_list: list[Resource], target_date: date, user: User, primary_slots: list[tuple[time, time]], logger_instance, booking_index: dict = None) -> dict:
+    logger_instance.debug(f"get_detailed_map_availability_for_user called for date: {target_date}, user: {user.username}, {len(resources_list)} resources.")
+    slot_counts_by_resource = _get_slot_availability_by_resource(
+        resources_list, target_date, user, primary_slots, logger_instance, booking_index=booking_index
+    )
+    total_primary_slots_on_map = sum(total for total, _ in slot_counts_by_resource.values())
+    available_primary_slots_for_user_on_map = sum(available for _, available in slot_counts_by_resource.values())
+
     logger_instance.info(f"Detailed availability for user {user.username} on date {target_date}: Total Slots on Map = {total_primary_slots_on_map}, Available to User = {available_primary_slots_for_user_on_map}")
     return {'total_primary_slots': total_primary_slots_on_map, 'available_primary_slots_for_user': available_primary_slots_for_user_on_map}
 
 
-def check_resources_availability_for_user(resources_list: list[Resource], target_date: date, user: User, primary_slots: list[tuple[time, time]], logger_instance) -> bool:
+def get_batch_map_availability_for_user(resources_list: list[Resource], target_date: date, user: User, primary_slots: list[tuple[time, time]], logger_instance) -> dict:
+    """
+    Single-pass variant of get_detailed_map_availability_for_user for many floor maps.
+    Settings, bookings, maintenance schedules and the user's own bookings are loaded once
+    for all resources and the slot counts are grouped in memory.
+    Returns {floor_map_id: {'total_primary_slots': int, 'available_primary_slots_for_user': int}}.
+    """
+    logger_instance.debug(f"get_batch_map_availability_for_user called for date: {target_date}, user: {user.username}, {len(resources_list)} resources.")
+    slot_counts_by_resource = _get_slot_availability_by_resource(resources_list, target_date, user, primary_slots, logger_instance)
+
+    availability_by_map = {}
+    for resource in resources_list:
+        map_totals = availability_by_map.setdefault(resource.floor_map_id, {'total_primary_slots': 0, 'available_primary_slots_for_user': 0})
+        total, available = slot_counts_by_resource.get(resource.id, (0, 0))
+        map_totals['total_primary_slots'] += total
+        map_totals['available_primary_slots_for_user'] += available
+    return availability_by_map
+
+
+def check_resources_availability_for_user(resources_list: list[Resource], target_date: date, user: User, primary_slots: list[tuple[time, time]], logger_instance, booking_index: dict = None) -> bool:
     logger_instance.debug(f"check_resources_availability_for_user called for date: {target_date}, user: {user.username}, {len(resources_list)} resources.")
     detailed_availability = get_detailed_map_availability_for_user(
-        resources_list, target_date, user, primary_slots, logger_instance
+        resources_list, target_date, user, primary_slots, logger_instance, booking_index=booking_index
     )
     available_count = detailed_availability.get('available_primary_slots_for_user', 0)
     is_available = available_count > 0
     logger_instance.info(f"Overall resource availability for user {user.username} on date {target_date}: {is_available} (based on {available_count} available slots).")
     return is_available
 
+def get_unavailable_dates_for_user(target_user: User, resources_list: list[Resource], start_date: date, end_date: date,
+                                   standard_slots: list[tuple[time, time]], booking_settings, now_utc: datetime, logger_instance) -> set:
+    """
+    Date-picker engine for /api/resources/unavailable_dates.
+
+    Loads the range's bookings once and keeps one Python int per resource as a
+    day x slot occupancy bitmap (bit = day_index * len(standard_slots) + slot_index).
+    Booking, maintenance, cutoff and user-conflict masks are combined with plain
+    bitwise operations; a date is unavailable when no permitted resource has a
+    free bit for it. Returns a set of 'YYYY-MM-DD' strings.
+    """
+    unavailable_dates = set()
+    statuses = ['approved', 'pending', 'checked_in', 'confirmed']
+    slots_per_day = len(standard_slots)
+    day_count = (end_date - start_date).days + 1
+    if day_count <= 0 or slots_per_day == 0:
+        return unavailable_dates
+
+    day_mask = (1 << slots_per_day) - 1
+    all_bits = (1 << (day_count * slots_per_day)) - 1
+    range_start_dt, range_end_dt = date_span_range(start_date, end_date)
+
+    global_time_offset_hours = booking_settings.global_time_offset_hours if booking_settings.global_time_offset_hours is not None else 0
+    past_adjustment_hours = booking_settings.past_booking_time_adjustment_hours if booking_settings.past_booking_time_adjustment_hours is not None else 0
+    user_can_book_past = target_user.has_permission('manage_bookings')
+
+    def interval_bits(start_time, end_time):
+        # Bits of every standard slot in the range that [start_time, end_time) overlaps.
+        bits = 0
+        first_day = max(start_time.date(), start_date)
+        last_day = min(end_time.date(), end_date)
+        current_day = first_day
+        while current_day <= last_day:
+            day_index = (current_day - start_date).days
+            for slot_index, (slot_start, slot_end) in enumerate(standard_slots):
+                if start_time < datetime.combine(current_day, slot_end) and end_time > datetime.combine(current_day, slot_start):
+                    bits |= 1 << (day_index * slots_per_day + slot_index)
+            current_day += timedelta(days=1)
+        return bits
+
+    def day_range_bits(first_day, last_day):
+        first_day = max(first_day, start_date)
+        last_day = min(last_day, end_date)
+        if first_day > last_day:
+            return 0
+        width = ((last_day - first_day).days + 1) * slots_per_day
+        return ((1 << width) - 1) << ((first_day - start_date).days * slots_per_day)
+
+    # Slots whose start is already behind the venue-local cutoff.
+    passed_bits = 0
+    if not user_can_book_past:
+        cutoff_local_naive = (now_utc + timedelta(hours=global_time_offset_hours)).replace(tzinfo=None) - timedelta(hours=past_adjustment_hours)
+        if cutoff_local_naive.date() > start_date:
+            passed_bits |= day_range_bits(start_date, cutoff_local_naive.date() - timedelta(days=1))
+        cutoff_day = cutoff_local_naive.date()
+        if start_date <= cutoff_day <= end_date:
+            day_index = (cutoff_day - start_date).days
+            for slot_index, (slot_start, _) in enumerate(standard_slots):
+                if datetime.combine(cutoff_day, slot_start) < cutoff_local_naive:
+                    passed_bits |= 1 << (day_index * slots_per_day + slot_index)
+
+    # Strictly past dates are closed outright when past bookings are disabled.
+    if not booking_settings.allow_past_bookings and not user_can_book_past and start_date < now_utc.date():
+        past_day = start_date
+        while past_day < now_utc.date() and past_day <= end_date:
+            unavailable_dates.add(past_day.strftime('%Y-%m-%d'))
+            past_day += timedelta(days=1)
+
+    if not resources_list:
+        logger_instance.debug("get_unavailable_dates_for_user: no published resources; only past-date rules apply.")
+        return unavailable_dates
+
+    resource_ids = [r.id for r in resources_list]
+    occupied_bits = {}
+    booking_rows = db.session.query(Booking.resource_id, Booking.start_time, Booking.end_time).filter(
+        Booking.resource_id.in_(resource_ids),
+        overlaps_range(Booking.start_time, Booking.end_time, range_start_dt, range_end_dt),
+        Booking.status.in_(statuses)
+    ).all()
+    for resource_id, booking_start, booking_end in booking_rows:
+        occupied_bits[resource_id] = occupied_bits.get(resource_id, 0) | interval_bits(booking_start, booking_end)
+
+    # The user's own bookings block the same slot on every *other* resource.
+    user_bits_by_resource = {}
+    if not booking_settings.allow_multiple_resources_same_time:
+        user_rows = db.session.query(Booking.resource_id, Booking.start_time, Booking.end_time).filter(
+            Booking.user_id == target_user.id,
+            overlaps_range(Booking.start_time, Booking.end_time, range_start_dt, range_end_dt),
+            Booking.status.in_(statuses)
+        ).all()
+        for resource_id, booking_start, booking_end in user_rows:
+            user_bits_by_resource[resource_id] = user_bits_by_resource.get(resource_id, 0) | interval_bits(booking_start, booking_end)
+    all_user_bits = 0
+    for bits in user_bits_by_resource.values():
+        all_user_bits |= bits
+
+    free_bits = 0
+    for resource in resources_list:
+        can_book, _ = check_booking_permission(target_user, resource, logger_instance)
+        if not can_book:
+            continue
+
+        blocked_bits = passed_bits | occupied_bits.get(resource.id, 0)
+        if resource.is_under_maintenance:
+            maintenance_last_day = resource.maintenance_until.date() if resource.maintenance_until else end_date
+            blocked_bits |= day_range_bits(start_date, maintenance_last_day)
+        if user_bits_by_resource:
+            if resource.id in user_bits_by_resource:
+                for other_resource_id, bits in user_bits_by_resource.items():
+                    if other_resource_id != resource.id:
+                        blocked_bits |= bits
+            else:
+                blocked_bits |= all_user_bits
+
+        free_bits |= all_bits & ~blocked_bits
+        if free_bits == all_bits:
+            break
+
+    for day_index in range(day_count):
+        if not (free_bits >> (day_index * slots_per_day)) & day_mask:
+            unavailable_dates.add((start_date + timedelta(days=day_index)).strftime('%Y-%m-%d'))
+
+    logger_instance.debug(f"get_unavailable_dates_for_user: {len(booking_rows)} bookings over {day_count} days and {len(resources_list)} resources -> {len(unavailable_dates)} unavailable dates.")
+    return unavailable_dates
+
+
+def _scan_slot_occupancy(occupied: dict, start_date: date, end_date: date, slot_definitions: list[tuple[time, time]]) -> list:
+    # Fills occupied[resource_id][day_index] slot bits from one range query over Booking. Each
+    # resource-day is painted into a SlotGrid whose cells divide every slot boundary, so a slot is
+    # busy exactly when the grid has a busy cell under its mask.
+    granularity_minutes = MINUTES_PER_DAY
+    for boundary in (boundary for slot in slot_definitions for boundary in slot):
+        if boundary.second or boundary.microsecond:
+            raise ValueError(f"Slot boundaries must be whole minutes, got {boundary}")
+        granularity_minutes = math.gcd(granularity_minutes, boundary.hour * 60 + boundary.minute)
+    mask_grid = SlotGrid(start_date, granularity_minutes)
+    slot_masks = [mask_grid.range_mask(*mask_grid.cell_range(datetime.combine(start_date, slot_start), datetime.combine(start_date, slot_end)))
+                  for slot_start, slot_end in slot_definitions]
+
+    range_start_dt, range_end_dt = date_span_range(start_date, end_date)
+    rows = db.session.query(Booking.resource_id, Booking.start_time, Booking.end_time).filter(
+        Booking.resource_id.in_(list(occupied.keys())),
+        overlaps_range(Booking.start_time, Booking.end_time, range_start_dt, range_end_dt),
+        Booking.status.in_(active_booking_statuses_for_conflict)
+    ).all()
+    grids = {}
+    for resource_id, booking_start, booking_end in rows:
+        current_day = max(booking_start.date(), start_date)
+        last_day = min(booking_end.date(), end_date)
+        while current_day <= last_day:
+            grid = grids.get((resource_id, current_day))
+            if grid is None:
+                grid = grids[(resource_id, current_day)] = SlotGrid(current_day, granularity_minutes)
+            grid.paint(booking_start, booking_end)
+            current_day += timedelta(days=1)
+    for (resource_id, day), grid in grids.items():
+        occupied[resource_id][(day - start_date).days] = sum(
+            1 << slot_index for slot_index, slot_mask in enumerate(slot_masks) if grid.busy_bits & slot_mask
+        )
+    return rows
+
+
+def build_availability_matrix(resources_list: list[Resource], start_date: date, end_date: date,
+                              slot_definitions: list[tuple[time, time]], logger_instance) -> dict:
+    """
+    Per-resource, per-day slot occupancy for [start_date, end_date] from one range query.
+
+    Returns {'occupied': {resource_id: [day_bits, ...]}, 'blocked': {resource_id: [0|1, ...]}}
+    where bit i of day_bits is set when an active booking overlaps slot_definitions[i] on that
+    day, and blocked marks days closed by the maintenance flag or maintenance schedules.
+    """
+    from maintenance_schedules import get_compiled_maintenance_schedules
+
+    day_count = (end_date - start_date).days + 1
+    occupied = {resource.id: [0] * day_count for resource in resources_list}
+    blocked = {resource.id: [0] * day_count for resource in resources_list}
+    if day_count <= 0 or not resources_list:
+        return {'occupied': occupied, 'blocked': blocked}
+
+    slot_masks = None
+    if current_app.config.get('OCCUPANCY_TABLE_READS_ENABLED'):
+        from occupancy import get_occupancy_slot_bits, occupancy_cell_mask
+        slot_masks = [occupancy_cell_mask(slot_start, slot_end) for slot_start, slot_end in slot_definitions]
+        if None in slot_masks:
+            slot_masks = None # Slots off the half-hour grid: fall back to scanning bookings
+    if slot_masks is not None:
+        rows = get_occupancy_slot_bits(list(occupied.keys()), start_date, end_date)
+        for (resource_id, day), cell_bits in rows.items():
+            occupied[resource_id][(day - start_date).days] = sum(
+                1 << slot_index for slot_index, slot_mask in enumerate(slot_masks) if cell_bits & slot_mask
+            )
+    else:
+        rows = _scan_slot_occupancy(occupied, start_date, end_date, slot_definitions)
+
+    compiled_schedules = get_compiled_maintenance_schedules()
+    for resource in resources_list:
+        day_flags = blocked[resource.id]
+        if resource.is_under_maintenance:
+            maintenance_last_day = resource.maintenance_until.date() if resource.maintenance_until else end_date
+            for day_index in range(min(day_count, (maintenance_last_day - start_date).days + 1)):
+                day_flags[day_index] = 1
+        for blocked_day in compiled_schedules.blocked_dates(resource, start_date, end_date):
+            day_flags[(blocked_day - start_date).days] = 1
+
+    logger_instance.debug(f"build_availability_matrix: {len(rows)} source rows over {day_count} days and {len(resources_list)} resources.")
+    return {'occupied': occupied, 'blocked': blocked}
+
+
+def _iter_free_slots_for_resource(resource: Resource, busy_intervals: list, range_start: datetime, range_end: datetime,
+                                  slot_minutes: int, compiled_schedules):
+    """
+    Yields the bookable slot_minutes slots of one resource in time order. Each day of the range is
+    painted into a SlotGrid (busy_intervals sorted by start, plus the parts of the day outside
+    [range_start, range_end)), and its free slots are read back aligned to multiples of
+    slot_minutes from midnight, like get_resource_available_slots does for a single day.
+    """
+    granularity_minutes = math.gcd(slot_minutes, MINUTES_PER_DAY)
+    upcoming = iter(busy_intervals)
+    next_interval = next(upcoming, None)
+    carried = []
+    day = range_start.date()
+    while datetime.combine(day, time.min) < range_end:
+        day_start, day_end = day_range(day)
+        carried = [interval for interval in carried if interval[1] > day_start]
+        while next_interval is not None and next_interval[0] < day_end:
+            carried.append(next_interval)
+            next_interval = next(upcoming, None)
+        blocked = (resource.is_under_maintenance and (resource.maintenance_until is None or day <= resource.maintenance_until.date())) \
+            or compiled_schedules.is_resource_blocked(resource, day)
+        if not blocked:
+            grid = SlotGrid(day, granularity_minutes).paint_all(carried)
+            grid.paint(day_start, range_start)
+            grid.paint(range_end, day_end)
+            for slot_start, slot_end in grid.free_slots(slot_minutes):
+                yield {
+                    'resource_id': resource.id,
+                    'resource_name': resource.name,
+                    'start_time': slot_start,
+                    'end_time': slot_end,
+                }
+        day += timedelta(days=1)
+
+
+def find_free_slots_for_user(resources_list: list[Resource], user: User, range_start: datetime, range_end: datetime,
+                             slot_duration: timedelta, limit: int, logger_instance,
+                             allow_multiple_resources_same_time: bool = True) -> list[dict]:
+    """
+    Returns up to `limit` bookable slots of slot_duration (whole minutes, at most a day) across all
+    resources the user may book in [range_start, range_end), earliest first. Slots are aligned to
+    multiples of slot_duration from midnight. When allow_multiple_resources_same_time is off, the
+    user's own active bookings are busy time on every resource, as create_booking would reject them.
+    Bookings are loaded in one sorted query and the per-resource slot streams are combined with a
+    heap merge, so the scan stops as soon as `limit` results are available.
+    """
+    from maintenance_schedules import get_compiled_maintenance_schedules
+
+    slot_minutes = int(slot_duration.total_seconds() // 60)
+    bookable_resources = []
+    for resource in resources_list:
+        can_book, _ = check_booking_permission(user, resource, logger_instance)
+        if can_book:
+            bookable_resources.append(resource)
+    if not bookable_resources or range_start >= range_end or limit <= 0 or not 0 < slot_minutes <= MINUTES_PER_DAY:
+        return []
+
+    bookings_by_resource = {resource.id: [] for resource in bookable_resources}
+    rows = db.session.query(Booking.resource_id, Booking.start_time, Booking.end_time).filter(
+        Booking.resource_id.in_(list(bookings_by_resource.keys())),
+        overlaps_range(Booking.start_time, Booking.end_time, range_start, range_end),
+        Booking.status.in_(active_booking_statuses_for_conflict)
+    ).order_by(Booking.resource_id, Booking.start_time).all()
+    for resource_id, booking_start, booking_end in rows:
+        bookings_by_resource[resource_id].append((booking_start, booking_end))
+
+    if not allow_multiple_resources_same_time:
+        user_rows = db.session.query(Booking.start_time, Booking.end_time).filter(
+            Booking.user_id == user.id,
+            overlaps_range(Booking.start_time, Booking.end_time, range_start, range_end),
+            Booking.status.in_(active_booking_statuses_for_conflict)
+        ).all()
+        if user_rows:
+            for resource_id, intervals in bookings_by_resource.items():
+                bookings_by_resource[resource_id] = sorted(intervals + [tuple(row) for row in user_rows])
+
+    compiled_schedules = get_compiled_maintenance_schedules()
+    slot_streams = [
+        _iter_free_slots_for_resource(resource, bookings_by_resource[resource.id], range_start, range_end, slot_minutes, compiled_schedules)
+        for resource in bookable_resources
+    ]
+    merged = heapq.merge(*slot_streams, key=lambda slot: (slot['start_time'], slot['resource_id']))
+    free_slots = list(itertools.islice(merged, limit))
+    logger_instance.debug(f"find_free_slots_for_user: {len(bookable_resources)} bookable resources, {len(rows)} bookings scanned, {len(free_slots)} slots returned.")
+    return free_slots
+
+
 def load_scheduler_settings():
     logger = current_app.logger if current_app else logging.getLogger(__name__)
     if not os.path.exists(SCHEDULER_SETTINGS_FILE_PATH):
@@ -473,12 +827,10 @@ def add_audit_log(action: str, details: str, user_id: int = None, username: str
         elif log_username is None and log_user_id is None:
             log_username = "System"
 
-        log_entry = AuditLog(user_id=log_user_id, username=log_username, action=action, details=details)
-        db.session.add(log_entry)
-        db.session.commit()
+        # Buffered: written with the next commit, or in one batch when the request ends.
+        queue_audit_log(user_id=log_user_id, username=log_username, action=action, details=details)
     except Exception as e:
         logger.error(f"Error adding audit log: {e}", exc_info=True)
-        db.session.rollback()
 
 def resource_to_dict(resource: Resource, include_sensitive: bool = False) -> dict:
     logger = current_app.logger if current_app else logging.getLogger(__name__)
@@ -549,6 +901,14 @@ def generate_booking_image(resource_id: int, map_coordinates_str: str, resource_
         # Check storage provider
         storage_provider = current_app.config.get('STORAGE_PROVIDER', 'local')
 
+        # Renders are content addressed; a recurring series or a repeat send reuses the first one.
+        image_version = map_image_version(floor_map, image_path if storage_provider != 'r2' else None)
+        map_hash = remembered_map_hash(floor_map, image_version)
+        if map_hash:
+            cached_image = get_cached_booking_image(booking_image_key(map_hash, floor_map, map_coordinates_str, resource_name))
+            if cached_image is not None:
+                return cached_image
+
         if storage_provider == 'r2':
             # Download from R2 to memory
             try:
@@ -562,8 +922,7 @@ def generate_booking_image(resource_id: int, map_coordinates_str: str, resource_
                 key = f"floor_map_uploads/{floor_map.image_filename}"
                 file_stream = io.BytesIO()
                 r2_storage.client.download_fileobj(r2_storage.bucket_name, key, file_stream)
-                file_stream.seek(0)
-                img = Image.open(file_stream)
+                map_image_bytes = file_stream.getvalue()
                 logger.info(f"Downloaded floor map image from R2: {key}")
             except Exception as e:
                 logger.error(f"Error downloading floor map from R2: {e}")
@@ -572,7 +931,15 @@ def generate_booking_image(resource_id: int, map_coordinates_str: str, resource_
             if not os.path.exists(image_path):
                 logger.error(f"Floor map image file not found at {image_path}")
                 return None
-            img = Image.open(image_path)
+            with open(image_path, 'rb') as map_file:
+                map_image_bytes = map_file.read()
+
+        map_hash = remember_map_hash(floor_map, map_image_bytes, image_version)
+        rendered_key = booking_image_key(map_hash, floor_map, map_coordinates_str, resource_name)
+        cached_image = get_cached_booking_image(rendered_key)
+        if cached_image is not None:
+            return cached_image
+        img = Image.open(io.BytesIO(map_image_bytes))
 
         # Handle EXIF orientation to match browser display
         try:
@@ -798,8 +1165,9 @@ def generate_booking_image(resource_id: int, map_coordinates_str: str, resource_
 
                     if img_size_kb > 300 and quality > 50:
                         quality -= 10
-        temp_image_buffer.seek(0)
-        return temp_image_buffer.getvalue()
+        rendered_image = temp_image_buffer.getvalue()
+        store_booking_image(rendered_key, rendered_image)
+        return rendered_image
 
     except Exception as e:
         logger.exception(f"Error generating booking image for resource {resource_id}: {e}")
@@ -1880,6 +2248,7 @@ def _import_user_configurations_data(user_config_data: dict) -> tuple[dict, int]
 
             if user:
                 user.username = username # Update username
+                sync_booking_user_names(user)
                 user.email = user_item.get('email', user.email)
                 user.is_admin = user_item.get('is_admin', user.is_admin)
 
@@ -2152,7 +2521,11 @@ __all__ = [
     'create_task', 'get_task_status', 'update_task_log', 'mark_task_done', # New task functions
     'retry_on_db_error',
     'get_current_effective_time', 'check_booking_permission',
-    'get_detailed_map_availability_for_user', 'check_resources_availability_for_user',
+    'build_booking_interval_index', 'booking_index_has_conflict',
+    'get_detailed_map_availability_for_user', 'get_batch_map_availability_for_user',
+    'check_resources_availability_for_user', 'get_unavailable_dates_for_user',
+    'find_free_slots_for_user',
+    'build_availability_matrix',
     'load_scheduler_settings', 'save_scheduler_settings', 'add_audit_log',
     'resource_to_dict', 'generate_booking_image', 'send_email',
     'send_slack_notification', 'send_teams_notification', 'parse_simple_rrule',
@@ -2313,36 +2686,53 @@ def _import_general_configurations_data(config_data: dict) -> tuple[dict, int]:
     return summary, status_code
 
 
+_map_opacity_file_cache = {} # config file path -> (mtime_ns, parsed opacity or None)
+
+
+def _read_map_opacity_file(config_file_path):
+    try:
+        with open(config_file_path, 'r') as f:
+            data = json.load(f)
+            opacity_val = data.get('map_resource_opacity')
+            if opacity_val is not None: # Check if key exists
+                try:
+                    opacity_float = float(opacity_val)
+                    if 0.0 <= opacity_float <= 1.0:
+                        current_app.logger.debug(f"Opacity {opacity_float} loaded from file {config_file_path}")
+                        return opacity_float
+                    else:
+                        current_app.logger.warning(f"Opacity value {opacity_float} from {config_file_path} is out of range (0.0-1.0). File value ignored.")
+                except ValueError:
+                    current_app.logger.warning(f"Invalid opacity value '{opacity_val}' in {config_file_path}. Not a float. File value ignored.")
+    except (IOError, json.JSONDecodeError, TypeError) as e: # Catch errors related to file access/parsing
+        current_app.logger.error(f"Error reading/parsing {config_file_path}: {e}. Fallback will be used.")
+    except Exception as e: # Catch any other unexpected errors
+        current_app.logger.error(f"Unexpected error with config file {config_file_path}: {e}. Fallback will be used.")
+    return None
+
+
 def get_map_opacity_value():
     """
     Retrieves the map opacity value.
     Priority:
-    1. Value from MAP_OPACITY_CONFIG_FILE (if configured and valid).
+    1. Value from MAP_OPACITY_CONFIG_FILE (if configured and valid). The parsed value is
+       reused until the file's modification time changes (e.g. the map-opacity POST rewrites it).
     2. Value from current_app.config['MAP_RESOURCE_OPACITY'] (which handles env var and default).
     """
     config_file_path = current_app.config.get('MAP_OPACITY_CONFIG_FILE')
 
     if config_file_path: # Ensure path is configured
         try:
-            # Ensure config_file_path is usable, Path objects from config.py should be fine
-            if os.path.exists(config_file_path):
-                with open(config_file_path, 'r') as f:
-                    data = json.load(f)
-                    opacity_val = data.get('map_resource_opacity')
-                    if opacity_val is not None: # Check if key exists
-                        try:
-                            opacity_float = float(opacity_val)
-                            if 0.0 <= opacity_float <= 1.0:
-                                current_app.logger.debug(f"Opacity {opacity_float} loaded from file {config_file_path}")
-                                return opacity_float
-                            else:
-                                current_app.logger.warning(f"Opacity value {opacity_float} from {config_file_path} is out of range (0.0-1.0). File value ignored.")
-                        except ValueError:
-                            current_app.logger.warning(f"Invalid opacity value '{opacity_val}' in {config_file_path}. Not a float. File value ignored.")
-        except (IOError, json.JSONDecodeError, TypeError) as e: # Catch errors related to file access/parsing
-            current_app.logger.error(f"Error reading/parsing {config_file_path}: {e}. Fallback will be used.")
-        except Exception as e: # Catch any other unexpected errors
-            current_app.logger.error(f"Unexpected error with config file {config_file_path}: {e}. Fallback will be used.")
+            mtime_ns = os.stat(config_file_path).st_mtime_ns
+        except (OSError, TypeError):
+            mtime_ns = None
+        if mtime_ns is not None:
+            cached = _map_opacity_file_cache.get(str(config_file_path))
+            if cached is None or cached[0] != mtime_ns:
+                cached = (mtime_ns, _read_map_opacity_file(config_file_path))
+                _map_opacity_file_cache[str(config_file_path)] = cached
+            if cached[1] is not None:
+                return cached[1]
 
     # Fallback to the value already processed by config.py (env var or its default in config.py)
     default_from_config = current_app.config.get('MAP_RESOURCE_OPACITY') # Should exist due to config.py